@@ -23,32 +23,105 @@ def gen_tree_indexes(num_entries):
 
 class TreePLRU(Component):
     """ The binary tree version of a "Pseudo Least-Recently Used" policy. 
+
+    The state is a binary tree with one bit for each internal node. 
+    Node ``n`` at depth ``d`` is stored at bit ``(2**d - 1) + n`` (see 
+    :func:`gen_tree_indexes`), and points toward the less-recently used half
+    of its subtree (0 for the lower half, and 1 for the upper half). 
+
+    - An access to an entry flips every node on the path to the entry so 
+      that they point away from it. 
+    - The least-recently used entry is found by following the nodes from 
+      the root. 
+
+    The functions :meth:`touch` and :meth:`victim` are also used to 
+    implement policies where the state is kept elsewhere (ie. one tree for 
+    each set in a cache). 
+
+    Accesses on the same cycle are applied in order. The ``lru`` output only
+    reflects accesses from previous cycles. 
+
     NOTE: The number of entries must be a power of two. 
+
+    Ports
+    =====
+    access:
+        Mark an entry as most-recently used
+    lru:
+        Index of the least-recently used entry
+
     """
-    def __init__(self, num_entries: int):
-        assert num_entries.bit_count() == 1
+    class Access(Signature):
+        """ An access to an entry. 
+
+        Members
+        =======
+        valid:
+            This access is valid
+        idx:
+            Index of the entry
+        """
+        def __init__(self, idx_width: int):
+            super().__init__({
+                "valid": Out(1),
+                "idx": Out(idx_width),
+            })
+
+    def __init__(self, num_entries: int, num_access: int = 1):
+        assert num_entries.bit_count() == 1 and num_entries >= 2
         self.num_entries = num_entries
+        self.num_access  = num_access
         self.idx_width   = exact_log2(num_entries)
         self.possible_indexes = [ i for i in range(self.num_entries) ]
 
         signature = Signature({
-            "access": In(self.idx_width),
+            "access": In(self.Access(self.idx_width)).array(num_access),
             "lru": Out(self.idx_width),
         })
         super().__init__(signature)
 
-    def elaborate(self, platform):
-        m = Module()
-
-        tree_state = Array(Signal() for _ in range(self.num_entries-1))
-
-        index_map = gen_tree_indexes(self.num_entries)
-        print(index_map)
-
-        m.d.sync += [ ]
-        return m 
+    @staticmethod
+    def touch(num_entries: int, state: Value, idx: Value) -> Value:
+        """ Return the state after an access to entry ``idx``. 
+        """
+        width = exact_log2(num_entries)
+        bits = []
+        for depth in range(width):
+            base = (1 << depth) - 1
+            off  = width - depth
+            for node in range(1 << depth):
+                on_path = (idx >> off) == node
+                bits.append(Mux(on_path, 
+                    ~idx[off - 1], state[base + node]
+                ))
+        return Cat(*bits)
 
+    @staticmethod
+    def victim(num_entries: int, state: Value) -> Value:
+        """ Return the index of the least-recently used entry. 
+        """
+        width = exact_log2(num_entries)
+        prefix = state[0]
+        for depth in range(1, width):
+            base = (1 << depth) - 1
+            bit  = state.bit_select(base + prefix, 1)
+            prefix = Cat(bit, prefix)
+        return prefix
 
+    def elaborate(self, platform):
+        m = Module()
 
+        tree_state = Signal(self.num_entries - 1, init=0)
 
+        next_state = tree_state
+        for idx, access in enumerate(self.access):
+            state = Signal(self.num_entries - 1, name=f"state{idx}")
+            m.d.comb += state.eq(Mux(access.valid, 
+                self.touch(self.num_entries, next_state, access.idx), 
+                next_state
+            ))
+            next_state = state
+        m.d.sync += tree_state.eq(next_state)
+        m.d.comb += self.lru.eq(self.victim(self.num_entries, tree_state))
+        return m
 
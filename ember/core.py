@@ -14,11 +14,14 @@ from ember.front.fetch import *
 from ember.front.demand_fetch import *
 from ember.front.l1i import *
 from ember.front.itlb import *
+from ember.front.ptw import *
+from ember.front.l2tlb import *
 from ember.front.ftq import *
 from ember.front.ifill import *
 from ember.front.cfc import *
 from ember.front.predecode import *
 from ember.front.bpu import *
+from ember.front.bp.update import *
 
 from ember.dq import *
 from ember.decode import *
@@ -31,6 +34,8 @@ class EmberFrontend(Component):
     =====
     fakeram:
         Interface to instruction memory
+    ptw_fakeram:
+        Interface to memory [for the PTW]
     dq_up:
         Upstream interface to the decode queue
     dbg_cf_req:
@@ -42,7 +47,12 @@ class EmberFrontend(Component):
     def __init__(self, param: EmberParams):
         self.p = param
         signature = Signature({
-            "fakeram": Out(FakeRamInterface(param.l1i.line_depth)).array(2),
+            "fakeram": Out(FakeRamInterface(
+                param.l1i.fill.beat_words, param.l1i.fill.id_bits
+            )).array(param.l1i.fill.num_mem),
+            "ptw_fakeram": Out(FakeRamInterface(
+                param.ptw.beat_words, param.ptw.id_bits
+            )),
             "dq_up": Out(CreditQueueUpstream(1, DecodeQueueEntry(param))),
             "dbg_cf_req": In(ControlFlowRequest(param)),
             "dbg_fetch_resp": Out(DemandFetchResponse(param)),
@@ -55,7 +65,7 @@ class EmberFrontend(Component):
         clk_ctr = Signal(8, init=0)
         m.d.sync += clk_ctr.eq(clk_ctr + 1)
 
-        #bpu   = m.submodules.bpu   = BranchPredictionUnit(self.p)
+        bpu   = m.submodules.bpu   = BranchPredictionUnit(self.p)
         cfc   = m.submodules.cfc   = ControlFlowController(self.p)
         ftq   = m.submodules.ftq   = FetchTargetQueue(self.p)
         #ifu   = m.submodules.ifu   = FetchUnit(self.p)
@@ -64,13 +74,27 @@ class EmberFrontend(Component):
         itlb  = m.submodules.itlb  = L1ICacheTLB(self.p)
         ifill = m.submodules.ifill = NewL1IFillUnit(self.p)
         pfu   = m.submodules.pfu   = L1IPrefetchUnit(self.p)
-        pdu   = m.submodules.pdu   = PredecodeUnit(self.p)
+        ptw   = m.submodules.ptw   = PageTableWalker(self.p)
+        l2tlb = m.submodules.l2tlb = L2TLB(self.p)
+        bpupd = m.submodules.bpupd = PredictorUpdateUnit(self.p)
 
         # CFC connections
         connect(m, cfc.alloc_req, ftq.alloc_req)
         connect(m, ftq.sts, cfc.ftq_sts)
+        connect(m, cfc.ftq_ckpt, ftq.ckpt_rp[0])
+        connect(m, cfc.ftq_next, ftq.ckpt_rp[2])
+        connect(m, cfc.ftq_flush, ftq.flush_req)
         connect(m, flipped(self.dbg_cf_req), cfc.dbg)
-        #connect(m, bpu.cf_req, cfc.bpu)
+        connect(m, bpu.cf_req, cfc.bpu_req)
+
+        # Predictor update connections
+        # NOTE: Nothing resolves branches yet, so 'bpupd.res' is undriven.
+        connect(m, dfu.resteer_req, bpupd.pd_resteer)
+        connect(m, bpupd.ftq_ckpt, ftq.ckpt_rp[1])
+        connect(m, bpupd.btb_wp, cfc.btb_wp)
+        connect(m, bpupd.cfm_wp, cfc.cfm_wp)
+        connect(m, bpupd.dir_update, bpu.update)
+        connect(m, bpupd.ind_update, cfc.ind_update)
 
         # IFU connections
         #connect(m, ifu.l1i_rp, l1i.rp[0])
@@ -81,12 +105,14 @@ class EmberFrontend(Component):
         #connect(m, ifu.resp, flipped(self.dbg_fetch_resp))
 
         # DFU connections
-        connect(m, dfu.l1i_rp, l1i.rp[0])
+        for idx in range(self.p.l1i.num_rp):
+            connect(m, dfu.l1i_rp[idx], l1i.rp[idx])
         connect(m, dfu.tlb_rp, itlb.rp)
         connect(m, dfu.ifill, ifill.port[0])
         connect(m, dfu.ifill_sts, ifill.sts)
         connect(m, dfu.resp, flipped(self.dbg_fetch_resp))
         connect(m, dfu.resteer_req, cfc.resteer_req)
+        connect(m, dfu.btb_rp, cfc.btb_rp)
 
         #with m.If(dfu.result.valid):
         #    cl = Signal(L1ICacheline(self.p))
@@ -111,8 +137,15 @@ class EmberFrontend(Component):
         #    self.dq_up.credit.req.valid.eq(dq_credit),
         #]
 
-        # PDU connections
-        #connect(m, pdu.resp, bpu.pd_resp)
+        # BPU connections
+        # Predictions are saved in the FTQ, and the BPU is recovered with 
+        # the checkpoint from the parent entry when the CFC flushes the FTQ. 
+        # NOTE: Nothing resolves branches yet, so the BPU is only recovered 
+        # after a resteer or a redirect. 
+        connect(m, dfu.pd_resp, bpu.pd_resp)
+        connect(m, bpu.cf_req, dfu.bpu_req)
+        connect(m, bpu.pred, ftq.bp_pred)
+        connect(m, ftq.bp_recover, bpu.recover)
 
         # PFU connections
         connect(m, pfu.l1i_pp, l1i.pp[0])
@@ -120,8 +153,19 @@ class EmberFrontend(Component):
         connect(m, pfu.ifill_req, ifill.port[1].req)
         connect(m, pfu.ifill_sts, ifill.sts)
 
-        #connect(m, ifill.port[0].resp, ftq.ifill_resp[0])
-        #connect(m, ifill.port[1].resp, ftq.ifill_resp[1])
+        # PTW connections
+        # NOTE: Nothing drives 'satp' yet, and the second L2 TLB read port
+        # is reserved for a data TLB. 
+        connect(m, dfu.xlat, ptw.port[0])
+        connect(m, pfu.xlat, ptw.port[1])
+        connect(m, ptw.tlb_fill, itlb.fill_req)
+        connect(m, ptw.l2tlb_rp, l2tlb.rp[0])
+        connect(m, ptw.l2tlb_fill, l2tlb.fill)
+        connect(m, ptw.resp, ftq.xlat_resp)
+        connect(m, ptw.fakeram, flipped(self.ptw_fakeram))
+
+        connect(m, ifill.port[0].resp, ftq.ifill_resp[0])
+        connect(m, ifill.port[1].resp, ftq.ifill_resp[1])
 
         # FTQ connections
         connect(m, ftq.fetch_req, dfu.req)
@@ -130,11 +174,22 @@ class EmberFrontend(Component):
         connect(m, ftq.prefetch_resp, pfu.resp)
         connect(m, ftq.prefetch_sts, pfu.sts)
 
+        # NOTE: Nothing commits instructions yet, so FTQ entries are freed 
+        # as soon as they have been fetched. Younger entries are flushed by 
+        # the CFC when a resteer disagrees with them. 
+        m.d.comb += [
+            ftq.free_req.valid.eq(dfu.resp.valid & (
+                (dfu.resp.sts == DemandResponseStatus.OK) | 
+                (dfu.resp.sts == DemandResponseStatus.RESTEER)
+            )),
+            ftq.free_req.id.eq(dfu.resp.ftq_idx),
+        ]
+
         # IFILL connections
-        connect(m, ifill.l1i_wp[0], l1i.wp[0])
-        connect(m, ifill.l1i_wp[1], l1i.wp[1])
-        connect(m, ifill.fakeram[0], flipped(self.fakeram[0]))
-        connect(m, ifill.fakeram[1], flipped(self.fakeram[1]))
+        for idx in range(self.p.l1i.num_wp):
+            connect(m, ifill.l1i_wp[idx], l1i.wp[idx])
+        for idx in range(self.p.l1i.fill.num_mem):
+            connect(m, ifill.fakeram[idx], flipped(self.fakeram[idx]))
 
         return m
 
@@ -165,7 +220,12 @@ class EmberCore(Component):
     def __init__(self, param: EmberParams):
         self.p = param
         signature = Signature({
-            "fakeram": Out(FakeRamInterface(param.l1i.line_depth)).array(2),
+            "fakeram": Out(FakeRamInterface(
+                param.l1i.fill.beat_words, param.l1i.fill.id_bits
+            )).array(param.l1i.fill.num_mem),
+            "ptw_fakeram": Out(FakeRamInterface(
+                param.ptw.beat_words, param.ptw.id_bits
+            )),
             "dbg_cf_req": In(ControlFlowRequest(param)),
         })
         super().__init__(signature)
@@ -178,8 +238,9 @@ class EmberCore(Component):
         midcore = m.submodules.midcore = EmberMidCore(self.p)
 
         # Connect frontend to memory interface
-        connect(m, front.fakeram[0], flipped(self.fakeram[0]))
-        connect(m, front.fakeram[1], flipped(self.fakeram[1]))
+        for idx in range(self.p.l1i.fill.num_mem):
+            connect(m, front.fakeram[idx], flipped(self.fakeram[idx]))
+        connect(m, front.ptw_fakeram, flipped(self.ptw_fakeram))
 
         # Connect frontend to debug wires
         connect(m, flipped(self.dbg_cf_req), front.dbg_cf_req)
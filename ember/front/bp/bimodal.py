@@ -0,0 +1,84 @@
+from amaranth import *
+from amaranth.lib.data import StructLayout
+from amaranth.lib.wiring import *
+import amaranth.lib.memory as memory
+
+from ember.param import *
+from ember.param.front import BimodalParams
+from ember.front.bp.common import *
+
+def bimodal_index(bp: BimodalParams, pc: Value) -> Value:
+    """ Compute the index into the counter table. """
+    return pc[2:2+bp.idx_bits]
+
+
+class BimodalMeta(StructLayout):
+    """ Information captured when making a prediction.
+
+    Members
+    =======
+    taken:
+        The predicted direction
+    ctr:
+        Counter read from the table
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "taken": unsigned(1),
+            "ctr": unsigned(2),
+        })
+
+
+class BimodalPredictor(DirectionPredictor):
+    """ Bimodal conditional branch direction predictor.
+
+    A table of 2-bit saturating counters indexed by the program counter.
+    This predictor does not use any global history, and recovery requests
+    are ignored.
+
+    """
+    def __init__(self, param: EmberParams):
+        self.bp = param.bp.bimodal
+        super().__init__(param)
+
+    @classmethod
+    def meta_layout(cls, p: EmberParams):
+        return BimodalMeta(p)
+
+    def elaborate(self, platform):
+        m = Module()
+        bp = self.bp
+
+        # Counters are initialized to weakly not-taken
+        mem = m.submodules.mem = memory.Memory(
+            shape=unsigned(2), depth=bp.depth, init=[1] * bp.depth,
+        )
+        wp = mem.write_port()
+        rp = mem.read_port(transparent_for=[wp])
+
+        req = self.predict.req
+        m.d.comb += [
+            rp.en.eq(req.valid),
+            rp.addr.eq(bimodal_index(bp, req.pc.bits)),
+        ]
+
+        r_valid = Signal()
+        m.d.sync += r_valid.eq(req.valid)
+
+        resp = self.predict.resp
+        m.d.comb += [
+            resp.valid.eq(r_valid),
+            resp.taken.eq(rp.data[1]),
+            resp.meta.taken.eq(rp.data[1]),
+            resp.meta.ctr.eq(rp.data),
+        ]
+
+        upd = self.update
+        m.d.comb += [
+            wp.en.eq(upd.valid),
+            wp.addr.eq(bimodal_index(bp, upd.pc.bits)),
+            wp.data.eq(counter_update(upd.meta.ctr, upd.taken)),
+        ]
+
+        return m
+
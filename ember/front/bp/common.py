@@ -0,0 +1,355 @@
+from abc import ABCMeta, abstractmethod
+
+from amaranth import *
+from amaranth.lib.data import StructLayout, ArrayLayout
+from amaranth.lib.wiring import *
+from amaranth.utils import ceil_log2, exact_log2
+
+from ember.param import *
+from ember.uarch.mop import ControlFlowOp
+
+def fold_history(hist: Value, length: int, width: int) -> Value:
+    """ XOR-fold the ``length`` most-recent bits of a global history into
+    a ``width``-bit value.
+
+    For example (where ``length`` is 10 and ``width`` is 4), the result is
+    ``hist[0:4] ^ hist[4:8] ^ hist[8:10]``.
+    """
+    res = C(0, width)
+    for off in range(0, length, width):
+        res = res ^ hist[off:min(off + width, length)]
+    return res[:width]
+
+def counter_update(ctr: Value, up: Value) -> Value:
+    """ Return the next value of a saturating counter.
+
+    The counter is incremented when ``up`` is high, and decremented
+    otherwise.
+    """
+    width = len(ctr)
+    max_val = (1 << width) - 1
+    inc = Mux(ctr == max_val, ctr, ctr + 1)
+    dec = Mux(ctr == 0, ctr, ctr - 1)
+    return Mux(up, inc, dec)[:width]
+
+def counter_weak(width: int, taken: Value) -> Value:
+    """ Return the weakly-taken or weakly-not-taken value for a saturating
+    counter with the given width.
+    """
+    return Mux(taken, C(1 << (width - 1), width), C((1 << (width - 1)) - 1, width))
+
+
+class GlobalHistoryUpdate(Signature):
+    """ A request to shift a speculative outcome into the global history.
+
+    Members
+    =======
+    valid:
+        This request is valid
+    taken:
+        The predicted outcome of a conditional branch
+    """
+    def __init__(self):
+        super().__init__({
+            "valid": Out(1),
+            "taken": Out(1),
+        })
+
+class GlobalHistoryMeta(StructLayout):
+    """ Global history captured when making a prediction.
+
+    Members
+    =======
+    ghist:
+        Global history used to make the prediction
+    ckpt:
+        Global history before the predicted outcome was shifted in
+    """
+    def __init__(self, width: int):
+        super().__init__({
+            "ghist": unsigned(width),
+            "ckpt": unsigned(width),
+        })
+
+class GlobalHistoryRecover(Signature):
+    """ A request to repair the global history.
+
+    Members
+    =======
+    valid:
+        This request is valid
+    ghist:
+        The history before the outcome of the mispredicted branch was 
+        shifted in
+    taken:
+        The resolved outcome of the mispredicted branch
+    """
+    def __init__(self, width: int):
+        super().__init__({
+            "valid": Out(1),
+            "ghist": Out(width),
+            "taken": Out(1),
+        })
+
+class GlobalHistoryRegister(Component):
+    """ Speculative global branch history.
+
+    The most-recent outcome always occupies bit 0. Outcomes are shifted into
+    the history as soon as a branch is predicted, which means that the
+    history may contain outcomes from the wrong path.
+
+    When a misprediction is discovered, the history is repaired by restoring
+    the checkpoint taken when the branch was predicted and shifting in the
+    resolved outcome. Recovery takes priority over a speculative update
+    occuring on the same cycle.
+
+    A prediction is made on the cycle after a request, and the history used 
+    to make it does not include the outcome of a prediction made on the 
+    same cycle as the request. The checkpoint is taken on the cycle the 
+    outcome is shifted in, so that recovering a back-to-back prediction 
+    does not drop the outcome of the previous one. 
+
+    Ports
+    =====
+    spec:
+        Speculative update
+    recover:
+        Recovery request
+    ghist:
+        The current speculative history
+    meta:
+        History for a prediction requested on the previous cycle
+
+    """
+    def __init__(self, width: int):
+        self.width = width
+        super().__init__(Signature({
+            "spec": In(GlobalHistoryUpdate()),
+            "recover": In(GlobalHistoryRecover(width)),
+            "ghist": Out(width),
+            "meta": Out(GlobalHistoryMeta(width)),
+        }))
+
+    def elaborate(self, platform):
+        m = Module()
+
+        r_ghist = Signal(self.width, init=0)
+        m.d.comb += self.ghist.eq(r_ghist)
+
+        r_req_ghist = Signal(self.width)
+        m.d.sync += r_req_ghist.eq(r_ghist)
+        m.d.comb += [
+            self.meta.ghist.eq(r_req_ghist),
+            self.meta.ckpt.eq(r_ghist),
+        ]
+
+        with m.If(self.recover.valid):
+            m.d.sync += r_ghist.eq(
+                Cat(self.recover.taken, self.recover.ghist[:-1])
+            )
+        with m.Elif(self.spec.valid):
+            m.d.sync += r_ghist.eq(Cat(self.spec.taken, r_ghist[:-1]))
+
+        return m
+
+
+class DirectionPredictPort(Signature):
+    """ Conditional branch direction prediction port.
+
+    A prediction is available on the cycle after a request. The layout of
+    the metadata depends on the type of predictor.
+    """
+    class Request(Signature):
+        def __init__(self, p: EmberParams):
+            super().__init__({
+                "valid": Out(1),
+                "pc": Out(p.vaddr),
+            })
+    class Response(Signature):
+        def __init__(self, p: EmberParams, meta_layout):
+            super().__init__({
+                "valid": Out(1),
+                "taken": Out(1),
+                "meta": Out(meta_layout),
+            })
+    def __init__(self, p: EmberParams, meta_layout):
+        super().__init__({
+            "req": Out(self.Request(p)),
+            "resp": In(self.Response(p, meta_layout)),
+        })
+
+class DirectionUpdateRequest(Signature):
+    """ A request to train a predictor with a resolved branch outcome.
+
+    Members
+    =======
+    valid:
+        This request is valid
+    pc:
+        Program counter of the conditional branch
+    taken:
+        The resolved direction of the branch
+    meta:
+        Metadata returned when the branch was predicted
+    """
+    def __init__(self, p: EmberParams, meta_layout):
+        super().__init__({
+            "valid": Out(1),
+            "pc": Out(p.vaddr),
+            "taken": Out(1),
+            "meta": Out(meta_layout),
+        })
+
+class DirectionRecoverRequest(Signature):
+    """ A request to repair speculative state after a misprediction.
+
+    Members
+    =======
+    valid:
+        This request is valid
+    taken:
+        The resolved direction of the mispredicted branch
+    meta:
+        Metadata returned when the branch was predicted
+    """
+    def __init__(self, p: EmberParams, meta_layout):
+        super().__init__({
+            "valid": Out(1),
+            "taken": Out(1),
+            "meta": Out(meta_layout),
+        })
+
+
+class DirectionPredictor(Component, metaclass=ABCMeta):
+    """ Base class for conditional branch direction predictors.
+
+    All direction predictors share the same interface, which allows the BPU
+    to use them interchangeably. Subclasses must implement :meth:`meta_layout`,
+    which the BPU also uses to size the metadata carried with each prediction.
+
+    Ports
+    =====
+    predict: :class:`DirectionPredictPort`
+        Prediction port
+    update: :class:`DirectionUpdateRequest`
+        Update request
+    recover: :class:`DirectionRecoverRequest`
+        Recovery request
+
+    """
+    def __init__(self, param: EmberParams):
+        self.p = param
+        meta_layout = self.meta_layout(param)
+        super().__init__(Signature({
+            "predict": In(DirectionPredictPort(param, meta_layout)),
+            "update": In(DirectionUpdateRequest(param, meta_layout)),
+            "recover": In(DirectionRecoverRequest(param, meta_layout)),
+        }))
+
+    @classmethod
+    @abstractmethod
+    def meta_layout(cls, p: EmberParams):
+        """ Return the layout of the metadata for a prediction. """
+
+
+class BTBSlot(StructLayout):
+    """ A branch recorded in a BTB entry.
+
+    Members
+    =======
+    valid:
+        This slot is valid
+    off:
+        Index of the branch within its cacheline
+    op: :class:`ControlFlowOp`
+        Type of control-flow instruction
+    tgt:
+        Target address
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "valid": unsigned(1),
+            "off": p.l1i.word_idx_shape,
+            "op": ControlFlowOp,
+            "tgt": p.vaddr,
+        })
+
+class BTBWriteRequest(Signature):
+    """ A request to record a taken branch in a BTB.
+
+    Members
+    =======
+    valid:
+        This request is valid
+    pc:
+        Program counter of the branch
+    op: :class:`ControlFlowOp`
+        Type of control-flow instruction
+    tgt:
+        Target address
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "valid": Out(1),
+            "pc": Out(p.vaddr),
+            "op": Out(ControlFlowOp),
+            "tgt": Out(p.vaddr),
+        })
+
+class BTBSlotSelect(Component):
+    """ Select the first valid branch at or after a fetch offset.
+
+    Ports
+    =====
+    slots:
+        Input branches
+    off:
+        Index of the first instruction being fetched within the cacheline
+    hit:
+        A branch was found
+    slot:
+        The selected branch
+    """
+    def __init__(self, p: EmberParams, num_slots: int):
+        self.p = p
+        self.num_slots = num_slots
+        super().__init__(Signature({
+            "slots": In(BTBSlot(p)).array(num_slots),
+            "off": In(p.l1i.word_idx_shape),
+            "hit": Out(1),
+            "slot": Out(BTBSlot(p)),
+        }))
+
+    def elaborate(self, platform):
+        m = Module()
+        n = self.num_slots
+
+        cand = [
+            self.slots[i].valid & (self.slots[i].off >= self.off)
+            for i in range(n)
+        ]
+
+        # A candidate is selected when no other candidate occurs earlier
+        # (ties are broken by the lowest slot index)
+        first = [ Signal(name=f"first{i}") for i in range(n) ]
+        for i in range(n):
+            earliest = C(1, 1)
+            for j in range(n):
+                if i == j:
+                    continue
+                off_i = self.slots[i].off
+                off_j = self.slots[j].off
+                before = (off_i < off_j) if j < i else (off_i <= off_j)
+                earliest = earliest & (~cand[j] | before)
+            m.d.comb += first[i].eq(cand[i] & earliest)
+
+        res = C(0, len(self.slot.as_value()))
+        for i in range(n):
+            res = Mux(first[i], self.slots[i].as_value(), res)
+        m.d.comb += [
+            self.hit.eq(Cat(*first).any()),
+            self.slot.eq(res),
+        ]
+
+        return m
+
@@ -0,0 +1,99 @@
+from amaranth import *
+from amaranth.lib.data import StructLayout
+from amaranth.lib.wiring import *
+import amaranth.lib.memory as memory
+
+from ember.param import *
+from ember.param.front import GshareParams
+from ember.front.bp.common import *
+
+def gshare_index(gp: GshareParams, pc: Value, ghist: Value) -> Value:
+    """ Compute the index into the counter table. """
+    res = pc[2:2+gp.idx_bits] ^ fold_history(ghist, gp.hist_len, gp.idx_bits)
+    return res[:gp.idx_bits]
+
+
+class GshareMeta(StructLayout):
+    """ Information captured when making a prediction.
+
+    Members
+    =======
+    hist: :class:`GlobalHistoryMeta`
+        Global history used to make the prediction
+    taken:
+        The predicted direction
+    ctr:
+        Counter read from the table
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "hist": GlobalHistoryMeta(p.bp.ghist_bits),
+            "taken": unsigned(1),
+            "ctr": unsigned(2),
+        })
+
+
+class GsharePredictor(DirectionPredictor):
+    """ Gshare conditional branch direction predictor.
+
+    A table of 2-bit saturating counters indexed by the program counter
+    XOR'ed with the global history. The predicted outcome is speculatively
+    shifted into the global history.
+
+    """
+    def __init__(self, param: EmberParams):
+        self.gp = param.bp.gshare
+        super().__init__(param)
+
+    @classmethod
+    def meta_layout(cls, p: EmberParams):
+        return GshareMeta(p)
+
+    def elaborate(self, platform):
+        m = Module()
+        gp = self.gp
+
+        ghr = m.submodules.ghr = GlobalHistoryRegister(self.p.bp.ghist_bits)
+
+        # Counters are initialized to weakly not-taken
+        mem = m.submodules.mem = memory.Memory(
+            shape=unsigned(2), depth=gp.depth, init=[1] * gp.depth,
+        )
+        wp = mem.write_port()
+        rp = mem.read_port(transparent_for=[wp])
+
+        req = self.predict.req
+        m.d.comb += [
+            rp.en.eq(req.valid),
+            rp.addr.eq(gshare_index(gp, req.pc.bits, ghr.ghist)),
+        ]
+
+        r_valid = Signal()
+        m.d.sync += r_valid.eq(req.valid)
+
+        resp = self.predict.resp
+        m.d.comb += [
+            resp.valid.eq(r_valid),
+            resp.taken.eq(rp.data[1]),
+            resp.meta.hist.eq(ghr.meta),
+            resp.meta.taken.eq(rp.data[1]),
+            resp.meta.ctr.eq(rp.data),
+            ghr.spec.valid.eq(r_valid),
+            ghr.spec.taken.eq(rp.data[1]),
+        ]
+
+        m.d.comb += [
+            ghr.recover.valid.eq(self.recover.valid),
+            ghr.recover.ghist.eq(self.recover.meta.hist.ckpt),
+            ghr.recover.taken.eq(self.recover.taken),
+        ]
+
+        upd = self.update
+        m.d.comb += [
+            wp.en.eq(upd.valid),
+            wp.addr.eq(gshare_index(gp, upd.pc.bits, upd.meta.hist.ghist)),
+            wp.data.eq(counter_update(upd.meta.ctr, upd.taken)),
+        ]
+
+        return m
+
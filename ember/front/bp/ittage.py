@@ -0,0 +1,339 @@
+from amaranth import *
+from amaranth.lib.data import StructLayout, ArrayLayout
+from amaranth.lib.wiring import *
+import amaranth.lib.memory as memory
+from amaranth.utils import ceil_log2, exact_log2
+
+from ember.common.coding import EmberPriorityEncoder
+from ember.param import *
+from ember.param.front import IttageParams
+from ember.front.bp.common import *
+
+def path_history_update(hist: Value, pc: Value) -> Value:
+    """ Shift bits from the address of a taken control-flow instruction into
+    a path history.
+    """
+    return Cat(pc[2:4], hist[:-2])
+
+def ittage_base_index(ip: IttageParams, pc: Value) -> Value:
+    """ Compute the index into the base table. """
+    return pc[2:2+ip.base_idx_bits]
+
+def ittage_index(ip: IttageParams, pc: Value, hist: Value, table: int) -> Value:
+    """ Compute the index into a tagged table. """
+    hlen = ip.hist_len[table]
+    res = pc[2:2+ip.idx_bits] ^ fold_history(hist, hlen, ip.idx_bits)
+    return res[:ip.idx_bits]
+
+def ittage_tag(ip: IttageParams, pc: Value, hist: Value, table: int) -> Value:
+    """ Compute the partial tag for a tagged table. """
+    hlen = ip.hist_len[table]
+    lo = 2 + ip.idx_bits
+    pc_tag = pc[lo:lo+ip.tag_bits]
+    h0 = fold_history(hist, hlen, ip.tag_bits)
+    h1 = fold_history(hist, hlen, ip.tag_bits - 1)
+    return (pc_tag ^ h0 ^ (h1 << 1))[:ip.tag_bits]
+
+
+class IttageBaseEntry(StructLayout):
+    """ An entry in the ITTAGE base table.
+
+    Members
+    =======
+    valid:
+        This entry is valid
+    tgt:
+        Most-recent target address
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "valid": unsigned(1),
+            "tgt": unsigned(32),
+        })
+
+class IttageEntry(StructLayout):
+    """ An entry in an ITTAGE tagged table.
+
+    Members
+    =======
+    valid:
+        This entry is valid
+    tag:
+        Partial tag
+    tgt:
+        Predicted target address
+    ctr:
+        Confidence counter
+    u:
+        This entry was recently useful
+    """
+    def __init__(self, p: EmberParams):
+        ip = p.bp.ittage
+        super().__init__({
+            "valid": unsigned(1),
+            "tag": unsigned(ip.tag_bits),
+            "tgt": unsigned(32),
+            "ctr": unsigned(ip.ctr_bits),
+            "u": unsigned(1),
+        })
+
+
+class IttagePredictPort(Signature):
+    """ ITTAGE prediction port.
+
+    The response is available on the same cycle as the request.
+    """
+    class Request(Signature):
+        def __init__(self, p: EmberParams):
+            super().__init__({
+                "valid": Out(1),
+                "pc": Out(p.vaddr),
+                "hist": Out(p.bp.ittage.hist_bits),
+            })
+    class Response(Signature):
+        def __init__(self, p: EmberParams):
+            super().__init__({
+                "hit": Out(1),
+                "tgt": Out(p.vaddr),
+            })
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "req": Out(self.Request(p)),
+            "resp": In(self.Response(p)),
+        })
+
+class IttageUpdateRequest(Signature):
+    """ A request to train the predictor with a resolved target.
+
+    Members
+    =======
+    valid:
+        This request is valid
+    pc:
+        Program counter of the indirect jump or call
+    hist:
+        Path history used to make the prediction
+    tgt:
+        The resolved target address
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "valid": Out(1),
+            "pc": Out(p.vaddr),
+            "hist": Out(p.bp.ittage.hist_bits),
+            "tgt": Out(p.vaddr),
+        })
+
+
+class IttagePredictor(Component):
+    """ ITTAGE indirect target predictor.
+
+    The predictor consists of a base table (indexed only by the program
+    counter, holding the most-recent target) and a set of partially-tagged
+    tables indexed by a hash of the program counter and increasingly-long
+    path history.
+
+    The path history is kept by the user of the predictor
+    (see :func:`path_history_update`) and sent along with each request.
+
+    Prediction
+    ==========
+    The hitting table with the longest history (the "provider") gives the
+    predicted target. When the provider has no confidence, the alternate
+    prediction (from the next-longest hitting table, or the base table)
+    is used instead.
+
+    Update
+    ======
+    Updates are performed in a single cycle by reading the tables with
+    separate read ports.
+
+    - When the provider target is correct, the confidence counter is
+      incremented. Otherwise, the confidence counter is decremented, and
+      the target is replaced when the counter is already zero.
+    - The provider is marked useful when it is correct and the alternate
+      prediction is not.
+    - On a misprediction, a new entry is allocated in the first table with
+      a longer history whose indexed entry is not useful. When no entry can
+      be allocated, the candidate entries are marked not useful.
+    - The base table is written when there is no provider.
+
+    Ports
+    =====
+    predict: :class:`IttagePredictPort`
+        Prediction port
+    update: :class:`IttageUpdateRequest`
+        Update request
+
+    """
+    def __init__(self, param: EmberParams):
+        self.p = param
+        self.ip = param.bp.ittage
+        super().__init__(Signature({
+            "predict": In(IttagePredictPort(param)),
+            "update": In(IttageUpdateRequest(param)),
+        }))
+
+    def _select(self, m: Module, name: str, base, hits, ents):
+        """ Select the provider and alternate predictions. """
+        num_tables = self.ip.num_tables
+
+        pred_valid = base.valid
+        pred_tgt   = base.tgt
+        alt_valid  = C(0, 1)
+        alt_tgt    = C(0, 32)
+        prov_ctr   = C(0, self.ip.ctr_bits)
+        prov       = C(0, ceil_log2(num_tables))
+        for idx in range(num_tables):
+            alt_valid  = Mux(hits[idx], pred_valid, alt_valid)
+            alt_tgt    = Mux(hits[idx], pred_tgt, alt_tgt)
+            pred_valid = Mux(hits[idx], 1, pred_valid)
+            pred_tgt   = Mux(hits[idx], ents[idx].tgt, pred_tgt)
+            prov_ctr   = Mux(hits[idx], ents[idx].ctr, prov_ctr)
+            prov       = Mux(hits[idx], idx, prov)
+
+        res = {
+            "prov_valid": Signal(name=f"{name}_prov_valid"),
+            "prov": Signal(ceil_log2(num_tables), name=f"{name}_prov"),
+            "prov_tgt": Signal(32, name=f"{name}_prov_tgt"),
+            "alt_valid": Signal(name=f"{name}_alt_valid"),
+            "alt_tgt": Signal(32, name=f"{name}_alt_tgt"),
+            "valid": Signal(name=f"{name}_valid"),
+            "tgt": Signal(32, name=f"{name}_tgt"),
+        }
+        use_alt = Cat(*hits).any() & (prov_ctr == 0) & alt_valid
+        m.d.comb += [
+            res["prov_valid"].eq(Cat(*hits).any()),
+            res["prov"].eq(prov),
+            res["prov_tgt"].eq(pred_tgt),
+            res["alt_valid"].eq(alt_valid),
+            res["alt_tgt"].eq(alt_tgt),
+            res["valid"].eq(Mux(use_alt, alt_valid, pred_valid)),
+            res["tgt"].eq(Mux(use_alt, alt_tgt, pred_tgt)),
+        ]
+        return res
+
+    def elaborate(self, platform):
+        m = Module()
+        ip = self.ip
+        num_tables = ip.num_tables
+
+        base_mem = m.submodules.base_mem = memory.Memory(
+            shape=IttageBaseEntry(self.p), depth=ip.base_depth, init=[],
+        )
+        base_wp = base_mem.write_port()
+        base_rp = base_mem.read_port(domain='comb')
+        base_up = base_mem.read_port(domain='comb')
+
+        ent_wp = []
+        ent_rp = []
+        ent_up = []
+        for idx in range(num_tables):
+            mem = m.submodules[f"ent_mem{idx}"] = memory.Memory(
+                shape=IttageEntry(self.p), depth=ip.table_depth, init=[],
+            )
+            ent_wp.append(mem.write_port())
+            ent_rp.append(mem.read_port(domain='comb'))
+            ent_up.append(mem.read_port(domain='comb'))
+
+        # ----------------------------------------------------------------
+        # Prediction
+
+        req = self.predict.req
+        m.d.comb += base_rp.addr.eq(ittage_base_index(ip, req.pc.bits))
+        p_hits = []
+        for idx in range(num_tables):
+            m.d.comb += ent_rp[idx].addr.eq(
+                ittage_index(ip, req.pc.bits, req.hist, idx)
+            )
+            tag = ittage_tag(ip, req.pc.bits, req.hist, idx)
+            p_hits.append(ent_rp[idx].data.valid & (ent_rp[idx].data.tag == tag))
+
+        pred = self._select(m, "pred", base_rp.data, p_hits,
+            [ ent_rp[idx].data for idx in range(num_tables) ]
+        )
+        m.d.comb += [
+            self.predict.resp.hit.eq(req.valid & pred["valid"]),
+            self.predict.resp.tgt.eq(pred["tgt"]),
+        ]
+
+        # ----------------------------------------------------------------
+        # Update
+
+        upd = self.update
+        upd_pc = upd.pc.bits
+        upd_tgt = upd.tgt.bits
+        m.d.comb += base_up.addr.eq(ittage_base_index(ip, upd_pc))
+        u_idx  = []
+        u_tag  = []
+        u_hits = []
+        for idx in range(num_tables):
+            u_idx.append(ittage_index(ip, upd_pc, upd.hist, idx))
+            u_tag.append(ittage_tag(ip, upd_pc, upd.hist, idx))
+            m.d.comb += ent_up[idx].addr.eq(u_idx[idx])
+            u_hits.append(
+                ent_up[idx].data.valid & (ent_up[idx].data.tag == u_tag[idx])
+            )
+        ents = [ ent_up[idx].data for idx in range(num_tables) ]
+        sel = self._select(m, "upd", base_up.data, u_hits, ents)
+
+        mispred  = ~sel["valid"] | (sel["tgt"] != upd_tgt)
+        prov_ok  = (sel["prov_tgt"] == upd_tgt)
+        alt_ok   = sel["alt_valid"] & (sel["alt_tgt"] == upd_tgt)
+
+        # Tables with a longer history than the provider
+        above = [
+            (~sel["prov_valid"] | (sel["prov"] < idx))
+            for idx in range(num_tables)
+        ]
+        alloc_enc = m.submodules.alloc_enc = EmberPriorityEncoder(num_tables)
+        m.d.comb += alloc_enc.i.eq(Cat(*[
+            above[idx] & ~ents[idx].u for idx in range(num_tables)
+        ]))
+
+        with m.If(upd.valid & ~sel["prov_valid"]):
+            m.d.comb += [
+                base_wp.en.eq(1),
+                base_wp.addr.eq(ittage_base_index(ip, upd_pc)),
+                base_wp.data.valid.eq(1),
+                base_wp.data.tgt.eq(upd_tgt),
+            ]
+
+        for idx in range(num_tables):
+            ent = ents[idx]
+            wp = ent_wp[idx]
+            is_provider = sel["prov_valid"] & (sel["prov"] == idx)
+            is_alloc = mispred & alloc_enc.valid & (alloc_enc.o == idx)
+            is_decay = mispred & ~alloc_enc.valid & above[idx]
+            m.d.comb += [
+                wp.addr.eq(u_idx[idx]),
+                wp.data.eq(ent),
+            ]
+            with m.If(upd.valid):
+                with m.If(is_provider):
+                    m.d.comb += wp.en.eq(1)
+                    with m.If(prov_ok):
+                        m.d.comb += wp.data.ctr.eq(counter_update(ent.ctr, 1))
+                        with m.If(~alt_ok):
+                            m.d.comb += wp.data.u.eq(1)
+                    with m.Elif(ent.ctr == 0):
+                        m.d.comb += wp.data.tgt.eq(upd_tgt)
+                    with m.Else():
+                        m.d.comb += wp.data.ctr.eq(counter_update(ent.ctr, 0))
+                with m.Elif(is_alloc):
+                    m.d.comb += [
+                        wp.en.eq(1),
+                        wp.data.valid.eq(1),
+                        wp.data.tag.eq(u_tag[idx]),
+                        wp.data.tgt.eq(upd_tgt),
+                        wp.data.ctr.eq(0),
+                        wp.data.u.eq(0),
+                    ]
+                with m.Elif(is_decay):
+                    m.d.comb += [
+                        wp.en.eq(1),
+                        wp.data.u.eq(0),
+                    ]
+
+        return m
+
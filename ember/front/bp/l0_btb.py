@@ -7,30 +7,33 @@ from ember.common import *
 from ember.common.pipeline import *
 from ember.common.coding import ChainedPriorityEncoder, EmberPriorityEncoder
 from ember.param import *
-from ember.front.predecode import *
+from ember.front.bp.common import *
 from ember.uarch.front import *
 
+class L0BTBTag(Shape):
+    """ L0 BTB tag bits (the address of a cacheline).
+    """
+    def __init__(self, vaddr: VirtualAddress):
+        super().__init__(width=vaddr.num_blk_bits)
+
 class L0BTBEntry(StructLayout):
     """ L0 BTB entry.
+
+    Each entry records a single branch. Multiple entries may be associated
+    with the same cacheline.
     """
     def __init__(self, p: EmberParams):
         super().__init__({
-            # Predecoded information
-            "info": PredecodeInfo(p.vaddr),
-            # Previously-selected way
-            "way": unsigned(exact_log2(p.l1i.num_ways)),
+            "valid": unsigned(1),
+            "tag": L0BTBTag(p.vaddr),
+            "slot": BTBSlot(p),
         })
 
-class L0BTBTag(Shape):
-    """ L0 BTB tag bits. 
-    """
-    def __init__(self, vaddr: VirtualAddress): 
-        super().__init__(width=vaddr.num_off_bits)
-
-
 
 class L0BTBReadPort(Signature):
-    """ L0 BTB read port. 
+    """ L0 BTB read port.
+
+    The response is available on the same cycle as the request.
     """
 
     class Request(Signature):
@@ -42,7 +45,8 @@ class L0BTBReadPort(Signature):
     class Response(Signature):
         def __init__(self, p: EmberParams):
             super().__init__({
-                "data": Out(L0BTBEntry(p)),
+                "hit": Out(1),
+                "slot": Out(BTBSlot(p)),
                 "valid": Out(1)
             })
 
@@ -53,76 +57,97 @@ class L0BTBReadPort(Signature):
         })
 
 class L0BTBWritePort(Signature):
-    """ L0 BTB write port. 
+    """ L0 BTB write port.
     """
-    class Request(Signature):
-        def __init__(self, p: EmberParams):
-            super().__init__({
-                "pc": Out(p.vaddr),
-                "data": Out(L0BTBEntry(p)),
-                "valid": Out(1),
-            })
-    class Response(Signature):
-        def __init__(self, p: EmberParams):
-            super().__init__({
-                "valid": Out(1)
-            })
-
     def __init__(self, p: EmberParams):
         super().__init__({
-            "req": Out(self.Request(p)),
-            "resp": In(self.Response(p)),
+            "req": Out(BTBWriteRequest(p)),
         })
 
 
+class L0BranchTargetBuffer(Component):
+    """ Fully-associative Branch Target Buffer (BTB).
 
+    A lookup returns the first branch at or after the fetch offset in the
+    requested cacheline.
 
-class L0BranchTargetBuffer(Component):
-    """ Fully-associative Branch Target Buffer (BTB). 
+    A write updates the entry for the same branch if one exists. Otherwise,
+    a new entry is allocated in FIFO order.
+
+    Ports
+    =====
+    rp: :class:`L0BTBReadPort`
+        Read ports
+    wp: :class:`L0BTBWritePort`
+        Write port
 
     """
-    def __init__(self, param: EmberParams):
+    def __init__(self, param: EmberParams, num_rp: int = 1):
         self.p = param
         self.depth = param.bp.l0_btb.depth
+        self.num_rp = num_rp
         super().__init__(Signature({
-            "rp": In(L0BTBReadPort(param)),
+            "rp": In(L0BTBReadPort(param)).array(num_rp),
             "wp": In(L0BTBWritePort(param)),
         }))
 
     def elaborate(self, platform):
         m = Module()
 
-        pc = Signal(30)
-        m.d.comb += pc.eq(self.rp.req.pc.bits[2:])
-
-        # FIXME: For now, just take the low bits as the tag
-        tag = Signal(L0BTBTag(self.p.vaddr))
-        m.d.comb += tag.eq(self.rp.req.pc.bits)
-
-        tag_arr = Array(
-            Signal(L0BTBTag(self.p.vaddr)) for i in range(self.depth)
-        )
-        data_arr = Array(
-            Signal(L0BTBEntry(self.p)) for i in range(self.depth)
+        entry_arr = Array(
+            Signal(L0BTBEntry(self.p), name=f"entry_arr{i}")
+            for i in range(self.depth)
         )
-        valid_arr = Array(Signal() for i in range(self.depth))
+
+        # Lookup
+        for rp_idx, rp in enumerate(self.rp):
+            rp_tag = rp.req.pc.fetch_blk
+            sel = m.submodules[f"sel{rp_idx}"] = \
+                    BTBSlotSelect(self.p, self.depth)
+            for idx in range(self.depth):
+                hit = entry_arr[idx].valid & (entry_arr[idx].tag == rp_tag)
+                m.d.comb += [
+                    sel.slots[idx].eq(entry_arr[idx].slot),
+                    sel.slots[idx].valid.eq(hit & entry_arr[idx].slot.valid),
+                ]
+            m.d.comb += [
+                sel.off.eq(rp.req.pc.bits[2:2+self.p.l1i.word_idx_shape.width]),
+                rp.resp.valid.eq(rp.req.valid),
+                rp.resp.hit.eq(rp.req.valid & sel.hit),
+                rp.resp.slot.eq(sel.slot),
+            ]
+
+        # Update an existing entry or allocate a new one
+        wreq = self.wp.req
+        wp_tag = wreq.pc.fetch_blk
+        wp_off = wreq.pc.bits[2:2+self.p.l1i.word_idx_shape.width]
         match_arr = Array(
             Signal(name=f"match_arr{i}") for i in range(self.depth)
         )
-
-        with m.If(self.wp.req.valid):
-            pass
-
         for idx in range(self.depth):
-            hit = (valid_arr[idx] & (tag_arr[idx] == tag))
-            m.d.comb += match_arr[idx].eq(hit)
-
-        
+            m.d.comb += match_arr[idx].eq(
+                entry_arr[idx].valid &
+                (entry_arr[idx].tag == wp_tag) &
+                (entry_arr[idx].slot.off == wp_off)
+            )
         enc = m.submodules.enc = EmberPriorityEncoder(self.depth)
         m.d.comb += enc.i.eq(Cat(*match_arr))
 
-
+        r_next = Signal(range(self.depth), init=0)
+        wp_idx = Mux(enc.valid, enc.o, r_next)
+        with m.If(wreq.valid):
+            m.d.sync += [
+                entry_arr[wp_idx].valid.eq(1),
+                entry_arr[wp_idx].tag.eq(wp_tag),
+                entry_arr[wp_idx].slot.valid.eq(1),
+                entry_arr[wp_idx].slot.off.eq(wp_off),
+                entry_arr[wp_idx].slot.op.eq(wreq.op),
+                entry_arr[wp_idx].slot.tgt.eq(wreq.tgt),
+            ]
+            with m.If(~enc.valid):
+                m.d.sync += r_next.eq(
+                    Mux(r_next == self.depth - 1, 0, r_next + 1)
+                )
 
         return m
 
-
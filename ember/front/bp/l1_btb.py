@@ -0,0 +1,310 @@
+from amaranth import *
+from amaranth.lib.data import StructLayout, ArrayLayout, View
+from amaranth.lib.wiring import *
+import amaranth.lib.memory as memory
+from amaranth.utils import ceil_log2, exact_log2
+
+from ember.common.coding import EmberPriorityEncoder
+from ember.param import *
+from ember.param.front import L1BTBParams
+from ember.front.bp.common import *
+
+def l1_btb_set(bp: L1BTBParams, pc: View) -> Value:
+    """ Compute the set index for the cacheline containing a branch. """
+    return pc.fetch_blk[:bp.set_bits]
+
+def l1_btb_tag(bp: L1BTBParams, pc: View) -> Value:
+    """ Compute the partial tag for the cacheline containing a branch.
+
+    Bits above the tag are folded into the tag so that all address bits
+    contribute to it.
+    """
+    hi = pc.fetch_blk[bp.set_bits:]
+    return fold_history(hi, len(hi), bp.tag_bits)
+
+
+class L1BTBEntry(StructLayout):
+    """ L1 BTB entry.
+
+    Each entry is associated with a single cacheline.
+
+    Members
+    =======
+    valid:
+        This entry is valid
+    tag:
+        Partial tag
+    slots:
+        Branches in the cacheline
+    """
+    def __init__(self, p: EmberParams):
+        bp = p.bp.l1_btb
+        super().__init__({
+            "valid": unsigned(1),
+            "tag": unsigned(bp.tag_bits),
+            "slots": ArrayLayout(BTBSlot(p), bp.num_slots),
+        })
+
+
+class L1BTBReadPort(Signature):
+    """ L1 BTB read port.
+
+    The response is available two cycles after the request.
+    """
+    class Request(Signature):
+        def __init__(self, p: EmberParams):
+            super().__init__({
+                "pc": Out(p.vaddr),
+                "valid": Out(1)
+            })
+    class Response(Signature):
+        def __init__(self, p: EmberParams):
+            super().__init__({
+                "pc": Out(p.vaddr),
+                "hit": Out(1),
+                "slot": Out(BTBSlot(p)),
+                "valid": Out(1)
+            })
+
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "req": Out(self.Request(p)),
+            "resp": In(self.Response(p)),
+        })
+
+class L1BTBWritePort(Signature):
+    """ L1 BTB write port.
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "req": Out(BTBWriteRequest(p)),
+        })
+
+
+class L1BranchTargetBuffer(Component):
+    """ Set-associative Branch Target Buffer (BTB).
+
+    Each entry is associated with a cacheline and holds up to
+    ``num_slots`` branches.
+
+    Lookup
+    ======
+    1. Read all ways in the set.
+    2. Compare tags and select the first branch at or after the fetch
+       offset in the hitting way.
+    3. The result is available on the following cycle.
+
+    Write
+    =====
+    Writes are read-modify-write operations (using a separate read port):
+
+    1. Read all ways in the set.
+    2. On a hit, update the slot for the same branch, or an invalid slot,
+       or the last slot (in that order). On a miss, write a new entry to
+       an invalid way, or to the way selected by a per-set round-robin
+       replacement pointer.
+
+    Ports
+    =====
+    rp: :class:`L1BTBReadPort`
+        Read port
+    wp: :class:`L1BTBWritePort`
+        Write port
+
+    """
+    def __init__(self, param: EmberParams):
+        self.p = param
+        self.bp = param.bp.l1_btb
+        super().__init__(Signature({
+            "rp": In(L1BTBReadPort(param)),
+            "wp": In(L1BTBWritePort(param)),
+        }))
+
+    def elaborate(self, platform):
+        m = Module()
+        bp = self.bp
+        num_ways = bp.num_ways
+        num_slots = bp.num_slots
+        off_bits = self.p.l1i.word_idx_shape.width
+
+        data_wp = []
+        data_rp = []
+        data_mp = []
+        for way in range(num_ways):
+            mem = m.submodules[f"data_mem{way}"] = memory.Memory(
+                shape=L1BTBEntry(self.p), depth=bp.num_sets, init=[],
+            )
+            data_wp.append(mem.write_port())
+            data_rp.append(mem.read_port(transparent_for=[data_wp[way]]))
+            data_mp.append(mem.read_port(transparent_for=[data_wp[way]]))
+
+        # Per-set round-robin replacement pointer
+        repl_mem = m.submodules.repl_mem = memory.Memory(
+            shape=unsigned(bp.way_bits), depth=bp.num_sets, init=[],
+        )
+        repl_wp = repl_mem.write_port()
+        repl_rp = repl_mem.read_port(transparent_for=[repl_wp])
+
+        # ----------------------------------------------------------------
+        # Lookup (stage 0): read all ways
+
+        req = self.rp.req
+        r1_valid = Signal()
+        r1_pc    = Signal(self.p.vaddr)
+        for way in range(num_ways):
+            m.d.comb += [
+                data_rp[way].en.eq(req.valid),
+                data_rp[way].addr.eq(l1_btb_set(bp, req.pc)),
+            ]
+        m.d.sync += [
+            r1_valid.eq(req.valid),
+            r1_pc.eq(req.pc),
+        ]
+
+        # ----------------------------------------------------------------
+        # Lookup (stage 1): compare tags and select a branch
+
+        r1_tag = l1_btb_tag(bp, r1_pc)
+        way_hit = [
+            data_rp[way].data.valid & (data_rp[way].data.tag == r1_tag)
+            for way in range(num_ways)
+        ]
+        hit_slots = Signal(ArrayLayout(BTBSlot(self.p), num_slots))
+        hit_data = C(0, len(hit_slots.as_value()))
+        for way in range(num_ways):
+            hit_data = Mux(way_hit[way],
+                data_rp[way].data.slots.as_value(), hit_data
+            )
+        m.d.comb += hit_slots.eq(hit_data)
+
+        sel = m.submodules.sel = BTBSlotSelect(self.p, num_slots)
+        for idx in range(num_slots):
+            m.d.comb += sel.slots[idx].eq(hit_slots[idx])
+        m.d.comb += sel.off.eq(r1_pc.bits[2:2+off_bits])
+
+        r2_valid = Signal()
+        r2_pc    = Signal(self.p.vaddr)
+        r2_hit   = Signal()
+        r2_slot  = Signal(BTBSlot(self.p))
+        m.d.sync += [
+            r2_valid.eq(r1_valid),
+            r2_pc.eq(r1_pc),
+            r2_hit.eq(r1_valid & Cat(*way_hit).any() & sel.hit),
+            r2_slot.eq(sel.slot),
+        ]
+
+        # ----------------------------------------------------------------
+        # Lookup (stage 2): drive the response
+
+        m.d.comb += [
+            self.rp.resp.valid.eq(r2_valid),
+            self.rp.resp.pc.eq(r2_pc),
+            self.rp.resp.hit.eq(r2_hit),
+            self.rp.resp.slot.eq(r2_slot),
+        ]
+
+        # ----------------------------------------------------------------
+        # Write (stage 0): read all ways and the replacement pointer
+
+        wreq = self.wp.req
+        w1_valid = Signal()
+        w1_pc    = Signal(self.p.vaddr)
+        w1_op    = Signal(ControlFlowOp)
+        w1_tgt   = Signal(self.p.vaddr)
+        for way in range(num_ways):
+            m.d.comb += [
+                data_mp[way].en.eq(wreq.valid),
+                data_mp[way].addr.eq(l1_btb_set(bp, wreq.pc)),
+            ]
+        m.d.comb += [
+            repl_rp.en.eq(wreq.valid),
+            repl_rp.addr.eq(l1_btb_set(bp, wreq.pc)),
+        ]
+        m.d.sync += [
+            w1_valid.eq(wreq.valid),
+            w1_pc.eq(wreq.pc),
+            w1_op.eq(wreq.op),
+            w1_tgt.eq(wreq.tgt),
+        ]
+
+        # ----------------------------------------------------------------
+        # Write (stage 1): merge the branch into an entry
+
+        w1_set = l1_btb_set(bp, w1_pc)
+        w1_tag = l1_btb_tag(bp, w1_pc)
+        w1_off = w1_pc.bits[2:2+off_bits]
+
+        w_hit = [
+            data_mp[way].data.valid & (data_mp[way].data.tag == w1_tag)
+            for way in range(num_ways)
+        ]
+        w_inv = [ ~data_mp[way].data.valid for way in range(num_ways) ]
+        hit_enc = m.submodules.hit_enc = EmberPriorityEncoder(num_ways)
+        inv_enc = m.submodules.inv_enc = EmberPriorityEncoder(num_ways)
+        m.d.comb += [
+            hit_enc.i.eq(Cat(*w_hit)),
+            inv_enc.i.eq(Cat(*w_inv)),
+        ]
+
+        # The way being written
+        w_way = Signal(bp.way_bits)
+        m.d.comb += w_way.eq(Mux(hit_enc.valid, hit_enc.o,
+            Mux(inv_enc.valid, inv_enc.o, repl_rp.data)
+        ))
+
+        # The existing entry in the hitting way
+        old_entry = Signal(L1BTBEntry(self.p))
+        old_data = C(0, len(old_entry.as_value()))
+        for way in range(num_ways):
+            old_data = Mux(w_hit[way], data_mp[way].data.as_value(), old_data)
+        m.d.comb += old_entry.eq(old_data)
+
+        # The slot being written
+        s_same = [
+            old_entry.slots[idx].valid & (old_entry.slots[idx].off == w1_off)
+            for idx in range(num_slots)
+        ]
+        s_inv = [ ~old_entry.slots[idx].valid for idx in range(num_slots) ]
+        same_enc = m.submodules.same_enc = EmberPriorityEncoder(num_slots)
+        sinv_enc = m.submodules.sinv_enc = EmberPriorityEncoder(num_slots)
+        m.d.comb += [
+            same_enc.i.eq(Cat(*s_same)),
+            sinv_enc.i.eq(Cat(*s_inv)),
+        ]
+        w_slot = Signal(range(num_slots))
+        m.d.comb += w_slot.eq(Mux(same_enc.valid, same_enc.o,
+            Mux(sinv_enc.valid, sinv_enc.o, num_slots - 1)
+        ))
+
+        new_entry = Signal(L1BTBEntry(self.p))
+        m.d.comb += [
+            new_entry.valid.eq(1),
+            new_entry.tag.eq(w1_tag),
+        ]
+        for idx in range(num_slots):
+            with m.If(w_slot == idx):
+                m.d.comb += [
+                    new_entry.slots[idx].valid.eq(1),
+                    new_entry.slots[idx].off.eq(w1_off),
+                    new_entry.slots[idx].op.eq(w1_op),
+                    new_entry.slots[idx].tgt.eq(w1_tgt),
+                ]
+            with m.Elif(hit_enc.valid):
+                m.d.comb += new_entry.slots[idx].eq(old_entry.slots[idx])
+
+        for way in range(num_ways):
+            m.d.comb += [
+                data_wp[way].en.eq(w1_valid & (w_way == way)),
+                data_wp[way].addr.eq(w1_set),
+                data_wp[way].data.eq(new_entry),
+            ]
+
+        # Advance the replacement pointer when replacing a valid entry
+        m.d.comb += [
+            repl_wp.en.eq(w1_valid & ~hit_enc.valid & ~inv_enc.valid),
+            repl_wp.addr.eq(w1_set),
+            repl_wp.data.eq(repl_rp.data + 1),
+        ]
+
+        return m
+
@@ -0,0 +1,238 @@
+from amaranth import *
+from amaranth.lib.data import StructLayout
+from amaranth.lib.wiring import *
+
+from ember.param import *
+from ember.param.front import LoopParams
+from ember.front.bp.common import *
+
+def loop_index(lp: LoopParams, pc: Value) -> Value:
+    """ Compute the index of the entry for a branch. """
+    return pc[2:2+lp.idx_bits]
+
+def loop_tag(lp: LoopParams, pc: Value) -> Value:
+    """ Compute the partial tag for a branch. """
+    lo = 2 + lp.idx_bits
+    return pc[lo:lo+lp.tag_bits]
+
+
+class LoopEntry(StructLayout):
+    """ An entry in the loop predictor.
+
+    Members
+    =======
+    valid:
+        This entry is valid
+    tag:
+        Partial tag
+    trip:
+        Number of consecutive taken outcomes before the loop exits
+    conf:
+        Number of consecutive loop instances with the same trip count
+    arch_iter:
+        Number of taken outcomes observed in the current loop instance
+    spec_iter:
+        Number of taken outcomes predicted in the current loop instance
+    age:
+        Decreased by conflicting allocations [the entry is replaced at zero]
+    """
+    def __init__(self, p: EmberParams):
+        lp = p.bp.loop
+        super().__init__({
+            "valid": unsigned(1),
+            "tag": unsigned(lp.tag_bits),
+            "trip": unsigned(lp.iter_bits),
+            "conf": unsigned(lp.conf_bits),
+            "arch_iter": unsigned(lp.iter_bits),
+            "spec_iter": unsigned(lp.iter_bits),
+            "age": unsigned(lp.age_bits),
+        })
+
+class LoopMeta(StructLayout):
+    """ Information captured when making a prediction.
+
+    Members
+    =======
+    hit:
+        The branch was found in the loop predictor
+    confident:
+        The prediction should override the main direction predictor
+    taken:
+        The predicted direction
+    idx:
+        Index of the entry used to make the prediction
+    iter:
+        Speculative iteration count used to make the prediction
+    """
+    def __init__(self, p: EmberParams):
+        lp = p.bp.loop
+        super().__init__({
+            "hit": unsigned(1),
+            "confident": unsigned(1),
+            "taken": unsigned(1),
+            "idx": unsigned(lp.idx_bits),
+            "iter": unsigned(lp.iter_bits),
+        })
+
+
+class LoopPredictor(DirectionPredictor):
+    """ Loop predictor.
+
+    A counted loop is closed by a branch which is taken a fixed number of
+    times (the "trip count") before falling through once. Predictors using
+    global history usually mispredict the final iteration of each loop
+    instance. The loop predictor learns the trip count for each branch and
+    predicts the exit.
+
+    Prediction
+    ==========
+    The prediction is available on the cycle after a request. A branch is
+    predicted taken until the speculative iteration count reaches the trip
+    count. The speculative iteration count is advanced with the predicted
+    outcome, and repaired with a recovery request.
+
+    The prediction is only meant to override the main direction predictor
+    when ``meta.confident`` is set: the same trip count has been observed
+    for several consecutive loop instances.
+
+    Update
+    ======
+    Resolved outcomes advance the architectural iteration count. When a
+    loop exits, the trip count is compared with the architectural
+    iteration count: confidence is increased when they match, and otherwise
+    the trip count is replaced.
+
+    An entry is allocated when a branch is resolved not-taken (the start of
+    a new loop instance), unless the existing entry is still useful. Each
+    entry has an age counter: it is set to the maximum value when the entry
+    is allocated and whenever a loop exit confirms the trip count, and it is
+    decreased by each conflicting allocation. An entry is only replaced 
+    when its age is zero, so an entry which is still learning the trip 
+    count is not evicted by a single conflicting branch.
+    An entry is invalidated when the iteration count overflows.
+
+    """
+    def __init__(self, param: EmberParams):
+        self.lp = param.bp.loop
+        super().__init__(param)
+
+    @classmethod
+    def meta_layout(cls, p: EmberParams):
+        return LoopMeta(p)
+
+    def elaborate(self, platform):
+        m = Module()
+        lp = self.lp
+        conf_max = (1 << lp.conf_bits) - 1
+        iter_max = (1 << lp.iter_bits) - 1
+        age_max  = (1 << lp.age_bits) - 1
+
+        entry_arr = Array(
+            Signal(LoopEntry(self.p), name=f"entry_arr{idx}")
+            for idx in range(lp.depth)
+        )
+
+        # The speculative iteration count being written on this cycle
+        spec_wr_en   = Signal()
+        spec_wr_idx  = Signal(lp.idx_bits)
+        spec_wr_iter = Signal(lp.iter_bits)
+
+        # ----------------------------------------------------------------
+        # Prediction (stage 0): read the entry
+
+        req = self.predict.req
+        idx = loop_index(lp, req.pc.bits)
+        tag = loop_tag(lp, req.pc.bits)
+        ent = entry_arr[idx]
+
+        # Forward a speculative iteration count being written on this cycle
+        cur_iter = Signal(lp.iter_bits)
+        m.d.comb += cur_iter.eq(Mux(spec_wr_en & (spec_wr_idx == idx),
+            spec_wr_iter, ent.spec_iter
+        ))
+
+        hit = ent.valid & (ent.tag == tag)
+        taken = (cur_iter != ent.trip)
+        confident = hit & (ent.conf == conf_max) & (ent.trip != 0)
+
+        r_valid = Signal()
+        r_meta  = Signal(LoopMeta(self.p))
+        m.d.sync += [
+            r_valid.eq(req.valid),
+            r_meta.hit.eq(hit),
+            r_meta.confident.eq(confident),
+            r_meta.taken.eq(taken),
+            r_meta.idx.eq(idx),
+            r_meta.iter.eq(cur_iter),
+        ]
+
+        # ----------------------------------------------------------------
+        # Prediction (stage 1): drive the response
+
+        resp = self.predict.resp
+        m.d.comb += [
+            resp.valid.eq(r_valid),
+            resp.taken.eq(r_meta.taken),
+            resp.meta.eq(r_meta),
+        ]
+
+        # Advance the speculative iteration count with the prediction.
+        # A recovery request replaces the count with the resolved outcome.
+        rec = self.recover
+        with m.If(rec.valid):
+            m.d.comb += [
+                spec_wr_en.eq(rec.meta.hit),
+                spec_wr_idx.eq(rec.meta.idx),
+                spec_wr_iter.eq(Mux(rec.taken, rec.meta.iter + 1, 0)),
+            ]
+        with m.Else():
+            m.d.comb += [
+                spec_wr_en.eq(r_valid & r_meta.hit),
+                spec_wr_idx.eq(r_meta.idx),
+                spec_wr_iter.eq(Mux(r_meta.taken, r_meta.iter + 1, 0)),
+            ]
+
+        # ----------------------------------------------------------------
+        # Update
+
+        upd = self.update
+        upd_idx = loop_index(lp, upd.pc.bits)
+        upd_tag = loop_tag(lp, upd.pc.bits)
+        upd_ent = entry_arr[upd_idx]
+        upd_hit = upd_ent.valid & (upd_ent.tag == upd_tag)
+
+        with m.If(upd.valid):
+            with m.If(upd_hit & upd.taken):
+                with m.If(upd_ent.arch_iter == iter_max):
+                    m.d.sync += upd_ent.valid.eq(0)
+                with m.Else():
+                    m.d.sync += upd_ent.arch_iter.eq(upd_ent.arch_iter + 1)
+            with m.Elif(upd_hit & ~upd.taken):
+                m.d.sync += upd_ent.arch_iter.eq(0)
+                with m.If(upd_ent.arch_iter == upd_ent.trip):
+                    m.d.sync += upd_ent.age.eq(age_max)
+                    with m.If(upd_ent.conf != conf_max):
+                        m.d.sync += upd_ent.conf.eq(upd_ent.conf + 1)
+                with m.Else():
+                    m.d.sync += [
+                        upd_ent.trip.eq(upd_ent.arch_iter),
+                        upd_ent.conf.eq(0),
+                    ]
+            with m.Elif(~upd.taken & (~upd_ent.valid | (upd_ent.age == 0))):
+                m.d.sync += [
+                    upd_ent.valid.eq(1),
+                    upd_ent.tag.eq(upd_tag),
+                    upd_ent.trip.eq(0),
+                    upd_ent.conf.eq(0),
+                    upd_ent.arch_iter.eq(0),
+                    upd_ent.spec_iter.eq(0),
+                    upd_ent.age.eq(age_max),
+                ]
+            with m.Elif(~upd.taken):
+                m.d.sync += upd_ent.age.eq(upd_ent.age - 1)
+
+        with m.If(spec_wr_en):
+            m.d.sync += entry_arr[spec_wr_idx].spec_iter.eq(spec_wr_iter)
+
+        return m
+
@@ -0,0 +1,148 @@
+from amaranth import *
+from amaranth.lib.data import StructLayout, ArrayLayout
+from amaranth.lib.wiring import *
+import amaranth.lib.memory as memory
+
+from ember.param import *
+from ember.param.front import PerceptronParams
+from ember.front.bp.common import *
+
+def perceptron_index(pp: PerceptronParams, pc: Value, ghist: Value,
+                     table: int) -> Value:
+    """ Compute the index into a weight table.
+
+    The first table is indexed only by the program counter. Each of the
+    remaining tables is indexed by the program counter XOR'ed with a
+    different segment of the global history.
+    """
+    pc_idx = pc[2:2+pp.idx_bits]
+    if table == 0:
+        return pc_idx
+    lo = (table - 1) * pp.seg_len
+    seg = ghist[lo:lo+pp.seg_len]
+    return (pc_idx ^ fold_history(seg, pp.seg_len, pp.idx_bits))[:pp.idx_bits]
+
+def weight_update(w: Value, up: Value) -> Value:
+    """ Return the next value of a saturating signed weight. """
+    width = len(w)
+    max_val = (1 << (width - 1)) - 1
+    min_val = -(1 << (width - 1))
+    inc = Mux(w == max_val, w, w + 1)
+    dec = Mux(w == min_val, w, w - 1)
+    return Mux(up, inc, dec)[:width].as_signed()
+
+
+class PerceptronMeta(StructLayout):
+    """ Information captured when making a prediction.
+
+    Members
+    =======
+    hist: :class:`GlobalHistoryMeta`
+        Global history used to make the prediction
+    taken:
+        The predicted direction
+    sum:
+        Sum of all weights
+    w:
+        Weight read from each table
+    """
+    def __init__(self, p: EmberParams):
+        pp = p.bp.perceptron
+        super().__init__({
+            "hist": GlobalHistoryMeta(p.bp.ghist_bits),
+            "taken": unsigned(1),
+            "sum": signed(pp.sum_bits),
+            "w": ArrayLayout(signed(pp.weight_bits), pp.num_tables),
+        })
+
+
+class PerceptronPredictor(DirectionPredictor):
+    """ Hashed perceptron conditional branch direction predictor.
+
+    Each table holds signed weights, and is indexed by a hash of the program
+    counter and a segment of the global history. A branch is predicted taken
+    when the sum of the weights selected from all tables is non-negative.
+
+    Weights are trained toward the resolved outcome when a prediction is
+    incorrect, or when the magnitude of the sum does not exceed the training
+    threshold.
+
+    """
+    def __init__(self, param: EmberParams):
+        self.pp = param.bp.perceptron
+        super().__init__(param)
+
+    @classmethod
+    def meta_layout(cls, p: EmberParams):
+        return PerceptronMeta(p)
+
+    def elaborate(self, platform):
+        m = Module()
+        pp = self.pp
+        num_tables = pp.num_tables
+
+        ghr = m.submodules.ghr = GlobalHistoryRegister(self.p.bp.ghist_bits)
+
+        wps = []
+        rps = []
+        for idx in range(num_tables):
+            mem = m.submodules[f"mem{idx}"] = memory.Memory(
+                shape=signed(pp.weight_bits), depth=pp.depth, init=[],
+            )
+            wps.append(mem.write_port())
+            rps.append(mem.read_port(transparent_for=[wps[idx]]))
+
+        req = self.predict.req
+        for idx in range(num_tables):
+            m.d.comb += [
+                rps[idx].en.eq(req.valid),
+                rps[idx].addr.eq(
+                    perceptron_index(pp, req.pc.bits, ghr.ghist, idx)
+                ),
+            ]
+
+        r_valid = Signal()
+        m.d.sync += r_valid.eq(req.valid)
+
+        w_sum = Signal(signed(pp.sum_bits))
+        m.d.comb += w_sum.eq(sum(rp.data for rp in rps))
+        pred_taken = Signal()
+        m.d.comb += pred_taken.eq(w_sum >= 0)
+
+        resp = self.predict.resp
+        m.d.comb += [
+            resp.valid.eq(r_valid),
+            resp.taken.eq(pred_taken),
+            resp.meta.hist.eq(ghr.meta),
+            resp.meta.taken.eq(pred_taken),
+            resp.meta.sum.eq(w_sum),
+            ghr.spec.valid.eq(r_valid),
+            ghr.spec.taken.eq(pred_taken),
+        ]
+        for idx in range(num_tables):
+            m.d.comb += resp.meta.w[idx].eq(rps[idx].data)
+
+        m.d.comb += [
+            ghr.recover.valid.eq(self.recover.valid),
+            ghr.recover.ghist.eq(self.recover.meta.hist.ckpt),
+            ghr.recover.taken.eq(self.recover.taken),
+        ]
+
+        upd = self.update
+        upd_sum = upd.meta.sum
+        upd_mag = Mux(upd_sum < 0, -upd_sum, upd_sum)
+        train = Signal()
+        m.d.comb += train.eq(upd.valid & (
+            (upd.meta.taken != upd.taken) | (upd_mag <= pp.threshold)
+        ))
+        for idx in range(num_tables):
+            m.d.comb += [
+                wps[idx].en.eq(train),
+                wps[idx].addr.eq(
+                    perceptron_index(pp, upd.pc.bits, upd.meta.hist.ghist, idx)
+                ),
+                wps[idx].data.eq(weight_update(upd.meta.w[idx], upd.taken)),
+            ]
+
+        return m
+
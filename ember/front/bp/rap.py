@@ -1,34 +1,27 @@
 from amaranth import *
 from amaranth.lib.data import StructLayout, ArrayLayout
 from amaranth.lib.enum import Enum
-import amaranth.lib.memory
 from amaranth.utils import exact_log2
 
 from ember.common import *
 from ember.param import *
-from ember.front.l1i import *
-from ember.front.itlb import *
+from ember.uarch.front import RapCheckpoint
 from ember.uarch.mop import *
 
-class RapRequest(Signature):
-    def __init__(self, num_entries: int):
-        super().__init__({
-            "valid": Out(1),
-            "idx": Out(exact_log2(num_entries))
-        })
-class RapWriteRequest(Signature):
-    def __init__(self, num_entries: int):
-        super().__init__({
-            "valid": Out(1),
-            "idx": Out(exact_log2(num_entries)),
-            "addr": Out(32),
-        })
-class RapResponse(Signature):
-    def __init__(self, num_entries: int):
+class RapEntry(StructLayout):
+    """ An entry in the RAP stack.
+
+    Members
+    =======
+    addr:
+        Return address
+    ctr:
+        Number of additional consecutive pushes of the same address
+    """
+    def __init__(self, ctr_bits: int):
         super().__init__({
-            "valid": Out(1),
-            "idx": Out(exact_log2(num_entries)),
-            "addr": Out(32),
+            "addr": unsigned(32),
+            "ctr": unsigned(ctr_bits),
         })
 
 class RapPushPort(Signature):
@@ -55,7 +48,7 @@ class RapPushPort(Signature):
     def __init__(self, num_entries: int):
         super().__init__({
             "req": Out(RapPushPort.Request(num_entries)),
-            "resp": Out(RapPushPort.Response(num_entries)),
+            "resp": In(RapPushPort.Response(num_entries)),
         })
 
 class RapPopPort(Signature):
@@ -65,8 +58,6 @@ class RapPopPort(Signature):
             super().__init__({
                 # This request is valid
                 "valid": Out(1),
-                # Index of the entry to-be-read from the stack
-                "idx": Out(exact_log2(num_entries)),
             })
     class Response(Signature):
         """ Response to a RAP pop request. """
@@ -87,78 +78,160 @@ class RapPopPort(Signature):
             "resp": In(RapPopPort.Response(num_entries)),
         })
 
+class RapRestoreRequest(Signature):
+    """ A request to restore the RAP from a checkpoint.
 
+    Members
+    =======
+    valid:
+        This request is valid
+    ckpt:
+        The checkpoint to restore
+    """
+    def __init__(self, num_entries: int, ctr_bits: int):
+        super().__init__({
+            "valid": Out(1),
+            "ckpt": Out(RapCheckpoint(num_entries, ctr_bits)),
+        })
 
 
 class ReturnAddressPredictor(Component):
-    """ A memory device used to track predicted return addresses. 
-
-    .. warning::
-        At the moment, this is a simple memory device that does not accomodate 
-        overflow/underflow conditions, and we assume that other logic in 
-        the pipeline is responsible for interacting with the RAP in a way 
-        that actually implements a stack.
+    """ A circular stack used to track predicted return addresses.
+
+    Overflow and Underflow
+    ======================
+    Pushing the address on the top of the stack increments a repeat counter
+    in the top entry instead of allocating a new entry (until the counter
+    saturates). This means that deep recursion consumes few entries.
+
+    The number of valid entries saturates at the size of the stack.
+    When the stack overflows, the oldest entry is overwritten. When the
+    stack is empty, a pop is signalled as an underflow and ``head_valid``
+    is low.
+
+    Checkpoints
+    ===========
+    The current top-of-stack pointer, the number of valid entries, and the
+    contents of the top-of-stack entry are always available as a checkpoint.
+    Restoring a checkpoint repairs the stack after wrong-path pushes and pops.
+    A push or pop occuring on the same cycle as a restore is applied to the
+    restored state, and ``head`` reflects the restored state.
+
+    Ports
+    =====
+    push:
+        Push an address onto the stack
+    pop:
+        Pop an address off the stack
+    head:
+        The address on the top of the stack
+    head_valid:
+        The stack is not empty
+    ckpt:
+        The current state of the stack
+    restore:
+        Restore the state of the stack
 
     """
-    def __init__(self, num_entries: int):
+    def __init__(self, num_entries: int, ctr_bits: int = 2):
         self.num_entries = num_entries
+        self.ctr_bits = ctr_bits
         signature = Signature({
-            "write_req": In(RapWriteRequest(num_entries)),
-            "req": In(RapRequest(num_entries)),
-            "resp": Out(RapResponse(num_entries)),
-
             "push": In(RapPushPort(num_entries)),
-            "pop": In(RapPushPort(num_entries)),
+            "pop": In(RapPopPort(num_entries)),
             "head": Out(32),
+            "head_valid": Out(1),
+            "ckpt": Out(RapCheckpoint(num_entries, ctr_bits)),
+            "restore": In(RapRestoreRequest(num_entries, ctr_bits)),
         })
         super().__init__(signature)
+
     def elaborate(self, platform):
         m = Module()
-        mem = m.submodules.mem = memory.Memory(
-            shape=unsigned(32),
-            depth=self.num_entries,
-            init=[],
-        )
 
-        r_ptr = Signal(exact_log2(self.num_entries))
+        ctr_max = (1 << self.ctr_bits) - 1
 
-        rp = mem.read_port(domain='comb')
-        wp = mem.write_port()
+        entry_arr = Array(
+            Signal(RapEntry(self.ctr_bits), name=f"entry_arr{idx}")
+            for idx in range(self.num_entries)
+        )
+        r_ptr = Signal(exact_log2(self.num_entries), init=0)
+        r_cnt = Signal(range(self.num_entries + 1), init=0)
 
         m.d.comb += [
-            rp.addr.eq(r_ptr - 1),
-            self.head.eq(rp.data),
+            self.ckpt.ptr.eq(r_ptr),
+            self.ckpt.cnt.eq(r_cnt),
+            self.ckpt.addr.eq(entry_arr[r_ptr].addr),
+            self.ckpt.ctr.eq(entry_arr[r_ptr].ctr),
         ]
 
-        with m.If(self.pop.req.valid):
-            m.d.sync += r_ptr.eq(r_ptr - 1)
-
-        with m.If(self.push.req.valid):
-            m.d.sync += r_ptr.eq(r_ptr + 1)
+        # The state of the stack before applying a push or pop
+        ptr = Signal(exact_log2(self.num_entries))
+        cnt = Signal(range(self.num_entries + 1))
+        tos = Signal(RapEntry(self.ctr_bits))
+        with m.If(self.restore.valid):
+            m.d.comb += [
+                ptr.eq(self.restore.ckpt.ptr),
+                cnt.eq(self.restore.ckpt.cnt),
+                tos.addr.eq(self.restore.ckpt.addr),
+                tos.ctr.eq(self.restore.ckpt.ctr),
+            ]
+            m.d.sync += [
+                r_ptr.eq(self.restore.ckpt.ptr),
+                r_cnt.eq(self.restore.ckpt.cnt),
+                entry_arr[self.restore.ckpt.ptr].eq(tos),
+            ]
+        with m.Else():
             m.d.comb += [
-                wp.en.eq(self.push.req.valid),
-                wp.data.eq(self.push.req.addr),
-                wp.addr.eq(r_ptr),
+                ptr.eq(r_ptr),
+                cnt.eq(r_cnt),
+                tos.eq(entry_arr[r_ptr]),
             ]
 
+        empty = (cnt == 0)
+        m.d.comb += [
+            self.head.eq(tos.addr),
+            self.head_valid.eq(~empty),
+        ]
 
-        #m.d.comb += [
-        #    #rp.en.eq(self.req.valid),
-        #    rp.addr.eq(self.req.idx),
-        #    wp.en.eq(self.write_req.valid),
-        #    wp.addr.eq(self.write_req.idx),
-        #    wp.data.eq(self.write_req.addr),
-        #]
-
-        #bypass_match = (self.write_req.idx == self.req.idx)
-        #can_bypass = (self.write_req.valid & bypass_match)
-        #result = Mux(can_bypass, self.write_req.addr, rp.data)
-        #m.d.sync += [
-        #    self.resp.valid.eq(self.req.valid),
-        #    self.resp.addr.eq(Mux(self.req.valid, result, 0)),
-        #    self.resp.idx.eq(self.req.idx),
-        #]
-        return m
+        push = self.push.req
+        pop  = self.pop.req
+        with m.If(push.valid):
+            repeat = (~empty & (tos.addr == push.addr) & (tos.ctr != ctr_max))
+            next_ptr = (ptr + 1)[:len(ptr)]
+            with m.If(repeat):
+                m.d.sync += entry_arr[ptr].ctr.eq(tos.ctr + 1)
+            with m.Else():
+                m.d.sync += [
+                    r_ptr.eq(next_ptr),
+                    entry_arr[next_ptr].addr.eq(push.addr),
+                    entry_arr[next_ptr].ctr.eq(0),
+                ]
+                with m.If(cnt != self.num_entries):
+                    m.d.sync += r_cnt.eq(cnt + 1)
+            m.d.comb += [
+                self.push.resp.valid.eq(1),
+                self.push.resp.idx.eq(Mux(repeat, ptr, next_ptr)),
+                self.push.resp.overflow.eq(
+                    ~repeat & (cnt == self.num_entries)
+                ),
+            ]
 
+        with m.Elif(pop.valid):
+            m.d.comb += [
+                self.pop.resp.valid.eq(1),
+                self.pop.resp.idx.eq(ptr),
+                self.pop.resp.addr.eq(tos.addr),
+                self.pop.resp.underflow.eq(empty),
+            ]
+            with m.If(~empty):
+                with m.If(tos.ctr != 0):
+                    m.d.sync += entry_arr[ptr].ctr.eq(tos.ctr - 1)
+                with m.Else():
+                    m.d.sync += [
+                        r_ptr.eq(ptr - 1),
+                        r_cnt.eq(cnt - 1),
+                    ]
 
+        return m
 
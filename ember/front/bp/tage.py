@@ -0,0 +1,332 @@
+from amaranth import *
+from amaranth.lib.data import StructLayout, ArrayLayout
+from amaranth.lib.wiring import *
+import amaranth.lib.memory as memory
+from amaranth.utils import ceil_log2, exact_log2
+
+from ember.common.coding import EmberPriorityEncoder
+from ember.param import *
+from ember.param.front import TageParams
+from ember.front.bp.common import *
+
+def tage_base_index(tp: TageParams, pc: Value) -> Value:
+    """ Compute the index into the bimodal base table. """
+    return pc[2:2+tp.base_idx_bits]
+
+def tage_index(tp: TageParams, pc: Value, ghist: Value, table: int) -> Value:
+    """ Compute the index into a tagged table. """
+    hlen = tp.hist_len[table]
+    res = pc[2:2+tp.idx_bits] ^ fold_history(ghist, hlen, tp.idx_bits)
+    return res[:tp.idx_bits]
+
+def tage_tag(tp: TageParams, pc: Value, ghist: Value, table: int) -> Value:
+    """ Compute the partial tag for a tagged table. """
+    hlen = tp.hist_len[table]
+    lo = 2 + tp.idx_bits
+    pc_tag = pc[lo:lo+tp.tag_bits]
+    h0 = fold_history(ghist, hlen, tp.tag_bits)
+    h1 = fold_history(ghist, hlen, tp.tag_bits - 1)
+    return (pc_tag ^ h0 ^ (h1 << 1))[:tp.tag_bits]
+
+
+class TageEntry(StructLayout):
+    """ An entry in a TAGE tagged table.
+
+    The "useful" counter associated with each entry is kept in a separate
+    memory so that it can be written without the rest of the entry.
+
+    Members
+    =======
+    valid:
+        This entry is valid
+    tag:
+        Partial tag
+    ctr:
+        Saturating prediction counter (taken when the high bit is set)
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "valid": unsigned(1),
+            "tag": unsigned(p.bp.tage.tag_bits),
+            "ctr": unsigned(p.bp.tage.ctr_bits),
+        })
+
+class TageMeta(StructLayout):
+    """ Information captured when making a prediction.
+
+    The metadata for a prediction must be returned to the predictor when
+    it is updated or recovered.
+
+    Members
+    =======
+    hist: :class:`GlobalHistoryMeta`
+        Global history used to make the prediction
+    taken:
+        The predicted direction
+    alt_taken:
+        The alternate prediction (from the next-longest hitting table)
+    provider_valid:
+        The prediction was provided by a tagged table
+    provider:
+        Index of the tagged table that provided the prediction
+    base_ctr:
+        Counter read from the base table
+    hit:
+        Tag match for each tagged table
+    ctr:
+        Counter read from each tagged table
+    u:
+        Useful counter read from each tagged table
+    """
+    def __init__(self, p: EmberParams):
+        tp = p.bp.tage
+        super().__init__({
+            "hist": GlobalHistoryMeta(p.bp.ghist_bits),
+            "taken": unsigned(1),
+            "alt_taken": unsigned(1),
+            "provider_valid": unsigned(1),
+            "provider": unsigned(ceil_log2(tp.num_tables)),
+            "base_ctr": unsigned(2),
+            "hit": unsigned(tp.num_tables),
+            "ctr": ArrayLayout(unsigned(tp.ctr_bits), tp.num_tables),
+            "u": ArrayLayout(unsigned(tp.u_bits), tp.num_tables),
+        })
+
+class TagePredictor(DirectionPredictor):
+    """ TAGE conditional branch direction predictor.
+
+    The predictor consists of a bimodal base table (indexed only by the
+    program counter) and a set of partially-tagged tables indexed by a hash
+    of the program counter and increasingly-long global history.
+
+    Prediction
+    ==========
+    1. The base table and all tagged tables are read in parallel.
+    2. On the next cycle, the hitting table with the longest history
+       (the "provider") gives the prediction. The next-longest hitting table
+       (or the base table) gives the "alternate" prediction.
+       The predicted outcome is speculatively shifted into the global history.
+
+    Update
+    ======
+    - The counter in the provider entry (or the base table when no tagged
+      table hits) is moved toward the resolved outcome.
+    - When the provider and alternate predictions disagree, the useful
+      counter of the provider entry is moved toward the provider being
+      correct.
+    - On a misprediction, a new entry is allocated in the first table with
+      a longer history whose indexed entry is not useful. When no entry can
+      be allocated, the useful counters of all candidate entries decay.
+
+    Updates are written directly from the metadata captured during
+    prediction, and do not require reading the tables.
+
+    .. note::
+        Back-to-back predictions use the history from the cycle when each
+        request was made, which does not include the outcome of a prediction
+        made on the previous cycle. The history checkpointed for recovery 
+        does include it (see :class:`GlobalHistoryRegister`). 
+
+    """
+    def __init__(self, param: EmberParams):
+        self.tp = param.bp.tage
+        super().__init__(param)
+
+    @classmethod
+    def meta_layout(cls, p: EmberParams):
+        return TageMeta(p)
+
+    def elaborate(self, platform):
+        m = Module()
+        tp = self.tp
+        num_tables = tp.num_tables
+
+        ghr = m.submodules.ghr = GlobalHistoryRegister(self.p.bp.ghist_bits)
+
+        # Base table (initialized to weakly not-taken)
+        base_mem = m.submodules.base_mem = memory.Memory(
+            shape=unsigned(2), depth=tp.base_depth, init=[1] * tp.base_depth,
+        )
+        base_wp = base_mem.write_port()
+        base_rp = base_mem.read_port(transparent_for=[base_wp])
+
+        # Tagged tables and useful counters
+        ent_wp = []
+        ent_rp = []
+        u_wp = []
+        u_rp = []
+        for idx in range(num_tables):
+            ent_mem = m.submodules[f"ent_mem{idx}"] = memory.Memory(
+                shape=TageEntry(self.p), depth=tp.table_depth, init=[],
+            )
+            u_mem = m.submodules[f"u_mem{idx}"] = memory.Memory(
+                shape=unsigned(tp.u_bits), depth=tp.table_depth, init=[],
+            )
+            ent_wp.append(ent_mem.write_port())
+            ent_rp.append(ent_mem.read_port(transparent_for=[ent_wp[idx]]))
+            u_wp.append(u_mem.write_port())
+            u_rp.append(u_mem.read_port(transparent_for=[u_wp[idx]]))
+
+        # ----------------------------------------------------------------
+        # Prediction (stage 0): read all tables
+
+        req = self.predict.req
+        ghist = ghr.ghist
+
+        r_valid = Signal()
+        r_tag   = [ Signal(tp.tag_bits, name=f"r_tag{idx}")
+                    for idx in range(num_tables) ]
+
+        m.d.comb += [
+            base_rp.en.eq(req.valid),
+            base_rp.addr.eq(tage_base_index(tp, req.pc.bits)),
+        ]
+        for idx in range(num_tables):
+            tbl_idx = tage_index(tp, req.pc.bits, ghist, idx)
+            m.d.comb += [
+                ent_rp[idx].en.eq(req.valid),
+                ent_rp[idx].addr.eq(tbl_idx),
+                u_rp[idx].en.eq(req.valid),
+                u_rp[idx].addr.eq(tbl_idx),
+            ]
+            m.d.sync += r_tag[idx].eq(tage_tag(tp, req.pc.bits, ghist, idx))
+        m.d.sync += r_valid.eq(req.valid)
+
+        # ----------------------------------------------------------------
+        # Prediction (stage 1): select the provider and alternate prediction
+
+        hit = [ Signal(name=f"hit{idx}") for idx in range(num_tables) ]
+        for idx in range(num_tables):
+            m.d.comb += hit[idx].eq(
+                ent_rp[idx].data.valid & (ent_rp[idx].data.tag == r_tag[idx])
+            )
+
+        # Walk from the shortest to the longest history. The last hitting
+        # table is the provider, and the prediction before it is the
+        # alternate prediction.
+        base_taken = base_rp.data[1]
+        pred = base_taken
+        alt  = base_taken
+        prov = C(0, ceil_log2(num_tables))
+        for idx in range(num_tables):
+            tbl_taken = ent_rp[idx].data.ctr[-1]
+            alt  = Mux(hit[idx], pred, alt)
+            pred = Mux(hit[idx], tbl_taken, pred)
+            prov = Mux(hit[idx], idx, prov)
+
+        pred_taken = Signal()
+        m.d.comb += pred_taken.eq(pred)
+
+        resp = self.predict.resp
+        meta = resp.meta
+        m.d.comb += [
+            resp.valid.eq(r_valid),
+            resp.taken.eq(pred_taken),
+            meta.hist.eq(ghr.meta),
+            meta.taken.eq(pred_taken),
+            meta.alt_taken.eq(alt),
+            meta.provider_valid.eq(Cat(*hit).any()),
+            meta.provider.eq(prov),
+            meta.base_ctr.eq(base_rp.data),
+            meta.hit.eq(Cat(*hit)),
+        ]
+        for idx in range(num_tables):
+            m.d.comb += [
+                meta.ctr[idx].eq(ent_rp[idx].data.ctr),
+                meta.u[idx].eq(u_rp[idx].data),
+            ]
+
+        # Speculatively update the global history with the prediction
+        m.d.comb += [
+            ghr.spec.valid.eq(r_valid),
+            ghr.spec.taken.eq(pred_taken),
+        ]
+
+        # ----------------------------------------------------------------
+        # Recovery
+
+        m.d.comb += [
+            ghr.recover.valid.eq(self.recover.valid),
+            ghr.recover.ghist.eq(self.recover.meta.hist.ckpt),
+            ghr.recover.taken.eq(self.recover.taken),
+        ]
+
+        # ----------------------------------------------------------------
+        # Update
+
+        upd      = self.update
+        upd_meta = upd.meta
+        upd_pc   = upd.pc.bits
+        mispred  = (upd_meta.taken != upd.taken)
+
+        # Tables with a longer history than the provider
+        above = [
+            (~upd_meta.provider_valid | (upd_meta.provider < idx))
+            for idx in range(num_tables)
+        ]
+
+        # Select the table used for allocation on a misprediction
+        alloc_cand = [
+            above[idx] & (upd_meta.u[idx] == 0) for idx in range(num_tables)
+        ]
+        m.submodules.alloc_enc = alloc_enc = EmberPriorityEncoder(num_tables)
+        m.d.comb += alloc_enc.i.eq(Cat(*alloc_cand))
+
+        with m.If(upd.valid & ~upd_meta.provider_valid):
+            m.d.comb += [
+                base_wp.en.eq(1),
+                base_wp.addr.eq(tage_base_index(tp, upd_pc)),
+                base_wp.data.eq(counter_update(upd_meta.base_ctr, upd.taken)),
+            ]
+
+        for idx in range(num_tables):
+            tbl_idx = tage_index(tp, upd_pc, upd_meta.hist.ghist, idx)
+            tbl_tag = tage_tag(tp, upd_pc, upd_meta.hist.ghist, idx)
+            is_provider = (
+                upd_meta.provider_valid & (upd_meta.provider == idx)
+            )
+            is_alloc = (mispred & alloc_enc.valid & (alloc_enc.o == idx))
+            is_decay = (mispred & ~alloc_enc.valid & above[idx])
+
+            m.d.comb += [
+                ent_wp[idx].addr.eq(tbl_idx),
+                u_wp[idx].addr.eq(tbl_idx),
+            ]
+            with m.If(upd.valid):
+                with m.If(is_provider):
+                    m.d.comb += [
+                        ent_wp[idx].en.eq(1),
+                        ent_wp[idx].data.valid.eq(1),
+                        ent_wp[idx].data.tag.eq(tbl_tag),
+                        ent_wp[idx].data.ctr.eq(
+                            counter_update(upd_meta.ctr[idx], upd.taken)
+                        ),
+                    ]
+                    with m.If(upd_meta.taken != upd_meta.alt_taken):
+                        m.d.comb += [
+                            u_wp[idx].en.eq(1),
+                            u_wp[idx].data.eq(
+                                counter_update(upd_meta.u[idx], ~mispred)
+                            ),
+                        ]
+                with m.Elif(is_alloc):
+                    m.d.comb += [
+                        ent_wp[idx].en.eq(1),
+                        ent_wp[idx].data.valid.eq(1),
+                        ent_wp[idx].data.tag.eq(tbl_tag),
+                        ent_wp[idx].data.ctr.eq(
+                            counter_weak(tp.ctr_bits, upd.taken)
+                        ),
+                        u_wp[idx].en.eq(1),
+                        u_wp[idx].data.eq(0),
+                    ]
+                with m.Elif(is_decay):
+                    m.d.comb += [
+                        u_wp[idx].en.eq(1),
+                        u_wp[idx].data.eq(
+                            counter_update(upd_meta.u[idx], 0)
+                        ),
+                    ]
+
+        return m
+
@@ -0,0 +1,263 @@
+from amaranth import *
+from amaranth.lib.data import StructLayout
+from amaranth.lib.wiring import *
+from amaranth.utils import ceil_log2, exact_log2
+
+from ember.param import *
+from ember.uarch.front import *
+from ember.front.bp.common import *
+from ember.front.bp.ittage import IttageUpdateRequest
+from ember.front.bpu import BranchPredictionUnit
+from ember.front.cfm import ControlFlowMapWritePort
+from ember.front.ftq import FTQCheckpointReadPort
+
+
+class BranchResolution(Signature):
+    """ The resolved outcome of a control-flow instruction.
+
+    Members
+    =======
+    valid:
+        This request is valid
+    pc:
+        Program counter of the control-flow instruction
+    op: :class:`ControlFlowOp`
+        Type of control-flow instruction
+    taken:
+        The resolved direction [for conditional branches]
+    tgt:
+        The resolved target address
+    meta:
+        BPU metadata returned when the branch was predicted
+    phist:
+        Path history used to predict the target [for indirect jumps]
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "valid": Out(1),
+            "pc": Out(p.vaddr),
+            "op": Out(ControlFlowOp),
+            "taken": Out(1),
+            "tgt": Out(p.vaddr),
+            "meta": Out(BranchPredictionUnit.meta_layout(p)),
+            "phist": Out(p.bp.ittage.hist_bits),
+        })
+
+
+class PredictorUpdate(StructLayout):
+    """ An entry in the predictor update queue.
+
+    Members
+    =======
+    btb:
+        Record a taken branch in the BTBs
+    cfm:
+        Record a fetch block in the control-flow map
+    dir:
+        Train the conditional branch predictors
+    ind:
+        Train the indirect target predictor
+    pc:
+        Program counter of the control-flow instruction
+    op: :class:`ControlFlowOp`
+        Type of control-flow instruction
+    taken:
+        The resolved direction
+    tgt:
+        The resolved target address
+    meta:
+        BPU metadata
+    phist:
+        Path history
+    entry_pc:
+        Entry address of the fetch block containing the instruction
+    blocks:
+        Number of cachelines in the fetch block
+    end_idx:
+        Byte offset of the instruction in the last cacheline
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "btb": unsigned(1),
+            "cfm": unsigned(1),
+            "dir": unsigned(1),
+            "ind": unsigned(1),
+            "pc": p.vaddr,
+            "op": ControlFlowOp,
+            "taken": unsigned(1),
+            "tgt": p.vaddr,
+            "meta": BranchPredictionUnit.meta_layout(p),
+            "phist": unsigned(p.bp.ittage.hist_bits),
+            "entry_pc": p.vaddr,
+            "blocks": p.fblk_size_shape,
+            "end_idx": unsigned(p.vaddr.num_off_bits),
+        })
+
+
+class PredictorUpdateUnit(Component):
+    """ Collects the outcomes of control-flow instructions and uses them to
+    train the branch predictors.
+
+    Outcomes are captured into a small queue, and the predictor tables are
+    written when entries leave the queue. Updates never stall lookups:
+    each structure has a separate write port (or read port for
+    read-modify-write), and at most one update is sent per cycle.
+    When the queue is full, new outcomes are dropped.
+
+    Outcomes come from two places:
+
+    - Resteer requests from the predecode stage. Direct jumps and calls are
+      recorded in the BTBs, and the fetch block containing them is recorded
+      in the control-flow map. The entry address of the fetch block is read
+      from the parent FTQ entry.
+
+    - Resolved control-flow instructions. Conditional branches train the
+      direction predictors (and are recorded in the BTBs when taken).
+      Indirect jumps and calls train the ITTAGE predictor and are recorded
+      in the BTBs.
+
+    Ports
+    =====
+    pd_resteer:
+        Resteer requests from the predecode stage
+    res:
+        Resolved control-flow instructions
+    ftq_ckpt:
+        Read the entry address of an FTQ entry
+    btb_wp:
+        BTB write request [to the NFP]
+    cfm_wp:
+        Control-flow map write request
+    dir_update:
+        Direction predictor update request [to the BPU]
+    ind_update:
+        Indirect target predictor update request
+
+    """
+    def __init__(self, param: EmberParams, depth: int = 4):
+        self.p = param
+        self.depth = depth
+        meta_layout = BranchPredictionUnit.meta_layout(param)
+        super().__init__(Signature({
+            "pd_resteer": In(ResteerRequest(param)),
+            "res": In(BranchResolution(param)),
+            "ftq_ckpt": Out(FTQCheckpointReadPort(param)),
+            "btb_wp": Out(BTBWriteRequest(param)),
+            "cfm_wp": Out(ControlFlowMapWritePort(param)),
+            "dir_update": Out(DirectionUpdateRequest(param, meta_layout)),
+            "ind_update": Out(IttageUpdateRequest(param)),
+        }))
+
+    def elaborate(self, platform):
+        m = Module()
+
+        queue = Array(
+            Signal(PredictorUpdate(self.p), name=f"queue{idx}")
+            for idx in range(self.depth)
+        )
+        r_rptr = Signal(exact_log2(self.depth), init=0)
+        r_wptr = Signal(exact_log2(self.depth), init=0)
+        r_used = Signal(ceil_log2(self.depth + 1), init=0)
+
+        # ----------------------------------------------------------------
+        # Outcomes from the predecode stage
+
+        pd = self.pd_resteer
+        m.d.comb += self.ftq_ckpt.idx.eq(pd.parent_ftq_idx)
+
+        pd_upd = Signal(PredictorUpdate(self.p))
+        pd_valid = pd.valid & (
+            (pd.op == ControlFlowOp.JUMP_DIR) |
+            (pd.op == ControlFlowOp.CALL_DIR)
+        )
+        m.d.comb += [
+            pd_upd.btb.eq(1),
+            pd_upd.cfm.eq(1),
+            pd_upd.pc.eq(pd.src_pc),
+            pd_upd.op.eq(pd.op),
+            pd_upd.taken.eq(1),
+            pd_upd.tgt.eq(pd.tgt_pc),
+            pd_upd.entry_pc.eq(self.ftq_ckpt.vaddr),
+            pd_upd.blocks.eq(pd.parent_line),
+            pd_upd.end_idx.eq(pd.parent_idx << 2),
+        ]
+
+        # ----------------------------------------------------------------
+        # Outcomes from branch resolution
+
+        res = self.res
+        res_upd = Signal(PredictorUpdate(self.p))
+        res_is_br  = (res.op == ControlFlowOp.BRANCH)
+        res_is_ind = (
+            (res.op == ControlFlowOp.JUMP_IND) |
+            (res.op == ControlFlowOp.CALL_IND)
+        )
+        res_valid = res.valid & (res_is_br | res_is_ind)
+        m.d.comb += [
+            res_upd.btb.eq(res_is_ind | (res_is_br & res.taken)),
+            res_upd.dir.eq(res_is_br),
+            res_upd.ind.eq(res_is_ind),
+            res_upd.pc.eq(res.pc),
+            res_upd.op.eq(res.op),
+            res_upd.taken.eq(res.taken),
+            res_upd.tgt.eq(res.tgt),
+            res_upd.meta.eq(res.meta),
+            res_upd.phist.eq(res.phist),
+        ]
+
+        # ----------------------------------------------------------------
+        # Enqueue up to two outcomes per cycle
+
+        free = self.depth - r_used
+        deq  = (r_used != 0)
+
+        wr0_en = Signal()
+        wr1_en = Signal()
+        wr0    = Signal(PredictorUpdate(self.p))
+        m.d.comb += [
+            wr0_en.eq((pd_valid | res_valid) & (free != 0)),
+            wr1_en.eq(pd_valid & res_valid & (free > 1)),
+            wr0.eq(Mux(res_valid, res_upd, pd_upd)),
+        ]
+        with m.If(wr0_en):
+            m.d.sync += queue[r_wptr].eq(wr0)
+        with m.If(wr1_en):
+            m.d.sync += queue[(r_wptr + 1)[:len(r_wptr)]].eq(pd_upd)
+
+        num_enq = wr0_en + wr1_en
+        m.d.sync += [
+            r_wptr.eq(r_wptr + num_enq),
+            r_rptr.eq(r_rptr + deq),
+            r_used.eq(r_used + num_enq - deq),
+        ]
+
+        # ----------------------------------------------------------------
+        # Send the oldest update to the predictors
+
+        head = queue[r_rptr]
+        m.d.comb += [
+            self.btb_wp.valid.eq(deq & head.btb),
+            self.btb_wp.pc.eq(head.pc),
+            self.btb_wp.op.eq(head.op),
+            self.btb_wp.tgt.eq(head.tgt),
+
+            self.cfm_wp.req.valid.eq(deq & head.cfm),
+            self.cfm_wp.req.pc.eq(head.pc),
+            self.cfm_wp.req.entry.entry_pc.eq(head.entry_pc),
+            self.cfm_wp.req.entry.blocks.eq(head.blocks),
+            self.cfm_wp.req.entry.end_idx.eq(head.end_idx),
+            self.cfm_wp.req.entry.next_pc.eq(head.tgt),
+
+            self.dir_update.valid.eq(deq & head.dir),
+            self.dir_update.pc.eq(head.pc),
+            self.dir_update.taken.eq(head.taken),
+            self.dir_update.meta.eq(head.meta),
+
+            self.ind_update.valid.eq(deq & head.ind),
+            self.ind_update.pc.eq(head.pc),
+            self.ind_update.hist.eq(head.phist),
+            self.ind_update.tgt.eq(head.tgt),
+        ]
+
+        return m
+
@@ -4,31 +4,124 @@ from amaranth.lib.enum import Enum
 
 from ember.common import *
 from ember.common.pipeline import *
-from ember.common.coding import ChainedPriorityEncoder
+from ember.common.coding import ChainedPriorityEncoder, EmberPriorityEncoder
 from ember.param import *
+from ember.param.front import DirectionPredictorKind
 from ember.front.predecode import *
+from ember.front.bp.common import *
+from ember.front.bp.bimodal import *
+from ember.front.bp.gshare import *
+from ember.front.bp.perceptron import *
+from ember.front.bp.tage import *
+from ember.front.bp.loop import *
 from ember.uarch.front import *
-from ember.front.cfc import ControlFlowRequest
+
+# Implementations for each type of conditional branch direction predictor
+DIRECTION_PREDICTORS = {
+    DirectionPredictorKind.BIMODAL:    BimodalPredictor,
+    DirectionPredictorKind.GSHARE:     GsharePredictor,
+    DirectionPredictorKind.PERCEPTRON: PerceptronPredictor,
+    DirectionPredictorKind.TAGE:       TagePredictor,
+}
+
+
+class BranchPredictionMeta(StructLayout):
+    """ Metadata associated with a conditional branch prediction.
+
+    Members
+    =======
+    dir:
+        Direction predictor metadata
+    loop: :class:`LoopMeta`
+        Loop predictor metadata
+    """
+    def __init__(self, p: EmberParams, dir_layout):
+        super().__init__({
+            "dir": dir_layout,
+            "loop": LoopMeta(p),
+        })
+
+
+class BranchPrediction(Signature):
+    """ A conditional branch prediction made by the BPU.
+
+    The metadata associated with a prediction must be kept until the branch
+    is resolved, and then returned to the BPU with an update request.
+
+    Members
+    =======
+    valid:
+        This prediction is valid
+    pc:
+        Program counter of the conditional branch
+    ftq_idx:
+        FTQ index of the block containing the branch
+    taken:
+        The predicted direction
+    meta:
+        Predictor metadata
+    """
+    def __init__(self, p: EmberParams, meta_layout):
+        super().__init__({
+            "valid": Out(1),
+            "pc": Out(p.vaddr),
+            "ftq_idx": Out(p.ftq.index_shape),
+            "taken": Out(1),
+            "meta": Out(meta_layout),
+        })
 
 
 class BranchPredictionUnit(Component):
-    """ Branch prediction unit. 
+    """ Branch prediction unit.
+
+    The BPU predicts the direction of the first conditional branch in a
+    predecoded cacheline. When a branch is predicted taken, the BPU sends a
+    speculative control-flow request for the branch target to the CFC on
+    the following cycle.
+
+    The type of direction predictor is selected with
+    :attr:`BranchPredictionParams.direction`. The layout of the prediction
+    metadata depends on the type of predictor.
+
+    A loop predictor is accessed in parallel with the direction predictor. 
+    When the loop predictor is confident, it overrides the direction 
+    predictor. Whenever one predictor is overridden by the other and 
+    disagrees with the final prediction, its speculative state is repaired 
+    on the same cycle (as though it had mispredicted). 
 
     Ports
     =====
     pd_resp:
         A predecoded cacheline from the PDU
-    cf_req: 
+    cf_req:
         Output speculative control-flow request
+    pred:
+        Output conditional branch prediction
+    update:
+        Direction predictor update request
+    recover:
+        Direction predictor recovery request
 
     """
-    def __init__(self, param: EmberParams): 
+    def __init__(self, param: EmberParams):
         self.p = param
+        self.predictor_cls = DIRECTION_PREDICTORS[param.bp.direction]
+        meta_layout = self.meta_layout(param)
         super().__init__(Signature({
             "pd_resp": In(PredecodeResponse(param)),
             "cf_req": Out(ControlFlowRequest(param)),
+            "pred": Out(BranchPrediction(param, meta_layout)),
+            "update": In(DirectionUpdateRequest(param, meta_layout)),
+            "recover": In(DirectionRecoverRequest(param, meta_layout)),
         }))
 
+    @staticmethod
+    def meta_layout(p: EmberParams):
+        """ Return the layout of the metadata for a prediction. """
+        return BranchPredictionMeta(p,
+            DIRECTION_PREDICTORS[p.bp.direction].meta_layout(p)
+        )
+
     def elaborate(self, platform):
         m = Module()
 
@@ -38,26 +131,111 @@ class BranchPredictionUnit(Component):
         pd_info = self.pd_resp.info
         pd_info_valid = self.pd_resp.info_valid
 
-        # Determine which entries are valid control-flow instructions
-        is_cf = Array(Signal() for idx in range(pd_width))
+        m.submodules.dirp = dirp = self.predictor_cls(self.p)
+        m.submodules.loop = loop = LoopPredictor(self.p)
+        m.d.comb += [
+            dirp.update.valid.eq(self.update.valid),
+            dirp.update.pc.eq(self.update.pc),
+            dirp.update.taken.eq(self.update.taken),
+            dirp.update.meta.eq(self.update.meta.dir),
+            loop.update.valid.eq(self.update.valid),
+            loop.update.pc.eq(self.update.pc),
+            loop.update.taken.eq(self.update.taken),
+            loop.update.meta.eq(self.update.meta.loop),
+        ]
+
+        # Determine which entries are valid conditional branches
+        is_br = Array(Signal(name=f"is_br{idx}") for idx in range(pd_width))
         for idx in range(pd_width):
-            m.d.comb += is_cf[idx].eq(
-                pd_info[idx].is_cf & pd_info_valid[idx]
+            m.d.comb += is_br[idx].eq(
+                self.pd_resp.valid & pd_info_valid[idx] &
+                (pd_info[idx].cf_op == ControlFlowOp.BRANCH)
             )
 
-        is_cf = [ self.pd_resp.info[idx].is_cf for idx in range(pd_width) ]
+        # Select the first conditional branch in the cacheline
+        br_sel_enc = m.submodules.br_sel_enc = EmberPriorityEncoder(pd_width)
+        m.d.comb += br_sel_enc.i.eq(Cat(*is_br))
 
-        # Select up to N predecoded control-flow instructions
-        pd_sel_enc = m.submodules.pd_sel_enc = \
-            ChainedPriorityEncoder(width=pd_width, depth=2)
-        m.d.comb += pd_sel_enc.i.eq(Cat(*is_cf))
+        br_idx = br_sel_enc.o
+        br_pc  = Signal(self.p.vaddr)
+        br_tgt = Array(pd_info[idx].tgt for idx in range(pd_width))[br_idx]
+        m.d.comb += br_pc.eq(Cat(C(0, 2), br_idx, pd_vaddr.fetch_blk))
 
         m.d.comb += [
-            self.cf_req.valid.eq(0),
-            self.cf_req.pc.eq(0),
+            dirp.predict.req.valid.eq(br_sel_enc.valid),
+            dirp.predict.req.pc.eq(br_pc),
+            loop.predict.req.valid.eq(br_sel_enc.valid),
+            loop.predict.req.pc.eq(br_pc),
         ]
 
-        return m
+        # The prediction is available on the next cycle
+        r_pc      = Signal(self.p.vaddr)
+        r_tgt     = Signal(self.p.vaddr)
+        r_ftq_idx = Signal(self.p.ftq.index_shape)
+        r_line    = Signal(self.p.fblk_size_shape)
+        r_idx     = Signal(self.p.l1i.word_idx_shape)
+        m.d.sync += [
+            r_pc.eq(br_pc),
+            r_tgt.eq(br_tgt),
+            r_ftq_idx.eq(self.pd_resp.ftq_idx),
+            r_line.eq(self.pd_resp.line),
+            r_idx.eq(br_idx),
+        ]
 
+        # A confident loop predictor overrides the direction predictor
+        dir_resp  = dirp.predict.resp
+        loop_resp = loop.predict.resp
+        pred_valid = dir_resp.valid
+        pred_taken = Signal()
+        m.d.comb += pred_taken.eq(Mux(loop_resp.meta.confident,
+            loop_resp.taken, dir_resp.taken
+        ))
+        m.d.comb += [
+            self.pred.valid.eq(pred_valid),
+            self.pred.pc.eq(r_pc),
+            self.pred.ftq_idx.eq(r_ftq_idx),
+            self.pred.taken.eq(pred_taken),
+            self.pred.meta.dir.eq(dir_resp.meta),
+            self.pred.meta.loop.eq(loop_resp.meta),
+        ]
 
+        # Repair the speculative state of a predictor which disagrees with
+        # the final prediction. Recovery requests take priority. 
+        dir_wrong  = pred_valid & (dir_resp.taken != pred_taken)
+        loop_wrong = pred_valid & (loop_resp.taken != pred_taken)
+        with m.If(self.recover.valid):
+            m.d.comb += [
+                dirp.recover.valid.eq(1),
+                dirp.recover.taken.eq(self.recover.taken),
+                dirp.recover.meta.eq(self.recover.meta.dir),
+                loop.recover.valid.eq(1),
+                loop.recover.taken.eq(self.recover.taken),
+                loop.recover.meta.eq(self.recover.meta.loop),
+            ]
+        with m.Else():
+            m.d.comb += [
+                dirp.recover.valid.eq(dir_wrong),
+                dirp.recover.taken.eq(pred_taken),
+                dirp.recover.meta.eq(dir_resp.meta),
+                loop.recover.valid.eq(loop_wrong),
+                loop.recover.taken.eq(pred_taken),
+                loop.recover.meta.eq(loop_resp.meta),
+            ]
+
+        # Redirect to the target of a predicted-taken branch
+        m.d.comb += [
+            self.cf_req.valid.eq(pred_valid & pred_taken),
+            self.cf_req.pc.eq(r_tgt),
+            self.cf_req.op.eq(ControlFlowOp.BRANCH),
+            self.cf_req.blocks.eq(0),
+            self.cf_req.parent_ftq_idx.eq(r_ftq_idx),
+            self.cf_req.parent_line.eq(r_line),
+            self.cf_req.parent_idx.eq(r_idx),
+        ]
+        with m.If(self.cf_req.valid):
+            m.d.sync += Print("[BPU] predict taken",
+                Format("pc={:08x}", r_pc.bits),
+                Format("tgt={:08x}", r_tgt.bits),
+            )
 
+        return m
@@ -6,17 +6,22 @@ import amaranth.lib.memory
 from ember.common import *
 from ember.common.pipeline import *
 from ember.param import *
-from ember.front.ftq import FTQAllocRequest, FTQStatusBus
+from ember.front.ftq import (
+    FTQAllocRequest, FTQStatusBus, FTQCheckpointReadPort, FTQFlushRequest
+)
 from ember.front.nfp import *
 from ember.front.cfm import *
 from ember.front.bp.rap import *
+from ember.front.bp.ittage import *
 from ember.uarch.front import *
 
-class CFRSource(Enum, shape=2):
+class CFRSource(Enum, shape=3):
     NONE = 0
     RESTEER = 1
     DEBUG = 2
     PRED0 = 3
+    BPU = 4
+    PRED1 = 5
 
 class ControlFlowController(Component):
     """ Collects control-flow requests from different parts of the machine and 
@@ -45,10 +50,79 @@ class ControlFlowController(Component):
     =====
     dbg:
         Incoming *architectural* control-flow request [from off-core]
+    resteer_req:
+        Incoming resteer request [from the DFU]
+    bpu_req:
+        Incoming *speculative* control-flow request [from the BPU]
     ftq_sts:
         FTQ allocation status
+    ftq_ckpt:
+        Read predictor checkpoints saved in the FTQ
+    ftq_next:
+        Read the FTQ entry after the parent of a redirect
     alloc_req:
         FTQ allocation request
+    ftq_flush:
+        FTQ flush request [for entries younger than the parent of a redirect]
+    ind_update:
+        Resolved indirect target [used to train the ITTAGE predictor]
+    btb_wp:
+        Record a taken branch in the BTBs
+    cfm_wp:
+        Record a fetch block in the control-flow map
+    btb_rp:
+        L0 BTB read port [for early redirects in the demand fetch unit]
+
+    Redirects
+    =========
+    Resteer requests and requests from the BPU name the parent FTQ entry 
+    which contains the redirecting instruction. For an override from the 
+    L1 BTB, the parent is the FTQ entry used to make the L1 BTB request. 
+    Entries allocated after the parent are speculative, and were predicted 
+    without knowing about the redirect. 
+
+    When the entry after the parent [or the allocation request sent to 
+    the FTQ on the previous cycle] already has the correct target, the 
+    prediction was correct and nothing needs to happen. Otherwise, the 
+    entries younger than the parent are flushed and the target is 
+    allocated in their place. 
+
+    When the FTQ is full, the flush frees the younger entries on the same 
+    cycle, but the FTQ is not ready to accept the target until the next 
+    cycle. A request which cannot be sent to the FTQ is held until the FTQ 
+    is ready, unless it is replaced by a newer redirect or debug request. 
+
+    Return Address Prediction
+    =========================
+    The state of the RAP is saved in each FTQ entry when it is allocated. 
+    When a resteer request arrives, the RAP is restored from the checkpoint
+    saved in the parent FTQ entry before the call or return is applied. 
+    This repairs the stack after pushes and pops made on the wrong path. 
+
+    Fetch Block Length
+    ==================
+    The length of each fetch block is predicted so that fetch ends at the 
+    first predicted-taken control-flow instruction: 
+
+    1. When the L0 control-flow map has an entry for the selected program 
+       counter, the length of the block is taken from the entry.
+    2. When the L0 BTB finds a taken branch in the first cacheline of the 
+       block (on the cycle the FTQ entry is allocated), the block ends at 
+       that branch.
+    3. Otherwise, the block is the default number of cachelines. 
+
+    Indirect Target Prediction
+    ==========================
+    Resteer requests for indirect jumps and calls use the target predicted 
+    by the ITTAGE predictor. When there is no prediction, the target is the 
+    next-sequential instruction. 
+
+    The path history used by the ITTAGE predictor is updated with the 
+    address of each taken control-flow instruction: when the next-fetch 
+    predictor predicts a taken branch, and when a redirect [a resteer, a 
+    BPU request or an L1 BTB override] flushes the FTQ. Like the RAP, it is 
+    saved in each FTQ entry. A redirect restores it from the parent FTQ 
+    entry before the redirecting instruction is shifted in. 
 
     """
     def __init__(self, param: EmberParams):
@@ -56,25 +130,61 @@ class ControlFlowController(Component):
         super().__init__(Signature({
             "dbg":       In(ControlFlowRequest(param)),
             "resteer_req": In(ResteerRequest(param)),
+            "bpu_req":   In(ControlFlowRequest(param)),
             "ftq_sts":   In(FTQStatusBus(param)),
+            "ftq_ckpt":  Out(FTQCheckpointReadPort(param)),
+            "ftq_next":  Out(FTQCheckpointReadPort(param)),
             "alloc_req": Out(FTQAllocRequest(param)),
+            "ftq_flush": Out(FTQFlushRequest(param)),
+            "ind_update": In(IttageUpdateRequest(param)),
+            "btb_wp":    In(BTBWriteRequest(param)),
+            "cfm_wp":    In(ControlFlowMapWritePort(param)),
+            "btb_rp":    In(L0BTBReadPort(param)),
         }))
 
     def elaborate(self, platform):
         m = Module()
 
         m.submodules.l0_cfm = l0_cfm = L0ControlFlowMap(self.p)
-        m.submodules.rap = rap = ReturnAddressPredictor(8)
+        connect(m, flipped(self.cfm_wp), l0_cfm.wp)
+        m.submodules.rap = rap = ReturnAddressPredictor(
+            self.p.bp.rap.depth, self.p.bp.rap.ctr_bits
+        )
+
+        # Repair the RAP using the checkpoint from the parent FTQ entry
+        m.d.comb += [
+            rap.restore.valid.eq(self.resteer_req.valid),
+            rap.restore.ckpt.eq(self.ftq_ckpt.rap),
+        ]
+
+        # The path history before the resteering instruction
+        r_phist = Signal(self.p.bp.ittage.hist_bits)
+        phist = Signal(self.p.bp.ittage.hist_bits)
+        m.d.comb += phist.eq(
+            Mux(self.resteer_req.valid, self.ftq_ckpt.phist, r_phist)
+        )
+
+        m.submodules.ittage = ittage = IttagePredictor(self.p)
+        m.d.comb += [
+            ittage.predict.req.valid.eq(self.resteer_req.valid),
+            ittage.predict.req.pc.eq(self.resteer_req.src_pc),
+            ittage.predict.req.hist.eq(phist),
+            ittage.update.valid.eq(self.ind_update.valid),
+            ittage.update.pc.eq(self.ind_update.pc),
+            ittage.update.hist.eq(self.ind_update.hist),
+            ittage.update.tgt.eq(self.ind_update.tgt),
+        ]
 
-        ## The request sent to the FTQ on the previous cycle
-        #r_prev_cfr = ControlFlowRequest(self.p).create()
+        m.submodules.nfp = nfp = NextFetchPredictor(self.p)
+        connect(m, flipped(self.btb_wp), nfp.wp)
+        connect(m, flipped(self.btb_rp), nfp.btb_rp)
 
-        ## Given the request from the previous cycle, try to predict a 
-        ## request for this cycle.
-        #m.d.comb += [
-        #    l0_cfm.rp.req.valid.eq(r_prev_cfr.valid),
-        #    l0_cfm.rp.req.pc.eq(r_prev_cfr.pc),
-        #]
+        # Given the request sent to the FTQ on the previous cycle, try to
+        # predict a request for this cycle.
+        m.d.comb += [
+            nfp.req.valid.eq(self.alloc_req.valid),
+            nfp.req.pc.eq(self.alloc_req.vaddr),
+        ]
 
         # These wires are used to build an FTQ allocation request
         sel_pc    = Signal(32)
@@ -82,13 +192,118 @@ class ControlFlowController(Component):
         sel_valid = Signal(1)
         sel_src   = Signal(CFRSource)
         sel_blocks = Signal(self.p.fblk_size_shape)
+        sel_end_idx = Signal(self.p.vaddr.num_off_bits)
         sel_passthru = Signal(1)
         resteer_pred = Signal()
         resteer_tgt = Signal(32)
 
+        # A selected request which has not been sent to the FTQ
+        r_pend_valid = Signal()
+        r_pend_pc    = Signal(32)
+        r_pend_pred  = Signal()
+        r_pend_src   = Signal(CFRSource)
+
+        # Track the FTQ index of each allocation until the L1 BTB response 
+        # for it is available. An override for an allocation which was 
+        # dropped or flushed in the meantime is ignored. 
+        r1_valid = Signal()
+        r1_idx   = Signal(self.p.ftq.index_shape)
+        r2_valid = Signal()
+        r2_idx   = Signal(self.p.ftq.index_shape)
+        m.d.sync += [
+            r1_valid.eq(self.alloc_req.valid & ~self.ftq_flush.valid),
+            r1_idx.eq(self.ftq_sts.next_ftq_idx),
+            r2_valid.eq(r1_valid & ~self.ftq_flush.valid),
+            r2_idx.eq(r1_idx),
+        ]
+        override = nfp.override.valid & r2_valid
+
+        # Check whether the FTQ entry after the parent of a redirect already 
+        # has the correct target
+        redir_valid = Signal()
+        redir_parent = Signal(self.p.ftq.index_shape)
+        redir_next = Signal(self.p.ftq.index_shape)
+        redir_tgt = Signal(32)
+        redir_hit = Signal()
+        # Only the low bits of the redirecting instruction are used in the 
+        # path history, and the BTBs only provide the word offset
+        redir_src = Signal(32)
+        with m.If(self.resteer_req.valid):
+            m.d.comb += [
+                redir_parent.eq(self.resteer_req.parent_ftq_idx),
+                redir_src.eq(self.resteer_req.src_pc.bits),
+            ]
+        with m.Elif(self.bpu_req.valid):
+            m.d.comb += [
+                redir_parent.eq(self.bpu_req.parent_ftq_idx),
+                redir_tgt.eq(self.bpu_req.pc),
+                redir_src.eq(Cat(C(0, 2), self.bpu_req.parent_idx)),
+            ]
+        with m.Else():
+            m.d.comb += [
+                redir_parent.eq(r2_idx),
+                redir_tgt.eq(nfp.override.pc),
+                redir_src.eq(Cat(C(0, 2), nfp.override.off)),
+            ]
+        m.d.comb += [
+            self.ftq_ckpt.idx.eq(redir_parent),
+            redir_valid.eq(
+                self.resteer_req.valid | self.bpu_req.valid | override
+            ),
+            redir_next.eq(redir_parent + 1),
+            self.ftq_next.idx.eq(redir_next),
+            redir_hit.eq(
+                (self.ftq_next.valid & 
+                 (self.ftq_next.vaddr.bits == redir_tgt)) |
+                (self.alloc_req.valid & 
+                 (self.ftq_sts.next_ftq_idx == redir_next) &
+                 (self.alloc_req.vaddr.bits == redir_tgt))
+            ),
+        ]
+        redirect = redir_valid & ~redir_hit
+        with m.If(redirect):
+            m.d.comb += [
+                self.ftq_flush.valid.eq(1),
+                self.ftq_flush.id.eq(redir_parent),
+            ]
+
+        # Repair the path history using the checkpoint from the parent FTQ 
+        # entry, and shift in the redirecting instruction. A correction 
+        # after an incorrect early redirect is not a control-flow 
+        # instruction, and only restores the checkpoint. 
+        redir_cf = ~self.resteer_req.valid | (
+            self.resteer_req.op != ControlFlowOp.NONE
+        )
+        with m.If(redirect):
+            m.d.sync += r_phist.eq(Mux(redir_cf,
+                path_history_update(self.ftq_ckpt.phist, redir_src),
+                self.ftq_ckpt.phist
+            ))
+
+        # Predict the length of the selected fetch block
+        pred_blocks = Signal(self.p.fblk_size_shape)
+        pred_end_idx = Signal(self.p.vaddr.num_off_bits)
+        m.d.comb += [
+            l0_cfm.rp.req.valid.eq(sel_valid),
+            l0_cfm.rp.req.pc.eq(sel_pc),
+            pred_blocks.eq(Mux(l0_cfm.rp.resp.valid, 
+                l0_cfm.rp.resp.blocks, 4
+            )),
+            pred_end_idx.eq(Mux(l0_cfm.rp.resp.valid, 
+                l0_cfm.rp.resp.end_idx, self.p.vaddr.num_line_bytes - 4
+            )),
+        ]
+
         # We're being resteered to a different block after predecoding.
         with m.If(self.resteer_req.valid):
+            m.d.comb += redir_tgt.eq(resteer_tgt)
             with m.Switch(self.resteer_req.op):
+                # A correction after an incorrect early redirect
+                with m.Case(ControlFlowOp.NONE):
+                    m.d.comb += [
+                        resteer_tgt.eq(self.resteer_req.tgt_pc),
+                        resteer_pred.eq(0),
+                    ]
                 with m.Case(ControlFlowOp.JUMP_DIR):
                     m.d.comb += [
                         resteer_tgt.eq(self.resteer_req.tgt_pc),
@@ -101,13 +316,35 @@ class ControlFlowController(Component):
                         resteer_tgt.eq(self.resteer_req.tgt_pc),
                         resteer_pred.eq(0),
                     ]
+                with m.Case(ControlFlowOp.JUMP_IND):
+                    m.d.comb += [
+                        resteer_tgt.eq(Mux(ittage.predict.resp.hit,
+                            ittage.predict.resp.tgt.bits,
+                            self.resteer_req.src_pc.bits + 4
+                        )),
+                        resteer_pred.eq(ittage.predict.resp.hit),
+                    ]
+                with m.Case(ControlFlowOp.CALL_IND):
+                    m.d.comb += [
+                        rap.push.req.addr.eq(self.resteer_req.src_pc.bits + 4),
+                        rap.push.req.valid.eq(1),
+                        resteer_tgt.eq(Mux(ittage.predict.resp.hit,
+                            ittage.predict.resp.tgt.bits,
+                            self.resteer_req.src_pc.bits + 4
+                        )),
+                        resteer_pred.eq(ittage.predict.resp.hit),
+                    ]
                 with m.Case(ControlFlowOp.RET):
                     m.d.comb += [
                         rap.pop.req.valid.eq(1),
-                        resteer_pred.eq(1),
+                        resteer_pred.eq(rap.head_valid),
                     ]
+                    # When the stack is empty, there's nothing to predict
+                    # except the next-sequential instruction
                     m.d.comb += [
-                        resteer_tgt.eq(rap.head),
+                        resteer_tgt.eq(Mux(rap.head_valid, rap.head,
+                            self.resteer_req.src_pc.bits + 4
+                        )),
                     ]
             m.d.sync += [
                     Print("[CFC] resteer", 
@@ -115,15 +352,19 @@ class ControlFlowController(Component):
                       Format("tgt={:08x}", resteer_tgt),
                       Format("op={}", self.resteer_req.op),
                       Format("pred={}", resteer_pred),
+                      Format("hit={}", redir_hit),
                 ),
             ]
 
+        # The younger FTQ entries are wrong-path: allocate the target
+        with m.If(redirect & self.resteer_req.valid):
             m.d.comb += [
                 sel_pc.eq(resteer_tgt),
                 sel_pred.eq(0),
                 sel_valid.eq(1),
                 sel_passthru.eq(1),
-                sel_blocks.eq(4),
+                sel_blocks.eq(pred_blocks),
+                sel_end_idx.eq(pred_end_idx),
                 sel_src.eq(CFRSource.RESTEER),
             ]
         # We're receiving a debug request from offcore. 
@@ -133,19 +374,57 @@ class ControlFlowController(Component):
                 sel_pred.eq(0),
                 sel_valid.eq(1),
                 sel_passthru.eq(1),
-                sel_blocks.eq(4),
+                sel_blocks.eq(pred_blocks),
+                sel_end_idx.eq(pred_end_idx),
                 sel_src.eq(CFRSource.DEBUG),
             ]
+        # We're being redirected by a predicted-taken branch
+        with m.Elif(redirect & self.bpu_req.valid):
+            m.d.comb += [
+                sel_pc.eq(self.bpu_req.pc),
+                sel_pred.eq(1),
+                sel_valid.eq(1),
+                sel_passthru.eq(1),
+                sel_blocks.eq(pred_blocks),
+                sel_end_idx.eq(pred_end_idx),
+                sel_src.eq(CFRSource.BPU),
+            ]
+        # The L1 BTB disagrees with an earlier prediction
+        with m.Elif(redirect & override):
+            m.d.comb += [
+                sel_pc.eq(nfp.override.pc),
+                sel_pred.eq(1),
+                sel_valid.eq(1),
+                sel_passthru.eq(1),
+                sel_blocks.eq(pred_blocks),
+                sel_end_idx.eq(pred_end_idx),
+                sel_src.eq(CFRSource.PRED1),
+            ]
+        # The FTQ was not ready for the request selected on a previous cycle
+        with m.Elif(r_pend_valid):
+            m.d.comb += [
+                sel_pc.eq(r_pend_pc),
+                sel_pred.eq(r_pend_pred),
+                sel_valid.eq(1),
+                sel_passthru.eq(1),
+                sel_blocks.eq(pred_blocks),
+                sel_end_idx.eq(pred_end_idx),
+                sel_src.eq(r_pend_src),
+            ]
         # We're predicting the previous block
-        #with m.Elif(l0_cfm.rp.resp.valid):
-        #    m.d.comb += [
-        #        sel_pc.eq(l0_cfm.rp.resp.pc),
-        #        sel_pred.eq(1),
-        #        sel_valid.eq(1),
-        #        sel_passthru.eq(1),
-        #        sel_blocks.eq(l0_cfm.rp.resp.blocks),
-        #        sel_src.eq(CFRSource.PRED0),
-        #    ]
+        with m.Elif(nfp.resp.valid & nfp.resp.hit):
+            m.d.sync += r_phist.eq(
+                path_history_update(r_phist, Cat(C(0, 2), nfp.resp.off))
+            )
+            m.d.comb += [
+                sel_pc.eq(nfp.resp.pc),
+                sel_pred.eq(1),
+                sel_valid.eq(1),
+                sel_passthru.eq(1),
+                sel_blocks.eq(pred_blocks),
+                sel_end_idx.eq(pred_end_idx),
+                sel_src.eq(CFRSource.PRED0),
+            ]
         with m.Else():
             m.d.comb += [
                 sel_pc.eq(0),
@@ -153,6 +432,7 @@ class ControlFlowController(Component):
                 sel_valid.eq(0),
                 sel_passthru.eq(0),
                 sel_blocks.eq(0),
+                sel_end_idx.eq(0),
                 sel_src.eq(CFRSource.NONE),
             ]
 
@@ -169,27 +449,32 @@ class ControlFlowController(Component):
             ]
 
 
-        ## Send the selected program counter value to the NFP.
-        #m.d.comb += [
-        #    nfp.req.pc.eq(sel_pc),
-        #    nfp.req.valid.eq(sel_valid),
-        #]
-        ## Output from the NFP is available on the next cycle
-        #m.d.sync += [
-        #    r_nfp_pc.eq(nfp.resp.pc),
-        #    r_nfp_valid.eq(nfp.resp.valid),
-        #]
-
-        ## Capture the selected program counter value from this cycle.
-        ## These registers hold information from the previous CFR.
-        #r_pc    = Signal(32, init=0x0000_0000)
-        #r_pred  = Signal(init=0)
-        #r_valid = Signal(init=0)
-        #m.d.sync += [
-        #    r_pc.eq(sel_pc),
-        #    r_pred.eq(sel_pred),
-        #    r_valid.eq(sel_valid),
-        #]
+        # The FTQ captures the state of the RAP when the allocation request
+        # is visible, which includes any push/pop from the previous cycle.
+        m.d.comb += [
+            self.alloc_req.rap.eq(rap.ckpt),
+            self.alloc_req.phist.eq(r_phist),
+        ]
+
+        # When the L0 BTB finds a taken branch in the first cacheline of the 
+        # block being allocated, the block ends at the branch.
+        r_blocks = Signal(self.p.fblk_size_shape)
+        r_end_idx = Signal(self.p.vaddr.num_off_bits)
+        btb_end = nfp.resp.valid & nfp.resp.hit
+        m.d.comb += [
+            self.alloc_req.blocks.eq(Mux(btb_end, 1, r_blocks)),
+            self.alloc_req.end_idx.eq(Mux(btb_end, 
+                nfp.resp.off << 2, r_end_idx
+            )),
+        ]
+
+        # Hold the selected request until the FTQ is ready
+        m.d.sync += [
+            r_pend_valid.eq(sel_valid & ~self.ftq_sts.ready),
+            r_pend_pc.eq(sel_pc),
+            r_pend_pred.eq(sel_pred),
+            r_pend_src.eq(sel_src),
+        ]
 
         # Send a request to the FTQ
         with m.If(self.ftq_sts.ready & sel_valid):
@@ -197,22 +482,22 @@ class ControlFlowController(Component):
                 self.alloc_req.valid.eq(sel_valid),
                 self.alloc_req.vaddr.eq(sel_pc),
                 self.alloc_req.passthru.eq(sel_passthru),
-                self.alloc_req.blocks.eq(sel_blocks),
+                r_blocks.eq(sel_blocks),
+                r_end_idx.eq(sel_end_idx),
+                self.alloc_req.predicted.eq(sel_pred),
 
                 Print(Format("[CFC] Allocate"),
                       Format("vaddr={:08x}", sel_pc),
                 )
-
-                #r_prev_cfr.valid.eq(sel_valid),
-                #r_prev_cfr.pc.eq(sel_pc),
-                #r_prev_cfr.blocks.eq(sel_blocks),
             ]
         with m.Else():
             m.d.sync += [
                 self.alloc_req.valid.eq(0),
                 self.alloc_req.vaddr.eq(0),
                 self.alloc_req.passthru.eq(0),
-                self.alloc_req.blocks.eq(0),
+                r_blocks.eq(0),
+                r_end_idx.eq(0),
+                self.alloc_req.predicted.eq(0),
             ]
 
         return m
@@ -23,6 +23,7 @@ class ControlFlowMapReadPort(Signature):
                 #"entry": Out(CFMEntry(p)),
                 "pc": Out(p.vaddr),
                 "blocks": Out(p.fblk_size_shape),
+                "end_idx": Out(p.vaddr.num_off_bits),
             })
     def __init__(self, p: EmberParams):
         super().__init__({
@@ -58,20 +59,49 @@ class FetchBlockExit(Enum, shape=4):
     LINK     = 0b0010
 
 class FetchBlockMetadata(StructLayout):
+    """ Metadata associated with a fetch block.
+
+    Members
+    =======
+    entry_pc:
+        Program counter of the first instruction in the block
+    blocks:
+        Number of sequential cachelines in the block
+    end_idx:
+        Byte offset of the control-flow instruction which ends the block
+        [in the last cacheline]
+    next_pc:
+        Program counter of the next block
+    """
     def __init__(self, p: EmberParams):
         super().__init__({
             "entry_pc": p.vaddr,
             "blocks": p.fblk_size_shape,
+            "end_idx": unsigned(p.vaddr.num_off_bits),
             "next_pc": p.vaddr,
         })
 
 
 class L0ControlFlowMap(Component):
+    """ A small fully-associative map from the entry address of a fetch block 
+    to the length of the block and the address of the next block.
+
+    Writes update the entry with a matching entry address, or replace the 
+    oldest entry. 
+
+    Ports
+    =====
+    rp:
+        Read port
+    wp:
+        Write port
+
+    """
     def __init__(self, param: EmberParams):
         self.p = param
         super().__init__(Signature({
             "rp": In(ControlFlowMapReadPort(param)),
-            "wp": In(ControlFlowMapReadPort(param)),
+            "wp": In(ControlFlowMapWritePort(param)),
         }))
 
     def elaborate(self, platform):
@@ -109,14 +139,28 @@ class L0ControlFlowMap(Component):
             self.rp.resp.valid.eq(self.rp.req.valid & hit),
             self.rp.resp.pc.eq(hit_entry.next_pc),
             self.rp.resp.blocks.eq(hit_entry.blocks),
+            self.rp.resp.end_idx.eq(hit_entry.end_idx),
         ]
 
-
+        # Find an existing entry for the block being written
+        m.submodules.wenc = wenc = EmberPriorityEncoder(4)
+        m.d.comb += wenc.i.eq(Cat(*[
+            valid_arr[idx] & 
+            (self.wp.req.entry.entry_pc == data_arr[idx].entry_pc)
+            for idx in range(4)
+        ]))
+
+        # Otherwise, replace the oldest entry
+        r_next = Signal(2, init=0)
+        widx = Mux(wenc.valid, wenc.o, r_next)
+        with m.If(self.wp.req.valid):
+            m.d.sync += [
+                data_arr[widx].eq(self.wp.req.entry),
+                valid_arr[widx].eq(1),
+            ]
+            with m.If(~wenc.valid):
+                m.d.sync += r_next.eq(r_next + 1)
+        m.d.comb += self.wp.resp.valid.eq(self.wp.req.valid)
 
         return m
 
-
-
-
-
-
@@ -9,6 +9,8 @@ from ember.front.l1i import *
 from ember.front.itlb import *
 from ember.front.ifill import *
 from ember.front.predecode import *
+from ember.front.bp.common import BTBSlot
+from ember.front.bp.l0_btb import L0BTBReadPort
 from ember.riscv.paging import *
 from ember.sim.fakeram import *
 
@@ -27,6 +29,8 @@ class DemandFetchRequest(Signature):
         Program counter of the first fetched instruction
     lines:
         Number of sequential cachelines in this request
+    end_idx:
+        Byte offset of the last instruction in the last cacheline
     ftq_idx:
         FTQ entry index
         
@@ -37,6 +41,7 @@ class DemandFetchRequest(Signature):
             "passthru": Out(1),
             "vaddr": Out(p.vaddr),
             "lines": Out(p.fblk_size_shape),
+            "end_idx": Out(p.vaddr.num_off_bits),
             "ftq_idx": Out(p.ftq.index_shape),
         })
 
@@ -97,8 +102,14 @@ class DemandFetchLineRequest(StructLayout):
         Index of the FTQ entry that generated this request
     line:
         Position of cacheline block in the parent transaction
+    mask:
+        Mask of valid instructions in this cacheline
     terminal:
-        This is the last cacheline in the parent transaction
+        This is the last request in the parent transaction
+    pair:
+        The next sequential cacheline is also read by this request
+    pair_mask:
+        Mask of valid instructions in the next sequential cacheline
     """
     def __init__(self, p: EmberParams):
         super().__init__({
@@ -110,6 +121,47 @@ class DemandFetchLineRequest(StructLayout):
             "line": unsigned(4),
             "mask": unsigned(p.l1i.line_depth),
             "terminal": unsigned(1),
+            "pair": unsigned(1),
+            "pair_mask": unsigned(p.l1i.line_depth),
+        })
+
+
+class DemandFetchROBEntry(StructLayout):
+    """ An entry in the demand fetch reorder buffer. 
+
+    Members
+    =======
+    valid:
+        This entry is valid
+    req: :class:`DemandFetchLineRequest`
+        The request for this cacheline
+    data:
+        Cacheline data
+    pair_data:
+        Next sequential cacheline data
+    btb_hit:
+        The L0 BTB found a predicted-taken branch in this cacheline
+    btb_slot:
+        The predicted-taken branch
+    line_addr:
+        Physical address of the cacheline
+    wait:
+        Waiting for the cacheline to be forwarded from the fill unit
+    wait_pair:
+        Waiting for the next sequential cacheline to be forwarded from the 
+        fill unit
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "valid": unsigned(1),
+            "req": DemandFetchLineRequest(p),
+            "data": L1ICacheline(p),
+            "pair_data": L1ICacheline(p),
+            "btb_hit": unsigned(1),
+            "btb_slot": BTBSlot(p),
+            "line_addr": unsigned(p.paddr.size - p.vaddr.num_off_bits),
+            "wait": unsigned(1),
+            "wait_pair": unsigned(1),
         })
 
 
@@ -123,7 +175,7 @@ class DemandFetchState(Enum, shape=4):
     RUN:
         A transaction is occuring. 
     STALL:
-        A transaction is stalled for the L1I fill unit. 
+        A transaction is stalled for a TLB miss. 
     """
     IDLE  = 0
     RUN   = 1
@@ -136,8 +188,9 @@ class DemandFetchUnit(Component):
     def is_running(self) -> Value:
         return (self.r_state == DemandFetchState.RUN)
 
-    def __init__(self, param: EmberParams):
+    def __init__(self, param: EmberParams, rob_depth: int = 4):
         self.p = param
+        self.rob_depth = rob_depth
         self.stage = PipelineStages()
 
         # The state of the pipeline
@@ -147,6 +200,28 @@ class DemandFetchUnit(Component):
         self.r_stall_req = Signal(DemandFetchLineRequest(self.p))
         self.r_stall_cyc = Signal(8, init=0)
 
+        # A fill is outstanding
+        self.r_fill_busy = Signal()
+        # Physical address of the first cacheline in the outstanding fill
+        self.r_fill_addr = Signal(self.p.paddr)
+        self.r_fill_line = Signal(self.p.paddr.size - self.p.vaddr.num_off_bits)
+        # The number of cachelines in the outstanding fill
+        self.r_fill_blocks = Signal(self.p.fblk_size_shape)
+        # Mask of cachelines in the outstanding fill that have been forwarded
+        # [only complete cachelines, not beats]
+        self.r_fill_mask = Signal(self.p.max_fblk_size)
+        # A younger miss is waiting for the outstanding fill to complete
+        self.r_defer = Signal()
+        self.r_defer_req = Signal(DemandFetchLineRequest(self.p))
+
+        # The line number of the next request released to stage 3
+        self.r_rel_line = Signal(4, init=1)
+        # Hitting cachelines waiting to be released in-order to stage 3
+        self.rob = Array(
+            Signal(DemandFetchROBEntry(self.p), name=f"rob{idx}")
+            for idx in range(self.rob_depth)
+        )
+
         # The number of cachelines in this transaction.
         self.r_lines    = Signal(self.p.fblk_size_shape)
 
@@ -155,6 +230,8 @@ class DemandFetchUnit(Component):
         self.r_pc = Signal(self.p.vaddr)
         self.r_init_start_idx = Signal(self.p.vaddr.num_off_bits)
         self.r_last_end_idx   = Signal(self.p.vaddr.num_off_bits)
+        # Mask of valid instructions in the last cacheline
+        self.r_last_mask      = Signal(self.p.l1i.line_depth)
 
         # The FTQ index that generated this transaction
         self.r_ftq_idx   = Signal(self.p.ftq.index_shape)
@@ -165,6 +242,9 @@ class DemandFetchUnit(Component):
         self.r_blk  = Signal(4, init=0)
         # The address sent downstream on the previous cycle.
         self.r_addr = Signal(self.p.vaddr)
+        # The byte offset of the first instruction in the next cacheline 
+        # sent downstream
+        self.r_next_off = Signal(self.p.vaddr.num_off_bits)
 
         # Access stage (L1I Tag/Data access, L1I TLB access)
         self.stage.add_stage(1, {
@@ -176,27 +256,45 @@ class DemandFetchUnit(Component):
         self.stage.add_stage(2, {
             "req": DemandFetchLineRequest(param),
             "flush": unsigned(1),
+            "btb_hit": unsigned(1),
+            "btb_slot": BTBSlot(param),
         })
 
         # Predecode stage
         self.stage.add_stage(3, {
             "req": DemandFetchLineRequest(param),
             "data": L1ICacheline(self.p),
+            "pair_data": L1ICacheline(self.p),
             "flush": unsigned(1),
             "resteer": unsigned(1),
+            "early": unsigned(1),
+            "early_slot": BTBSlot(param),
         })
 
+        # An early redirect is being sent from stage 2
+        self.w_early = Signal()
+        self.w_early_src_pc = Signal(self.p.vaddr)
+        self.w_early_slot = Signal(BTBSlot(param))
+        self.w_early_req = Signal(DemandFetchLineRequest(param))
+
+        # The BPU is redirecting the front-end away from this transaction
+        self.w_cancel = Signal()
+
         # Ports
         signature = Signature({
             "req": In(DemandFetchRequest(param)),
             "resp": Out(DemandFetchResponse(param)),
             "ready": Out(1),
-            "l1i_rp": Out(L1ICacheReadPort(param)),
+            "l1i_rp": Out(L1ICacheReadPort(param)).array(param.l1i.num_rp),
             "tlb_rp": Out(L1ICacheTLBReadPort()),
+            "xlat": Out(L1ICacheTLBXlatPort()),
             "ifill": Out(L1IFillPort(param)),
             "ifill_sts": In(L1IFillStatus(param)),
             "result": Out(FetchData(param)),
             "resteer_req": Out(ResteerRequest(self.p)),
+            "btb_rp": Out(L0BTBReadPort(param)),
+            "pd_resp": Out(PredecodeResponse(param)),
+            "bpu_req": In(ControlFlowRequest(param)),
         })
         super().__init__(signature)
 
@@ -208,6 +306,57 @@ class DemandFetchUnit(Component):
         self.elaborate_s3(m)
         return m
 
+    def line_request(self, m: Module, line, start_off, addr, lines, 
+                     last_mask, last_end, passthru):
+        """ Determine the masks for a request sent down the pipeline, given 
+        the position of the cacheline in the transaction and the byte offset 
+        of the first instruction. 
+
+        When the request does not start at the beginning of a cacheline, 
+        the instructions before the offset are taken from the next 
+        sequential cacheline (when a second L1I read port is available, 
+        and when both cachelines are in the same page). The following 
+        request then starts at the same offset in the next cacheline. 
+        """
+        width = self.p.l1i.line_depth
+        all_mask = C((1 << width) - 1, width)
+        res = Signal(StructLayout({
+            "mask": unsigned(width),
+            "end_idx": unsigned(self.p.vaddr.num_off_bits),
+            "terminal": unsigned(1),
+            "pair": unsigned(1),
+            "pair_mask": unsigned(width),
+        }))
+
+        start = (start_off >> 2)
+        terminal = (line == lines)
+        pair_terminal = ((line + 1) == lines)
+        head_mask = offset2masklut(width, start)
+        if self.p.l1i.num_rp > 1:
+            pair = (
+                (start != 0) & ~terminal & 
+                (passthru | ~addr.l1i.line.all())
+            )
+        else:
+            pair = C(0, 1)
+
+        # The next cacheline is the last one in the transaction, and ends 
+        # before the offset
+        pair_done = pair & pair_terminal & ((last_end >> 2) < start)
+
+        m.d.comb += [
+            res.mask.eq(head_mask & Mux(terminal, last_mask, all_mask)),
+            res.end_idx.eq(Mux(terminal, 
+                last_end, self.p.vaddr.num_line_bytes - 4
+            )),
+            res.terminal.eq(terminal | pair_done),
+            res.pair.eq(pair),
+            res.pair_mask.eq(Mux(pair, 
+                ~head_mask & Mux(pair_terminal, last_mask, all_mask), 0
+            )),
+        ]
+        return res
+
     def elaborate_s0(self, m: Module):
         """ Demand Fetch Pipe - Stage 0
 
@@ -235,13 +384,29 @@ class DemandFetchUnit(Component):
 
 
 
+        # Translation for the request that caused the stall has completed
+        xlat_done = (
+            self.xlat.resp.valid & 
+            (self.xlat.resp.vpn == self.r_stall_req.vaddr.sv32.vpn)
+        )
+
         with m.Switch(self.r_state):
             # When the pipeline is idle, begin a new transaction when we 
             # recieve a valid request. 
             with m.Case(DemandFetchState.IDLE):
                 init_off = self.req.vaddr.get_fetch_off()
-                init_mask = offset2masklut(8, init_off >> 2)
                 init_addr = self.req.vaddr.get_fetch_addr()
+                # The fetch block may end in the first cacheline
+                last_mask = limit2masklut(8, self.req.end_idx >> 2)
+                init = self.line_request(m,
+                    line=C(1, 4), 
+                    start_off=init_off, 
+                    addr=self.req.vaddr, 
+                    lines=self.req.lines, 
+                    last_mask=last_mask, 
+                    last_end=self.req.end_idx, 
+                    passthru=self.req.passthru,
+                )
                 with m.If(self.req.valid):
                     m.d.sync += [
                         Print(Format("[DFU] Start transaction"),
@@ -255,9 +420,12 @@ class DemandFetchUnit(Component):
                         self.r_init_start_idx.eq(init_off),
                         self.r_ftq_idx.eq(self.req.ftq_idx),
                         self.r_lines.eq(self.req.lines),
+                        self.r_last_end_idx.eq(self.req.end_idx),
+                        self.r_last_mask.eq(last_mask),
                         self.r_passthru.eq(self.req.passthru),
                         self.r_addr.eq(init_addr),
-                        self.r_blk.eq(1),
+                        self.r_blk.eq(Mux(init.terminal, self.req.lines, 1)),
+                        self.r_next_off.eq(Mux(init.pair, init_off, 0)),
 
                         # Change state
                         self.r_state.eq(DemandFetchState.RUN),
@@ -266,48 +434,90 @@ class DemandFetchUnit(Component):
                         # Send the first request downstream
                         self.stage[1].valid.eq(1),
                         self.stage[1].req.line.eq(1),
-                        self.stage[1].req.mask.eq(init_mask),
                         self.stage[1].req.vaddr.eq(init_addr),
                         self.stage[1].req.start_idx.eq(init_off),
                         self.stage[1].req.ftq_idx.eq(self.req.ftq_idx),
                         self.stage[1].req.passthru.eq(self.req.passthru),
+                        self.stage[1].req.mask.eq(init.mask),
+                        self.stage[1].req.end_idx.eq(init.end_idx),
+                        self.stage[1].req.terminal.eq(init.terminal),
+                        self.stage[1].req.pair.eq(init.pair),
+                        self.stage[1].req.pair_mask.eq(init.pair_mask),
                     ]
 
             # When the pipeline is running *and* no stall condition is 
             # occuring, continue sending requests down the pipeline
             with m.Case(DemandFetchState.RUN):
                 done      = (self.r_blk == self.r_lines)
-                next_addr = (self.r_addr.bits + self.p.l1i.line_bytes)
-                next_blk  = (self.r_blk + 1)
-                is_terminal = (next_blk == self.r_lines)
-                with m.If(~done & ~self.is_stalled()):
+                next_addr = Signal(self.p.vaddr)
+                next_blk  = (self.r_blk + 1)[:len(self.r_blk)]
+                m.d.comb += next_addr.eq(self.r_addr.bits + self.p.l1i.line_bytes)
+                nxt = self.line_request(m,
+                    line=next_blk, 
+                    start_off=self.r_next_off, 
+                    addr=next_addr, 
+                    lines=self.r_lines, 
+                    last_mask=self.r_last_mask, 
+                    last_end=self.r_last_end_idx, 
+                    passthru=self.r_passthru,
+                )
+                # Stop sending requests when they would overflow the 
+                # reorder buffer
+                rob_full = (
+                    (next_blk - self.r_rel_line)[:4] >= self.rob_depth
+                )
+                # All requests older than the deferred request have been 
+                # released
+                restart = (
+                    self.r_defer & (self.r_rel_line == self.r_defer_req.line)
+                )
+
+                # Resume the transaction at the deferred request
+                with m.If(restart):
+                    m.d.sync += [
+                        self.r_defer.eq(0),
+                        self.r_addr.eq(self.r_defer_req.vaddr),
+                        self.r_blk.eq(Mux(self.r_defer_req.terminal, 
+                            self.r_lines, self.r_defer_req.line
+                        )),
+                        self.r_next_off.eq(Mux(self.r_defer_req.pair, 
+                            self.r_defer_req.start_idx, 0
+                        )),
+                        self.stage[1].valid.eq(1),
+                        self.stage[1].req.eq(self.r_defer_req),
+                    ]
+                with m.Elif(~done & ~self.r_defer & ~rob_full):
                     m.d.sync += [
                         self.r_addr.eq(next_addr),
-                        self.r_blk.eq(next_blk),
+                        self.r_blk.eq(Mux(nxt.terminal, self.r_lines, next_blk)),
+                        self.r_next_off.eq(Mux(nxt.pair, self.r_next_off, 0)),
 
                         self.stage[1].valid.eq(1),
                         self.stage[1].req.line.eq(next_blk),
                         self.stage[1].req.vaddr.eq(next_addr),
-                        self.stage[1].req.mask.eq(C(0b11111111, 8)),
+                        self.stage[1].req.start_idx.eq(self.r_next_off),
                         self.stage[1].req.ftq_idx.eq(self.r_ftq_idx),
                         self.stage[1].req.passthru.eq(self.r_passthru),
-                        self.stage[1].req.terminal.eq(is_terminal),
+                        self.stage[1].req.mask.eq(nxt.mask),
+                        self.stage[1].req.end_idx.eq(nxt.end_idx),
+                        self.stage[1].req.terminal.eq(nxt.terminal),
+                        self.stage[1].req.pair.eq(nxt.pair),
+                        self.stage[1].req.pair_mask.eq(nxt.pair_mask),
                     ]
 
-            # When the pipeline is stalled for L1I fill, wait for a response 
-            # from the fill unit before replaying the transaction [resuming at 
-            # the block which originally caused the stall]. 
+            # When the pipeline is stalled for a TLB miss, wait for the 
+            # translation to complete before replaying the transaction 
+            # [resuming at the block which originally caused the stall]. 
+            #
+            # NOTE: Page faults are not reported yet. The transaction is 
+            # replayed, and the TLB miss occurs again. 
             with m.Case(DemandFetchState.STALL):
                 m.d.sync += [
                     self.r_stall_cyc.eq(self.r_stall_cyc + 1),
                     self.stage[1].req.eq(0),
                     self.stage[2].req.eq(0),
                 ]
-                ifill_resp_ok = (
-                    (self.ifill.resp.ftq_idx == self.r_ftq_idx) &
-                    self.ifill.resp.valid
-                )
-                with m.If(ifill_resp_ok):
+                with m.If(xlat_done):
                     m.d.sync += [
                         #Print(
                         #    Format("[DFU] stage0 addr={:08x}: unstall",
@@ -316,7 +526,12 @@ class DemandFetchUnit(Component):
                         #),
                         self.r_state.eq(DemandFetchState.RUN),
                         self.r_addr.eq(self.r_stall_req.vaddr),
-                        self.r_blk.eq(self.r_stall_req.line),
+                        self.r_blk.eq(Mux(self.r_stall_req.terminal, 
+                            self.r_lines, self.r_stall_req.line
+                        )),
+                        self.r_next_off.eq(Mux(self.r_stall_req.pair, 
+                            self.r_stall_req.start_idx, 0
+                        )),
                         self.stage[1].valid.eq(1),
                         self.stage[1].req.eq(self.r_stall_req),
                     ]
@@ -334,12 +549,20 @@ class DemandFetchUnit(Component):
         m.d.sync += [
             self.stage[2].valid.eq(0),
             self.stage[2].req.eq(0),
+            self.stage[2].btb_hit.eq(0),
+            self.stage[2].btb_slot.eq(0),
         ]
         m.d.comb += [
+            self.btb_rp.req.valid.eq(0),
+            self.btb_rp.req.pc.eq(0),
             self.tlb_rp.req.valid.eq(0),
             self.tlb_rp.req.vpn.eq(0),
-            self.l1i_rp.req.valid.eq(0),
-            self.l1i_rp.req.set.eq(0),
+        ]
+        m.d.comb += [
+            rp.req.valid.eq(0) for rp in self.l1i_rp
+        ]
+        m.d.comb += [
+            rp.req.set.eq(0) for rp in self.l1i_rp
         ]
 
         # Drive the TLB and L1I read ports when: 
@@ -353,10 +576,31 @@ class DemandFetchUnit(Component):
             m.d.comb += [
                 self.tlb_rp.req.valid.eq(tlb_req_valid),
                 self.tlb_rp.req.vpn.eq(tlb_req_vpn),
-                self.l1i_rp.req.valid.eq(l1i_req_valid),
-                self.l1i_rp.req.set.eq(l1i_req_set),
+                self.l1i_rp[0].req.valid.eq(l1i_req_valid),
+                self.l1i_rp[0].req.set.eq(l1i_req_set),
+            ]
+
+            # Read the next sequential cacheline on the second read port
+            if self.p.l1i.num_rp > 1:
+                pair_addr = Signal(self.p.vaddr)
+                m.d.comb += [
+                    pair_addr.eq(req.vaddr.bits + self.p.l1i.line_bytes),
+                    self.l1i_rp[1].req.valid.eq(req.pair),
+                    self.l1i_rp[1].req.set.eq(pair_addr.l1i.set),
+                ]
+
+            # Look for a predicted-taken branch in the L0 BTB (in parallel 
+            # with the L1I access), starting at the first valid instruction
+            # and ending at the last valid instruction
+            m.d.comb += [
+                self.btb_rp.req.valid.eq(stage_ok),
+                self.btb_rp.req.pc.eq(req.vaddr.bits | req.start_idx),
             ]
+            btb_resp = self.btb_rp.resp
+            btb_in_range = (btb_resp.slot.off <= (req.end_idx >> 2))
             m.d.sync += [
+                self.stage[2].btb_hit.eq(btb_resp.hit & btb_in_range),
+                self.stage[2].btb_slot.eq(btb_resp.slot),
                 self.stage[2].req.eq(req),
                 self.stage[2].valid.eq(1),
                 #Print(Format("[DFU] stage1"),
@@ -368,12 +612,32 @@ class DemandFetchUnit(Component):
         """ Demand Fetch Pipe - Stage 2
 
         Handle hit/miss conditions for the L1I/TLB accesses. 
+
+        Hit-under-miss
+        ==============
+        An L1I miss does not stall the pipeline. The fill unit is asked 
+        for the remaining cachelines in the transaction (starting with the 
+        missing cacheline), and younger requests keep flowing down the 
+        pipeline while the fill is outstanding. Requests are kept in a small 
+        reorder buffer (indexed by line number), and all cachelines are 
+        released to stage 3 in-order. 
+
+        Cachelines are forwarded from the fill unit while they are being 
+        written to the L1I. A request that misses on a cacheline belonging 
+        to the outstanding fill waits in the reorder buffer, and is released 
+        as soon as its data has been forwarded (without being replayed), 
+        even before the rest of the fill has completed. 
+
+        Only one fill is outstanding at a time. Any other miss is 
+        *deferred*: younger requests are discarded, and the transaction 
+        resumes at the deferred request after all older requests have been 
+        released. 
         """
 
         m.submodules.wsel = wsel = \
                 L1IWaySelect(self.p.l1i.num_ways, L1ITag())
         l1_line_data = Array(
-            self.l1i_rp.resp.line_data[way_idx]
+            self.l1i_rp[0].resp.line_data[way_idx]
             for way_idx in range(self.p.l1i.num_ways)
         )
         req = self.stage[2].req
@@ -389,14 +653,16 @@ class DemandFetchUnit(Component):
 
             self.stage[3].valid.eq(0),
             self.stage[3].data.eq(0),
+            self.stage[3].pair_data.eq(0),
             self.stage[3].req.eq(0),
+            self.stage[3].early.eq(0),
+            self.stage[3].early_slot.eq(0),
             self.result.valid.eq(0),
             self.result.vaddr.eq(0),
             self.result.ftq_idx.eq(0),
             self.result.data.eq(0),
         ]
 
-        need_stall = Signal()
         need_resteer = self.stage[3].resteer
         stage2_sts = Signal(FetchResponseStatus)
 
@@ -440,30 +706,177 @@ class DemandFetchUnit(Component):
             wsel.i_tag.eq(in_tag),
         ]
         m.d.comb += [
-            wsel.i_tags[way_idx].eq(self.l1i_rp.resp.tag_data[way_idx])
+            wsel.i_tags[way_idx].eq(self.l1i_rp[0].resp.tag_data[way_idx])
             for way_idx in range(self.p.l1i.num_ways)
         ]
         tag_line = Mux(wsel.o_hit, l1_line_data[wsel.o_way], 0)
 
+        # Select a way for the next sequential cacheline. Both cachelines 
+        # are in the same page, so the same tag is used. 
+        pair_hit  = Signal()
+        pair_line = Signal(L1ICacheline(self.p))
+        if self.p.l1i.num_rp > 1:
+            m.submodules.wsel_pair = wsel_pair = \
+                    L1IWaySelect(self.p.l1i.num_ways, L1ITag())
+            pair_line_data = Array(
+                self.l1i_rp[1].resp.line_data[way_idx]
+                for way_idx in range(self.p.l1i.num_ways)
+            )
+            m.d.comb += [
+                wsel_pair.i_valid.eq(tag_ok & req.pair),
+                wsel_pair.i_tag.eq(in_tag),
+            ]
+            m.d.comb += [
+                wsel_pair.i_tags[way_idx].eq(
+                    self.l1i_rp[1].resp.tag_data[way_idx]
+                )
+                for way_idx in range(self.p.l1i.num_ways)
+            ]
+            m.d.comb += [
+                pair_hit.eq(wsel_pair.o_hit),
+                pair_line.eq(Mux(wsel_pair.o_hit, 
+                    pair_line_data[wsel_pair.o_way], 0
+                )),
+            ]
+
+        # Report hits to the L1I replacement policy
+        m.d.comb += [
+            self.l1i_rp[0].hit.valid.eq(stage_ok & tag_ok & wsel.o_hit),
+            self.l1i_rp[0].hit.set.eq(req.vaddr.l1i.set),
+            self.l1i_rp[0].hit.way.eq(wsel.o_way),
+        ]
+        if self.p.l1i.num_rp > 1:
+            pair_vaddr = Signal(self.p.vaddr)
+            m.d.comb += [
+                pair_vaddr.eq(req.vaddr.bits + self.p.l1i.line_bytes),
+                self.l1i_rp[1].hit.valid.eq(
+                    stage_ok & tag_ok & req.pair & pair_hit
+                ),
+                self.l1i_rp[1].hit.set.eq(pair_vaddr.l1i.set),
+                self.l1i_rp[1].hit.way.eq(wsel_pair.o_way),
+            ]
+
+        # The cacheline hits, but the next sequential cacheline misses
+        pair_miss = Signal()
+
         # Determine the outcome of this access. 
         with m.If(stage_ok & ~tag_ok & ~tlb_hit & ~req.passthru):
             m.d.comb += stage2_sts.eq(FetchResponseStatus.TLB_MISS)
-            m.d.comb += need_stall.eq(1)
         with m.Elif(stage_ok & tag_ok & ~wsel.o_hit):
             m.d.comb += stage2_sts.eq(FetchResponseStatus.L1_MISS)
-            m.d.comb += need_stall.eq(1)
+        with m.Elif(stage_ok & tag_ok & req.pair & ~pair_hit):
+            m.d.comb += stage2_sts.eq(FetchResponseStatus.L1_MISS)
+            m.d.comb += pair_miss.eq(1)
         with m.Elif(stage_ok & tag_ok & wsel.o_hit):
             m.d.comb += stage2_sts.eq(FetchResponseStatus.L1_HIT)
-            m.d.comb += need_stall.eq(0)
         with m.Else():
             m.d.comb += stage2_sts.eq(FetchResponseStatus.NONE)
-            m.d.comb += need_stall.eq(0)
 
-        # Stall the pipeline on the next cycle.
+        l1_miss  = (stage2_sts == FetchResponseStatus.L1_MISS)
+        tlb_miss = (stage2_sts == FetchResponseStatus.TLB_MISS)
+
+        # Requests younger than a deferred request are discarded. 
+        # They are sent again when the transaction resumes at the deferred 
+        # request. 
+        discard = self.r_defer & (req.line > self.r_defer_req.line)
+        live = self.is_running() & ~need_resteer & ~discard
+
+        # Physical addresses of the cachelines read by this request
+        off_bits  = self.p.vaddr.num_off_bits
+        line_bits = self.p.paddr.size - off_bits
+        prim_addr = Signal(line_bits)
+        pair_addr = Signal(line_bits)
+        m.d.comb += [
+            prim_addr.eq(paddr_sel[off_bits:]),
+            pair_addr.eq(prim_addr + 1),
+        ]
+        need_prim = ~wsel.o_hit
+        need_pair = req.pair & ~pair_hit
+
+        # Cachelines are forwarded from the fill unit while they are being 
+        # written to the L1I. Keep track of the cachelines in the outstanding
+        # fill that have already been forwarded. 
+        #
+        # Beats are also forwarded before the cacheline is complete, and 
+        # may contain all of the instructions needed by a request. 
+        fwd = self.ifill.fwd
+        fwd_line = fwd.addr.as_value()[off_bits:]
+        fwd_idx  = (fwd_line - self.r_fill_line)[:4]
+        fwd_ok = (
+            fwd.valid & self.r_fill_busy & 
+            (fwd.ftq_idx == self.r_ftq_idx) & 
+            (fwd_idx < self.r_fill_blocks)
+        )
+        def fwd_covers(mask):
+            return (mask & ~fwd.mask) == 0
+        with m.If(fwd_ok & fwd.mask.all()):
+            m.d.sync += self.r_fill_mask.eq(
+                self.r_fill_mask | (C(1, len(self.r_fill_mask)) << fwd_idx)
+            )
+        fill_resp_ok = (
+            self.ifill.resp.valid & 
+            (self.ifill.resp.ftq_idx == self.r_ftq_idx) &
+            (self.ifill.resp.addr == self.r_fill_addr)
+        )
+        with m.If(self.r_fill_busy & fill_resp_ok):
+            m.d.sync += self.r_fill_busy.eq(0)
+
+        # A missing cacheline can wait for the outstanding fill when it 
+        # belongs to the fill and has not already been forwarded (unless it 
+        # is being forwarded on this cycle). 
+        def fill_covers(addr):
+            idx = (addr - self.r_fill_line)[:4]
+            return (
+                self.r_fill_busy & (idx < self.r_fill_blocks) & (
+                    ~self.r_fill_mask.bit_select(idx, 1) | 
+                    (fwd_ok & (fwd_line == addr))
+                )
+            )
+        wait_fill = live & l1_miss & (
+            (~need_prim | fill_covers(prim_addr)) & 
+            (~need_pair | fill_covers(pair_addr))
+        )
+
+        # Otherwise, an L1I miss starts a fill when no other fill is 
+        # outstanding. 
+        start_fill = (
+            live & l1_miss & ~wait_fill & ~self.r_fill_busy & ifill_ready
+        )
+
+        # A TLB miss stalls the pipeline when there are no older requests 
+        # waiting to be released. 
+        start_stall = (
+            live & tlb_miss & ~self.r_fill_busy & 
+            (req.line == self.r_rel_line)
+        )
+
+        # Otherwise, the miss is deferred until there are no older 
+        # requests waiting to be released. 
+        defer = live & (
+            (l1_miss & ~wait_fill & ~start_fill) | 
+            (tlb_miss & ~start_stall)
+        )
+        with m.If(defer & 
+                  (~self.r_defer | (req.line < self.r_defer_req.line))):
+            m.d.sync += [
+                self.r_defer.eq(1),
+                self.r_defer_req.eq(req),
+            ]
+
+        # Stall the pipeline on the next cycle, and request translation.
         # Capture the address and block number so we can replay
-        # this transaction after the fill unit responds.
-        with m.If(need_stall & ~self.is_stalled() & ~need_resteer):
+        # this transaction after the stall is resolved. 
+        #
+        # NOTE: There is never more than one outstanding request from the
+        # DFU, so the PTW is always ready to accept it. 
+        m.d.sync += [
+            self.xlat.req.valid.eq(0),
+            self.xlat.req.vpn.eq(0),
+        ]
+        with m.If(start_stall):
             m.d.sync += [
+                self.xlat.req.valid.eq(1),
+                self.xlat.req.vpn.eq(req.vaddr.sv32.vpn),
                 #Print(
                 #    Format("[DFU] stage2 addr={:08x}: stall", req.vaddr.bits),
                 #),
@@ -471,41 +884,181 @@ class DemandFetchUnit(Component):
                 self.r_blk.eq(0),
                 self.r_addr.eq(0),
                 self.r_stall_req.eq(req),
+                self.r_defer.eq(0),
                 self.stage[1].req.eq(0),
                 self.stage[2].req.eq(0),
-
+            ]
+            m.d.sync += [
+                self.rob[idx].valid.eq(0) for idx in range(self.rob_depth)
             ]
 
         # Setup a request to the fill unit (valid on the next cycle).
         # 
-        # NOTE: This requests all of the remaining cachelines in the block. 
+        # NOTE: This requests all of the remaining cachelines in the block, 
+        # starting with the cacheline containing the first instruction in 
+        # this request. 
         # NOTE: A resteering event in the predecode stage cancels our request
         # FIXME: This simply uses the physical address without verifying TLB
         #        that the TLB output is valid. 
-        rem_blks = (self.r_lines - req.line + 1)
-        ifill_req_valid = (stage2_sts == FetchResponseStatus.L1_MISS)
-        setup_ifill = (
-            ifill_req_valid & ifill_ready & ~self.is_stalled() & ~need_resteer
-        )
-        with m.If(setup_ifill):
+        # NOTE: When only the next sequential cacheline misses, the request 
+        # starts at the next sequential cacheline.
+        # NOTE: The address includes the offset of the first instruction, 
+        # so that the fill unit can request it from memory first. 
+        rem_blks = (self.r_lines - req.line + 1 - pair_miss)
+        fill_paddr = Signal(self.p.paddr)
+        m.d.comb += fill_paddr.eq(Mux(pair_miss, 
+            Cat(C(0, off_bits), pair_addr),
+            Cat(req.start_idx, prim_addr),
+        ))
+        with m.If(start_fill):
             m.d.sync += [
-                self.ifill.req.valid.eq(ifill_req_valid),
-                self.ifill.req.addr.eq(paddr_sel),
+                self.r_fill_busy.eq(1),
+                self.r_fill_addr.eq(fill_paddr),
+                self.r_fill_line.eq(fill_paddr.as_value()[off_bits:]),
+                self.r_fill_blocks.eq(rem_blks),
+                self.r_fill_mask.eq(0),
+                self.ifill.req.valid.eq(1),
+                self.ifill.req.addr.eq(fill_paddr),
                 self.ifill.req.ftq_idx.eq(self.r_ftq_idx),
                 self.ifill.req.blocks.eq(rem_blks),
                 self.ifill.req.src.eq(L1IFillSource.DEMAND),
             ]
 
-        # When we hit in the L1I, send the hitting cacheline to the next 
-        # stage for predecoding. Do not send data when we are stalled, or
-        # when we have cancelled the transaction due to re-steering based on 
-        # information from predecode.
+        # Requests are released to the next stage in-order. 
+        # When all of the data for this request is available and this is 
+        # the next request to be released, send the cachelines to the next 
+        # stage for predecoding. Otherwise, the request is kept in the 
+        # reorder buffer until all older requests have been released, and 
+        # until any missing cachelines have been forwarded from the fill 
+        # unit. 
+        #
+        # Do not send data when we are stalled, or when we have cancelled 
+        # the transaction due to re-steering based on information from 
+        # predecode.
+        fwd_prim = (
+            fwd_ok & need_prim & (fwd_line == prim_addr) & 
+            fwd_covers(req.mask)
+        )
+        fwd_pair = (
+            fwd_ok & need_pair & (fwd_line == pair_addr) & 
+            fwd_covers(req.pair_mask)
+        )
+        hit = Signal(DemandFetchROBEntry(self.p))
+        m.d.comb += [
+            hit.valid.eq(1),
+            hit.req.eq(req),
+            hit.data.eq(Mux(fwd_prim, fwd.data, tag_line)),
+            hit.pair_data.eq(Mux(fwd_pair, fwd.data, pair_line)),
+            hit.btb_hit.eq(self.stage[2].btb_hit),
+            hit.btb_slot.eq(self.stage[2].btb_slot),
+            hit.line_addr.eq(prim_addr),
+            hit.wait.eq(need_prim & ~fwd_prim),
+            hit.wait_pair.eq(need_pair & ~fwd_pair),
+        ]
+        hit_ready = ~hit.wait & ~hit.wait_pair
+
         hit_valid = (stage2_sts == FetchResponseStatus.L1_HIT)
-        with m.If(hit_valid & ~self.is_stalled() & ~need_resteer):
+        hit_ok = (hit_valid & live) | wait_fill | start_fill
+        rob_idx_bits = exact_log2(self.rob_depth)
+        rel_entry = self.rob[self.r_rel_line[:rob_idx_bits]]
+        rob_rel = (
+            self.is_running() & ~need_resteer & rel_entry.valid & 
+            ~rel_entry.wait & ~rel_entry.wait_pair &
+            (rel_entry.req.line == self.r_rel_line)
+        )
+        hit_rel = (
+            hit_ok & hit_ready & (req.line == self.r_rel_line) & ~rob_rel
+        )
+        hit_rob = hit_ok & (
+            (req.line > self.r_rel_line) | 
+            ((req.line == self.r_rel_line) & ~hit_ready)
+        )
+
+        # Fill the reorder buffer with forwarded cachelines [or beats that 
+        # contain all of the instructions needed by an entry]
+        for idx in range(self.rob_depth):
+            entry = self.rob[idx]
+            with m.If(fwd_ok & entry.valid & entry.wait & 
+                      (entry.line_addr == fwd_line) & 
+                      fwd_covers(entry.req.mask)):
+                m.d.sync += [
+                    entry.wait.eq(0),
+                    entry.data.eq(fwd.data),
+                ]
+            with m.If(fwd_ok & entry.valid & entry.wait_pair & 
+                      ((entry.line_addr + 1)[:line_bits] == fwd_line) & 
+                      fwd_covers(entry.req.pair_mask)):
+                m.d.sync += [
+                    entry.wait_pair.eq(0),
+                    entry.pair_data.eq(fwd.data),
+                ]
+
+        # The request released to the next stage on this cycle
+        rel = Signal(DemandFetchROBEntry(self.p))
+        with m.If(rob_rel):
+            m.d.comb += rel.eq(rel_entry)
+            m.d.sync += rel_entry.valid.eq(0)
+        with m.Elif(hit_rel):
+            m.d.comb += rel.eq(hit)
+        with m.If(rel.valid):
             m.d.sync += [
+                self.r_rel_line.eq(self.r_rel_line + 1),
                 self.stage[3].valid.eq(1),
-                self.stage[3].data.eq(tag_line),
-                self.stage[3].req.eq(self.stage[2].req),
+                self.stage[3].data.eq(rel.data),
+                self.stage[3].pair_data.eq(rel.pair_data),
+                self.stage[3].req.eq(rel.req),
+            ]
+
+        with m.If(hit_rob):
+            m.d.sync += self.rob[req.line[:rob_idx_bits]].eq(hit)
+
+        # When the L0 BTB found an unconditional jump in a released 
+        # cacheline, redirect the front-end early. This cacheline becomes 
+        # the last cacheline in the transaction: the jump is the last 
+        # valid instruction, and younger requests are squashed. 
+        #
+        # The L0 BTB has no direction prediction, so conditional branches 
+        # are left to the BPU. Indirect jumps and calls are left to the 
+        # predecode stage (where the ITTAGE predictor is used). 
+        slot = rel.btb_slot
+        early_op_ok = (
+            (slot.op == ControlFlowOp.JUMP_DIR) |
+            (slot.op == ControlFlowOp.CALL_DIR) |
+            (slot.op == ControlFlowOp.RET)
+        )
+        m.d.comb += [
+            self.w_early.eq(
+                rel.valid & rel.btb_hit & early_op_ok & ~self.w_cancel
+            ),
+            self.w_early_src_pc.eq(
+                Cat(C(0, 2), slot.off, rel.req.vaddr.fetch_blk)
+            ),
+            self.w_early_slot.eq(slot),
+            self.w_early_req.eq(rel.req),
+        ]
+        with m.If(self.w_early):
+            m.d.sync += [
+                Print(Format("[DFU] early redirect"),
+                      Format("pc={:08x}", self.w_early_src_pc.bits),
+                      Format("tgt={:08x}", slot.tgt.bits),
+                ),
+                self.stage[3].req.mask.eq(
+                    rel.req.mask & 
+                    limit2masklut(self.p.l1i.line_depth, slot.off)
+                ),
+                self.stage[3].req.end_idx.eq(slot.off << 2),
+                self.stage[3].req.terminal.eq(1),
+                self.stage[3].req.pair.eq(0),
+                self.stage[3].req.pair_mask.eq(0),
+                self.stage[3].early.eq(1),
+                self.stage[3].early_slot.eq(slot),
+
+                # Squash younger requests and stop sending requests
+                self.stage[1].valid.eq(0),
+                self.stage[1].req.eq(0),
+                self.stage[2].valid.eq(0),
+                self.stage[2].req.eq(0),
+                self.r_blk.eq(self.r_lines),
             ]
 
     def elaborate_s3(self, m: Module): 
@@ -554,11 +1107,43 @@ class DemandFetchUnit(Component):
            (and correspondingly, let any resteering direct call instructions
            push their return address onto the stack). 
 
+        Early Redirects
+        ===============
+        When an early redirect was made from stage 2, predecode only 
+        verifies it. The redirect is correct when the first control-flow 
+        instruction is the predicted branch (with the same type and, for 
+        direct branches, the same target), and no resteer is necessary. 
+        Otherwise:
+
+        - When the first control-flow instruction is resteering, resteer 
+          as usual. 
+        - Otherwise, the predicted branch does not exist. Resteer to the 
+          instruction after the predicted branch. 
+
+        Conditional Branches
+        ====================
+        When the first control-flow instruction is a conditional branch 
+        (and no resteer is necessary), the predecoded cacheline is sent to 
+        the BPU. Only the branch is marked as valid. 
+
+        The prediction is available on the next cycle. When the branch is 
+        predicted taken and the transaction is still running, the 
+        transaction ends immediately: the cacheline in this stage is 
+        discarded and the FTQ receives a resteer response. 
+
         """
         m.submodules.pdu = pdu = PredecodeUnit(self.p)
-        stage_ok = self.stage[3].valid
         req = self.stage[3].req
 
+        # A predicted-taken branch in an earlier cacheline ends this 
+        # transaction, and discards the cacheline in this stage. 
+        cancel = self.w_cancel
+        m.d.comb += cancel.eq(
+            (self.is_running() | self.is_stalled()) & self.bpu_req.valid & 
+            (self.bpu_req.parent_ftq_idx == self.r_ftq_idx)
+        )
+        stage_ok = self.stage[3].valid & ~cancel
+
         # Drive defaults
         m.d.comb += [
             self.resteer_req.valid.eq(0),
@@ -592,6 +1177,26 @@ class DemandFetchUnit(Component):
         connect(m, flipped(pd_resp), pdu.resp)
         info = Array([ pd_resp.info[idx] for idx in range(pdu.width)])
 
+        # Predecode the next sequential cacheline
+        m.submodules.pdu_pair = pdu_pair = PredecodeUnit(self.p)
+        pair_vaddr = Signal(self.p.vaddr)
+        m.d.comb += pair_vaddr.eq(req.vaddr.bits + self.p.l1i.line_bytes)
+        pair_pd_req = PredecodeRequest(self.p).create()
+        pair_pd_resp = PredecodeResponse(self.p).create()
+        m.d.comb += [
+            pair_pd_req.valid.eq(stage_ok & req.pair),
+            pair_pd_req.mask.eq(req.pair_mask),
+            pair_pd_req.cline.eq(Mux(stage_ok, self.stage[3].pair_data, 0)),
+            pair_pd_req.vaddr.eq(pair_vaddr),
+            pair_pd_req.line.eq(req.line + 1),
+            pair_pd_req.ftq_idx.eq(req.ftq_idx),
+        ]
+        connect(m, pair_pd_req, pdu_pair.req)
+        connect(m, flipped(pair_pd_resp), pdu_pair.resp)
+        pair_info = Array([ 
+            pair_pd_resp.info[idx] for idx in range(pdu_pair.width)
+        ])
+
         # Find the first control-flow instruction in the line. 
         has_cf = Signal()
         is_cf = Array([ 
@@ -602,19 +1207,82 @@ class DemandFetchUnit(Component):
         m.d.comb += pdenc.i.eq(Cat(*is_cf))
         m.d.comb += has_cf.eq(Cat(*is_cf).any())
 
+        # When there is no control-flow instruction in the line, find the 
+        # first control-flow instruction in the next sequential cacheline. 
+        pair_is_cf = Array([ 
+            (pair_info[idx].is_cf & pair_pd_resp.info_valid[idx] & 
+             ~pair_info[idx].ill)
+            for idx in range(pdu_pair.width)
+        ])
+        m.submodules.pair_pdenc = pair_pdenc = \
+                EmberPriorityEncoder(pdu_pair.width)
+        m.d.comb += pair_pdenc.i.eq(Cat(*pair_is_cf))
+        cf_in_pair = ~pdenc.valid & pair_pdenc.valid
+        cf_idx = Mux(cf_in_pair, pair_pdenc.o, pdenc.o)
+        cf_info = Signal(PredecodeInfo(self.p.vaddr))
+        m.d.comb += cf_info.eq(Mux(cf_in_pair, 
+            pair_info[pair_pdenc.o], info[pdenc.o]
+        ))
+
         # Determine if the first control-flow instruction is resteering
-        resteer_view = PredecodeInfoView(self.p.vaddr, info[pdenc.o])
-        need_resteer = (
-            pdenc.valid & 
+        resteer_view = PredecodeInfoView(self.p.vaddr, cf_info)
+        cf_resteer = (
+            (pdenc.valid | pair_pdenc.valid) & 
             resteer_view.resteerable() & 
             ~resteer_view.ill
         )
 
+        # Verify an early redirect from stage 2
+        early = stage_ok & self.stage[3].early
+        early_slot = self.stage[3].early_slot
+        early_view = PredecodeInfoView(self.p.vaddr, info[early_slot.off])
+        early_ok = (
+            Cat(*pd_resp.info_valid).bit_select(early_slot.off, 1) & 
+            early_view.is_cf & ~early_view.ill & 
+            (early_view.cf_op == early_slot.op) & 
+            ((early_view.cf_op == ControlFlowOp.RET) | 
+             (early_view.tgt.bits == early_slot.tgt.bits)) &
+            # No resteering instruction before the predicted branch
+            ~(cf_resteer & (pdenc.o < early_slot.off))
+        )
+        early_bad = early & ~early_ok & ~cf_resteer
+        need_resteer = Signal()
+        m.d.comb += need_resteer.eq(
+            Mux(early, ~early_ok & (cf_resteer | early_bad), cf_resteer)
+        )
+        early_fix_src_pc = Signal(self.p.vaddr)
+        m.d.comb += early_fix_src_pc.eq(
+            Cat(C(0, 2), early_slot.off, pd_resp.vaddr.fetch_blk)
+        )
+
+        # Send a conditional branch to the BPU
+        cf_branch = (
+            (pdenc.valid | pair_pdenc.valid) & ~resteer_view.ill &
+            (resteer_view.cf_op == ControlFlowOp.BRANCH)
+        )
+        m.d.comb += [
+            self.pd_resp.valid.eq(stage_ok & cf_branch & ~need_resteer),
+            self.pd_resp.vaddr.eq(Mux(cf_in_pair, pair_vaddr, req.vaddr)),
+            self.pd_resp.ftq_idx.eq(req.ftq_idx),
+            self.pd_resp.line.eq(req.line + cf_in_pair),
+        ]
+        m.d.comb += [
+            self.pd_resp.info[idx].eq(Mux(cf_in_pair, 
+                pair_pd_resp.info[idx], pd_resp.info[idx]
+            ))
+            for idx in range(pdu.width)
+        ]
+        m.d.comb += [
+            self.pd_resp.info_valid[idx].eq(cf_idx == idx)
+            for idx in range(pdu.width)
+        ]
+
         # Compute the program counter of the resteering instruction
         resteer_src_pc = Signal(self.p.vaddr)
-        m.d.comb += resteer_src_pc.eq(
-            Mux(need_resteer, (pd_resp.vaddr.bits + (pdenc.o << 2)), 0)
-        )
+        m.d.comb += resteer_src_pc.eq(Mux(cf_resteer, 
+            Mux(cf_in_pair, pair_vaddr.bits, pd_resp.vaddr.bits) + (cf_idx << 2), 
+            0
+        ))
 
         # Asynchronously tell the previous stages about resteering
         # FIXME: Is this actually necessary? 
@@ -622,30 +1290,71 @@ class DemandFetchUnit(Component):
 
         # Create a new mask for the resulting cacheline where the resteering 
         # instruction is the last valid instruction
-        resteer_mask = limit2masklut(self.p.l1i.line_depth, pdenc.o)
-        result_mask = Mux(need_resteer, resteer_mask, req.mask)
+        resteer_mask = limit2masklut(self.p.l1i.line_depth, cf_idx)
+        cf_resteer_ok = need_resteer & cf_resteer
+        result_mask = Mux(cf_resteer_ok & ~cf_in_pair, 
+            resteer_mask, req.mask
+        )
+        result_pair_mask = Mux(cf_resteer_ok, 
+            Mux(cf_in_pair, resteer_mask & req.pair_mask, 0), 
+            req.pair_mask
+        )
 
         # *Asynchronously* signal the CFC with a resteering request. 
-        with m.If(need_resteer):
+        with m.If(need_resteer & cf_resteer):
             m.d.comb += [
                 self.resteer_req.valid.eq(need_resteer),
                 self.resteer_req.tgt_pc.eq(resteer_view.tgt),
                 self.resteer_req.src_pc.eq(resteer_src_pc),
                 self.resteer_req.op.eq(resteer_view.cf_op),
                 self.resteer_req.parent_ftq_idx.eq(req.ftq_idx),
+                self.resteer_req.parent_line.eq(req.line + cf_in_pair),
+                self.resteer_req.parent_idx.eq(cf_idx),
+            ]
+        # The predicted branch does not exist: continue with the next 
+        # instruction after the predicted branch. 
+        with m.Elif(need_resteer):
+            m.d.comb += [
+                self.resteer_req.valid.eq(1),
+                self.resteer_req.tgt_pc.eq(early_fix_src_pc.bits + 4),
+                self.resteer_req.src_pc.eq(early_fix_src_pc),
+                self.resteer_req.op.eq(ControlFlowOp.NONE),
+                self.resteer_req.parent_ftq_idx.eq(req.ftq_idx),
                 self.resteer_req.parent_line.eq(req.line),
-                self.resteer_req.parent_idx.eq(pdenc.o),
+                self.resteer_req.parent_idx.eq(early_slot.off),
+            ]
+        # An early redirect from stage 2
+        with m.Elif(self.w_early):
+            m.d.comb += [
+                self.resteer_req.valid.eq(1),
+                self.resteer_req.tgt_pc.eq(self.w_early_slot.tgt),
+                self.resteer_req.src_pc.eq(self.w_early_src_pc),
+                self.resteer_req.op.eq(self.w_early_slot.op),
+                self.resteer_req.parent_ftq_idx.eq(self.w_early_req.ftq_idx),
+                self.resteer_req.parent_line.eq(self.w_early_req.line),
+                self.resteer_req.parent_idx.eq(self.w_early_slot.off),
             ]
 
-        # Send the resulting cacheline out of the pipeline.
+        # Merge both cachelines into a single fetch packet. 
+        # Words before the offset of the first instruction are taken from 
+        # the next sequential cacheline. 
+        packet_mask = result_mask | result_pair_mask
+        packet_pc = Cat(req.start_idx, req.vaddr.fetch_blk)
+        cl = Signal(L1ICacheline(self.p))
+        m.d.comb += [
+            cl[idx].eq(Mux(req.pair_mask[idx], 
+                self.stage[3].pair_data[idx], self.stage[3].data[idx]
+            ))
+            for idx in range(self.p.l1i.line_depth)
+        ]
+
+        # Send the resulting fetch packet out of the pipeline.
         # NOTE: This *always* occurs when this stage is valid.
         with m.If(stage_ok):
-            cl = Signal(L1ICacheline(self.p))
-            m.d.comb += cl.eq(self.stage[3].data)
             m.d.sync += Print(
                 Format("[DFU] output mask={:08b} addr={:08x}:", 
-                       reverse_bits(result_mask),
-                       req.vaddr.bits
+                       reverse_bits(packet_mask),
+                       packet_pc
                 ),
                 Format("{:08x} {:08x} {:08x} {:08x}",
                        cl[0],cl[1],cl[2],cl[3]
@@ -656,10 +1365,10 @@ class DemandFetchUnit(Component):
             )
             m.d.sync += [
                 self.result.valid.eq(1),
-                self.result.vaddr.eq(req.vaddr),
+                self.result.vaddr.eq(packet_pc),
                 self.result.ftq_idx.eq(req.ftq_idx),
-                self.result.mask.eq(result_mask),
-                self.result.data.eq(self.stage[3].data),
+                self.result.mask.eq(packet_mask),
+                self.result.data.eq(cl),
             ]
 
         # Determine if this cacheline completes/terminates the transaction.
@@ -667,7 +1376,8 @@ class DemandFetchUnit(Component):
         # - Respond to the FTQ with the appropriate status
         # - Flush the entire pipeline
         complete = (
-            stage_ok & self.is_running() & (need_resteer | req.terminal)
+            (stage_ok & self.is_running() & (need_resteer | req.terminal)) |
+            cancel
         )
         with m.If(complete):
             m.d.sync += [
@@ -676,10 +1386,15 @@ class DemandFetchUnit(Component):
                 self.r_addr.eq(0),
                 self.r_ftq_idx.eq(0),
                 self.r_lines.eq(0),
+                self.r_last_end_idx.eq(0),
+                self.r_last_mask.eq(0),
                 self.r_passthru.eq(0),
                 self.ready.eq(1),
                 self.r_blk.eq(0),
                 self.r_stall_cyc.eq(0),
+                self.r_fill_busy.eq(0),
+                self.r_defer.eq(0),
+                self.r_rel_line.eq(1),
 
                 self.stage[1].valid.eq(0),
                 self.stage[1].req.eq(0),
@@ -688,13 +1403,16 @@ class DemandFetchUnit(Component):
                 self.stage[3].valid.eq(0),
                 self.stage[3].req.eq(0),
 
-                self.resp.sts.eq(Mux(need_resteer, 
+                self.resp.sts.eq(Mux(need_resteer | cancel, 
                     DemandResponseStatus.RESTEER,
                     DemandResponseStatus.OK
                 )),
-                self.resp.vaddr.eq(req.vaddr),
-                self.resp.valid.eq(stage_ok),
-                self.resp.ftq_idx.eq(req.ftq_idx),
+                self.resp.vaddr.eq(Mux(cancel, self.r_pc, req.vaddr)),
+                self.resp.valid.eq(1),
+                self.resp.ftq_idx.eq(Mux(cancel, self.r_ftq_idx, req.ftq_idx)),
+            ]
+            m.d.sync += [
+                self.rob[idx].valid.eq(0) for idx in range(self.rob_depth)
             ]
 
 
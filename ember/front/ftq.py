@@ -12,6 +12,8 @@ from ember.front.ifill import *
 from ember.front.prefetch import *
 from ember.front.demand_fetch import *
 from ember.front.demand_fetch import DemandFetchRequest
+from ember.front.bp.common import DirectionRecoverRequest
+from ember.front.bpu import BranchPrediction, BranchPredictionUnit
 
 from ember.uarch.front import *
 
@@ -27,6 +29,16 @@ class FTQAllocRequest(Signature):
         Program counter value
     passthru:
         Treat this virtual address as a physical address
+    blocks:
+        Number of sequential cachelines in the fetch block
+    end_idx:
+        Byte offset of the last instruction in the last cacheline
+    predicted:
+        This request was predicted
+    rap:
+        Return address predictor checkpoint
+    phist:
+        Path history checkpoint
     """
     def __init__(self, param: EmberParams):
         super().__init__({
@@ -34,18 +46,42 @@ class FTQAllocRequest(Signature):
             "passthru": Out(1),
             "vaddr": Out(param.vaddr),
             "blocks": Out(param.fblk_size_shape),
+            "end_idx": Out(param.vaddr.num_off_bits),
             "predicted": Out(1),
+            "rap": Out(RapCheckpoint(param.bp.rap.depth, param.bp.rap.ctr_bits)),
+            "phist": Out(param.bp.ittage.hist_bits),
         })
 
 class FTQFreeRequest(Signature):
-    """ A request to free an FTQ entry. 
+    """ A request to free the oldest FTQ entries [after they have been 
+    committed]. 
+
+    All entries from the oldest entry up to (and including) the entry ``id`` 
+    are freed on the same cycle. 
+
+    Members
+    =======
+    valid:
+        This request is valid
+    id:
+        Index of the youngest FTQ entry to be freed. 
+
+    """
+    def __init__(self, param: EmberParams):
+        super().__init__({
+            "valid": Out(1),
+            "id": Out(param.ftq.index_shape),
+        })
+
+class FTQFlushRequest(Signature):
+    """ A request to free all FTQ entries younger than a mispredicted entry.
 
     Members
     =======
     valid:
         This request is valid
     id:
-        Index of the FTQ entry to be freed. 
+        Index of the mispredicted FTQ entry [which is not freed]
 
     """
     def __init__(self, param: EmberParams):
@@ -54,6 +90,56 @@ class FTQFreeRequest(Signature):
             "id": Out(param.ftq.index_shape),
         })
 
+class FTQCheckpointReadPort(Signature):
+    """ Read the predictor checkpoints saved in an FTQ entry.
+
+    The response is available on the same cycle as the request.
+
+    Members
+    =======
+    idx:
+        Index of the FTQ entry
+    valid:
+        The FTQ entry is allocated
+    vaddr:
+        Program counter value associated with the FTQ entry
+    rap:
+        Return address predictor checkpoint
+    phist:
+        Path history checkpoint
+    """
+    def __init__(self, param: EmberParams):
+        super().__init__({
+            "idx": Out(param.ftq.index_shape),
+            "valid": In(1),
+            "vaddr": In(param.vaddr),
+            "rap": In(RapCheckpoint(param.bp.rap.depth, param.bp.rap.ctr_bits)),
+            "phist": In(param.bp.ittage.hist_bits),
+        })
+
+class FTQBranchCheckpoint(StructLayout):
+    """ The state of the conditional branch predictors saved in an FTQ 
+    entry. 
+
+    Predictions are made in program order, so this is the most-recent 
+    prediction for a branch in this entry or in an older entry. 
+
+    Members
+    =======
+    valid:
+        A conditional branch has been predicted
+    taken:
+        The predicted direction
+    meta:
+        Predictor metadata returned with the prediction
+    """
+    def __init__(self, param: EmberParams):
+        super().__init__({
+            "valid": unsigned(1),
+            "taken": unsigned(1),
+            "meta": BranchPredictionUnit.meta_layout(param),
+        })
+
 class FTQStatusBus(Signature):
     """ Status output from the FTQ.
 
@@ -90,7 +176,7 @@ class FetchTargetQueue(Component):
     =============
 
     The fetch pointer indicates the next demand fetch request, which always 
-    corresponds to the oldest entry in the queue. 
+    corresponds to the oldest entry in the queue that has not been fetched. 
 
     - When the entry is ``PENDING``: 
 
@@ -106,12 +192,14 @@ class FetchTargetQueue(Component):
 
     - When the entry is ``FILL``:
 
-      - Wait for the fill unit to respond
+      - Wait for the fill unit to complete the cacheline that missed 
+        [during prefetch]
       - Return to the pending state (and replay)
 
     - When the entry is ``XLAT``:
 
-      - Wait for the PTW to respond
+      - Wait for the PTW to complete the translation that missed 
+        [during prefetch]
       - Return to the pending state (and replay)
 
     - When the entry is ``STALL``: 
@@ -124,6 +212,48 @@ class FetchTargetQueue(Component):
       - Wait for the backend to release this entry 
       - Return to the unallocated state
 
+    Prefetch Pointer
+    ================
+
+    The prefetch pointer runs ahead of the fetch pointer. Each entry is 
+    sent to the PFU once, which probes every cacheline in the fetch block 
+    and sends fills for the cachelines that miss. 
+
+    The number of entries between the fetch pointer and the prefetch 
+    pointer, and the number of outstanding prefetch fills, are limited by 
+    :class:`PrefetchParams`. Both limits are reduced when prefetch accuracy 
+    is low. Accuracy is measured by counting prefetched entries that are 
+    demand fetched (which increases accuracy) and prefetched entries that 
+    are flushed (which decreases accuracy). 
+
+    Freeing Entries
+    ===============
+
+    Entries are freed in order when they are committed. A free request 
+    may free any number of the oldest entries on a single cycle. 
+
+    When a misprediction is discovered, a flush request frees all entries 
+    younger than the mispredicted entry. When the mispredicted entry has 
+    already been freed, every entry is younger, and all of them are freed. 
+    Allocation is not allowed on the same cycle. When the fetch pointer moves past the mispredicted entry, 
+    it is moved back to the next entry to be allocated. If a demand fetch 
+    for a flushed entry is in-flight, the response is dropped, and the next 
+    demand fetch request is held until then. 
+
+
+    Branch Prediction Checkpoints
+    =============================
+
+    Each entry also saves the state of the conditional branch predictors 
+    after the branches in the entry have been predicted (see 
+    :class:`FTQBranchCheckpoint`). A prediction from the BPU is written to 
+    its own entry and to every younger entry, and a new entry starts with 
+    the most-recent prediction. 
+
+    When younger entries are flushed, the BPU is recovered with the 
+    checkpoint saved in the mispredicted entry. This discards the 
+    speculative history from predictions made on the wrong path. 
+
 
     Ports
     =====
@@ -132,7 +262,13 @@ class FetchTargetQueue(Component):
         Request to allocate a new FTQ entry.
 
     free_req:
-        Request to free an FTQ entry
+        Request to free the oldest FTQ entries
+    flush_req:
+        Request to free the FTQ entries younger than a mispredicted entry
+    ckpt_rp:
+        Read the predictor checkpoints saved in an FTQ entry 
+        [for the CFC and the predictor update unit]. The CFC uses a 
+        second port to check the entry after the parent of a redirect.
 
     fetch_req:
         Output request to the IFU pipe
@@ -146,12 +282,20 @@ class FetchTargetQueue(Component):
 
     ifill_resp:
         L1I fill unit responses.
+    xlat_resp:
+        Completed translations [from the PTW]
+
+    bp_pred:
+        Conditional branch predictions [from the BPU]
+    bp_recover:
+        Output recovery request [to the BPU] 
 
     """
 
     def __init__(self, param: EmberParams):
         self.p = param
         self.depth = param.ftq.depth
+        meta_layout = BranchPredictionUnit.meta_layout(param)
         signature = Signature({
 
             "sts": Out(FTQStatusBus(param)),
@@ -159,6 +303,9 @@ class FetchTargetQueue(Component):
             "alloc_req": In(FTQAllocRequest(param)),
 
             "free_req": In(FTQFreeRequest(param)),
+            "flush_req": In(FTQFlushRequest(param)),
+
+            "ckpt_rp": In(FTQCheckpointReadPort(param)).array(3),
 
             "fetch_req": Out(DemandFetchRequest(param)),
             "fetch_resp": In(DemandFetchResponse(param)),
@@ -167,7 +314,11 @@ class FetchTargetQueue(Component):
             "prefetch_resp": In(PrefetchResponse(param)),
             "prefetch_sts": In(PrefetchPipelineStatus()),
 
-            #"ifill_resp": In(L1IFillPort.Response(param)).array(2),
+            "ifill_resp": In(L1IFillPort.Response(param)).array(2),
+            "xlat_resp": In(L1ICacheTLBXlatPort.Response()),
+
+            "bp_pred": In(BranchPrediction(param, meta_layout)),
+            "bp_recover": Out(DirectionRecoverRequest(param, meta_layout)),
         })
         super().__init__(signature)
 
@@ -183,15 +334,33 @@ class FetchTargetQueue(Component):
         r_fptr = Signal(self.p.ftq.index_shape, init=0)
         r_pptr = Signal(self.p.ftq.index_shape, init=1)
         r_wptr = Signal(self.p.ftq.index_shape, init=0)
-        r_used = Signal(ceil_log2(self.depth+1), init=0)
+        r_rptr = Signal(self.p.ftq.index_shape, init=0)
         r_full = Signal()
 
+        # A demand fetch for a flushed entry is in-flight, and the response 
+        # must be dropped
+        r_drop = Signal()
+
+        # The number of allocated entries. 
+        # NOTE: The queue never holds more than 'depth - 1' entries, so the 
+        # pointers never wrap around onto each other. 
+        r_used = Signal(ceil_log2(self.depth+1))
+        m.d.comb += r_used.eq((r_wptr - r_rptr)[:len(r_wptr)])
+
+        # The distance between the oldest entry and some other entry
+        def age(idx):
+            return (idx - r_rptr)[:len(r_rptr)]
+
+        flush = self.flush_req
+        free  = self.free_req
+
         # Default assignment for demand request output
         m.d.sync += [
             self.fetch_req.valid.eq(0),
             self.fetch_req.vaddr.eq(0),
             self.fetch_req.passthru.eq(0),
             self.fetch_req.lines.eq(0),
+            self.fetch_req.end_idx.eq(0),
 
         ]
         # Default assignment for probe request output
@@ -199,13 +368,15 @@ class FetchTargetQueue(Component):
             self.prefetch_req.valid.eq(0),
             self.prefetch_req.vaddr.eq(0),
             self.prefetch_req.passthru.eq(0),
+            self.prefetch_req.blocks.eq(0),
+            self.prefetch_req.ftq_idx.eq(0),
         ]
 
         # Determine whether or not an allocation can occur this cycle. 
         # Allocate/write a new FTQ entry, incrementing the write pointer.
         next_wptr = r_wptr + 1
         next_used = r_used + 1
-        can_alloc = (next_used < self.depth)
+        can_alloc = (next_used < self.depth) & ~flush.valid
         alloc_ok  = (self.alloc_req.valid & can_alloc)
         new_entry = data_arr[r_wptr]
         with m.If(alloc_ok):
@@ -216,65 +387,273 @@ class FetchTargetQueue(Component):
                 new_entry.passthru.eq(self.alloc_req.passthru),
                 new_entry.predicted.eq(self.alloc_req.predicted),
                 new_entry.blocks.eq(self.alloc_req.blocks),
+                new_entry.end_idx.eq(self.alloc_req.end_idx),
                 new_entry.prefetched.eq(0),
                 new_entry.complete.eq(0),
                 new_entry.valid.eq(1),
                 new_entry.id.eq(r_wptr),
+                new_entry.fill_line.eq(0),
+                new_entry.fill_mask.eq(0),
+                new_entry.xlat_vpn.eq(0),
+                new_entry.rap.eq(self.alloc_req.rap),
+                new_entry.phist.eq(self.alloc_req.phist),
                 r_wptr.eq(next_wptr),
-                r_used.eq(next_used),
             ]
             # NOTE: If we're allocating into the head of the queue (implying
             # that the queue is empty), immediately setup the request to 
             # demand fetch instead of waiting a cycle
-            with m.If(r_wptr == r_fptr):
+            with m.If((r_wptr == r_fptr) & ~r_drop):
                 m.d.sync += [
                     new_entry.state.eq(FTQEntryState.FETCH),
                     self.fetch_req.valid.eq(1),
                     self.fetch_req.lines.eq(self.alloc_req.blocks),
+                    self.fetch_req.end_idx.eq(self.alloc_req.end_idx),
                     self.fetch_req.vaddr.eq(self.alloc_req.vaddr),
                     self.fetch_req.passthru.eq(self.alloc_req.passthru),
                     self.fetch_req.ftq_idx.eq(r_wptr),
                 ]
 
+        # ----------------------------------------------------------------
+        # Free the oldest entries [up to and including 'free.id'], and 
+        # flush the entries younger than 'flush.id'. 
+
+        free_ok = free.valid & (age(free.id) < r_used)
+        next_rptr = Mux(free_ok, free.id + 1, r_rptr)
+        with m.If(free_ok):
+            m.d.sync += r_rptr.eq(next_rptr)
+
+        # Entries which have been freed [and not flushed or reallocated]. 
+        # When the mispredicted entry has already been freed, every entry 
+        # is flushed. A flush for an entry which has itself been flushed is 
+        # ignored. 
+        r_freed = Signal(self.depth)
+        parent_freed = (
+            (age(flush.id) >= r_used) & r_freed.bit_select(flush.id, 1)
+        )
+        flush_ok = flush.valid & ((age(flush.id) < r_used) | parent_freed)
+        flush_wptr = Mux(parent_freed, next_rptr, flush.id + 1)
+        with m.If(flush_ok):
+            m.d.sync += r_wptr.eq(flush_wptr)
+
+        # An entry is younger than the mispredicted entry
+        def flush_younger(idx):
+            return parent_freed | (age(idx) > age(flush.id))
+
+        # Prefetched entries discarded by a flush
+        flushed_pf = []
+        for idx in range(self.depth):
+            allocated = (age(idx) < r_used)
+            freed   = free_ok & allocated & (age(idx) <= age(free.id))
+            flushed = flush_ok & allocated & flush_younger(idx)
+            with m.If(freed | flushed):
+                m.d.sync += data_arr[idx].valid.eq(0)
+            with m.If(freed):
+                m.d.sync += r_freed[idx].eq(1)
+            with m.Elif(flushed | (alloc_ok & (r_wptr == idx))):
+                m.d.sync += r_freed[idx].eq(0)
+            flushed_pf.append(flushed & data_arr[idx].prefetched)
+
         # Determine whether or not the queue will be full [on the next cycle]
-        full      = (r_used == self.depth)
-        next_full = ((next_used == self.depth) & self.alloc_req.valid)
-        m.d.sync += r_full.eq(next_full | full)
+        next_wptr_final = Mux(flush_ok, flush_wptr, 
+            Mux(alloc_ok, next_wptr, r_wptr)
+        )
+        next_used_final = (next_wptr_final - next_rptr)[:len(r_wptr)]
+        m.d.sync += r_full.eq((next_used_final + 1) >= self.depth)
 
-        # Drive the FTQ status wires 
+        # Drive the FTQ status wires. 
+        # An allocation request is only visible on the next cycle, after a 
+        # flush on this cycle has completed. 
         m.d.comb += self.sts.ready.eq(~r_full)
         m.d.comb += self.sts.next_ftq_idx.eq(r_wptr)
 
+        # Read predictor checkpoints
+        for ckpt_rp in self.ckpt_rp:
+            m.d.comb += [
+                ckpt_rp.valid.eq(data_arr[ckpt_rp.idx].valid),
+                ckpt_rp.vaddr.eq(data_arr[ckpt_rp.idx].vaddr),
+                ckpt_rp.rap.eq(data_arr[ckpt_rp.idx].rap),
+                ckpt_rp.phist.eq(data_arr[ckpt_rp.idx].phist),
+            ]
+
+        # ----------------------------------------------------------------
+        # Save the state of the conditional branch predictors. 
+        #
+        # A prediction is written to its own entry and to every younger 
+        # entry. Predictions are made in program order, so a prediction for 
+        # an entry which is no longer allocated is for an entry which has 
+        # already been freed [and every allocated entry is younger]. 
+        #
+        # A new entry starts with the most-recent prediction. This takes 
+        # priority over a prediction for the entry that previously used 
+        # the same index. 
+
+        bp_arr = [
+            Signal(FTQBranchCheckpoint(self.p), name=f"bp_arr{idx}")
+            for idx in range(self.depth)
+        ]
+        r_bp_last = Signal(FTQBranchCheckpoint(self.p))
+
+        pred = self.bp_pred
+        pred_ckpt = Signal(FTQBranchCheckpoint(self.p))
+        pred_freed = (age(pred.ftq_idx) >= r_used)
+        m.d.comb += [
+            pred_ckpt.valid.eq(1),
+            pred_ckpt.taken.eq(pred.taken),
+            pred_ckpt.meta.eq(pred.meta),
+        ]
+        for idx in range(self.depth):
+            allocated = (age(idx) < r_used)
+            younger = allocated & (
+                pred_freed | (age(idx) > age(pred.ftq_idx))
+            )
+            with m.If(pred.valid & ((pred.ftq_idx == idx) | younger)):
+                m.d.sync += bp_arr[idx].eq(pred_ckpt)
+
+        # When younger entries are flushed, recover the BPU with the 
+        # checkpoint from the mispredicted entry. A prediction on the same 
+        # cycle is forwarded when it is for the same entry or an older 
+        # entry [and is discarded otherwise]. 
+        flush_ckpt = Signal(FTQBranchCheckpoint(self.p))
+        pred_older = pred.valid & (pred_freed | 
+            (~parent_freed & (age(pred.ftq_idx) <= age(flush.id)))
+        )
+        m.d.comb += flush_ckpt.eq(
+            Mux(pred_older, pred_ckpt, Array(bp_arr)[flush.id])
+        )
+        m.d.comb += [
+            self.bp_recover.valid.eq(flush_ok & flush_ckpt.valid),
+            self.bp_recover.taken.eq(flush_ckpt.taken),
+            self.bp_recover.meta.eq(flush_ckpt.meta),
+        ]
+
+        bp_last = Signal(FTQBranchCheckpoint(self.p))
+        with m.If(flush_ok):
+            m.d.comb += bp_last.eq(flush_ckpt)
+        with m.Elif(pred.valid):
+            m.d.comb += bp_last.eq(pred_ckpt)
+        with m.Else():
+            m.d.comb += bp_last.eq(r_bp_last)
+        m.d.sync += r_bp_last.eq(bp_last)
+        with m.If(alloc_ok):
+            m.d.sync += Array(bp_arr)[r_wptr].eq(bp_last)
+
 
 
         # ----------------------------------------------------------------
         # Monitor incoming responses from the PFU pipe.
         #
-        # NOTE: This effectively performs a random access using the FTQ index 
-        # from the response. Seems.. not optimal?
-        #
-        # Using the FTQ index from the PFU response, and depending on the 
-        # response status, move the entry to the appropriate state. 
+        # The PFU responds once for each cacheline in a prefetch request. 
+        # Count the fills that were sent to the fill unit, and count the 
+        # fills that have completed. 
+
+        pf = self.p.ftq.prefetch
+        r_pf_inflight = Signal(range(pf.max_inflight + self.p.max_fblk_size))
 
         pfu_resp = self.prefetch_resp
-        with m.If(pfu_resp.valid):
-            pfu_resp_tgt = data_arr[pfu_resp.ftq_idx]
-            m.d.sync += Assert(pfu_resp_tgt.valid)
-            with m.If(~pfu_resp.stall):
-                with m.Switch(pfu_resp.sts):
-                    with m.Case(FetchResponseStatus.L1_MISS):
-                        m.d.sync += [
-                            pfu_resp_tgt.state.eq(FTQEntryState.FILL),
-                        ]
-                    with m.Case(FetchResponseStatus.TLB_MISS):
-                        m.d.sync += [
-                            pfu_resp_tgt.state.eq(FTQEntryState.XLAT),
-                        ]
-                    with m.Case(FetchResponseStatus.L1_HIT):
-                        m.d.sync += [
-                            pfu_resp_tgt.state.eq(FTQEntryState.NONE),
-                            pfu_resp_tgt.prefetched.eq(1),
-                        ]
+        pf_fill_sent = (
+            pfu_resp.valid & ~pfu_resp.stall & 
+            (pfu_resp.sts == FetchResponseStatus.L1_MISS)
+        )
+        pf_fill_done = Cat(*[
+            resp.valid & (resp.src == L1IFillSource.PREFETCH)
+            for resp in self.ifill_resp
+        ])
+        m.d.sync += r_pf_inflight.eq(
+            r_pf_inflight + pf_fill_sent - sum(pf_fill_done)
+        )
+
+        # ----------------------------------------------------------------
+        # Park entries that missed in the L1I during prefetch, and wake them
+        # when the fill for the cacheline has completed. Entries that missed
+        # in the TLB are parked in the 'XLAT' state, and are woken when the 
+        # PTW has completed the translation [or reported a fault]. 
+        #
+        # An entry is parked in the 'FILL' state only if it has not been 
+        # sent to the IFU. Fills may complete out of order, so each entry 
+        # keeps a mask of the cachelines that missed (relative to the first 
+        # cacheline that missed), and is woken when the mask is empty. 
+        #
+        # Each entry compares its own index with the PFU response, and its 
+        # own cacheline addresses with each fill response. All entries 
+        # waiting on a cacheline are updated on the same cycle, and there is 
+        # no random access into the queue. 
+        #
+        # NOTE: A cacheline which cannot be represented in the mask [ie. in 
+        # a different physical page] is not tracked. 
+        #
+        # NOTE: An entry is not parked when the translation completes on 
+        # the same cycle [the TLB has already been filled]. 
+
+        xlat = self.xlat_resp
+        pf_xlat_sent = (
+            pfu_resp.valid & ~pfu_resp.stall & 
+            (pfu_resp.sts == FetchResponseStatus.TLB_MISS)
+        )
+        pfu_vpn = pfu_resp.vaddr.sv32.vpn
+        pfu_xlat_done = xlat.valid & (xlat.vpn == pfu_vpn)
+
+        off_bits = self.p.vaddr.num_off_bits
+        mask_bits = exact_log2(self.p.max_fblk_size)
+        pfu_line = pfu_resp.paddr.bits[off_bits:]
+        for idx in range(self.depth):
+            entry   = data_arr[idx]
+            pending = entry.valid & ~entry.complete & (
+                (entry.state == FTQEntryState.NONE) | 
+                (entry.state == FTQEntryState.FILL) | 
+                (entry.state == FTQEntryState.XLAT)
+            )
+            park = pf_fill_sent & (pfu_resp.ftq_idx == idx) & pending
+            park_xlat = (
+                pf_xlat_sent & (pfu_resp.ftq_idx == idx) & pending & 
+                ~pfu_xlat_done
+            )
+            wake_xlat = xlat.valid & (entry.xlat_vpn == xlat.vpn)
+
+            # The first cacheline that missed becomes the base of the mask
+            parked = (entry.state == FTQEntryState.FILL)
+            fill_base = Mux(parked, entry.fill_line, pfu_line)
+            park_mask = Signal(self.p.max_fblk_size, name=f"park_mask{idx}")
+            park_off = (pfu_line - fill_base)[:len(entry.fill_line)]
+            with m.If(park & (park_off < self.p.max_fblk_size)):
+                m.d.comb += park_mask.eq(1 << park_off[:mask_bits])
+
+            # Cachelines covered by each completed fill
+            fill_done = C(0, self.p.max_fblk_size)
+            for resp in self.ifill_resp:
+                resp_line = resp.addr.bits[off_bits:]
+                done_lo = (fill_base - resp_line)[:len(entry.fill_line)]
+                done_hi = (resp_line - fill_base)[:len(entry.fill_line)]
+                blocks_mask = ((1 << resp.blocks) - 1)[:self.p.max_fblk_size]
+                done = Signal(self.p.max_fblk_size)
+                with m.If(resp.valid & (done_lo < resp.blocks)):
+                    m.d.comb += done.eq(blocks_mask >> done_lo[:mask_bits])
+                with m.Elif(resp.valid & (done_hi < self.p.max_fblk_size)):
+                    m.d.comb += done.eq(blocks_mask << done_hi[:mask_bits])
+                fill_done = fill_done | done
+            fill_mask = Signal(self.p.max_fblk_size, name=f"fill_mask{idx}")
+            m.d.comb += fill_mask.eq(
+                (Mux(parked, entry.fill_mask, 0) | park_mask) & 
+                ~fill_done
+            )
+            wake = (fill_mask == 0)
+            with m.If(park):
+                m.d.sync += [
+                    entry.state.eq(FTQEntryState.FILL),
+                    entry.fill_line.eq(fill_base),
+                    entry.fill_mask.eq(fill_mask),
+                ]
+            with m.Elif(park_xlat):
+                m.d.sync += [
+                    entry.state.eq(FTQEntryState.XLAT),
+                    entry.xlat_vpn.eq(pfu_vpn),
+                ]
+            with m.Elif(entry.valid & parked & wake):
+                m.d.sync += entry.state.eq(FTQEntryState.NONE)
+            with m.Elif(entry.valid & parked):
+                m.d.sync += entry.fill_mask.eq(fill_mask)
+            with m.Elif(entry.valid & (entry.state == FTQEntryState.XLAT) 
+                        & wake_xlat):
+                m.d.sync += entry.state.eq(FTQEntryState.NONE)
 
         # ----------------------------------------------------------------
         # Monitor incoming responses from the IFU pipe.
@@ -283,7 +662,14 @@ class FetchTargetQueue(Component):
         # current value of 'r_fptr'. 
 
         ifu_resp   = self.fetch_resp
-        with m.If(ifu_resp.valid):
+        with m.If(ifu_resp.valid & r_drop):
+            m.d.sync += [
+                Print(Format("[FTQ] Drop flushed demand resp idx={}", 
+                    ifu_resp.ftq_idx
+                )),
+                r_drop.eq(0),
+            ]
+        with m.Elif(ifu_resp.valid):
             m.d.sync += Print(Format("[FTQ] Demand Resp"),
                               Format("idx={}", ifu_resp.ftq_idx), 
                               Format("sts={}", ifu_resp.sts),
@@ -314,10 +700,11 @@ class FetchTargetQueue(Component):
 
 
         # ----------------------------------------------------------------
-        # Handle the state of the oldest entry in the queue. 
+        # Handle the state of the oldest unfetched entry in the queue. 
         #
-        # 'r_fptr' always indicates the oldest entry in the queue.
-        # This is the current outstanding demand fetch request. 
+        # 'r_fptr' always indicates the oldest entry in the queue which has 
+        # not been fetched. This is the current outstanding demand fetch 
+        # request. 
         #
         # NOTE: The declaration of 'w_ifu_entry' here is an annoying hack
         # (sorry) to give the entry a distinct name when viewing waveforms. 
@@ -337,7 +724,7 @@ class FetchTargetQueue(Component):
             #)),
         ]
 
-        with m.If(w_ifu_entry.valid):
+        with m.If(w_ifu_entry.valid & ~r_drop & ~flush.valid):
             with m.Switch(w_ifu_entry.state):
                 # The entry is valid and ready to be sent to the IFU. 
                 # Setup a request to the IFU (visible on the next cycle). 
@@ -351,6 +738,7 @@ class FetchTargetQueue(Component):
                         ifu_entry.state.eq(FTQEntryState.FETCH),
                         self.fetch_req.valid.eq(1),
                         self.fetch_req.lines.eq(w_ifu_entry.blocks),
+                        self.fetch_req.end_idx.eq(w_ifu_entry.end_idx),
                         self.fetch_req.vaddr.eq(w_ifu_entry.vaddr),
                         self.fetch_req.passthru.eq(w_ifu_entry.passthru),
                         self.fetch_req.ftq_idx.eq(r_fptr),
@@ -359,8 +747,65 @@ class FetchTargetQueue(Component):
                 with m.Default():
                     pass
 
+        # When the fetch pointer has moved past the mispredicted entry, 
+        # move it back to the next entry to be allocated. 
+        # If a demand fetch for a flushed entry is still in-flight, drop the 
+        # response. 
+        fetch_busy = (
+            w_ifu_entry.valid & 
+            (w_ifu_entry.state != FTQEntryState.NONE) & 
+            ~ifu_resp.valid
+        )
+        with m.If(flush_ok & flush_younger(r_fptr)):
+            m.d.sync += r_fptr.eq(flush_wptr)
+            with m.If(fetch_busy & (age(r_fptr) < r_used)):
+                m.d.sync += r_drop.eq(1)
+
         # ----------------------------------------------------------------
         # Select a candidate for prefetch
+        #
+        # 'r_pptr' runs ahead of the fetch pointer, and indicates the next 
+        # entry to be sent to the PFU. An entry is sent when it is no more 
+        # than 'dist' entries ahead of the fetch pointer, and when fewer 
+        # than 'budget' prefetch fills are outstanding. 
+        #
+        # Both limits are throttled by a saturating counter that tracks 
+        # prefetch accuracy. The counter is incremented when the demand 
+        # fetch for a prefetched entry completes, and decremented when a 
+        # prefetched entry is discarded by a flush. 
+
+        r_pf_acc = Signal(pf.acc_bits, init=(1 << (pf.acc_bits - 1)))
+        pf_useful = (
+            ifu_resp.valid & ~r_drop & data_arr[r_fptr].prefetched & (
+                (ifu_resp.sts == DemandResponseStatus.OK) | 
+                (ifu_resp.sts == DemandResponseStatus.RESTEER)
+            )
+        )
+        pf_useless = Cat(*flushed_pf).any()
+        pf_acc_max = (1 << pf.acc_bits) - 1
+        with m.If(pf_useless & (r_pf_acc != 0)):
+            m.d.sync += r_pf_acc.eq(r_pf_acc - 1)
+        with m.Elif(pf_useful & (r_pf_acc != pf_acc_max)):
+            m.d.sync += r_pf_acc.eq(r_pf_acc + 1)
+
+        # Limits for each level of accuracy [from the upper two bits]
+        pf_level = r_pf_acc[-2:]
+        pf_dist = Array([ 
+            C(dist, self.p.ftq.index_shape) for dist in (
+                1, 
+                max(1, pf.max_dist // 4), 
+                max(1, pf.max_dist // 2), 
+                pf.max_dist,
+            )
+        ])[pf_level]
+        pf_budget = Array([
+            C(budget, len(r_pf_inflight)) for budget in (
+                max(1, pf.max_inflight // 2), 
+                max(1, pf.max_inflight // 2), 
+                pf.max_inflight, 
+                pf.max_inflight,
+            )
+        ])[pf_level]
 
         # The candidate for prefetch on this cycle
         pfu_entry = data_arr[r_pptr]
@@ -369,52 +814,51 @@ class FetchTargetQueue(Component):
             w_pfu_entry.eq(pfu_entry),
         ]
 
+        # The number of entries between the fetch pointer and the candidate
+        pf_ahead = (age(r_pptr) - age(r_fptr))[:len(r_pptr)]
+        pf_in_range = (age(r_pptr) > age(r_fptr)) & (age(r_pptr) < r_used)
+
+        # This entry is eligible for prefetch
+        pfu_req_elig = Signal()
+
+        # A prefetch request is being setup on this cycle. 
+        # The request is visible to the PFU pipe on the subsequent cycle.
+        pfu_req_fire = Signal()
+
+        m.d.comb += [
+            pfu_req_elig.eq(
+                pf_in_range & 
+                w_pfu_entry.valid & 
+                ~w_pfu_entry.prefetched & 
+                (pf_ahead <= pf_dist)
+            ),
+            pfu_req_fire.eq(
+                pfu_req_elig & 
+                self.prefetch_sts.ready &
+                (r_pf_inflight < pf_budget) & 
+                ~flush.valid
+            ),
+        ]
+
+        # Send this entry to the PFU pipe
+        with m.If(pfu_req_fire):
+            m.d.sync += [
+                pfu_entry.prefetched.eq(1),
+                self.prefetch_req.valid.eq(1),
+                self.prefetch_req.vaddr.eq(w_pfu_entry.vaddr),
+                self.prefetch_req.passthru.eq(w_pfu_entry.passthru),
+                self.prefetch_req.blocks.eq(w_pfu_entry.blocks),
+                self.prefetch_req.ftq_idx.eq(r_pptr),
+                r_pptr.eq(r_pptr + 1),
+            ]
 
-        ## This entry is eligible for prefetch
-        #pfu_req_elig = Signal()
-
-        ## A prefetch request is being setup on this cycle. 
-        ## The request is visible to the PFU pipe on the subsequent cycle.
-        #pfu_req_fire = Signal()
-
-        #m.d.comb += [
-        #    pfu_req_elig.eq(
-        #        w_pfu_entry.valid & 
-        #        ~w_pfu_entry.prefetched & 
-        #        (w_pfu_entry.state == FTQEntryState.NONE) & 
-        #        (r_pptr != r_fptr) 
-        #    ),
-
-        #    pfu_req_fire.eq(
-        #        pfu_req_elig & 
-        #        self.prefetch_sts.ready &
-        #        ~(pfu_resp.valid & pfu_resp.stall)
-        #    ),
-        #]
-
-        #pf_credit_tx_avail = Signal(2)
-        #m.d.comb += [
-        #    pf_credit_tx_avail.eq(r_pf_credit + pf_credit_rx.o),
-        #]
-        #pf_credit_ok = (pf_credit_tx_avail >= 1)
-        #pf_credit_tx = Signal(2)
-        #pf_credit_next = Mux(pfu_req_fire & pf_credit_ok, 
-        #    pf_credit_tx_avail - 1,
-        #    pf_credit_tx_avail
-        #)
-        #m.d.sync += r_pf_credit.eq(pf_credit_next)
-
-        ## Send this entry to the PFU pipe
-        #with m.If(pfu_req_fire & pf_credit_ok):
-        #    m.d.sync += [
-        #        Print(Format("Prefetch Fire: idx={} addr={:08x}", r_pptr, w_pfu_entry.vaddr.bits)),
-        #        pfu_entry.state.eq(FTQEntryState.PROBE),
-        #        self.prefetch_req.valid.eq(1),
-        #        self.prefetch_req.vaddr.eq(w_pfu_entry.vaddr),
-        #        self.prefetch_req.passthru.eq(w_pfu_entry.passthru),
-        #        self.prefetch_req.ftq_idx.eq(r_pptr),
-        #        r_pptr.eq(r_pptr + 1),
-        #    ]
+        # Keep the prefetch pointer ahead of the fetch pointer, and move it 
+        # back when the entries it points to have been flushed
+        with m.If(~pf_in_range & (age(r_pptr) <= age(r_fptr))):
+            m.d.sync += r_pptr.eq(r_fptr + 1)
+        with m.If(flush_ok & (parent_freed | 
+                  (age(r_pptr) > (age(flush.id) + 1)))):
+            m.d.sync += r_pptr.eq(flush_wptr)
 
         return m
 
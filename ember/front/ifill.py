@@ -31,15 +31,9 @@ class L1IFillPort(Signature):
         """ L1 instruction cache fill request.
 
         .. note::
-            Right now, the way index specified by a request is unused,
-            and the way used when writing the L1I is generated very late in 
-            the process (within in the L1ICache module itself). 
-
-            Currently, the replacement policy implementation for the L1I
-            is very ad-hoc. You might want to keep this wire around in case 
-            it's useful to select a particular way index earlier in the 
-            pipeline. This will probably become clearer when we decide to 
-            implement a policy that isn't random. 
+            Right now, the way index specified by a request is unused. 
+            The way used when writing the L1I is selected by the replacement
+            policy in the L1ICache module when each cacheline is written. 
 
         Members
         =======
@@ -74,19 +68,59 @@ class L1IFillPort(Signature):
             Index of the FTQ entry that generated the request
         way:
             Way index used for the request
+        addr:
+            Physical address of the first cacheline in the request
+        blocks:
+            Number of sequential cachelines in the request
+        src:
+            Source of the request
         """
         def __init__(self, p: EmberParams):
             super().__init__({
                 "valid": Out(1),
                 "ftq_idx": Out(p.ftq.index_shape),
+                "addr": Out(p.paddr),
+                "blocks": Out(p.fblk_size_shape),
                 "way": Out(ceil_log2(p.l1i.num_ways)),
                 "src": Out(L1IFillSource),
             })
 
+    class Forward(Signature):
+        """ Fill data forwarded from an MSHR. 
+
+        A complete cacheline is forwarded while it is being written to 
+        the L1I cache. Before the cacheline is complete, each beat received 
+        from memory is also forwarded (along with the beats that have 
+        already been received). 
+
+        Members
+        =======
+        valid:
+            This cacheline is valid
+        ftq_idx:
+            Index of the FTQ entry that generated the request
+        addr:
+            Physical address of the cacheline
+        mask:
+            Mask of valid words in the cacheline data [all words are valid 
+            for a complete cacheline]
+        data:
+            Cacheline data
+        """
+        def __init__(self, p: EmberParams):
+            super().__init__({
+                "valid": Out(1),
+                "ftq_idx": Out(p.ftq.index_shape),
+                "addr": Out(p.paddr),
+                "mask": Out(p.l1i.line_depth),
+                "data": Out(L1ICacheline(p)),
+            })
+
     def __init__(self, p: EmberParams):
         super().__init__({
             "req": Out(self.Request(p)),
             "resp": In(self.Response(p)),
+            "fwd": In(self.Forward(p)),
         })
 
 
@@ -99,6 +133,74 @@ class L1IFillStatus(Signature):
             "ready":  Out(1),
         })
 
+class L1IMshrStatus(Signature):
+    """ The request held by an MSHR, used to merge new requests into it. 
+
+    Members
+    =======
+    busy:
+        This MSHR holds a request that can accept merged requests
+    addr:
+        Physical address of the first cacheline in the request
+    blocks:
+        Number of sequential cachelines in the request
+    written:
+        Bitmask of cachelines that have been written to the L1I [or are 
+        being written on this cycle]
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "busy": Out(1),
+            "addr": Out(p.paddr),
+            "blocks": Out(p.fblk_size_shape),
+            "written": Out(2 ** p.fblk_size_shape.width),
+        })
+
+class L1IMshrExtend(Signature):
+    """ Extend the request held by an MSHR to cover more cachelines. 
+
+    Members
+    =======
+    valid:
+        This request is valid
+    blocks:
+        New number of sequential cachelines in the request
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "valid": Out(1),
+            "blocks": Out(p.fblk_size_shape),
+        })
+
+class L1IFillWaiter(StructLayout):
+    """ A request waiting for the fill held by an MSHR. 
+
+    Members
+    =======
+    valid:
+        This entry is valid
+    ftq_idx:
+        Index of the FTQ entry that generated the request
+    addr:
+        Physical address of the first cacheline in the request
+    blocks:
+        Number of sequential cachelines in the request
+    way:
+        Way index used for the request
+    src:
+        Source of the request
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "valid": unsigned(1),
+            "ftq_idx": p.ftq.index_shape,
+            "addr": p.paddr,
+            "blocks": p.fblk_size_shape,
+            "way": unsigned(ceil_log2(p.l1i.num_ways)),
+            "src": L1IFillSource,
+        })
+
+
 class L1IMshrState(Enum, shape=2):
     """ The state associated with an MSHR. 
 
@@ -113,6 +215,60 @@ class L1IMshrState(Enum, shape=2):
     RUN   = 1
 
 
+class L1IMshrLineBuffer(StructLayout):
+    """ A cacheline being received from memory by an MSHR. 
+
+    Members
+    =======
+    busy:
+        A request for this cacheline is outstanding
+    full:
+        All beats have been received, and the cacheline is waiting to be 
+        accepted by the fill write buffer
+    addr:
+        Physical address of the cacheline
+    beat:
+        Index of the next beat expected from memory
+    beats:
+        Mask of beats received from memory
+    data:
+        Cacheline data
+    """
+    def __init__(self, p: EmberParams):
+        num_beats = p.l1i.line_depth // p.l1i.fill.beat_words
+        super().__init__({
+            "busy": unsigned(1),
+            "full": unsigned(1),
+            "addr": p.paddr,
+            "beat": unsigned(max(1, ceil_log2(num_beats))),
+            "beats": unsigned(num_beats),
+            "data": L1ICacheline(p),
+        })
+
+
+class L1IFillWrite(Signature):
+    """ A completed cacheline sent from an MSHR to the fill write buffer. 
+
+    Members
+    =======
+    valid:
+        This cacheline is valid
+    ready:
+        The cacheline has been accepted
+    addr:
+        Physical address of the cacheline
+    data:
+        Cacheline data
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "valid": Out(1),
+            "ready": In(1),
+            "addr": Out(p.paddr),
+            "data": Out(L1ICacheline(p)),
+        })
+
+
 class L1IMissStatusHoldingRegister(Component):
     """ L1I cache "miss-status holding register" (MSHR)
 
@@ -130,27 +286,60 @@ class L1IMissStatusHoldingRegister(Component):
     - ``L1IMshrState.IDLE``: Ready to accept a request
     - ``L1IMshrState.RUN``: Request is registered and being sent to memory
 
-    .. warning::
-        Currently, this module does *not* handle requests to memory that 
-        cannot be completed in a single cycle. 
+    Each cacheline in the request is sent to memory as a separate request. 
+    Up to ``num_lbuf`` cacheline requests are outstanding at once, and each 
+    outstanding request is tagged with the index of a line buffer. 
+    Memory may stall requests (with 'ready'), and may return responses 
+    after any number of cycles and in any order. Each response is received 
+    in one or more beats. 
+
+    The first cacheline in a request is requested "critical-beat first": 
+    memory returns the beat containing the requested address first, and 
+    wraps around to the start of the cacheline. Other cachelines are 
+    requested from the first beat. 
+
+    Each beat is forwarded to the requester when it is received (along with 
+    the beats already received), so that a requester can restart as soon 
+    as the instructions it needs have arrived. After the last beat has been 
+    received, the cacheline is sent to the fill write buffer (which is 
+    shared by all MSHRs). The line buffer is released when the cacheline 
+    has been accepted. The fill unit reports each cacheline back to the 
+    MSHR when it is written to the L1I cache, and the complete cacheline is 
+    forwarded to the requester on the same cycle. The last beat is only 
+    forwarded with the complete cacheline. 
+
+    While a request is being serviced, the fill unit may merge other 
+    requests into it. The request can be extended with more sequential 
+    cachelines until the cycle where the last cacheline is written. 
 
     Ports
     =====
     ready: 
         High when this MSHR is ready to accept a request
+    sts:
+        The request held by this MSHR
+    ext:
+        Extend the request held by this MSHR
     complete:
         High when this MSHR can be reset
     req: 
         Incoming fill request to this MSHR
-    l1i_wp: 
-        L1I cache write port interface
+    wb:
+        Completed cachelines [to the fill write buffer]
+    wb_done:
+        A cacheline from this MSHR was written to the L1I cache
     fakeram: 
         Memory interface
 
     """
     def __init__(self, param: EmberParams):
         self.p = param
-        self.stage = PipelineStages()
+        self.num_lbuf   = param.l1i.fill.num_lbuf
+        self.beat_words = param.l1i.fill.beat_words
+        self.num_beats  = param.l1i.line_depth // self.beat_words
+        assert self.num_beats * self.beat_words == param.l1i.line_depth
+        # Offset of the beat index in a physical address
+        self.beat_off   = 2 + exact_log2(self.beat_words)
 
         self.r_state     = Signal(L1IMshrState, init=L1IMshrState.IDLE)
         self.r_busy      = Signal(init=0)
@@ -159,153 +348,228 @@ class L1IMissStatusHoldingRegister(Component):
         self.r_way       = Signal(ceil_log2(self.p.l1i.num_ways))
         self.r_blocks    = Signal(self.p.fblk_size_shape)
         self.r_src       = Signal(L1IFillSource)
-        self.r_blk  = Signal(4)
-        self.r_addr = Signal(self.p.paddr)
-
-
-        # Memory access
-        self.stage.add_stage(1, {
-            "addr": self.p.paddr,
-            "blk": unsigned(4),
-        })
-
-        # Memory response
-        self.stage.add_stage(2, {
-            "addr": self.p.paddr,
-            "blk": unsigned(4),
-        })
-
-        # L1I writeback
-        self.stage.add_stage(3, {
-            "addr": self.p.paddr,
-            "blk": unsigned(4),
-            "data": ArrayLayout(unsigned(32), param.l1i.line_depth),
-        })
 
+        # The number of cachelines requested from memory
+        self.r_issued  = Signal(self.p.fblk_size_shape)
+        # The number of cachelines written to the L1I
+        self.r_written = Signal(self.p.fblk_size_shape)
+        # The address of the next cacheline requested from memory
+        self.r_addr = Signal(self.p.paddr)
+        # The first beat requested for the next cacheline
+        self.r_crit = Signal(max(1, ceil_log2(self.num_beats)))
+        # Bitmask of cachelines written to the L1I
+        self.r_done = Signal(2 ** self.p.fblk_size_shape.width)
+
+        # Cachelines being received from memory
+        self.lbuf = Array(
+            Signal(L1IMshrLineBuffer(param), name=f"lbuf{idx}")
+            for idx in range(self.num_lbuf)
+        )
+        # Line buffers released on this cycle
+        self.lbuf_rel = Signal(self.num_lbuf)
 
         signature = Signature({
             "ready": Out(1),
             "complete": In(1),
+            "sts": Out(L1IMshrStatus(param)),
+            "ext": In(L1IMshrExtend(param)),
             "port": In(L1IFillPort(param)),
-            "l1i_wp": Out(L1ICacheWritePort(param)),
-            "fakeram": Out(FakeRamInterface(param.l1i.line_depth)),
+            "wb": Out(L1IFillWrite(param)),
+            "wb_done": In(L1IFillPort.Forward(param)),
+            "fakeram": Out(FakeRamInterface(
+                self.beat_words, param.l1i.fill.id_bits
+            )),
         })
         super().__init__(signature)
         return
 
-    def elaborate_s0(self, m: Module):
+    def elaborate_ctrl(self, m: Module):
+        off_bits = self.p.vaddr.num_off_bits
         m.d.comb += self.ready.eq(self.r_state == L1IMshrState.IDLE)
 
         m.d.sync += [
             self.port.resp.valid.eq(0),
             self.port.resp.ftq_idx.eq(0),
             self.port.resp.way.eq(0),
+            self.port.resp.addr.eq(0),
+            self.port.resp.blocks.eq(0),
             self.port.resp.src.eq(0),
         ]
 
-        with m.Switch(self.r_state):
-            with m.Case(L1IMshrState.IDLE):
-                with m.If(self.port.req.valid):
-                    m.d.sync += [
-                        Assert(self.port.req.blocks != 0),
-                        self.r_state.eq(L1IMshrState.RUN),
-                        self.r_busy.eq(1),
-                        self.r_base_addr.eq(self.port.req.addr),
-                        self.r_ftq_idx.eq(self.port.req.ftq_idx),
-                        self.r_way.eq(self.port.req.way),
-                        self.r_blocks.eq(self.port.req.blocks),
-                        self.r_src.eq(self.port.req.src),
-
-                        self.r_blk.eq(1),
-                        self.r_addr.eq(self.port.req.addr),
-
-                        self.stage[1].addr.eq(self.port.req.addr),
-                        self.stage[1].blk.eq(1),
-                        self.stage[1].valid.eq(1),
-                    ]
-            with m.Case(L1IMshrState.RUN):
-                m.d.sync += [
-                    self.stage[1].addr.eq(0),
-                    self.stage[1].blk.eq(0),
-                    self.stage[1].valid.eq(0),
-                ]
-                done = (self.r_blk == self.r_blocks)
-                with m.If(~done):
-                    next_blk = (self.r_blk + 1)
-                    next_addr = (self.r_addr.bits + self.p.l1i.line_bytes)
-                    m.d.sync += [
-                        self.r_blk.eq(next_blk),
-                        self.r_addr.eq(next_addr),
-                        self.stage[1].addr.eq(next_addr),
-                        self.stage[1].blk.eq(next_blk),
-                        self.stage[1].valid.eq(1),
-                    ]
+        with m.If((self.r_state == L1IMshrState.IDLE) & self.port.req.valid):
+            m.d.sync += [
+                Assert(self.port.req.blocks != 0),
+                self.r_state.eq(L1IMshrState.RUN),
+                self.r_busy.eq(1),
+                self.r_base_addr.eq(self.port.req.addr),
+                self.r_ftq_idx.eq(self.port.req.ftq_idx),
+                self.r_way.eq(self.port.req.way),
+                self.r_blocks.eq(self.port.req.blocks),
+                self.r_src.eq(self.port.req.src),
+                self.r_issued.eq(0),
+                self.r_written.eq(0),
+                self.r_addr.eq(Cat(
+                    C(0, off_bits), self.port.req.addr.as_value()[off_bits:]
+                )),
+                self.r_crit.eq(
+                    self.port.req.addr.as_value()[self.beat_off:off_bits]
+                ),
+            ]
 
+        # Merged requests may need more cachelines
+        with m.If((self.r_state == L1IMshrState.RUN) & self.ext.valid):
+            m.d.sync += [
+                Assert(self.ext.blocks >= self.r_blocks),
+                self.r_blocks.eq(self.ext.blocks),
+            ]
 
-    def elaborate_s1(self, m: Module):
+    def elaborate_issue(self, m: Module):
+        """ Send requests for cachelines to memory. 
+        """
+        # Find a free line buffer [or one being released on this cycle]
+        m.submodules.lbuf_enc = lbuf_enc = EmberPriorityEncoder(self.num_lbuf)
+        m.d.comb += lbuf_enc.i.eq(~Cat(*[ x.busy for x in self.lbuf ]) | 
+            self.lbuf_rel
+        )
+
+        can_issue = (
+            (self.r_state == L1IMshrState.RUN) & 
+            (self.r_issued != self.r_blocks) & 
+            lbuf_enc.valid
+        )
+        req_addr = self.r_addr.as_value() | (self.r_crit << self.beat_off)
         m.d.comb += [
-            self.fakeram.req.addr.eq(0),
-            self.fakeram.req.valid.eq(0),
-        ]
-        m.d.sync += [
-            self.stage[2].addr.eq(0),
-            self.stage[2].blk.eq(0),
-            self.stage[2].valid.eq(0),
+            self.fakeram.req.valid.eq(can_issue),
+            self.fakeram.req.addr.eq(Mux(can_issue, req_addr, 0)),
+            self.fakeram.req.id.eq(Mux(can_issue, lbuf_enc.o, 0)),
         ]
 
-        with m.If(self.stage[1].valid):
-            m.d.comb += [
-                self.fakeram.req.addr.eq(self.stage[1].addr),
-                self.fakeram.req.valid.eq(1),
-            ]
+        # The request is accepted by memory
+        with m.If(can_issue & self.fakeram.req.ready):
+            lbuf = self.lbuf[lbuf_enc.o]
             m.d.sync += [
-                self.stage[2].addr.eq(self.stage[1].addr),
-                self.stage[2].blk.eq(self.stage[1].blk),
-                self.stage[2].valid.eq(1),
+                self.r_issued.eq(self.r_issued + 1),
+                self.r_addr.eq(self.r_addr.bits + self.p.l1i.line_bytes),
+                self.r_crit.eq(0),
+                lbuf.busy.eq(1),
+                lbuf.addr.eq(self.r_addr),
+                lbuf.beat.eq(self.r_crit),
+                lbuf.beats.eq(0),
             ]
 
-    def elaborate_s2(self, m: Module):
-        m.d.sync += [
-            self.stage[3].addr.eq(0),
-            self.stage[3].blk.eq(0),
-            self.stage[3].valid.eq(0),
-            self.stage[3].data.eq(0),
-        ]
+    def elaborate_resp(self, m: Module, beat_fwd):
+        """ Receive beats from memory. 
+        """
+        resp = self.fakeram.resp
+        lbuf_idx = resp.id[:max(1, ceil_log2(self.num_lbuf))]
+        lbuf = self.lbuf[lbuf_idx]
 
-        # FIXME: For now, we're *assuming* that a memory device will always
-        # reply on the cycle immediately following the request. 
-        with m.If(self.stage[2].valid):
-            m.d.sync += Assert(self.fakeram.resp.valid)
+        # Merge this beat into the line buffer. Beats wrap around to the 
+        # start of the cacheline. 
+        merged = Signal(L1ICacheline(self.p))
+        m.d.comb += [
+            merged[idx].eq(Mux(lbuf.beat == (idx // self.beat_words),
+                resp.data[idx % self.beat_words], lbuf.data[idx]
+            ))
+            for idx in range(self.p.l1i.line_depth)
+        ]
+        beats = Signal(self.num_beats)
+        m.d.comb += beats.eq(
+            lbuf.beats | (C(1, self.num_beats) << lbuf.beat)
+        )
 
-        with m.If(self.stage[2].valid & self.fakeram.resp.valid):
+        with m.If(resp.valid):
             m.d.sync += [
-                self.stage[3].addr.eq(self.stage[2].addr),
-                self.stage[3].blk.eq(self.stage[2].blk),
-                self.stage[3].valid.eq(self.stage[2].valid),
-                self.stage[3].data.eq(Cat(*self.fakeram.resp.data)),
+                Assert(lbuf.busy & ~lbuf.full, 
+                    "Memory response for an idle line buffer"
+                ),
+                lbuf.data.eq(merged),
+                lbuf.beat.eq(lbuf.beat + 1),
+                lbuf.beats.eq(beats),
             ]
+            # The last beat completes the cacheline
+            with m.If(resp.last):
+                m.d.sync += [
+                    Assert(beats.all(), "Unexpected number of beats"),
+                    lbuf.full.eq(1),
+                ]
 
-    def elaborate_s3(self, m: Module):
+        # Forward the beats received so far. The last beat is forwarded 
+        # with the complete cacheline after it has been written to the L1I. 
+        beat_ok = resp.valid & ~resp.last
         m.d.comb += [
-            self.l1i_wp.req.valid.eq(0),
-            self.l1i_wp.req.set.eq(0),
-            self.l1i_wp.req.way.eq(0),
-            self.l1i_wp.req.line_data.eq(0),
-            self.l1i_wp.req.tag_data.eq(0),
-            self.l1i_wp.req.tag_data.valid.eq(0),
+            beat_fwd.valid.eq(beat_ok),
+            beat_fwd.ftq_idx.eq(Mux(beat_ok, self.r_ftq_idx, 0)),
+            beat_fwd.addr.eq(Mux(beat_ok, lbuf.addr, 0)),
+            beat_fwd.mask.eq(Mux(beat_ok, Cat(*[ 
+                beats[idx // self.beat_words] 
+                for idx in range(self.p.l1i.line_depth)
+            ]), 0)),
+            beat_fwd.data.eq(Mux(beat_ok, merged, 0)),
         ]
-        with m.If(self.stage[3].valid):
+
+    def elaborate_writeback(self, m: Module, beat_fwd):
+        """ Send completed cachelines to the fill write buffer, and track 
+        the cachelines that have been written to the L1I. 
+        """
+        m.submodules.wb_enc = wb_enc = EmberPriorityEncoder(self.num_lbuf)
+        m.d.comb += wb_enc.i.eq(Cat(*[ x.full for x in self.lbuf ]))
+        wb_lbuf = self.lbuf[wb_enc.o]
+        m.d.comb += self.lbuf_rel.eq(
+            Mux(self.wb.ready, C(1, self.num_lbuf) << wb_enc.o, 0)
+        )
+        m.d.comb += [
+            self.wb.valid.eq(wb_enc.valid),
+            self.wb.addr.eq(Mux(wb_enc.valid, wb_lbuf.addr, 0)),
+            self.wb.data.eq(Mux(wb_enc.valid, wb_lbuf.data, 0)),
+        ]
+        with m.If(wb_enc.valid & self.wb.ready):
+            m.d.sync += [
+                wb_lbuf.busy.eq(0),
+                wb_lbuf.full.eq(0),
+            ]
+
+        # A cacheline written to the L1I is forwarded to the requester. 
+        # Otherwise, a beat received from memory is forwarded. 
+        done = self.wb_done
+        with m.If(done.valid):
+            m.d.comb += [
+                self.port.fwd.valid.eq(1),
+                self.port.fwd.ftq_idx.eq(self.r_ftq_idx),
+                self.port.fwd.addr.eq(done.addr),
+                self.port.fwd.mask.eq(done.mask),
+                self.port.fwd.data.eq(done.data),
+            ]
+        with m.Else():
             m.d.comb += [
-                self.l1i_wp.req.valid.eq(1),
-                self.l1i_wp.req.set.eq(self.stage[3].addr.l1i.set),
-                self.l1i_wp.req.way.eq(self.r_way),
-                self.l1i_wp.req.line_data.eq(self.stage[3].data),
-                self.l1i_wp.req.tag_data.ppn.eq(self.stage[3].addr.sv32.ppn),
-                self.l1i_wp.req.tag_data.valid.eq(1),
+                self.port.fwd.valid.eq(beat_fwd.valid),
+                self.port.fwd.ftq_idx.eq(beat_fwd.ftq_idx),
+                self.port.fwd.addr.eq(beat_fwd.addr),
+                self.port.fwd.mask.eq(beat_fwd.mask),
+                self.port.fwd.data.eq(beat_fwd.data),
             ]
 
-        done = (self.stage[3].blk == self.r_blocks)
-        with m.If(done & self.stage[3].valid):
+        off_bits = self.p.vaddr.num_off_bits
+        wr_idx = (
+            done.addr.as_value()[off_bits:] - 
+            self.r_base_addr.as_value()[off_bits:]
+        )[:len(self.r_blocks)]
+        wr_mask = Mux(done.valid, C(1, len(self.r_done)) << wr_idx, 0)
+        m.d.sync += self.r_done.eq(self.r_done | wr_mask)
+        with m.If(done.valid):
+            m.d.sync += self.r_written.eq(self.r_written + 1)
+
+        # Respond after the last cacheline has been written
+        last = ((self.r_written + 1)[:len(self.r_blocks)] == self.r_blocks)
+        m.d.comb += [
+            self.sts.busy.eq(
+                (self.r_state == L1IMshrState.RUN) & ~(last & done.valid)
+            ),
+            self.sts.addr.eq(self.r_base_addr),
+            self.sts.blocks.eq(self.r_blocks),
+            self.sts.written.eq(self.r_done | wr_mask),
+        ]
+        with m.If(last & done.valid):
             m.d.sync += [
                 self.r_state.eq(L1IMshrState.IDLE),
                 self.r_busy.eq(0),
@@ -314,42 +578,292 @@ class L1IMissStatusHoldingRegister(Component):
                 self.r_way.eq(0),
                 self.r_blocks.eq(0),
                 self.r_src.eq(0),
-                self.r_blk.eq(0),
+                self.r_issued.eq(0),
+                self.r_written.eq(0),
                 self.r_addr.eq(0),
+                self.r_crit.eq(0),
+                self.r_done.eq(0),
                 self.port.resp.valid.eq(1),
                 self.port.resp.ftq_idx.eq(self.r_ftq_idx),
                 self.port.resp.way.eq(self.r_way),
+                self.port.resp.addr.eq(self.r_base_addr),
+                self.port.resp.blocks.eq(self.r_blocks),
                 self.port.resp.src.eq(self.r_src),
             ]
 
     def elaborate(self, platform):
         m = Module()
-        self.elaborate_s0(m)
-        self.elaborate_s1(m)
-        self.elaborate_s2(m)
-        self.elaborate_s3(m)
+        beat_fwd = L1IFillPort.Forward(self.p).create()
+        self.elaborate_ctrl(m)
+        self.elaborate_resp(m, beat_fwd)
+        self.elaborate_writeback(m, beat_fwd)
+        # A line buffer released by writeback can be reused on the same 
+        # cycle, so this must come last
+        self.elaborate_issue(m)
         return m
 
+class L1IFillWriteEntry(StructLayout):
+    """ An entry in the fill write buffer. 
+
+    Members
+    =======
+    mshr:
+        Index of the MSHR that received the cacheline
+    addr:
+        Physical address of the cacheline
+    data:
+        Cacheline data
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "mshr": unsigned(max(1, ceil_log2(p.l1i.fill.num_mshr))),
+            "addr": p.paddr,
+            "data": L1ICacheline(p),
+        })
+
+
 class NewL1IFillUnit(Component):
+    """ L1I fill unit. 
+
+    Fill requests from each port are sent to a free MSHR, or merged into an 
+    MSHR that is already servicing the same cachelines. This means that a 
+    demand fetch request and a prefetch request for the same cachelines 
+    only result in a single fill. 
+
+    Each MSHR keeps the requests waiting for it. When the fill is complete, 
+    a response is sent to every waiting port, and cachelines are forwarded 
+    to every waiting port while they are being written to the L1I. Beats 
+    are also forwarded to every waiting port as they are received from 
+    memory. 
+
+    The MSHRs share a smaller number of memory channels and L1I cache 
+    write ports: 
+
+    - MSHR ``idx`` sends requests on memory channel ``idx % num_mem``. 
+      Requests are tagged with the index of the MSHR on the channel and 
+      the index of the line buffer, and responses are returned to the MSHR
+      by tag. 
+
+    - Completed cachelines from all MSHRs are collected in a fill write 
+      buffer, and up to ``num_wp`` cachelines are written to the L1I on 
+      each cycle. When the write buffer is empty, cachelines are written 
+      on the same cycle that they are sent by an MSHR. 
+
+    Ports
+    =====
+    port:
+        Fill request ports
+    sts:
+        Fill unit status
+    l1i_wp:
+        L1I cache write ports
+    fakeram:
+        Memory channels
+
+    """
     def __init__(self, param: EmberParams):
         self.p = param
         self.num_mshr = param.l1i.fill.num_mshr
         self.num_port = param.l1i.fill.num_port
+        self.num_mem  = param.l1i.fill.num_mem
+        self.num_wp   = param.l1i.num_wp
         signature = Signature({
             "port":     In(L1IFillPort(param)).array(self.num_port),
             "sts":     Out(L1IFillStatus(param)),
-            "l1i_wp":  Out(L1ICacheWritePort(param)).array(self.num_mshr),
-            "fakeram": Out(FakeRamInterface(param.l1i.line_depth)).array(self.num_mshr),
+            "l1i_wp":  Out(L1ICacheWritePort(param)).array(self.num_wp),
+            "fakeram": Out(FakeRamInterface(
+                param.l1i.fill.beat_words, param.l1i.fill.id_bits
+            )).array(self.num_mem),
         })
         super().__init__(signature)
 
+    def elaborate_mem(self, m: Module, mshr: list):
+        """ Share memory channels between MSHRs. 
+        """
+        fill = self.p.l1i.fill
+        lbuf_bits = max(1, ceil_log2(fill.num_lbuf))
+        mshr_bits = ceil_log2(fill.mshr_per_mem)
+        for mem_idx in range(self.num_mem):
+            chan  = self.fakeram[mem_idx]
+            users = [ 
+                idx for idx in range(self.num_mshr) 
+                if (idx % self.num_mem) == mem_idx
+            ]
+
+            # Select one request from the MSHRs using this channel
+            enc = m.submodules[f"mem_enc{mem_idx}"] = \
+                    EmberPriorityEncoder(len(users))
+            m.d.comb += [
+                enc.i.eq(Cat(*[ mshr[idx].fakeram.req.valid for idx in users ])),
+                chan.req.valid.eq(enc.valid),
+                chan.req.addr.eq(0),
+                chan.req.id.eq(0),
+            ]
+            for local_idx, idx in enumerate(users):
+                req  = mshr[idx].fakeram.req
+                resp = mshr[idx].fakeram.resp
+                sel  = enc.valid & (enc.o == local_idx)
+                if mshr_bits == 0:
+                    req_id = req.id[:lbuf_bits]
+                    resp_ok = chan.resp.valid
+                else:
+                    req_id = Cat(req.id[:lbuf_bits], C(local_idx, mshr_bits))
+                    resp_ok = chan.resp.valid & (
+                        chan.resp.id[lbuf_bits:lbuf_bits+mshr_bits] == local_idx
+                    )
+                with m.If(sel):
+                    m.d.comb += [
+                        chan.req.addr.eq(req.addr),
+                        chan.req.id.eq(req_id),
+                    ]
+                m.d.comb += [
+                    req.ready.eq(chan.req.ready & sel),
+                    resp.valid.eq(resp_ok),
+                    resp.id.eq(chan.resp.id[:lbuf_bits]),
+                    resp.last.eq(chan.resp.last),
+                ]
+                m.d.comb += [
+                    resp.data[word].eq(chan.resp.data[word])
+                    for word in range(fill.beat_words)
+                ]
+
+    def elaborate_wbuf(self, m: Module, mshr: list, r_wait: Array):
+        """ Collect completed cachelines from MSHRs in the fill write buffer 
+        and write them to the L1I. 
+
+        At most one cacheline is written for each MSHR on a cycle, and 
+        cachelines written on the same cycle never belong to MSHRs with 
+        requests waiting from the same port (each port only receives one 
+        forwarded cacheline per cycle). 
+        """
+        depth = self.p.l1i.fill.wbuf_depth
+        wbuf = Array(
+            Signal(L1IFillWriteEntry(self.p), name=f"wbuf{idx}")
+            for idx in range(depth)
+        )
+        r_rptr = Signal(exact_log2(depth), init=0)
+        r_wptr = Signal(exact_log2(depth), init=0)
+        r_used = Signal(ceil_log2(depth + 1), init=0)
+
+        # Ports with requests waiting for each MSHR
+        wait_mask = Array(
+            Cat(*[ r_wait[idx][port_idx].valid 
+                   for port_idx in range(self.num_port) ])
+            for idx in range(self.num_mshr)
+        )
+
+        # Cachelines written to each L1I write port on this cycle
+        wr = [
+            Signal(L1IFillWriteEntry(self.p), name=f"wr{idx}") 
+            for idx in range(self.num_wp)
+        ]
+        wr_valid = [ Signal(name=f"wr_valid{idx}") for idx in range(self.num_wp) ]
+
+        # Write the oldest entries in the write buffer (in order)
+        used_port = C(0, self.num_port)
+        used_mshr = C(0, self.num_mshr)
+        deq = C(1, 1)
+        num_deq = C(0, 1)
+        for wp_idx in range(self.num_wp):
+            ent = wbuf[(r_rptr + wp_idx)[:len(r_rptr)]]
+            ent_mshr = C(1, self.num_mshr) << ent.mshr
+            ent_port = wait_mask[ent.mshr]
+            deq = deq & (r_used > wp_idx) & (
+                ((ent_mshr & used_mshr) == 0) & ((ent_port & used_port) == 0)
+            )
+            with m.If(deq):
+                m.d.comb += [
+                    wr_valid[wp_idx].eq(1),
+                    wr[wp_idx].eq(ent),
+                ]
+            used_port = used_port | Mux(deq, ent_port, 0)
+            used_mshr = used_mshr | Mux(deq, ent_mshr, 0)
+            num_deq = num_deq + deq
+
+        # When the write buffer is empty, write cachelines from the MSHRs 
+        # directly. Otherwise, cachelines are placed in the write buffer. 
+        free = depth - r_used
+        num_byp = C(0, 1)
+        num_enq = C(0, 1)
+        for idx in range(self.num_mshr):
+            wb = mshr[idx].wb
+            byp = Signal(name=f"wb_byp{idx}")
+            enq = Signal(name=f"wb_enq{idx}")
+            m.d.comb += [
+                byp.eq(wb.valid & (r_used == 0) & 
+                    (num_byp < self.num_wp) & 
+                    ((wait_mask[idx] & used_port) == 0)
+                ),
+                enq.eq(wb.valid & ~byp & (num_enq < free)),
+                wb.ready.eq(byp | enq),
+            ]
+            ent = Signal(L1IFillWriteEntry(self.p), name=f"wb_ent{idx}")
+            m.d.comb += [
+                ent.mshr.eq(idx),
+                ent.addr.eq(wb.addr),
+                ent.data.eq(wb.data),
+            ]
+            for wp_idx in range(self.num_wp):
+                with m.If(byp & (num_byp == wp_idx)):
+                    m.d.comb += [
+                        wr_valid[wp_idx].eq(1),
+                        wr[wp_idx].eq(ent),
+                    ]
+            with m.If(enq):
+                m.d.sync += wbuf[(r_wptr + num_enq)[:len(r_wptr)]].eq(ent)
+            used_port = used_port | Mux(byp, wait_mask[idx], 0)
+            num_byp = num_byp + byp
+            num_enq = num_enq + enq
+
+        m.d.sync += [
+            r_rptr.eq(r_rptr + num_deq),
+            r_wptr.eq(r_wptr + num_enq),
+            r_used.eq(r_used + num_enq - num_deq),
+        ]
+
+        # Write to the L1I, and report each cacheline to its MSHR
+        for idx in range(self.num_mshr):
+            m.d.comb += [
+                mshr[idx].wb_done.valid.eq(0),
+                mshr[idx].wb_done.ftq_idx.eq(0),
+                mshr[idx].wb_done.addr.eq(0),
+                mshr[idx].wb_done.mask.eq(0),
+                mshr[idx].wb_done.data.eq(0),
+            ]
+        for wp_idx in range(self.num_wp):
+            wp = self.l1i_wp[wp_idx]
+            m.d.comb += [
+                wp.req.valid.eq(wr_valid[wp_idx]),
+                wp.req.set.eq(0),
+                wp.req.way.eq(0),
+                wp.req.line_data.eq(0),
+                wp.req.tag_data.eq(0),
+            ]
+            # The L1I selects the way to be replaced in the set
+            with m.If(wr_valid[wp_idx]):
+                m.d.comb += [
+                    wp.req.set.eq(wr[wp_idx].addr.l1i.set),
+                    wp.req.way.eq(wp.victim.way),
+                    wp.req.line_data.eq(wr[wp_idx].data),
+                    wp.req.tag_data.ppn.eq(wr[wp_idx].addr.sv32.ppn),
+                    wp.req.tag_data.valid.eq(1),
+                ]
+                for idx in range(self.num_mshr):
+                    with m.If(wr[wp_idx].mshr == idx):
+                        m.d.comb += [
+                            mshr[idx].wb_done.valid.eq(1),
+                            mshr[idx].wb_done.addr.eq(wr[wp_idx].addr),
+                            mshr[idx].wb_done.mask.eq(
+                                C(-1, self.p.l1i.line_depth)
+                            ),
+                            mshr[idx].wb_done.data.eq(wr[wp_idx].data),
+                        ]
+
     def elaborate(self, platform):
         m = Module()
 
         # Logic for mapping requests to available MSHRs
         xbar = m.submodules.xbar = SimpleCrossbar(self.num_port, self.num_mshr)
-        xbar_resp = m.submodules.xbar_resp = \
-                SimpleCrossbar(self.num_port, self.num_mshr)
 
         # Instantiate MSHRs
         mshr = []
@@ -357,69 +871,175 @@ class NewL1IFillUnit(Component):
             x = m.submodules[f"mshr{idx}"] = L1IMissStatusHoldingRegister(self.p)
             mshr.append(x)
 
-        # Connect MSHRs to resources
-        # FIXME: This simply *assumes* that the L1I cache and memory interface
-        # have multiple ports
-        for idx in range(self.num_mshr):
-            connect(m, mshr[idx].l1i_wp, flipped(self.l1i_wp[idx]))
-            connect(m, mshr[idx].fakeram, flipped(self.fakeram[idx]))
-
-        # Distribute valid requests to available MSHRs
-        port_req_valid = [ port.req.valid for port in self.port ]
-        mshr_ready    = [ m.ready for m in mshr ]
+        mshr_ready = [ m.ready for m in mshr ]
         m.d.comb += [
-            xbar.upstream_grant.eq(Cat(*port_req_valid)),
             xbar.downstream_grant.eq(Cat(*mshr_ready)),
             self.sts.ready.eq(Cat(*mshr_ready).any()),
         ]
-        # Distribute responses from completed MSHRs to output ports
-        mshr_resp_valid = [ m.port.resp.valid for m in mshr ]
-        m.d.comb += [
-            xbar_resp.upstream_grant.eq(C(3, self.num_port)),
-            xbar_resp.downstream_grant.eq(Cat(*mshr_resp_valid)),
-        ]
+
+        # Requests waiting for the fill held by each MSHR [one per port]
+        r_wait = Array(
+            Array(
+                Signal(L1IFillWaiter(self.p), name=f"r_wait{idx}_{port_idx}")
+                for port_idx in range(self.num_port)
+            )
+            for idx in range(self.num_mshr)
+        )
 
 
+        self.elaborate_mem(m, mshr)
+        self.elaborate_wbuf(m, mshr, r_wait)
+
         # Where 'N' is the number of ports, and 'M' is the number of MSHRs: 
         #
         #                 N-to-N            N-to-M           M-to-M         
         #  self.port.req|=======>|req_in  |========|req_out|=======>|mshr.req
         #               |        |        |  xbar  |       |        |
         #               |        |        |        |       |        |          
-        #               |        |        |  xbar  |       |        |
+        #               |        |        |  port  |       |        |
         # self.port.resp|<=======|resp_out|========|resp_in|<=======|mshr.resp
         #                 N-to-N            N-to-M           M-to-M
         #
+        # Responses are returned to the port that sent the request. 
 
 
         # Connect ports to wires
         req_in = Array(L1IFillPort.Request(self.p).flip().create() for _ in range(self.num_port))
         resp_out = Array(L1IFillPort.Response(self.p).create() for _ in range(self.num_port))
+        fwd_out = Array(L1IFillPort.Forward(self.p).create() for _ in range(self.num_port))
         for port_idx in range(self.num_port):
             connect(m, flipped(self.port[port_idx].req), req_in[port_idx])
             connect(m, resp_out[port_idx], flipped(self.port[port_idx].resp))
+            connect(m, fwd_out[port_idx], flipped(self.port[port_idx].fwd))
 
         # Connect wires to MSHRs
         req_out = Array(L1IFillPort.Request(self.p).create() for _ in range(self.num_mshr))
         resp_in = Array(L1IFillPort.Response(self.p).create() for _ in range(self.num_mshr))
+        fwd_in = Array(L1IFillPort.Forward(self.p).create() for _ in range(self.num_mshr))
         for mshr_idx in range(self.num_mshr):
             connect(m, req_out[mshr_idx], mshr[mshr_idx].port.req)
             connect(m, mshr[mshr_idx].port.resp, flipped(resp_in[mshr_idx]))
+            connect(m, mshr[mshr_idx].port.fwd, flipped(fwd_in[mshr_idx]))
 
         # Default assignments
-        for idx in range(self.num_port):
+        for idx in range(self.num_mshr):
             m.d.comb += [
                 req_out[idx].valid.eq(0),
                 req_out[idx].addr.eq(0),
                 req_out[idx].way.eq(0),
                 req_out[idx].ftq_idx.eq(0),
                 req_out[idx].blocks.eq(0),
+            ]
+        for idx in range(self.num_port):
+            m.d.comb += [
                 resp_out[idx].valid.eq(0),
                 resp_out[idx].ftq_idx.eq(0),
+                resp_out[idx].way.eq(0),
+                resp_out[idx].addr.eq(0),
+                resp_out[idx].blocks.eq(0),
                 resp_out[idx].src.eq(L1IFillSource.NONE),
+                fwd_out[idx].valid.eq(0),
+                fwd_out[idx].ftq_idx.eq(0),
+                fwd_out[idx].addr.eq(0),
+                fwd_out[idx].mask.eq(0),
+                fwd_out[idx].data.eq(0),
             ]
 
+        # Merge requests into MSHRs that are already servicing them. 
+        #
+        # A request can be merged when its first cacheline belongs to the 
+        # request held by an MSHR, and when none of its cachelines have 
+        # already been written to the L1I (every cacheline must still be 
+        # forwarded to the requester). The request held by the MSHR is 
+        # extended when the merged request covers more cachelines. 
+        #
+        # NOTE: Each MSHR only keeps one waiting request per port. Another
+        # request from the same port is given a new MSHR. 
+        off_bits  = self.p.vaddr.num_off_bits
+        blk_width = self.p.fblk_size_shape.width
+        merge_valid = Array(
+            Signal(name=f"merge_valid{idx}") for idx in range(self.num_port)
+        )
+        merge_idx = Array(
+            Signal(range(self.num_mshr), name=f"merge_idx{idx}") 
+            for idx in range(self.num_port)
+        )
+        merge_end = Array(
+            Array(
+                Signal(blk_width + 1, name=f"merge_end{idx}_{mshr_idx}")
+                for mshr_idx in range(self.num_mshr)
+            )
+            for idx in range(self.num_port)
+        )
         for idx in range(self.num_port):
+            req = req_in[idx]
+            req_line = req.addr.as_value()[off_bits:]
+            match = []
+            for mshr_idx in range(self.num_mshr):
+                sts = mshr[mshr_idx].sts
+                off = (req_line - sts.addr.as_value()[off_bits:])[:len(req_line)]
+                end = merge_end[idx][mshr_idx]
+                req_mask = Signal(2 ** blk_width, 
+                    name=f"merge_mask{idx}_{mshr_idx}"
+                )
+                m.d.comb += [
+                    end.eq(off[:blk_width] + req.blocks),
+                    req_mask.eq(
+                        ((C(1, 2 ** blk_width) << req.blocks) - 1) << 
+                        off[:blk_width]
+                    ),
+                ]
+                match.append(
+                    req.valid & sts.busy & (off < sts.blocks) & 
+                    (end < 2 ** blk_width) & 
+                    ((req_mask & sts.written) == 0) & 
+                    ~r_wait[mshr_idx][idx].valid
+                )
+            enc = m.submodules[f"merge_enc{idx}"] = \
+                    EmberPriorityEncoder(self.num_mshr)
+            m.d.comb += [
+                enc.i.eq(Cat(*match)),
+                merge_valid[idx].eq(enc.valid),
+                merge_idx[idx].eq(enc.o),
+            ]
+
+        for mshr_idx in range(self.num_mshr):
+            ext_valid  = C(0, 1)
+            ext_blocks = mshr[mshr_idx].sts.blocks
+            for idx in range(self.num_port):
+                end = merge_end[idx][mshr_idx]
+                sel = merge_valid[idx] & (merge_idx[idx] == mshr_idx)
+                ext_valid  = ext_valid | sel
+                ext_blocks = Mux(sel & (end > ext_blocks), end, ext_blocks)
+            m.d.comb += [
+                mshr[mshr_idx].ext.valid.eq(ext_valid),
+                mshr[mshr_idx].ext.blocks.eq(ext_blocks),
+            ]
+
+        # Distribute other valid requests to available MSHRs
+        m.d.comb += xbar.upstream_grant.eq(Cat(*[
+            req_in[idx].valid & ~merge_valid[idx] 
+            for idx in range(self.num_port)
+        ]))
+
+        # Waiting requests are released when the MSHR responds
+        for mshr_idx in range(self.num_mshr):
+            with m.If(resp_in[mshr_idx].valid):
+                m.d.sync += [
+                    r_wait[mshr_idx][idx].valid.eq(0)
+                    for idx in range(self.num_port)
+                ]
+
+        for idx in range(self.num_port):
+            waiter = Signal(L1IFillWaiter(self.p), name=f"waiter{idx}")
+            m.d.comb += [
+                waiter.valid.eq(1),
+                waiter.ftq_idx.eq(req_in[idx].ftq_idx),
+                waiter.addr.eq(req_in[idx].addr),
+                waiter.blocks.eq(req_in[idx].blocks),
+                waiter.way.eq(req_in[idx].way),
+                waiter.src.eq(req_in[idx].src),
+            ]
             with m.If(xbar.grant[idx]): 
                 mshr_idx = xbar.dst_idx[idx]
                 m.d.comb += [
@@ -431,15 +1051,62 @@ class NewL1IFillUnit(Component):
                     req_out[mshr_idx].src.eq(req_in[idx].src),
                     req_out[mshr_idx].blocks.eq(req_in[idx].blocks),
                 ]
+                m.d.sync += r_wait[mshr_idx][idx].eq(waiter)
+            with m.Elif(merge_valid[idx]):
+                m.d.sync += r_wait[merge_idx[idx]][idx].eq(waiter)
 
+        # Responses are returned to every port with a request waiting for 
+        # the MSHR. Each port receives its own request. 
+        #
+        # NOTE: This assumes that MSHRs holding requests from the same port 
+        # never complete on the same cycle. 
         for idx in range(self.num_port):
-            with m.If(xbar_resp.grant[idx]): 
-                mshr_idx = xbar_resp.dst_idx[idx]
+            resp_enc = m.submodules[f"resp_enc{idx}"] = \
+                    EmberPriorityEncoder(self.num_mshr)
+            m.d.comb += resp_enc.i.eq(Cat(*[
+                resp_in[mshr_idx].valid & r_wait[mshr_idx][idx].valid
+                for mshr_idx in range(self.num_mshr)
+            ]))
+            with m.If(resp_enc.valid): 
+                waiter = r_wait[resp_enc.o][idx]
                 m.d.comb += [
                     #Print(Format("mshr_resp{} -> port_resp{}", mshr_idx, idx)),
-                    resp_out[idx].valid.eq(resp_in[mshr_idx].valid),
-                    resp_out[idx].ftq_idx.eq(resp_in[mshr_idx].ftq_idx),
-                    resp_out[idx].src.eq(resp_in[mshr_idx].src),
+                    resp_out[idx].valid.eq(1),
+                    resp_out[idx].ftq_idx.eq(waiter.ftq_idx),
+                    resp_out[idx].way.eq(waiter.way),
+                    resp_out[idx].addr.eq(waiter.addr),
+                    resp_out[idx].blocks.eq(waiter.blocks),
+                    resp_out[idx].src.eq(waiter.src),
+                ]
+
+            # Forwarded cachelines are also returned to every waiting port. 
+            #
+            # Complete cachelines take priority over beats (which are only 
+            # forwarded when no complete cacheline is sent to the port). 
+            # At most one complete cacheline is sent to each port on a cycle, 
+            # and a beat that is not forwarded is sent again with the next 
+            # beat or the complete cacheline. 
+            fwd_full = [
+                fwd_in[mshr_idx].valid & r_wait[mshr_idx][idx].valid & 
+                fwd_in[mshr_idx].mask.all()
+                for mshr_idx in range(self.num_mshr)
+            ]
+            fwd_beat = [
+                fwd_in[mshr_idx].valid & r_wait[mshr_idx][idx].valid & 
+                ~fwd_in[mshr_idx].mask.all()
+                for mshr_idx in range(self.num_mshr)
+            ]
+            fwd_enc = m.submodules[f"fwd_enc{idx}"] = \
+                    EmberPriorityEncoder(2 * self.num_mshr)
+            m.d.comb += fwd_enc.i.eq(Cat(*fwd_full, *fwd_beat))
+            with m.If(fwd_enc.valid): 
+                mshr_idx = fwd_enc.o % self.num_mshr
+                m.d.comb += [
+                    fwd_out[idx].valid.eq(fwd_in[mshr_idx].valid),
+                    fwd_out[idx].ftq_idx.eq(r_wait[mshr_idx][idx].ftq_idx),
+                    fwd_out[idx].addr.eq(fwd_in[mshr_idx].addr),
+                    fwd_out[idx].mask.eq(fwd_in[mshr_idx].mask),
+                    fwd_out[idx].data.eq(fwd_in[mshr_idx].data),
                 ]
 
         return m
@@ -13,6 +13,7 @@ from amaranth_soc.wishbone import Signature as WishboneSignature
 
 from ember.common import *
 from ember.common.lfsr import LFSR
+from ember.common.replacement import TreePLRU
 from ember.riscv.paging import *
 from ember.param import *
 
@@ -45,12 +46,79 @@ class L1ICacheTLBReadPort(Signature):
 
 
 class L1ICacheTLBFillRequest(Signature):
-    """ A request to write an entry into the L1I TLB. """
+    """ A request to write an entry into the L1I TLB. 
+
+    Members
+    =======
+    valid:
+        This request is valid
+    pte:
+        Page table entry
+    vpn:
+        Virtual page number
+    superpage:
+        The entry maps a 4MiB superpage [``vpn0`` is ignored]
+    """
     def __init__(self):
         super().__init__({
             'valid': Out(1),
             'pte': Out(PageTableEntrySv32()),
             'vpn': Out(VirtualPageNumberSv32()),
+            'superpage': Out(1),
+        })
+
+
+class L1ICacheTLBXlatPort(Signature):
+    """ Interface used to request address translation after a TLB miss. 
+
+    Members
+    =======
+    req:
+        Translation request
+    resp:
+        Translation response [for every completed translation]
+    ready:
+        A request can be accepted on the next cycle
+    """
+    class Request(Signature):
+        """ A request to translate a virtual page number. 
+
+        Members
+        =======
+        valid:
+            This request is valid
+        vpn:
+            Virtual page number that missed in the TLB
+        """
+        def __init__(self):
+            super().__init__({
+                'valid': Out(1),
+                'vpn': Out(VirtualPageNumberSv32()),
+            })
+    class Response(Signature):
+        """ Translation for a virtual page number has completed. 
+
+        Members
+        =======
+        valid:
+            This response is valid
+        vpn:
+            Virtual page number from the request
+        fault:
+            No valid mapping exists [and the TLB was not filled]
+        """
+        def __init__(self):
+            super().__init__({
+                'valid': Out(1),
+                'vpn': Out(VirtualPageNumberSv32()),
+                'fault': Out(1),
+            })
+
+    def __init__(self):
+        super().__init__({
+            'req': Out(self.Request()),
+            'resp': In(self.Response()),
+            'ready': In(1),
         })
 
 
@@ -61,13 +129,22 @@ class L1ICacheTLB(Component):
     Each entry in the TLB associates a virtual page number (VPN) to 
     a page table entry (PTE). 
 
+    Superpages
+    ==========
+    Each entry has a page-size bit. An entry for a 4MiB superpage only 
+    compares ``vpn1``, and the physical page number in the response is 
+    formed with ``vpn0`` from the request. A single entry covers all of 
+    the 4KiB pages in a superpage. 
+
     Replacement Policy
     ==================
-    Currently, the replacement policy is *random*. 
-    The index for each fill request is generated by an LFSR. 
+    The replacement policy is tree-based pseudo least-recently used 
+    (see :class:`ember.common.replacement.TreePLRU`). Hits on the read port
+    and probe port, and fills, mark an entry as most-recently used. 
 
-    At some point, this will probably be replaced with the tree-based 
-    pseudo least-recently used (PLRU) policy.
+    A fill request replaces the least-recently used entry, unless an entry
+    for the same virtual page number [or the same superpage] already 
+    exists. 
 
     Ports
     =====
@@ -84,8 +161,6 @@ class L1ICacheTLB(Component):
         self.p = param
         self.depth = param.l1i.tlb.depth
 
-        #self.lfsr = LFSR(degree=ceil_log2(self.depth))
-
         signature = Signature({
             "fill_req": In(L1ICacheTLBFillRequest()),
             "rp": In(L1ICacheTLBReadPort()),
@@ -96,13 +171,6 @@ class L1ICacheTLB(Component):
     def elaborate(self, platform):
         m = Module()
 
-        # NOTE: Generates a "random" index for allocations/evictions.
-        # This is fine, for now. 
-        lfsr_en = self.fill_req.valid
-        m.submodules.lfsr = lfsr = \
-            EnableInserter(lfsr_en)(LFSR(degree=ceil_log2(self.depth)))
-        lfsr_out = lfsr.value
-
         # Tag and data arrays.
         data_arr  = Array(
             Signal(PageTableEntrySv32(), name=f"data_arr{i}") 
@@ -113,6 +181,25 @@ class L1ICacheTLB(Component):
             for i in range(self.depth)
         )
         valid_arr = Array(Signal() for i in range(self.depth))
+        sp_arr    = Array(
+            Signal(name=f"sp_arr{i}") for i in range(self.depth)
+        )
+
+        # Compare an entry against a virtual page number. The lower bits
+        # are ignored when either side is a superpage. 
+        def tag_match(idx, vpn, superpage=C(0)):
+            return valid_arr[idx] & (tag_arr[idx].vpn1 == vpn.vpn1) & (
+                sp_arr[idx] | superpage | (tag_arr[idx].vpn0 == vpn.vpn0)
+            )
+
+        # The physical page number for a superpage includes the lower
+        # bits of the virtual page number
+        def match_pte(name, hit, idx, vpn):
+            pte = Signal(PageTableEntrySv32(), name=name)
+            m.d.comb += pte.eq(Mux(hit, data_arr[idx], 0))
+            with m.If(sp_arr[idx]):
+                m.d.comb += pte.ppn.ppn0.eq(vpn.vpn0)
+            return pte
 
         # Match signals
         match_arr_rp = Array(
@@ -129,8 +216,12 @@ class L1ICacheTLB(Component):
         match_hit_pp  = (~enc_pp.n & self.pp.req.valid)
         match_idx_rp  = enc_rp.o
         match_idx_pp  = enc_pp.o
-        match_data_rp = Mux(match_hit_rp, data_arr[match_idx_rp], 0)
-        match_data_pp = Mux(match_hit_pp, data_arr[match_idx_pp], 0)
+        match_data_rp = match_pte("match_data_rp", 
+            match_hit_rp, match_idx_rp, self.rp.req.vpn
+        )
+        match_data_pp = match_pte("match_data_pp", 
+            match_hit_pp, match_idx_pp, self.pp.req.vpn
+        )
 
         # Default assignment for the response
         m.d.sync += [
@@ -146,9 +237,7 @@ class L1ICacheTLB(Component):
         with m.If(self.rp.req.valid):
             # Drive input to all of the comparators
             m.d.comb += [
-                match_arr_rp[idx].eq(
-                    (tag_arr[idx] == self.rp.req.vpn) & valid_arr[idx]
-                )
+                match_arr_rp[idx].eq(tag_match(idx, self.rp.req.vpn))
                 for idx in range(self.depth)
             ]
             # Obtain the index of the matching entry (if one exists). 
@@ -164,9 +253,7 @@ class L1ICacheTLB(Component):
         with m.If(self.pp.req.valid):
             # Drive input to all of the comparators
             m.d.comb += [
-                match_arr_pp[idx].eq(
-                    (tag_arr[idx] == self.pp.req.vpn) & valid_arr[idx]
-                )
+                match_arr_pp[idx].eq(tag_match(idx, self.pp.req.vpn))
                 for idx in range(self.depth)
             ]
             # Obtain the index of the matching entry (if one exists). 
@@ -180,11 +267,31 @@ class L1ICacheTLB(Component):
             ]
 
 
+        # Replace an existing entry for the same page, or the least-recently
+        # used entry
+        m.submodules.plru = plru = TreePLRU(self.depth, num_access=3)
+        m.submodules.enc_fill = enc_fill = PriorityEncoder(self.depth)
+        m.d.comb += enc_fill.i.eq(Cat(*[
+            tag_match(idx, self.fill_req.vpn, self.fill_req.superpage)
+            for idx in range(self.depth)
+        ]))
+        fill_idx = Mux(enc_fill.n, plru.lru, enc_fill.o)
+
+        m.d.comb += [
+            plru.access[0].valid.eq(match_hit_rp),
+            plru.access[0].idx.eq(match_idx_rp),
+            plru.access[1].valid.eq(match_hit_pp),
+            plru.access[1].idx.eq(match_idx_pp),
+            plru.access[2].valid.eq(self.fill_req.valid),
+            plru.access[2].idx.eq(fill_idx),
+        ]
+
         with m.If(self.fill_req.valid):
             m.d.sync += [
-                tag_arr[lfsr_out].eq(self.fill_req.vpn),
-                data_arr[lfsr_out].eq(self.fill_req.pte),
-                valid_arr[lfsr_out].eq(1),
+                tag_arr[fill_idx].eq(self.fill_req.vpn),
+                data_arr[fill_idx].eq(self.fill_req.pte),
+                sp_arr[fill_idx].eq(self.fill_req.superpage),
+                valid_arr[fill_idx].eq(1),
             ]
 
         return m
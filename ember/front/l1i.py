@@ -11,6 +11,7 @@ from amaranth_soc.wishbone import Signature as WishboneSignature
 
 from ember.common import *
 from ember.common.lfsr import *
+from ember.common.replacement import TreePLRU
 from ember.front.l1i_array import *
 from ember.riscv.paging import *
 from ember.param import *
@@ -62,11 +63,22 @@ class L1ICacheReadPort(Signature):
                 "tag_data": Out(L1ITag()).array(p.l1i.num_ways),
                 "line_data": Out(L1ICacheline(p)).array(p.l1i.num_ways),
             })
+    class Hit(Signature):
+        """ A hit in some way of a set read from the L1I cache. 
+        Hits are used to update the replacement policy. 
+        """
+        def __init__(self, p: EmberParams):
+            super().__init__({
+                "valid": Out(1),
+                "set": Out(ceil_log2(p.l1i.num_sets)),
+                "way": Out(ceil_log2(p.l1i.num_ways)),
+            })
 
     def __init__(self, p: EmberParams):
         super().__init__({
             "req": Out(self.Request(p)),
             "resp": In(self.Response(p)),
+            "hit": Out(self.Hit(p)),
         })
 
 class L1ICacheWritePort(Signature):
@@ -87,11 +99,19 @@ class L1ICacheWritePort(Signature):
             super().__init__({
                 "valid": Out(1),
             })
+    class Victim(Signature):
+        """ The way that should be replaced in the set selected by the 
+        current request. """
+        def __init__(self, p: EmberParams):
+            super().__init__({
+                "way": Out(ceil_log2(p.l1i.num_ways)),
+            })
 
     def __init__(self, p: EmberParams):
         super().__init__({
             "req": Out(self.Request(p)),
             "resp": In(self.Response(p)),
+            "victim": In(self.Victim(p)),
         })
 
 class L1ICache(Component):
@@ -122,9 +142,16 @@ class L1ICache(Component):
     Replacement
     -----------
 
-    The current replacement policy is *random*. 
-    Each write port in this module is associated to an LFSR which generates 
-    the way index used to write into the data/tag arrays. 
+    The replacement policy is tree-based pseudo-LRU (see 
+    :class:`ember.common.replacement.TreePLRU`), with one tree for each set. 
+    A set is updated when a hit is reported on a read port, and when a way 
+    is written on a write port. 
+
+    Each write port reports the least-recently used way in the set selected 
+    by its request, and the requester decides which way is written. 
+    Updates from read ports and lower-numbered write ports on the same cycle 
+    are taken into account, so concurrent writes to the same set are given 
+    different ways. 
 
     Ports 
     =====
@@ -149,6 +176,42 @@ class L1ICache(Component):
         })
         super().__init__(signature)
 
+    def elaborate_plru(self, m: Module):
+        """ Replacement policy state. 
+        """
+        num_ways = self.p.l1i.num_ways
+        plru = Array(
+            Signal(num_ways - 1, name=f"plru{idx}", init=0)
+            for idx in range(self.p.l1i.num_sets)
+        )
+
+        # Accesses on this cycle (in order)
+        acc = [ 
+            (rp.hit.valid, rp.hit.set, rp.hit.way) for rp in self.rp 
+        ] + [ 
+            (wp.req.valid, wp.req.set, wp.req.way) for wp in self.wp
+        ]
+
+        # The state of a set after all previous accesses on this cycle
+        def state_before(pos, set_idx):
+            state = plru[set_idx]
+            for valid, acc_set, acc_way in acc[:pos]:
+                state = Mux(valid & (acc_set == set_idx), 
+                    TreePLRU.touch(num_ways, state, acc_way), state
+                )
+            return state
+
+        for pos, (valid, acc_set, acc_way) in enumerate(acc):
+            state = state_before(pos, acc_set)
+            with m.If(valid):
+                m.d.sync += plru[acc_set].eq(
+                    TreePLRU.touch(num_ways, state, acc_way)
+                )
+
+        for idx, wp in enumerate(self.wp):
+            state = state_before(self.num_rp + idx, wp.req.set)
+            m.d.comb += wp.victim.way.eq(TreePLRU.victim(num_ways, state))
+
     def elaborate(self, platform):
         m = Module()
 
@@ -156,15 +219,7 @@ class L1ICache(Component):
         data_arr = m.submodules.data_arr = L1ICacheDataArray(self.p)
         tag_arr  = m.submodules.tag_arr  = L1ICacheTagArray(self.p)
 
-        # Create an LFSR for each write port. 
-        # NOTE: The replacement policy is random. 
-        lfsr_wp = [ 
-            EnableInserter(self.wp[idx].req.valid)(LFSR(degree=4))
-            for idx in range(self.num_wp) 
-        ]
-        for idx in range(self.num_wp):
-            m.submodules[f"lfsr_wp{idx}"] = lfsr = lfsr_wp[idx]
-
+        self.elaborate_plru(m)
 
         # Outputs for the current request are valid on the next cycle
         for idx in range(self.num_rp):
@@ -195,12 +250,12 @@ class L1ICache(Component):
         for idx in range(self.num_wp):
             m.d.comb += [
                 data_arr.wp[idx].req.valid.eq(self.wp[idx].req.valid),
-                data_arr.wp[idx].req.way.eq(lfsr_wp[idx].value),
+                data_arr.wp[idx].req.way.eq(self.wp[idx].req.way),
                 data_arr.wp[idx].req.idx.eq(self.wp[idx].req.set),
                 data_arr.wp[idx].req.data.eq(self.wp[idx].req.line_data),
 
                 tag_arr.wp[idx].req.valid.eq(self.wp[idx].req.valid),
-                tag_arr.wp[idx].req.way.eq(lfsr_wp[idx].value),
+                tag_arr.wp[idx].req.way.eq(self.wp[idx].req.way),
                 tag_arr.wp[idx].req.idx.eq(self.wp[idx].req.set),
                 tag_arr.wp[idx].req.data.eq(self.wp[idx].req.tag_data),
             ]
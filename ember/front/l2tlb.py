@@ -0,0 +1,285 @@
+
+from amaranth import *
+from amaranth.lib.data import *
+from amaranth.lib.wiring import *
+import amaranth.lib.memory as memory
+from amaranth.utils import ceil_log2, exact_log2
+
+from ember.common.coding import EmberPriorityEncoder
+from ember.riscv.paging import *
+from ember.param import *
+from ember.param.front import L2TLBParams
+
+
+def l2tlb_set(tp: L2TLBParams, vpn: Value) -> Value:
+    """ Compute the set index for a virtual page number. """
+    return vpn.as_value()[:tp.set_bits]
+
+def l2tlb_tag(tp: L2TLBParams, vpn: Value) -> Value:
+    """ Compute the tag for a virtual page number. """
+    return vpn.as_value()[tp.set_bits:]
+
+
+class L2TLBEntry(StructLayout):
+    """ L2 TLB entry.
+
+    Members
+    =======
+    valid:
+        This entry is valid
+    tag:
+        Virtual page number bits above the set index
+    pte:
+        Page table entry
+    superpage:
+        The page table entry maps a 4MiB superpage
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "valid": unsigned(1),
+            "tag": unsigned(p.l2tlb.tag_bits),
+            "pte": PageTableEntrySv32(),
+            "superpage": unsigned(1),
+        })
+
+
+class L2TLBReadPort(Signature):
+    """ L2 TLB read port.
+
+    The response is available on the cycle after the request.
+    """
+    class Request(Signature):
+        """ A request to resolve a virtual page number.
+
+        Members
+        =======
+        valid:
+            This request is valid
+        vpn:
+            Virtual page number
+        """
+        def __init__(self):
+            super().__init__({
+                'valid': Out(1),
+                'vpn': Out(VirtualPageNumberSv32()),
+            })
+    class Response(Signature):
+        """ Result of a lookup.
+
+        Members
+        =======
+        valid:
+            This response is valid
+        hit:
+            A matching entry was found
+        vpn:
+            Virtual page number from the request
+        pte:
+            Page table entry [when ``hit`` is set]
+        superpage:
+            The page table entry maps a 4MiB superpage
+        """
+        def __init__(self):
+            super().__init__({
+                'valid': Out(1),
+                'hit': Out(1),
+                'vpn': Out(VirtualPageNumberSv32()),
+                'pte': Out(PageTableEntrySv32()),
+                'superpage': Out(1),
+            })
+
+    def __init__(self):
+        super().__init__({
+            'req': Out(self.Request()),
+            'resp': In(self.Response()),
+        })
+
+
+class L2TLBFillRequest(Signature):
+    """ A request to write an entry into the L2 TLB. """
+    def __init__(self):
+        super().__init__({
+            'valid': Out(1),
+            'vpn': Out(VirtualPageNumberSv32()),
+            'pte': Out(PageTableEntrySv32()),
+            'superpage': Out(1),
+        })
+
+
+class L2TLB(Component):
+    """ Set-associative L2 TLB.
+
+    The L2 TLB is shared by the L1 TLBs, and holds translations that were
+    completed by the page table walker. Each read port is looked up before
+    a walk is started.
+
+    Lookup
+    ======
+    1. Read all ways in the set.
+    2. Compare tags, and drive the response on the next cycle.
+
+    Superpages
+    ==========
+    Entries are indexed with the lower bits of the virtual page number, 
+    so a 4MiB superpage is held as a separate entry for each 4KiB page 
+    that was translated. Entries keep the page-size bit, so that the L1 
+    TLBs can be filled with the whole superpage on a hit. 
+
+    Fill
+    ====
+    Fills are read-modify-write operations (using a separate read port):
+
+    1. Read all ways in the set.
+    2. Update the way with the same tag, or write an invalid way, or the
+       way selected by a per-set round-robin replacement pointer (in that
+       order).
+
+    Ports
+    =====
+    rp: :class:`L2TLBReadPort`
+        Read ports [port 0 is used for L1I TLB misses]
+    fill: :class:`L2TLBFillRequest`
+        Fill request
+
+    """
+    def __init__(self, param: EmberParams):
+        self.p = param
+        self.tp = param.l2tlb
+        super().__init__(Signature({
+            "rp": In(L2TLBReadPort()).array(param.l2tlb.num_port),
+            "fill": In(L2TLBFillRequest()),
+        }))
+
+    def elaborate(self, platform):
+        m = Module()
+        tp = self.tp
+        num_ways = tp.num_ways
+
+        data_wp = []
+        data_rp = []
+        data_mp = []
+        for way in range(num_ways):
+            mem = m.submodules[f"data_mem{way}"] = memory.Memory(
+                shape=L2TLBEntry(self.p), depth=tp.num_sets, init=[],
+            )
+            data_wp.append(mem.write_port())
+            data_rp.append([
+                mem.read_port(transparent_for=[data_wp[way]])
+                for _ in range(tp.num_port)
+            ])
+            data_mp.append(mem.read_port(transparent_for=[data_wp[way]]))
+
+        # Per-set round-robin replacement pointer
+        repl_mem = m.submodules.repl_mem = memory.Memory(
+            shape=unsigned(tp.way_bits), depth=tp.num_sets, init=[],
+        )
+        repl_wp = repl_mem.write_port()
+        repl_rp = repl_mem.read_port(transparent_for=[repl_wp])
+
+        # ----------------------------------------------------------------
+        # Lookup
+
+        for idx, rp in enumerate(self.rp):
+            r1_valid = Signal(name=f"r1_valid{idx}")
+            r1_vpn   = Signal(VirtualPageNumberSv32(), name=f"r1_vpn{idx}")
+            for way in range(num_ways):
+                m.d.comb += [
+                    data_rp[way][idx].en.eq(rp.req.valid),
+                    data_rp[way][idx].addr.eq(l2tlb_set(tp, rp.req.vpn)),
+                ]
+            m.d.sync += [
+                r1_valid.eq(rp.req.valid),
+                r1_vpn.eq(rp.req.vpn),
+            ]
+
+            way_hit = [
+                data_rp[way][idx].data.valid &
+                (data_rp[way][idx].data.tag == l2tlb_tag(tp, r1_vpn))
+                for way in range(num_ways)
+            ]
+            hit_pte = C(0, PageTableEntrySv32().size)
+            hit_sp  = C(0)
+            for way in range(num_ways):
+                hit_pte = Mux(way_hit[way],
+                    data_rp[way][idx].data.pte.as_value(), hit_pte
+                )
+                hit_sp  = Mux(way_hit[way],
+                    data_rp[way][idx].data.superpage, hit_sp
+                )
+            m.d.comb += [
+                rp.resp.valid.eq(r1_valid),
+                rp.resp.hit.eq(r1_valid & Cat(*way_hit).any()),
+                rp.resp.vpn.eq(r1_vpn),
+                rp.resp.pte.eq(hit_pte),
+                rp.resp.superpage.eq(hit_sp),
+            ]
+
+        # ----------------------------------------------------------------
+        # Fill (stage 0): read all ways and the replacement pointer
+
+        fill = self.fill
+        w1_valid = Signal()
+        w1_vpn   = Signal(VirtualPageNumberSv32())
+        w1_pte   = Signal(PageTableEntrySv32())
+        w1_sp    = Signal()
+        for way in range(num_ways):
+            m.d.comb += [
+                data_mp[way].en.eq(fill.valid),
+                data_mp[way].addr.eq(l2tlb_set(tp, fill.vpn)),
+            ]
+        m.d.comb += [
+            repl_rp.en.eq(fill.valid),
+            repl_rp.addr.eq(l2tlb_set(tp, fill.vpn)),
+        ]
+        m.d.sync += [
+            w1_valid.eq(fill.valid),
+            w1_vpn.eq(fill.vpn),
+            w1_pte.eq(fill.pte),
+            w1_sp.eq(fill.superpage),
+        ]
+
+        # ----------------------------------------------------------------
+        # Fill (stage 1): select a way and write the entry
+
+        w1_set = l2tlb_set(tp, w1_vpn)
+        w1_tag = l2tlb_tag(tp, w1_vpn)
+        w_hit = [
+            data_mp[way].data.valid & (data_mp[way].data.tag == w1_tag)
+            for way in range(num_ways)
+        ]
+        w_inv = [ ~data_mp[way].data.valid for way in range(num_ways) ]
+        hit_enc = m.submodules.hit_enc = EmberPriorityEncoder(num_ways)
+        inv_enc = m.submodules.inv_enc = EmberPriorityEncoder(num_ways)
+        m.d.comb += [
+            hit_enc.i.eq(Cat(*w_hit)),
+            inv_enc.i.eq(Cat(*w_inv)),
+        ]
+
+        w_way = Signal(tp.way_bits)
+        m.d.comb += w_way.eq(Mux(hit_enc.valid, hit_enc.o,
+            Mux(inv_enc.valid, inv_enc.o, repl_rp.data)
+        ))
+
+        new_entry = Signal(L2TLBEntry(self.p))
+        m.d.comb += [
+            new_entry.valid.eq(1),
+            new_entry.tag.eq(w1_tag),
+            new_entry.pte.eq(w1_pte),
+            new_entry.superpage.eq(w1_sp),
+        ]
+        for way in range(num_ways):
+            m.d.comb += [
+                data_wp[way].en.eq(w1_valid & (w_way == way)),
+                data_wp[way].addr.eq(w1_set),
+                data_wp[way].data.eq(new_entry),
+            ]
+
+        # Advance the replacement pointer when replacing a valid entry
+        m.d.comb += [
+            repl_wp.en.eq(w1_valid & ~hit_enc.valid & ~inv_enc.valid),
+            repl_wp.addr.eq(w1_set),
+            repl_wp.data.eq(repl_rp.data + 1),
+        ]
+
+        return m
+
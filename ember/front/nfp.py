@@ -6,18 +6,19 @@ from ember.common import *
 from ember.common.pipeline import *
 from ember.common.coding import ChainedPriorityEncoder
 from ember.param import *
-from ember.front.predecode import *
 from ember.uarch.front import *
+from ember.front.bp.common import *
 from ember.front.bp.l0_btb import *
+from ember.front.bp.l1_btb import *
 
 class NFPRequest(Signature):
-    """ A request for a next-fetch prediction. 
+    """ A request for a next-fetch prediction.
 
     Members
     =======
     valid:
         This request is valid.
-    pc: 
+    pc:
         The program counter used to make a prediction.
 
     """
@@ -28,18 +29,46 @@ class NFPRequest(Signature):
         })
 
 class NFPResponse(Signature):
-    """ A response from the next-fetch predictor. 
+    """ A response from the next-fetch predictor.
 
     Members
     =======
     valid:
         This response is valid.
-    npc:
+    hit:
+        The prediction was made with a hit in the BTB.
+    off:
+        Index of the hitting branch within its cacheline.
+    pc:
         Output predicted program counter value from the NFP.
     """
     def __init__(self, p: EmberParams):
         super().__init__({
             "valid": Out(1),
+            "hit": Out(1),
+            "off": Out(p.l1i.word_idx_shape),
+            "pc": Out(p.vaddr),
+        })
+
+class NFPOverride(Signature):
+    """ A correction for a next-fetch prediction made two cycles earlier.
+
+    Members
+    =======
+    valid:
+        The earlier prediction should be overridden.
+    src_pc:
+        The program counter used to make the earlier prediction.
+    off:
+        Index of the taken branch within the cacheline.
+    pc:
+        The corrected program counter value.
+    """
+    def __init__(self, p: EmberParams):
+        super().__init__({
+            "valid": Out(1),
+            "src_pc": Out(p.vaddr),
+            "off": Out(p.l1i.word_idx_shape),
             "pc": Out(p.vaddr),
         })
 
@@ -47,26 +76,47 @@ class NFPResponse(Signature):
 class NextFetchPredictor(Component):
     """ The next-fetch predictor (or "L0 predictor", "zero-cycle predictor").
 
-    Given a program counter value, [combinationally] predict the next program 
-    counter value that will be sent to the FTQ. 
+    Given a program counter value, [combinationally] predict the next program
+    counter value that will be sent to the FTQ.
 
-    In general, the logic for this should be something like: 
+    In general, the logic for this should be something like:
 
-    1. Maintain a small associative cache of predecoded blocks. 
-       Combinationally read metadata about the associated fetch block. 
-    2. On a miss, fallback to predicting the address of the next-sequential 
-       fetch block. 
-    3. On a hit, go to the offset in the hitting fetch block given by the 
-       offset bits in the PC and find the first predicted-taken control-flow 
+    1. Maintain a small associative cache of predecoded blocks.
+       Combinationally read metadata about the associated fetch block.
+    2. On a miss, fallback to predicting the address of the next-sequential
+       fetch block.
+    3. On a hit, go to the offset in the hitting fetch block given by the
+       offset bits in the PC and find the first predicted-taken control-flow
        instruction.
 
+    The L0 BTB is backed by a larger L1 BTB which is accessed in parallel.
+    The L1 BTB result is available two cycles later. When it disagrees
+    with the L0 BTB, the NFP signals an override and the hitting branch
+    is copied into the L0 BTB.
+
+    Ports
+    =====
+    req:
+        Prediction request
+    resp:
+        Prediction response [from the L0 BTB]
+    override:
+        Prediction override [from the L1 BTB]
+    wp:
+        Request to record a taken branch in both BTBs
+    btb_rp:
+        Additional L0 BTB read port [for the demand fetch unit]
+
     """
 
-    def __init__(self, param: EmberParams): 
+    def __init__(self, param: EmberParams):
         self.p = param
         sig = Signature({
             "req": In(NFPRequest(param)),
             "resp": Out(NFPResponse(param)),
+            "override": Out(NFPOverride(param)),
+            "wp": In(BTBWriteRequest(param)),
+            "btb_rp": In(L0BTBReadPort(param)),
         })
         super().__init__(sig)
 
@@ -76,19 +126,85 @@ class NextFetchPredictor(Component):
         fblk_addr = self.req.pc.get_fetch_addr()
 
         # Try to find the address in the L0 BTB
-        l0_btb = m.submodules.l0_btb = L0BranchTargetBuffer(self.p)
+        l0_btb = m.submodules.l0_btb = L0BranchTargetBuffer(self.p, num_rp=2)
         m.d.comb += [
-            l0_btb.rp.req.pc.eq(self.req.pc),
-            l0_btb.rp.req.valid.eq(self.req.valid),
+            l0_btb.rp[0].req.pc.eq(self.req.pc),
+            l0_btb.rp[0].req.valid.eq(self.req.valid),
         ]
+        connect(m, flipped(self.btb_rp), l0_btb.rp[1])
 
-        # Predict the next-sequential fetch block address
+        # On a hit, predict the target of the branch.
+        # Otherwise, predict the next-sequential fetch block address.
+        l0_resp = l0_btb.rp[0].resp
         m.d.comb += [
             self.resp.valid.eq(self.req.valid),
-            self.resp.pc.eq(fblk_addr + 0x20),
+            self.resp.hit.eq(l0_resp.hit),
+            self.resp.off.eq(l0_resp.slot.off),
+            self.resp.pc.eq(Mux(l0_resp.hit,
+                l0_resp.slot.tgt,
+                fblk_addr + self.p.vaddr.num_line_bytes
+            )),
         ]
 
-        return m
+        # Start an L1 BTB lookup in parallel
+        l1_btb = m.submodules.l1_btb = L1BranchTargetBuffer(self.p)
+        m.d.comb += [
+            l1_btb.rp.req.pc.eq(self.req.pc),
+            l1_btb.rp.req.valid.eq(self.req.valid),
+        ]
 
+        # Keep the L0 BTB result until the L1 BTB result is available
+        r1_l0_hit = Signal()
+        r1_l0_slot = Signal(BTBSlot(self.p))
+        r2_l0_hit = Signal()
+        r2_l0_slot = Signal(BTBSlot(self.p))
+        m.d.sync += [
+            r1_l0_hit.eq(l0_resp.hit),
+            r1_l0_slot.eq(l0_resp.slot),
+            r2_l0_hit.eq(r1_l0_hit),
+            r2_l0_slot.eq(r1_l0_slot),
+        ]
 
+        # Override the L0 BTB when the L1 BTB finds a different branch
+        l1_resp = l1_btb.rp.resp
+        disagree = Signal()
+        m.d.comb += disagree.eq(l1_resp.valid & l1_resp.hit & (
+            ~r2_l0_hit |
+            (r2_l0_slot.off != l1_resp.slot.off) |
+            (r2_l0_slot.tgt.bits != l1_resp.slot.tgt.bits)
+        ))
+        m.d.comb += [
+            self.override.valid.eq(disagree),
+            self.override.src_pc.eq(l1_resp.pc),
+            self.override.off.eq(l1_resp.slot.off),
+            self.override.pc.eq(l1_resp.slot.tgt),
+        ]
+
+        # Writes are sent to both BTBs. When there is no write request,
+        # the L0 BTB is refilled with the branch from the L1 BTB.
+        l1_branch_pc = Cat(
+            C(0, 2), l1_resp.slot.off, l1_resp.pc.fetch_blk
+        )
+        m.d.comb += [
+            l1_btb.wp.req.valid.eq(self.wp.valid),
+            l1_btb.wp.req.pc.eq(self.wp.pc),
+            l1_btb.wp.req.op.eq(self.wp.op),
+            l1_btb.wp.req.tgt.eq(self.wp.tgt),
+        ]
+        with m.If(self.wp.valid):
+            m.d.comb += [
+                l0_btb.wp.req.valid.eq(self.wp.valid),
+                l0_btb.wp.req.pc.eq(self.wp.pc),
+                l0_btb.wp.req.op.eq(self.wp.op),
+                l0_btb.wp.req.tgt.eq(self.wp.tgt),
+            ]
+        with m.Else():
+            m.d.comb += [
+                l0_btb.wp.req.valid.eq(disagree),
+                l0_btb.wp.req.pc.eq(l1_branch_pc),
+                l0_btb.wp.req.op.eq(l1_resp.slot.op),
+                l0_btb.wp.req.tgt.eq(l1_resp.slot.tgt),
+            ]
+
+        return m
 
@@ -8,7 +8,7 @@ from ember.param import *
 from ember.common.pipeline import *
 from ember.common.lfsr import *
 from ember.front.l1i import L1ICacheProbePort, L1IWaySelect
-from ember.front.itlb import L1ICacheTLBReadPort
+from ember.front.itlb import L1ICacheTLBReadPort, L1ICacheTLBXlatPort
 from ember.front.ifill import L1IFillPort, L1IFillStatus, L1IFillSource
 
 from ember.uarch.front import *
@@ -25,7 +25,7 @@ class L1IPrefetchUnit(Component):
 
         - A TLB miss occured; we cannot fill the L1I cache until resolving 
           the physical address of the cacheline. 
-          Send a request to TLB fill/PTW and report back to the FTQ. 
+          Send a request to the PTW and report back to the FTQ. 
 
         - A tag miss occured; the cacheline is not present in the L1I cache.
           Send a request to L1I fill and report back to the FTQ. 
@@ -34,19 +34,33 @@ class L1IPrefetchUnit(Component):
        This means the prefetch request is ineffective. 
        Report back to the FTQ indicating that the data has been prefetched. 
 
-    This pipeline *must* stall for fill unit availability in the case of 
-    a probe miss. 
+    This pipeline *must* stall for fill unit [or PTW] availability in the 
+    case of a probe miss. While stage 1 is stalled, stage 0 replays the 
+    probe for the stalled cacheline. 
+
+    A request covers every cacheline in a fetch block. The request is 
+    captured on the cycle it arrives, and stage 0 probes one cacheline per 
+    cycle until the last cacheline has been probed (reporting back to the 
+    FTQ for each one). No new requests are accepted until then. 
 
     Ports
     =====
+    sts: :class:`PrefetchPipelineStatus`
+        Ready to accept a request
     req: :class:`PrefetchRequest`
         Prefetch request from the FTQ
+    resp: :class:`PrefetchResponse`
+        Response to the FTQ [for each cacheline]
     l1i_pp: :class:`L1ICacheProbePort`
         L1I cache probe port
     tlb_pp: :class:`L1ICacheTLBReadPort`
         L1I TLB probe port
     ifill_req: 
         L1I fill request
+    ifill_sts:
+        L1I fill unit status
+    xlat:
+        Translation request [to the PTW]
 
     """
     def __init__(self, param: EmberParams):
@@ -61,6 +75,13 @@ class L1IPrefetchUnit(Component):
         
         self.r_stall = Signal()
 
+        # The request currently being walked by stage 0
+        self.r_busy     = Signal()
+        self.r_vaddr    = Signal(self.p.vaddr)
+        self.r_left     = Signal(self.p.fblk_size_shape)
+        self.r_ftq_idx  = Signal(self.p.ftq.index_shape)
+        self.r_passthru = Signal()
+
         sig = Signature({
             "sts": Out(PrefetchPipelineStatus()),
             "req": In(PrefetchRequest(param)),
@@ -69,41 +90,73 @@ class L1IPrefetchUnit(Component):
             "tlb_pp": Out(L1ICacheTLBReadPort()),
             "ifill_req": Out(L1IFillPort.Request(param)),
             "ifill_sts": In(L1IFillStatus(param)),
+            "xlat": Out(L1ICacheTLBXlatPort()),
         })
         super().__init__(sig)
 
     def elaborate_s0(self, m: Module):
 
-        # FIXME: Stall for fill unit availability?
         m.d.comb += [
-            self.sts.ready.eq(self.stage[1].ready)
+            self.sts.ready.eq(~self.r_busy & ~self.req.valid)
+        ]
+
+        # Select the cacheline to probe on this cycle. 
+        # When stage 1 is stalled, probe the stalled cacheline again. 
+        replay = ~self.stage[1].ready
+        probe_valid    = Signal()
+        probe_vaddr    = Signal(self.p.vaddr)
+        probe_passthru = Signal()
+        m.d.comb += [
+            probe_valid.eq(Mux(replay, self.stage[1].valid, self.r_busy)),
+            probe_vaddr.eq(Mux(replay, self.stage[1].vaddr, self.r_vaddr)),
+            probe_passthru.eq(
+                Mux(replay, self.stage[1].passthru, self.r_passthru)
+            ),
         ]
 
         # Probe the TLB
-        with m.If(self.req.passthru):
+        with m.If(probe_passthru):
             m.d.comb += [
                 self.tlb_pp.req.valid.eq(0),
                 self.tlb_pp.req.vpn.eq(0),
             ]
         with m.Else():
             m.d.comb += [
-                self.tlb_pp.req.valid.eq(self.req.valid),
-                self.tlb_pp.req.vpn.eq(self.req.vaddr.sv32.vpn),
+                self.tlb_pp.req.valid.eq(probe_valid),
+                self.tlb_pp.req.vpn.eq(probe_vaddr.sv32.vpn),
             ]
 
         # Probe all ways in the set
         m.d.comb += [
-            self.l1i_pp.req.valid.eq(self.req.valid),
-            self.l1i_pp.req.set.eq(self.req.vaddr.l1i.set),
+            self.l1i_pp.req.valid.eq(probe_valid),
+            self.l1i_pp.req.set.eq(probe_vaddr.l1i.set),
         ]
 
-        # FIXME: Pass to the next stage, otherwise wait
-        with m.If(self.stage[1].ready & self.req.valid):
+        # Pass the next cacheline to stage 1 and move to the next one
+        with m.If(~replay):
             m.d.sync += [
-                self.stage[1].valid.eq(self.req.valid),
-                self.stage[1].vaddr.eq(self.req.vaddr),
-                self.stage[1].passthru.eq(self.req.passthru),
-                self.stage[1].ftq_idx.eq(self.req.ftq_idx),
+                self.stage[1].valid.eq(self.r_busy),
+                self.stage[1].vaddr.eq(self.r_vaddr),
+                self.stage[1].passthru.eq(self.r_passthru),
+                self.stage[1].ftq_idx.eq(self.r_ftq_idx),
+            ]
+            with m.If(self.r_busy):
+                m.d.sync += [
+                    self.r_vaddr.fetch_blk.eq(self.r_vaddr.fetch_blk + 1),
+                    self.r_left.eq(self.r_left - 1),
+                ]
+                with m.If(self.r_left == 1):
+                    m.d.sync += self.r_busy.eq(0)
+
+        # Capture a new request
+        with m.If(self.req.valid & ~self.r_busy):
+            m.d.sync += [
+                self.r_busy.eq(1),
+                self.r_vaddr.eq(self.req.vaddr),
+                self.r_vaddr.fetch_off.eq(0),
+                self.r_left.eq(Mux(self.req.blocks == 0, 1, self.req.blocks)),
+                self.r_ftq_idx.eq(self.req.ftq_idx),
+                self.r_passthru.eq(self.req.passthru),
             ]
 
     def elaborate_s1(self, m: Module): 
@@ -116,6 +169,7 @@ class L1IPrefetchUnit(Component):
         m.d.sync += [
             self.resp.sts.eq(PrefetchResponseStatus.NONE),
             self.resp.vaddr.eq(0),
+            self.resp.paddr.eq(0),
             self.resp.valid.eq(0),
             self.resp.ftq_idx.eq(0),
         ]
@@ -201,18 +255,29 @@ class L1IPrefetchUnit(Component):
                 self.ifill_req.src.eq(L1IFillSource.PREFETCH),
             ]
 
-        m.d.comb += self.stage[1].ready.eq(~ifill_stall)
+        # Request translation after a TLB miss
+        xlat_req_valid = (sts == PrefetchResponseStatus.TLB_MISS)
+        xlat_fire  = Signal()
+        xlat_stall = Signal()
+        m.d.comb += [
+            xlat_fire.eq(xlat_req_valid & self.xlat.ready),
+            xlat_stall.eq(xlat_req_valid & ~self.xlat.ready),
+        ]
+        m.d.sync += [
+            self.xlat.req.valid.eq(xlat_fire),
+            self.xlat.req.vpn.eq(Mux(xlat_fire, vaddr.sv32.vpn, 0)),
+        ]
 
-        # FIXME: Inputs to TLB fill/PTW would go here..
-        m.d.sync += []
+        m.d.comb += self.stage[1].ready.eq(~ifill_stall & ~xlat_stall)
 
         # Respond to the FTQ 
         m.d.sync += [
             self.resp.sts.eq(sts),
             self.resp.vaddr.eq(vaddr),
+            self.resp.paddr.eq(paddr_sel),
             self.resp.valid.eq(self.stage[1].valid),
             self.resp.ftq_idx.eq(ftq_idx),
-            self.resp.stall.eq(ifill_stall),
+            self.resp.stall.eq(ifill_stall | xlat_stall),
         ]
 
     def elaborate(self, platform):
@@ -0,0 +1,414 @@
+
+from amaranth import *
+from amaranth.lib.data import *
+from amaranth.lib.wiring import *
+from amaranth.utils import ceil_log2, exact_log2
+
+from ember.common import *
+from ember.common.coding import EmberPriorityEncoder
+from ember.riscv.paging import *
+from ember.param import *
+from ember.front.itlb import L1ICacheTLBXlatPort, L1ICacheTLBFillRequest
+from ember.front.l2tlb import L2TLBReadPort, L2TLBFillRequest
+from ember.sim.fakeram import *
+
+
+class PageTableWalk(StructLayout):
+    """ The state of an outstanding page table walk.
+
+    Members
+    =======
+    valid:
+        This walk is in progress
+    vpn:
+        Virtual page number being translated
+    lvl:
+        Level of the page table being read [1 for the root table]. After
+        an L2 TLB hit, set when the entry maps a superpage.
+    ppn:
+        Physical page number of the page table being read
+    hold:
+        Waiting for the result of the L2 TLB lookup
+    done:
+        The translation was found in the L2 TLB
+    sent:
+        A memory request for this level has been sent
+    beat:
+        Number of beats received for this level
+    pte:
+        Page table entry captured from the memory response
+    """
+    def __init__(self, p: EmberParams):
+        num_beats = p.ptw.line_words // p.ptw.beat_words
+        super().__init__({
+            "valid": unsigned(1),
+            "vpn": VirtualPageNumberSv32(),
+            "lvl": unsigned(1),
+            "ppn": PhysicalPageNumberSv32(),
+            "hold": unsigned(1),
+            "done": unsigned(1),
+            "sent": unsigned(1),
+            "beat": unsigned(max(1, ceil_log2(num_beats))),
+            "pte": PageTableEntrySv32(),
+        })
+
+class PageDirectoryEntry(StructLayout):
+    """ An entry in the cache of non-leaf page table entries.
+
+    Members
+    =======
+    valid:
+        This entry is valid
+    vpn1:
+        Upper bits of the virtual page number
+    ppn:
+        Physical page number of the level 0 page table
+    """
+    def __init__(self):
+        super().__init__({
+            "valid": unsigned(1),
+            "vpn1": unsigned(10),
+            "ppn": PhysicalPageNumberSv32(),
+        })
+
+
+class PageTableWalker(Component):
+    """ Sv32 hardware page table walker (PTW).
+
+    Translation requests [after a TLB miss] are captured in a register
+    for each port, and at most one captured request is moved into a free
+    walk on each cycle. A request for a page that is already being walked
+    is simply dropped, since every completed walk is broadcast to all
+    ports.
+
+    Walks are pipelined: on each cycle, one walk may send a memory request,
+    and one walk may receive a memory response. Responses are tagged with
+    the index of the walk, and may be returned out-of-order.
+
+    1. The L2 TLB is looked up when a walk is allocated. On a hit, the 
+       TLB is filled and the translation is broadcast without reading 
+       memory. 
+
+    2. Otherwise, a walk starts at the root page table [from ``satp``], 
+       unless the non-leaf entry for the upper bits of the virtual page 
+       number is present in the PDE cache. In that case, the walk starts 
+       at level 0.
+
+    3. When a valid non-leaf entry is found at level 1, the entry is
+       recorded in the PDE cache and the walk moves to level 0.
+
+    4. When a valid leaf entry is found, the L1 and L2 TLBs are filled and 
+       the translation is broadcast on the next cycle. A leaf at level 1
+       (a superpage) fills the TLBs with the page-size bit set.
+
+    5. Otherwise, the translation is broadcast with ``fault`` set, and
+       the TLB is not filled.
+
+    The ready signal on each port indicates that the capture register will
+    be empty on the next cycle.
+
+    NOTE: Faults are also reported for leaf entries that are not
+    executable, or that have the ``A`` bit cleared (the walker never
+    updates page table entries). Privilege is not checked yet.
+
+    NOTE: Nothing writes ``satp`` yet, so the PDE cache is never
+    invalidated.
+
+    Ports
+    =====
+    satp:
+        Current value of the ``satp`` CSR
+    port:
+        Translation request ports
+    resp:
+        Completed translations [to the FTQ]
+    tlb_fill:
+        L1I TLB fill request
+    l2tlb_rp:
+        L2 TLB read port
+    l2tlb_fill:
+        L2 TLB fill request
+    fakeram:
+        Interface to memory
+
+    """
+    def __init__(self, param: EmberParams):
+        self.p = param
+        self.num_walk  = param.ptw.num_walk
+        self.num_port  = param.ptw.num_port
+        self.pde_depth = param.ptw.pde_depth
+        super().__init__(Signature({
+            "satp": In(SatpSv32()),
+            "port": In(L1ICacheTLBXlatPort()).array(self.num_port),
+            "resp": Out(L1ICacheTLBXlatPort.Response()),
+            "tlb_fill": Out(L1ICacheTLBFillRequest()),
+            "l2tlb_rp": Out(L2TLBReadPort()),
+            "l2tlb_fill": Out(L2TLBFillRequest()),
+            "fakeram": Out(FakeRamInterface(
+                param.ptw.beat_words, param.ptw.id_bits
+            )),
+        }))
+
+    def elaborate_pde(self, m: Module):
+        """ PDE cache.
+
+        Entries are written when a walk finds a non-leaf entry at level 1.
+        Writes update the entry with matching ``vpn1``, or replace the
+        oldest entry.
+        """
+        self.pde_arr = pde_arr = Array(
+            Signal(PageDirectoryEntry(), name=f"pde_arr{idx}")
+            for idx in range(self.pde_depth)
+        )
+        self.pde_wr = Signal(PageDirectoryEntry())
+
+        m.submodules.pde_wenc = wenc = EmberPriorityEncoder(self.pde_depth)
+        m.d.comb += wenc.i.eq(Cat(*[
+            pde_arr[idx].valid & (pde_arr[idx].vpn1 == self.pde_wr.vpn1)
+            for idx in range(self.pde_depth)
+        ]))
+
+        r_next = Signal(range(self.pde_depth), init=0)
+        widx = Mux(wenc.valid, wenc.o, r_next)
+        with m.If(self.pde_wr.valid):
+            m.d.sync += pde_arr[widx].eq(self.pde_wr)
+            with m.If(~wenc.valid):
+                m.d.sync += r_next.eq(Mux(r_next == self.pde_depth - 1,
+                    0, r_next + 1
+                ))
+
+    def elaborate(self, platform):
+        m = Module()
+
+        walks = Array(
+            Signal(PageTableWalk(self.p), name=f"walk{idx}")
+            for idx in range(self.num_walk)
+        )
+
+        self.elaborate_pde(m)
+
+        line_bits = exact_log2(self.p.ptw.line_words)
+        beat_bits = exact_log2(self.p.ptw.beat_words)
+
+        # Physical address of the entry being read by a walk
+        def pte_addr(walk):
+            vpn_sel = Mux(walk.lvl, walk.vpn.vpn1, walk.vpn.vpn0)
+            return Cat(C(0, 2), vpn_sel, walk.ppn)
+
+        # ----------------------------------------------------------------
+        # Handle memory responses.
+        #
+        # The beat containing the entry is captured, and the entry is used
+        # when the last beat arrives.
+
+        mem_resp = self.fakeram.resp
+        rwalk    = walks[mem_resp.id]
+        rword    = pte_addr(rwalk)[2:2 + line_bits]
+        rbeat    = rword >> beat_bits
+        rdata    = Array(mem_resp.data)[rword[:beat_bits]]
+        beat_hit = (rwalk.beat == rbeat)
+
+        pte = Signal(PageTableEntrySv32())
+        m.d.comb += pte.eq(Mux(beat_hit, rdata, rwalk.pte))
+
+        invalid    = ~pte.v | (~pte.r & pte.w)
+        leaf       = pte.r | pte.x
+        descend    = rwalk.lvl & ~invalid & ~leaf
+        misaligned = rwalk.lvl & (pte.ppn.ppn0 != 0)
+        fault      = invalid | ~leaf | ~pte.x | ~pte.a | misaligned
+
+        # Completed translations are visible on the next cycle
+        m.d.sync += [
+            self.resp.valid.eq(0),
+            self.resp.vpn.eq(0),
+            self.resp.fault.eq(0),
+            self.tlb_fill.valid.eq(0),
+            self.tlb_fill.vpn.eq(0),
+            self.tlb_fill.pte.eq(0),
+            self.tlb_fill.superpage.eq(0),
+            self.l2tlb_fill.valid.eq(0),
+            self.l2tlb_fill.vpn.eq(0),
+            self.l2tlb_fill.pte.eq(0),
+            self.l2tlb_fill.superpage.eq(0),
+        ]
+        for port in self.port:
+            m.d.comb += [
+                port.resp.valid.eq(self.resp.valid),
+                port.resp.vpn.eq(self.resp.vpn),
+                port.resp.fault.eq(self.resp.fault),
+            ]
+
+        m.d.comb += self.pde_wr.eq(0)
+        with m.If(mem_resp.valid):
+            m.d.sync += rwalk.beat.eq(rwalk.beat + 1)
+            with m.If(beat_hit):
+                m.d.sync += rwalk.pte.eq(rdata)
+            with m.If(mem_resp.last & descend):
+                m.d.sync += [
+                    rwalk.lvl.eq(0),
+                    rwalk.ppn.eq(pte.ppn),
+                    rwalk.sent.eq(0),
+                    rwalk.beat.eq(0),
+                ]
+                m.d.comb += [
+                    self.pde_wr.valid.eq(1),
+                    self.pde_wr.vpn1.eq(rwalk.vpn.vpn1),
+                    self.pde_wr.ppn.eq(pte.ppn),
+                ]
+            with m.Elif(mem_resp.last):
+                m.d.sync += [
+                    rwalk.valid.eq(0),
+                    self.resp.valid.eq(1),
+                    self.resp.vpn.eq(rwalk.vpn),
+                    self.resp.fault.eq(fault),
+                ]
+                with m.If(~fault):
+                    m.d.sync += [
+                        self.tlb_fill.valid.eq(1),
+                        self.tlb_fill.vpn.eq(rwalk.vpn),
+                        self.tlb_fill.pte.eq(pte),
+                        self.tlb_fill.superpage.eq(rwalk.lvl),
+                        self.l2tlb_fill.valid.eq(1),
+                        self.l2tlb_fill.vpn.eq(rwalk.vpn),
+                        self.l2tlb_fill.pte.eq(pte),
+                        self.l2tlb_fill.superpage.eq(rwalk.lvl),
+                    ]
+
+        # Otherwise, send a translation that was found in the L2 TLB
+        mem_done = mem_resp.valid & mem_resp.last & ~descend
+        m.submodules.done_enc = done_enc = EmberPriorityEncoder(self.num_walk)
+        m.d.comb += done_enc.i.eq(Cat(*[
+            walks[idx].valid & walks[idx].done
+            for idx in range(self.num_walk)
+        ]))
+        dwalk = walks[done_enc.o]
+        with m.If(done_enc.valid & ~mem_done):
+            m.d.sync += [
+                dwalk.valid.eq(0),
+                self.resp.valid.eq(1),
+                self.resp.vpn.eq(dwalk.vpn),
+                self.resp.fault.eq(0),
+                self.tlb_fill.valid.eq(1),
+                self.tlb_fill.vpn.eq(dwalk.vpn),
+                self.tlb_fill.pte.eq(dwalk.pte),
+                self.tlb_fill.superpage.eq(dwalk.lvl),
+            ]
+
+        # ----------------------------------------------------------------
+        # Handle the result of an L2 TLB lookup [for the walk allocated on 
+        # the previous cycle]. On a hit, the level of the walk records the 
+        # size of the page. 
+
+        r_l2_walk = Signal(range(self.num_walk))
+        l2_resp = self.l2tlb_rp.resp
+        lwalk = walks[r_l2_walk]
+        with m.If(l2_resp.valid):
+            m.d.sync += lwalk.hold.eq(0)
+            with m.If(l2_resp.hit):
+                m.d.sync += [
+                    lwalk.done.eq(1),
+                    lwalk.lvl.eq(l2_resp.superpage),
+                    lwalk.pte.eq(l2_resp.pte),
+                ]
+
+        # ----------------------------------------------------------------
+        # Send a memory request for one walk.
+        #
+        # Requests are for the cacheline containing the entry.
+
+        m.submodules.issue_enc = issue_enc = EmberPriorityEncoder(self.num_walk)
+        m.d.comb += issue_enc.i.eq(Cat(*[
+            walks[idx].valid & ~walks[idx].hold & ~walks[idx].done & 
+            ~walks[idx].sent
+            for idx in range(self.num_walk)
+        ]))
+        iwalk = walks[issue_enc.o]
+        m.d.comb += [
+            self.fakeram.req.valid.eq(issue_enc.valid),
+            self.fakeram.req.addr.eq(Cat(
+                C(0, 2 + line_bits), pte_addr(iwalk)[2 + line_bits:32]
+            )),
+            self.fakeram.req.id.eq(issue_enc.o),
+        ]
+        with m.If(self.fakeram.req.valid & self.fakeram.req.ready):
+            m.d.sync += iwalk.sent.eq(1)
+
+        # ----------------------------------------------------------------
+        # Capture translation requests, and start one walk.
+
+        pend_layout = StructLayout({
+            "valid": unsigned(1),
+            "vpn": VirtualPageNumberSv32(),
+        })
+        pend = [
+            Signal(pend_layout, name=f"pend{idx}")
+            for idx in range(self.num_port)
+        ]
+
+        m.submodules.pend_enc = pend_enc = EmberPriorityEncoder(self.num_port)
+        m.d.comb += pend_enc.i.eq(Cat(*[ x.valid for x in pend ]))
+        sel = Signal(pend_layout)
+        m.d.comb += sel.eq(Array(pend)[pend_enc.o])
+
+        # This page is already being walked
+        dup = Cat(*[
+            walks[idx].valid & (walks[idx].vpn == sel.vpn)
+            for idx in range(self.num_walk)
+        ]).any()
+
+        m.submodules.free_enc = free_enc = EmberPriorityEncoder(self.num_walk)
+        m.d.comb += free_enc.i.eq(Cat(*[
+            ~walks[idx].valid for idx in range(self.num_walk)
+        ]))
+
+        drain = pend_enc.valid & (dup | free_enc.valid)
+        alloc = pend_enc.valid & ~dup & free_enc.valid
+
+        # Start at level 0 when the PDE cache hits
+        pde_hit = Cat(*[
+            self.pde_arr[idx].valid &
+            (self.pde_arr[idx].vpn1 == sel.vpn.vpn1)
+            for idx in range(self.pde_depth)
+        ])
+        pde_ppn = Signal(PhysicalPageNumberSv32())
+        m.d.comb += pde_ppn.eq(0)
+        for idx in range(self.pde_depth):
+            with m.If(pde_hit[idx]):
+                m.d.comb += pde_ppn.eq(self.pde_arr[idx].ppn)
+
+        # Look up the L2 TLB before starting the walk
+        m.d.comb += [
+            self.l2tlb_rp.req.valid.eq(alloc),
+            self.l2tlb_rp.req.vpn.eq(sel.vpn),
+        ]
+        m.d.sync += r_l2_walk.eq(free_enc.o)
+
+        awalk = walks[free_enc.o]
+        with m.If(alloc):
+            m.d.sync += [
+                awalk.valid.eq(1),
+                awalk.vpn.eq(sel.vpn),
+                awalk.hold.eq(1),
+                awalk.done.eq(0),
+                awalk.lvl.eq(~pde_hit.any()),
+                awalk.ppn.eq(Mux(pde_hit.any(), pde_ppn, self.satp.ppn)),
+                awalk.sent.eq(0),
+                awalk.beat.eq(0),
+                awalk.pte.eq(0),
+            ]
+
+        for idx, port in enumerate(self.port):
+            drained = drain & (pend_enc.o == idx)
+            with m.If(drained):
+                m.d.sync += pend[idx].valid.eq(0)
+            with m.If(port.req.valid):
+                m.d.sync += [
+                    Assert(~pend[idx].valid | drained,
+                           "translation request was dropped"),
+                    pend[idx].valid.eq(1),
+                    pend[idx].vpn.eq(port.req.vpn),
+                ]
+            m.d.comb += port.ready.eq(~pend[idx].valid & ~port.req.valid)
+
+        return m
+
@@ -18,10 +18,104 @@ class L1ICacheTLBParams(object):
         #self.data_shape = PageTableEntrySv32()
         #self.tag_shape  = VirtualPageNumberSv32()
 
+class L2TLBParams(object):
+    """ L2 TLB parameters.
+
+    Parameters
+    ==========
+    num_sets:
+        Number of sets
+    num_ways:
+        Number of ways
+    num_port:
+        Number of read ports
+    """
+    def __init__(self, num_sets: int, num_ways: int, num_port: int):
+        assert num_ways >= 2
+        self.num_sets = num_sets
+        self.num_ways = num_ways
+        self.num_port = num_port
+        self.set_bits = exact_log2(num_sets)
+        self.way_bits = exact_log2(num_ways)
+        # The virtual page number bits above the set index
+        self.tag_bits = 20 - self.set_bits
+
+class PageTableWalkerParams(object):
+    """ Page table walker parameters.
+
+    Parameters
+    ==========
+    num_walk:
+        Number of outstanding walks
+    num_port:
+        Number of request ports
+    pde_depth:
+        Number of entries in the cache of non-leaf [level 1] entries
+    beat_words:
+        Number of words in each beat of a memory response
+    line_words:
+        Number of words in each memory request
+    id_bits:
+        Number of bits in the tag associated with a memory request
+    """
+    def __init__(self, num_walk: int, num_port: int, pde_depth: int = 4,
+                 beat_words: int = 8, line_words: int = 8, id_bits: int = 4):
+        assert line_words % beat_words == 0
+        assert max(1, ceil_log2(num_walk)) <= id_bits, \
+            "Not enough bits to tag memory requests"
+        self.num_walk = num_walk
+        self.num_port = num_port
+        self.pde_depth = pde_depth
+        self.beat_words = beat_words
+        self.line_words = line_words
+        self.id_bits = id_bits
+
+
 class L1IFillParams(object):
-    def __init__(self, num_mshr: int, num_port: int, **kwargs):
+    """ L1I fill unit parameters.
+
+    Parameters
+    ==========
+    num_mshr:
+        Number of miss-status holding registers
+    num_port:
+        Number of request ports
+    num_mem:
+        Number of memory channels [shared by all MSHRs]
+    wbuf_depth:
+        Number of entries in the fill write buffer
+    beat_words:
+        Number of words in each beat of a memory response
+    num_lbuf:
+        Number of outstanding cacheline requests for each MSHR
+    id_bits:
+        Number of bits in the tag associated with a memory request
+
+    The L1I cache write ports are shared by all MSHRs. The number of write 
+    ports is given by :class:`L1ICacheParams`. 
+    """
+    def __init__(self, num_mshr: int, num_port: int, 
+                 num_mem: int = 2, wbuf_depth: int = 4,
+                 beat_words: int = 8, num_lbuf: int = 2, id_bits: int = 4,
+                 **kwargs):
+        assert num_mem <= num_mshr
+        # The fill write buffer is indexed with wrapping pointers, and 
+        # its depth must be a power of two
+        exact_log2(wbuf_depth)
+        # Memory requests are tagged with the index of the MSHR (on the 
+        # memory channel) and the index of the line buffer
+        self.mshr_per_mem = (num_mshr + num_mem - 1) // num_mem
+        assert (
+            ceil_log2(self.mshr_per_mem) + max(1, ceil_log2(num_lbuf)) 
+            <= id_bits
+        ), "Not enough bits to tag memory requests"
         self.num_mshr = num_mshr
-        self.num_port = num_mshr
+        self.num_port = num_port
+        self.num_mem = num_mem
+        self.wbuf_depth = wbuf_depth
+        self.beat_words = beat_words
+        self.num_lbuf = num_lbuf
+        self.id_bits = id_bits
 
 
 class L1ICacheParams(object):
@@ -68,7 +162,7 @@ class L1ICacheParams(object):
         )
 
         # Ports
-        self.num_rp = 1
+        self.num_rp = 2
         self.num_wp = 2
         self.num_pp = 1
 
@@ -94,10 +188,34 @@ class L1ICacheParams(object):
         )
 
 
+class PrefetchParams(object):
+    """ FTQ-directed instruction prefetch parameters.
+
+    Parameters
+    ==========
+    max_dist:
+        Maximum number of FTQ entries ahead of the fetch pointer which may 
+        be sent to the PFU
+    max_inflight:
+        Maximum number of outstanding prefetch fills
+    acc_bits:
+        Number of bits in the prefetch accuracy counter
+    """
+    def __init__(self, max_dist: int, max_inflight: int, acc_bits: int):
+        assert max_dist >= 1 and max_inflight >= 1 and acc_bits >= 2
+        self.max_dist = max_dist
+        self.max_inflight = max_inflight
+        self.acc_bits = acc_bits
+
 class FTQParams(object):
     def __init__(self): 
         self.depth = 16
         self.index_shape = unsigned(exact_log2(self.depth))
+        self.prefetch = PrefetchParams(
+            max_dist=4,
+            max_inflight=2,
+            acc_bits=3,
+        )
 
 class FetchParams(object):
     """ Instruction fetch parameters.
@@ -119,8 +237,247 @@ class FetchParams(object):
         self.offset_bits = ceil_log2(self.width_bytes)
 
 class L0BTBParams(object):
-    def __init__(self):
-        self.depth = 16
+    """ L0 BTB parameters.
+
+    Parameters
+    ==========
+    depth:
+        Number of entries (one branch per entry)
+    """
+    def __init__(self, depth: int):
+        self.depth = depth
+
+class L1BTBParams(object):
+    """ L1 BTB parameters.
+
+    Each entry in the L1 BTB is associated with a single cacheline, and 
+    may hold multiple branches. 
+
+    Parameters
+    ==========
+    num_sets:
+        Number of sets
+    num_ways:
+        Number of ways
+    num_slots:
+        Number of branches in each entry
+    tag_bits:
+        Number of partial tag bits in an entry
+    """
+    def __init__(self, num_sets: int, num_ways: int, num_slots: int,
+                 tag_bits: int):
+        self.num_sets  = num_sets
+        self.num_ways  = num_ways
+        self.num_slots = num_slots
+        self.tag_bits  = tag_bits
+        self.set_bits  = exact_log2(num_sets)
+        self.way_bits  = exact_log2(num_ways)
+
+class RapParams(object):
+    """ Return address predictor parameters.
+
+    Parameters
+    ==========
+    depth:
+        Number of entries in the stack
+    ctr_bits:
+        Number of bits in the repeat counter for each entry
+    """
+    def __init__(self, depth: int, ctr_bits: int):
+        self.depth    = depth
+        self.ctr_bits = ctr_bits
+
+class BimodalParams(object):
+    """ Bimodal conditional branch predictor parameters.
+
+    Parameters
+    ==========
+    depth:
+        Number of 2-bit counters
+    """
+    def __init__(self, depth: int):
+        self.depth    = depth
+        self.idx_bits = exact_log2(depth)
+
+class GshareParams(object):
+    """ Gshare conditional branch predictor parameters.
+
+    Parameters
+    ==========
+    depth:
+        Number of 2-bit counters
+    hist_len:
+        Number of global history bits hashed with the program counter
+    """
+    def __init__(self, depth: int, hist_len: int):
+        self.depth    = depth
+        self.idx_bits = exact_log2(depth)
+        self.hist_len = hist_len
+
+class PerceptronParams(object):
+    """ Hashed perceptron conditional branch predictor parameters.
+
+    The first weight table is indexed only by the program counter (and 
+    holds the bias weight). The global history is divided evenly between 
+    the remaining tables. 
+
+    Parameters
+    ==========
+    num_tables:
+        Number of weight tables
+    depth:
+        Number of weights in each table
+    weight_bits:
+        Number of bits in a signed weight
+    hist_len:
+        Number of global history bits used by all tables
+    """
+    def __init__(self, num_tables: int, depth: int, weight_bits: int, 
+                 hist_len: int):
+        assert num_tables >= 2
+        assert hist_len % (num_tables - 1) == 0
+        self.num_tables  = num_tables
+        self.depth       = depth
+        self.idx_bits    = exact_log2(depth)
+        self.weight_bits = weight_bits
+        self.hist_len    = hist_len
+        self.seg_len     = hist_len // (num_tables - 1)
+
+        # Width of the sum of all weights
+        self.sum_bits  = weight_bits + ceil_log2(num_tables) + 1
+        # Training threshold
+        self.threshold = int(2.14 * (num_tables + 1) + 20.58)
+
+class TageParams(object):
+    """ TAGE conditional branch predictor parameters. 
+
+    The history lengths used by the tagged tables form a geometric series 
+    between ``min_hist`` and ``max_hist``. 
+
+    Parameters
+    ==========
+    num_tables:
+        Number of tagged tables
+    base_depth:
+        Number of entries in the bimodal base table
+    table_depth:
+        Number of entries in each tagged table
+    tag_bits:
+        Number of partial tag bits in a tagged entry
+    ctr_bits:
+        Number of bits in a tagged prediction counter
+    u_bits:
+        Number of bits in a "useful" counter
+    min_hist:
+        Global history length used by the first tagged table
+    max_hist:
+        Global history length used by the last tagged table
+
+    """
+    def __init__(self, num_tables: int, base_depth: int, table_depth: int,
+                 tag_bits: int, ctr_bits: int, u_bits: int,
+                 min_hist: int, max_hist: int):
+        assert num_tables >= 2
+        assert min_hist < max_hist
+        self.num_tables  = num_tables
+        self.base_depth  = base_depth
+        self.table_depth = table_depth
+        self.tag_bits    = tag_bits
+        self.ctr_bits    = ctr_bits
+        self.u_bits      = u_bits
+        self.min_hist    = min_hist
+        self.max_hist    = max_hist
+
+        self.base_idx_bits = exact_log2(base_depth)
+        self.idx_bits      = exact_log2(table_depth)
+
+        # History length used by each tagged table
+        ratio = (max_hist / min_hist) ** (1 / (num_tables - 1))
+        self.hist_len = [ 
+            int(min_hist * (ratio ** idx) + 0.5) for idx in range(num_tables)
+        ]
+
+
+class IttageParams(object):
+    """ ITTAGE indirect target predictor parameters.
+
+    The path history lengths used by the tagged tables form a geometric 
+    series between ``min_hist`` and ``max_hist``. 
+
+    Parameters
+    ==========
+    num_tables:
+        Number of tagged tables
+    base_depth:
+        Number of entries in the base table
+    table_depth:
+        Number of entries in each tagged table
+    tag_bits:
+        Number of partial tag bits in a tagged entry
+    ctr_bits:
+        Number of bits in a confidence counter
+    min_hist:
+        Path history length used by the first tagged table
+    max_hist:
+        Path history length used by the last tagged table
+
+    """
+    def __init__(self, num_tables: int, base_depth: int, table_depth: int,
+                 tag_bits: int, ctr_bits: int, min_hist: int, max_hist: int):
+        assert num_tables >= 2
+        assert min_hist < max_hist
+        self.num_tables  = num_tables
+        self.base_depth  = base_depth
+        self.table_depth = table_depth
+        self.tag_bits    = tag_bits
+        self.ctr_bits    = ctr_bits
+        self.min_hist    = min_hist
+        self.max_hist    = max_hist
+
+        self.base_idx_bits = exact_log2(base_depth)
+        self.idx_bits      = exact_log2(table_depth)
+
+        # Number of bits in the path history register
+        self.hist_bits = max_hist
+
+        # History length used by each tagged table
+        ratio = (max_hist / min_hist) ** (1 / (num_tables - 1))
+        self.hist_len = [ 
+            int(min_hist * (ratio ** idx) + 0.5) for idx in range(num_tables)
+        ]
+
+class LoopParams(object):
+    """ Loop predictor parameters.
+
+    Parameters
+    ==========
+    depth:
+        Number of entries
+    tag_bits:
+        Number of partial tag bits in an entry
+    iter_bits:
+        Number of bits in an iteration counter (the largest trip count)
+    conf_bits:
+        Number of bits in a confidence counter
+    age_bits:
+        Number of bits in an age counter [used for replacement]
+    """
+    def __init__(self, depth: int, tag_bits: int, iter_bits: int, 
+                 conf_bits: int, age_bits: int):
+        self.depth     = depth
+        self.tag_bits  = tag_bits
+        self.iter_bits = iter_bits
+        self.conf_bits = conf_bits
+        self.age_bits  = age_bits
+        self.idx_bits  = exact_log2(depth)
+
+
+class DirectionPredictorKind(Enum):
+    """ Type of conditional branch direction predictor. """
+    BIMODAL    = "bimodal"
+    GSHARE     = "gshare"
+    PERCEPTRON = "perceptron"
+    TAGE       = "tage"
 
 
 class BranchPredictionParams(object):
@@ -130,10 +487,79 @@ class BranchPredictionParams(object):
 
     Parameters
     ==========
+    direction: :class:`DirectionPredictorKind`
+        The type of conditional branch predictor used by the BPU
+    ghist_bits:
+        Number of bits in the global branch history
+    l0_btb: :class:`L0BTBParams`
+        L0 BTB parameters
+    l1_btb: :class:`L1BTBParams`
+        L1 BTB parameters
+    rap: :class:`RapParams`
+        Return address predictor parameters
+    bimodal: :class:`BimodalParams`
+        Bimodal conditional branch predictor parameters
+    gshare: :class:`GshareParams`
+        Gshare conditional branch predictor parameters
+    perceptron: :class:`PerceptronParams`
+        Hashed perceptron conditional branch predictor parameters
+    tage: :class:`TageParams`
+        TAGE conditional branch predictor parameters
+    ittage: :class:`IttageParams`
+        ITTAGE indirect target predictor parameters
+    loop: :class:`LoopParams`
+        Loop predictor parameters
 
     """
     def __init__(self):
-        self.l0_btb = L0BTBParams()
+        self.direction = DirectionPredictorKind.TAGE
+        self.l0_btb = L0BTBParams(depth=16)
+        self.l1_btb = L1BTBParams(
+            num_sets=256,
+            num_ways=4,
+            num_slots=2,
+            tag_bits=12,
+        )
+        self.rap = RapParams(depth=8, ctr_bits=2)
+        self.bimodal = BimodalParams(depth=1024)
+        self.gshare = GshareParams(depth=1024, hist_len=10)
+        self.perceptron = PerceptronParams(
+            num_tables=8,
+            depth=256,
+            weight_bits=6,
+            hist_len=56,
+        )
+        self.tage = TageParams(
+            num_tables=4,
+            base_depth=1024,
+            table_depth=256,
+            tag_bits=8,
+            ctr_bits=3,
+            u_bits=2,
+            min_hist=4,
+            max_hist=64,
+        )
+        self.ittage = IttageParams(
+            num_tables=3,
+            base_depth=64,
+            table_depth=64,
+            tag_bits=9,
+            ctr_bits=2,
+            min_hist=4,
+            max_hist=32,
+        )
+        self.loop = LoopParams(
+            depth=16,
+            tag_bits=10,
+            iter_bits=10,
+            conf_bits=2,
+            age_bits=2,
+        )
+        self.ghist_bits = max(
+            self.gshare.hist_len, 
+            self.perceptron.hist_len, 
+            self.tage.max_hist,
+        )
 
 
 
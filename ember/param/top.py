@@ -52,6 +52,10 @@ class EmberParams:
 
     l1i: L1ICacheParams
         L1I cache parameters
+    ptw: PageTableWalkerParams
+        Page table walker parameters
+    l2tlb: L2TLBParams
+        L2 TLB parameters
     bp: BranchPredictionParams
         Branch prediction parameters
     ftq: FTQParams
@@ -85,6 +89,24 @@ class EmberParams:
             line_depth=8,
         )
 
+        # Page table walker parameters
+        self.ptw = PageTableWalkerParams(
+            num_walk=4,
+            num_port=2,
+            pde_depth=4,
+            beat_words=self.l1i.fill.beat_words,
+            line_words=self.l1i.line_depth,
+        )
+
+        # L2 TLB parameters
+        # NOTE: Port 0 is used by the PTW [for L1I TLB misses], and port 1
+        # is reserved for a data TLB. 
+        self.l2tlb = L2TLBParams(
+            num_sets=64,
+            num_ways=4,
+            num_port=2,
+        )
+
         # Virtual address layout
         self.vaddr = VirtualAddress(
             l1i_line_bytes=self.l1i.line_bytes,
@@ -0,0 +1,979 @@
+""" Trace-driven models of the branch predictors.
+
+Each model is parameterized by the same :class:`BranchPredictionParams` as
+the corresponding RTL predictor in :mod:`ember.front.bp`, and is meant to
+be bit-exact with the RTL when branches are predicted and trained in order:
+each branch is predicted, and then immediately updated (and recovered, when
+mispredicted) before the next branch is predicted. In this mode, the
+speculative state of each predictor (the global history and the speculative
+loop iteration counts) always follows the resolved outcomes.
+
+The path history used by the ITTAGE model follows the same definition as 
+the control-flow controller: the address of every taken control-flow 
+instruction is shifted in (see :func:`crosscheck_cfc`). 
+
+The results of :func:`run_trace` describe the predictors, and not the 
+pipelined frontend. The following are not modeled: 
+
+- Back-to-back predictions. In the RTL, a prediction requested on the 
+  cycle after another prediction is made with a history that does not 
+  include the previous outcome [the history is repaired correctly when 
+  either prediction is recovered]. 
+- Wrong-path predictions, and updates made long after a prediction. 
+- The speculative path history. The RTL shifts in the predicted-taken 
+  instructions when they are predicted, while the model only shifts in 
+  the resolved outcomes. 
+
+Branch Traces
+=============
+A trace is a gzip-compressed file containing an 8-byte magic value, the
+number of instructions retired while the trace was captured (as a
+little-endian 64-bit integer), and a sequence of records (one for each
+retired control-flow instruction):
+
+====== ===== =========================================================
+Offset Size  Description
+====== ===== =========================================================
+0      4     Program counter
+4      4     Target address (or the next program counter)
+8      1     Type of control-flow instruction (:class:`ControlFlowOp`)
+9      1     The resolved direction
+====== ===== =========================================================
+
+NumPy and Numba are optional. When NumPy is available, traces are loaded
+directly into arrays and the hashes used to index each table are computed
+for a whole trace at once. When Numba is also available, the loop that
+predicts and trains each branch is compiled, and the tables are kept in
+arrays (replaying millions of branches per second instead of tens of
+thousands). Otherwise, everything is computed with Python integers.
+
+Cross-checking
+==============
+The ``crosscheck_*`` functions replay a (short) trace through both a model
+and the RTL predictor (with the Amaranth simulator), and return a list of
+branches where the predictions differ.
+The predictors are given histories computed from the trace, except in 
+:func:`crosscheck_cfc`, where the path history is kept by the control-flow 
+controller. 
+
+"""
+
+import gzip
+import struct
+from abc import ABCMeta, abstractmethod
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+from amaranth.sim import Tick
+
+from ember.param import *
+from ember.param.front import DirectionPredictorKind
+from ember.uarch.mop import ControlFlowOp
+
+# ----------------------------------------------------------------------------
+# Helpers (see :mod:`ember.front.bp.common`)
+
+def _mask(width: int) -> int:
+    return (1 << width) - 1
+
+def _jit(fn):
+    """ Compile a function with Numba (when it is available). """
+    return njit(cache=True)(fn) if njit is not None else fn
+
+@_jit
+def _fold_array(hist, length, width, res):
+    for i in range(len(hist)):
+        fold = np.uint64(0)
+        for off in range(0, length, width):
+            mask = np.uint64((1 << min(width, length - off)) - 1)
+            fold ^= (hist[i] >> np.uint64(off)) & mask
+        res[i] = fold
+
+def fold_history(hist, length: int, width: int):
+    """ XOR-fold the ``length`` most-recent bits of a history into a
+    ``width``-bit value (see :func:`ember.front.bp.common.fold_history`).
+    """
+    if (njit is not None) and isinstance(hist, np.ndarray):
+        res = np.empty(len(hist), dtype=np.uint64)
+        _fold_array(hist.astype(np.uint64, copy=False), length, width, res)
+        return res
+    res = 0
+    for off in range(0, length, width):
+        res = res ^ ((hist >> off) & _mask(min(width, length - off)))
+    return res
+
+@_jit
+def counter_update(ctr: int, up: bool, width: int) -> int:
+    """ Return the next value of a saturating counter. """
+    if up:
+        return ctr if ctr == (1 << width) - 1 else ctr + 1
+    return ctr if ctr == 0 else ctr - 1
+
+@_jit
+def counter_weak(width: int, taken: bool) -> int:
+    """ Return the weakly-taken or weakly-not-taken counter value. """
+    return (1 << (width - 1)) if taken else (1 << (width - 1)) - 1
+
+@_jit
+def weight_update(w: int, up: bool, width: int) -> int:
+    """ Return the next value of a saturating signed weight. """
+    if up:
+        return min(w + 1, (1 << (width - 1)) - 1)
+    return max(w - 1, -(1 << (width - 1)))
+
+@_jit
+def _shift_array(symbols, sym_bits, mask, hist):
+    for i in range(len(symbols)):
+        hist[i+1] = ((hist[i] << sym_bits) | symbols[i]) & mask
+
+def shift_history(symbols, sym_bits: int, hist_bits: int):
+    """ Return the history before each symbol is shifted in, followed by the
+    final history.
+
+    Symbols are shifted into the least-significant bits of the history
+    (see :class:`ember.front.bp.common.GlobalHistoryRegister` and
+    :func:`ember.front.bp.ittage.path_history_update`).
+    """
+    if np is not None:
+        symbols = np.asarray(symbols, dtype=np.uint64)
+        hist = np.zeros(len(symbols) + 1, dtype=np.uint64)
+        if njit is not None:
+            _shift_array(symbols, np.uint64(sym_bits),
+                np.uint64(_mask(hist_bits)), hist
+            )
+            return hist
+        for depth in range(hist_bits // sym_bits):
+            if depth >= len(symbols):
+                break
+            hist[depth+1:] |= symbols[:len(symbols)-depth] << np.uint64(
+                depth * sym_bits
+            )
+        return hist
+    hist = [0]
+    for sym in symbols:
+        hist.append(((hist[-1] << sym_bits) | sym) & _mask(hist_bits))
+    return hist
+
+def _columns(values):
+    """ Return a tuple of columns as lists of Python integers. """
+    if np is not None:
+        return tuple(np.asarray(col).tolist() for col in values)
+    return tuple(list(col) for col in values)
+
+# Number of records hashed at once
+_HASH_CHUNK = 1 << 14
+
+def _table(fill: int, *shape):
+    """ Return a table with the given shape.
+
+    Tables are arrays when the models are compiled, and (nested) lists of
+    Python integers otherwise.
+    """
+    if njit is not None:
+        return np.full(shape, fill, dtype=np.int64)
+    if len(shape) == 1:
+        return [fill] * shape[0]
+    return [ _table(fill, *shape[1:]) for _ in range(shape[0]) ]
+
+def _inputs(cols):
+    """ Return columns in the form expected by the compiled models: a 2D
+    array with one row for each column, or a tuple of lists.
+    """
+    if njit is not None:
+        return np.stack([ np.asarray(col, dtype=np.int64) for col in cols ])
+    return _columns(cols)
+
+def _apply(fn, *cols):
+    """ Apply a hash function to a whole trace.
+
+    With NumPy, the trace is hashed in chunks that fit in the cache.
+    """
+    if np is not None:
+        cols = [ np.asarray(col, dtype=np.uint64) for col in cols ]
+        num = len(cols[0])
+        res = None
+        for lo in range(0, max(num, 1), _HASH_CHUNK):
+            hs = fn(*(col[lo:lo+_HASH_CHUNK] for col in cols))
+            if res is None:
+                res = np.empty((len(hs), num), dtype=np.int64)
+            for row, h in zip(res, hs):
+                row[lo:lo+_HASH_CHUNK] = h
+        return res if njit is not None else _columns(res)
+    res = [ fn(*args) for args in zip(*cols) ]
+    return tuple(list(col) for col in zip(*res)) if res else ()
+
+
+# ----------------------------------------------------------------------------
+# Branch traces
+
+class BranchTrace(object):
+    """ A sequence of retired control-flow instructions.
+
+    Members
+    =======
+    pc:
+        Program counter of each instruction
+    tgt:
+        Target address (or the next program counter) of each instruction
+    op:
+        Type of each instruction (:class:`ControlFlowOp`)
+    taken:
+        The resolved direction of each instruction
+    insts:
+        Number of retired instructions
+    """
+    MAGIC = b"EMBRBT\x00\x01"
+    RECORD = struct.Struct("<IIBB")
+
+    def __init__(self, pc, tgt, op, taken, insts: int = 0):
+        assert len(pc) == len(tgt) == len(op) == len(taken)
+        self.pc    = pc
+        self.tgt   = tgt
+        self.op    = op
+        self.taken = taken
+        self.insts = insts
+
+    def __len__(self):
+        return len(self.pc)
+
+    @classmethod
+    def from_records(cls, records, insts: int = 0):
+        """ Create a trace from a list of ``(pc, tgt, op, taken)`` tuples. """
+        cols = [ list(col) for col in zip(*records) ] or [[], [], [], []]
+        cols[2] = [ ControlFlowOp(op).value for op in cols[2] ]
+        if np is not None:
+            dtypes = [ np.uint32, np.uint32, np.uint8, np.uint8 ]
+            cols = [ np.asarray(col, dtype=dt) for col, dt in zip(cols, dtypes) ]
+        return cls(*cols, insts=insts)
+
+    @classmethod
+    def load(cls, path: str):
+        with gzip.open(path, "rb") as f:
+            data = f.read()
+        if data[:8] != cls.MAGIC:
+            raise ValueError(f"{path} is not a branch trace")
+        insts, = struct.unpack_from("<Q", data, 8)
+        body = data[16:]
+        if np is not None:
+            dt = np.dtype([
+                ("pc", "<u4"), ("tgt", "<u4"), ("op", "u1"), ("taken", "u1")
+            ])
+            arr = np.frombuffer(body, dtype=dt)
+            return cls(arr["pc"], arr["tgt"], arr["op"], arr["taken"], insts)
+        return cls.from_records(cls.RECORD.iter_unpack(body), insts)
+
+    def save(self, path: str):
+        with gzip.open(path, "wb") as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack("<Q", self.insts))
+            for rec in zip(*_columns((self.pc, self.tgt, self.op, self.taken))):
+                f.write(self.RECORD.pack(*rec))
+
+    def select(self, ops):
+        """ Return the indices of records with one of the given types. """
+        ops = [ ControlFlowOp(op).value for op in ops ]
+        if np is not None:
+            return np.flatnonzero(np.isin(self.op, ops))
+        return [ idx for idx, op in enumerate(self.op) if op in ops ]
+
+    def column(self, name: str, idxs):
+        col = getattr(self, name)
+        if np is not None:
+            return col[idxs]
+        return [ col[idx] for idx in idxs ]
+
+    def path_history(self, hist_bits: int):
+        """ Return the path history before each record.
+
+        The program counter of every taken control-flow instruction is
+        shifted into the path history (see
+        :func:`ember.front.bp.ittage.path_history_update`).
+        """
+        if np is not None:
+            is_taken = (self.op != ControlFlowOp.BRANCH.value) | (self.taken != 0)
+            syms = (self.pc[is_taken].astype(np.uint64) >> np.uint64(2)) & np.uint64(3)
+            hist = shift_history(syms, 2, hist_bits)
+            cnt = np.cumsum(is_taken) - is_taken
+            return hist[cnt]
+        res = []
+        hist = 0
+        for pc, op, taken in zip(self.pc, self.op, self.taken):
+            res.append(hist)
+            if (op != ControlFlowOp.BRANCH.value) or taken:
+                hist = ((hist << 2) | ((pc >> 2) & 3)) & _mask(hist_bits)
+        return res
+
+
+# ----------------------------------------------------------------------------
+# Conditional branch direction predictors
+
+class DirectionModel(metaclass=ABCMeta):
+    """ Base class for conditional branch direction predictor models.
+
+    Subclasses must implement :meth:`hashes` (which must work with either
+    Python integers or NumPy arrays) and :meth:`replay`.
+    """
+    def __init__(self, param: EmberParams):
+        self.p = param
+
+    @abstractmethod
+    def hashes(self, pc, ghist):
+        """ Return a tuple of the indices/tags used to access the tables. """
+
+    @abstractmethod
+    def replay(self, hs, taken, pred):
+        """ Predict each branch and train the predictor with the resolved
+        outcome before predicting the next branch.
+
+        ``hs`` holds a column for each value returned by :meth:`hashes`,
+        and the prediction for each branch is written to ``pred``.
+        """
+
+    def run(self, pc, taken):
+        """ Predict and train a sequence of conditional branches, returning
+        the predictions (as an array when the models are compiled).
+        """
+        ghist = shift_history(taken, 1, self.p.bp.ghist_bits)[:-1]
+        hs = _apply(self.hashes, pc, ghist)
+        taken, = _inputs((taken,))
+        pred = _table(0, len(taken))
+        self.replay(hs, taken, pred)
+        return pred
+
+
+@_jit
+def _counter_replay(hs, taken, ctr, pred):
+    for i in range(len(taken)):
+        idx = hs[0][i]
+        pred[i] = ctr[idx] >> 1
+        ctr[idx] = counter_update(ctr[idx], taken[i], 2)
+
+class BimodalModel(DirectionModel):
+    """ Model of :class:`ember.front.bp.bimodal.BimodalPredictor`. """
+    def __init__(self, param: EmberParams):
+        super().__init__(param)
+        self.bp = param.bp.bimodal
+        self.ctr = _table(1, self.bp.depth)
+
+    def hashes(self, pc, ghist):
+        return ((pc >> 2) & _mask(self.bp.idx_bits),)
+
+    def replay(self, hs, taken, pred):
+        _counter_replay(hs, taken, self.ctr, pred)
+
+
+class GshareModel(DirectionModel):
+    """ Model of :class:`ember.front.bp.gshare.GsharePredictor`. """
+    def __init__(self, param: EmberParams):
+        super().__init__(param)
+        self.gp = param.bp.gshare
+        self.ctr = _table(1, self.gp.depth)
+
+    def hashes(self, pc, ghist):
+        gp = self.gp
+        fold = fold_history(ghist, gp.hist_len, gp.idx_bits)
+        return (((pc >> 2) ^ fold) & _mask(gp.idx_bits),)
+
+    def replay(self, hs, taken, pred):
+        _counter_replay(hs, taken, self.ctr, pred)
+
+
+@_jit
+def _perceptron_replay(hs, taken, w, threshold, weight_bits, pred):
+    num_tables = len(w)
+    for i in range(len(taken)):
+        w_sum = 0
+        for table in range(num_tables):
+            w_sum += w[table][hs[table][i]]
+        pred[i] = 1 if w_sum >= 0 else 0
+        if (pred[i] != taken[i]) or (abs(w_sum) <= threshold):
+            for table in range(num_tables):
+                idx = hs[table][i]
+                w[table][idx] = weight_update(w[table][idx], taken[i],
+                    weight_bits
+                )
+
+class PerceptronModel(DirectionModel):
+    """ Model of :class:`ember.front.bp.perceptron.PerceptronPredictor`. """
+    def __init__(self, param: EmberParams):
+        super().__init__(param)
+        self.pp = param.bp.perceptron
+        self.w = _table(0, self.pp.num_tables, self.pp.depth)
+
+    def hashes(self, pc, ghist):
+        pp = self.pp
+        pc_idx = (pc >> 2) & _mask(pp.idx_bits)
+        res = [ pc_idx ]
+        for table in range(1, pp.num_tables):
+            lo = (table - 1) * pp.seg_len
+            seg = (ghist >> lo) & _mask(pp.seg_len)
+            res.append(
+                (pc_idx ^ fold_history(seg, pp.seg_len, pp.idx_bits)) &
+                _mask(pp.idx_bits)
+            )
+        return tuple(res)
+
+    def replay(self, hs, taken, pred):
+        pp = self.pp
+        _perceptron_replay(hs, taken, self.w, pp.threshold, pp.weight_bits,
+            pred
+        )
+
+
+@_jit
+def _tage_replay(hs, taken, base, valid, tag, ctr, u, ctr_bits, u_bits, pred):
+    # Column 0 is the base index, followed by the index and tag for each
+    # tagged table. 'prov' and 'alloc' are -1 when there is no provider
+    # and no table to allocate.
+    num_tables = len(valid)
+    for i in range(len(taken)):
+        base_idx = hs[0][i]
+        prov_pred = base[base_idx] >> 1
+        alt_pred  = prov_pred
+        prov = -1
+        for t in range(num_tables):
+            idx = hs[1 + 2*t][i]
+            if (valid[t][idx] != 0) and (tag[t][idx] == hs[2 + 2*t][i]):
+                alt_pred  = prov_pred
+                prov_pred = ctr[t][idx] >> (ctr_bits - 1)
+                prov = t
+
+        mispred = (prov_pred != taken[i])
+        alloc = -1
+        for t in range(prov + 1, num_tables):
+            if u[t][hs[1 + 2*t][i]] == 0:
+                alloc = t
+                break
+
+        if prov < 0:
+            base[base_idx] = counter_update(base[base_idx], taken[i], 2)
+        for t in range(num_tables):
+            idx = hs[1 + 2*t][i]
+            if t == prov:
+                valid[t][idx] = 1
+                tag[t][idx] = hs[2 + 2*t][i]
+                ctr[t][idx] = counter_update(ctr[t][idx], taken[i], ctr_bits)
+                if prov_pred != alt_pred:
+                    u[t][idx] = counter_update(u[t][idx], not mispred, u_bits)
+            elif mispred and (alloc == t):
+                valid[t][idx] = 1
+                tag[t][idx] = hs[2 + 2*t][i]
+                ctr[t][idx] = counter_weak(ctr_bits, taken[i])
+                u[t][idx] = 0
+            elif mispred and (alloc < 0) and (t > prov):
+                u[t][idx] = counter_update(u[t][idx], False, u_bits)
+        pred[i] = prov_pred
+
+class TageModel(DirectionModel):
+    """ Model of :class:`ember.front.bp.tage.TagePredictor`. """
+    def __init__(self, param: EmberParams):
+        super().__init__(param)
+        tp = self.tp = param.bp.tage
+        self.base = _table(1, tp.base_depth)
+        self.valid = _table(0, tp.num_tables, tp.table_depth)
+        self.tag = _table(0, tp.num_tables, tp.table_depth)
+        self.ctr = _table(0, tp.num_tables, tp.table_depth)
+        self.u = _table(0, tp.num_tables, tp.table_depth)
+
+    def hashes(self, pc, ghist):
+        tp = self.tp
+        res = [ (pc >> 2) & _mask(tp.base_idx_bits) ]
+        for table in range(tp.num_tables):
+            hlen = tp.hist_len[table]
+            idx = ((pc >> 2) ^ fold_history(ghist, hlen, tp.idx_bits))
+            pc_tag = (pc >> (2 + tp.idx_bits)) & _mask(tp.tag_bits)
+            h0 = fold_history(ghist, hlen, tp.tag_bits)
+            h1 = fold_history(ghist, hlen, tp.tag_bits - 1)
+            res.append(idx & _mask(tp.idx_bits))
+            res.append((pc_tag ^ h0 ^ (h1 << 1)) & _mask(tp.tag_bits))
+        return tuple(res)
+
+    def replay(self, hs, taken, pred):
+        tp = self.tp
+        _tage_replay(hs, taken, self.base, self.valid, self.tag, self.ctr,
+            self.u, tp.ctr_bits, tp.u_bits, pred
+        )
+
+
+@_jit
+def _loop_replay(hs, taken, valid, tag, trip, conf, arch_iter, spec_iter, age,
+                 conf_bits, iter_bits, age_bits, pred, confident):
+    conf_max = (1 << conf_bits) - 1
+    iter_max = (1 << iter_bits) - 1
+    age_max = (1 << age_bits) - 1
+    for i in range(len(taken)):
+        idx = hs[0][i]
+        hit = (valid[idx] != 0) and (tag[idx] == hs[1][i])
+        cur_iter = spec_iter[idx]
+        pred[i] = 1 if cur_iter != trip[idx] else 0
+        confident[i] = 1 if (
+            hit and (conf[idx] == conf_max) and (trip[idx] != 0)
+        ) else 0
+
+        cur_arch_iter = arch_iter[idx]
+        if hit and taken[i]:
+            if cur_arch_iter == iter_max:
+                valid[idx] = 0
+            else:
+                arch_iter[idx] = cur_arch_iter + 1
+        elif hit and not taken[i]:
+            arch_iter[idx] = 0
+            if cur_arch_iter == trip[idx]:
+                age[idx] = age_max
+                if conf[idx] != conf_max:
+                    conf[idx] += 1
+            else:
+                trip[idx] = cur_arch_iter
+                conf[idx] = 0
+        elif not taken[i] and ((valid[idx] == 0) or (age[idx] == 0)):
+            valid[idx] = 1
+            tag[idx] = hs[1][i]
+            trip[idx] = 0
+            conf[idx] = 0
+            arch_iter[idx] = 0
+            spec_iter[idx] = 0
+            age[idx] = age_max
+        elif not taken[i]:
+            age[idx] -= 1
+
+        # The speculative iteration count follows the resolved outcome
+        if hit:
+            spec_iter[idx] = ((cur_iter + 1) & iter_max) if taken[i] else 0
+
+class LoopModel(object):
+    """ Model of :class:`ember.front.bp.loop.LoopPredictor`. """
+    def __init__(self, param: EmberParams):
+        self.p = param
+        lp = self.lp = param.bp.loop
+        self.valid = _table(0, lp.depth)
+        self.tag = _table(0, lp.depth)
+        self.trip = _table(0, lp.depth)
+        self.conf = _table(0, lp.depth)
+        self.arch_iter = _table(0, lp.depth)
+        self.spec_iter = _table(0, lp.depth)
+        self.age = _table(0, lp.depth)
+
+    def hashes(self, pc):
+        lp = self.lp
+        return (
+            (pc >> 2) & _mask(lp.idx_bits),
+            (pc >> (2 + lp.idx_bits)) & _mask(lp.tag_bits),
+        )
+
+    def run(self, pc, taken):
+        """ Predict and train a sequence of conditional branches, returning
+        the predictions and whether each prediction is confident.
+        """
+        lp = self.lp
+        hs = _apply(self.hashes, pc)
+        taken, = _inputs((taken,))
+        pred = _table(0, len(taken))
+        confident = _table(0, len(taken))
+        _loop_replay(hs, taken, self.valid, self.tag, self.trip, self.conf,
+            self.arch_iter, self.spec_iter, self.age,
+            lp.conf_bits, lp.iter_bits, lp.age_bits, pred, confident
+        )
+        return pred, confident
+
+
+# Models for each type of conditional branch direction predictor
+DIRECTION_MODELS = {
+    DirectionPredictorKind.BIMODAL:    BimodalModel,
+    DirectionPredictorKind.GSHARE:     GshareModel,
+    DirectionPredictorKind.PERCEPTRON: PerceptronModel,
+    DirectionPredictorKind.TAGE:       TageModel,
+}
+
+
+class BranchPredictionModel(object):
+    """ Model of the conditional branch predictors in
+    :class:`ember.front.bpu.BranchPredictionUnit`.
+
+    A confident loop predictor overrides the direction predictor.
+    """
+    def __init__(self, param: EmberParams):
+        self.p = param
+        self.dirp = DIRECTION_MODELS[param.bp.direction](param)
+        self.loop = LoopModel(param)
+
+    def run(self, pc, taken):
+        dir_pred = self.dirp.run(pc, taken)
+        loop_pred, loop_conf = self.loop.run(pc, taken)
+        if njit is not None:
+            return np.where(loop_conf != 0, loop_pred, dir_pred)
+        return [
+            lp if conf else dp
+            for dp, lp, conf in zip(dir_pred, loop_pred, loop_conf)
+        ]
+
+
+# ----------------------------------------------------------------------------
+# Indirect target predictor
+
+@_jit
+def _ittage_replay(hs, tgt, base_valid, base_tgt, valid, tag, tgts, ctr, u,
+                   ctr_bits, pred_valid, pred_tgt):
+    # Column 0 is the base index, followed by the index and tag for each
+    # tagged table. 'prov' and 'alloc' are -1 when there is no provider
+    # and no table to allocate.
+    num_tables = len(valid)
+    for i in range(len(tgt)):
+        base_idx = hs[0][i]
+        prov_valid = base_valid[base_idx]
+        prov_tgt = base_tgt[base_idx]
+        alt_valid = 0
+        alt_tgt = 0
+        prov_ctr = 0
+        prov = -1
+        for t in range(num_tables):
+            idx = hs[1 + 2*t][i]
+            if (valid[t][idx] != 0) and (tag[t][idx] == hs[2 + 2*t][i]):
+                alt_valid, alt_tgt = prov_valid, prov_tgt
+                prov_valid, prov_tgt = 1, tgts[t][idx]
+                prov_ctr = ctr[t][idx]
+                prov = t
+        use_alt = (prov >= 0) and (prov_ctr == 0) and (alt_valid != 0)
+        res_valid = alt_valid if use_alt else prov_valid
+        res_tgt = alt_tgt if use_alt else prov_tgt
+
+        mispred = (res_valid == 0) or (res_tgt != tgt[i])
+        prov_ok = (prov_tgt == tgt[i])
+        alt_ok = (alt_valid != 0) and (alt_tgt == tgt[i])
+        alloc = -1
+        for t in range(prov + 1, num_tables):
+            if u[t][hs[1 + 2*t][i]] == 0:
+                alloc = t
+                break
+
+        if prov < 0:
+            base_valid[base_idx] = 1
+            base_tgt[base_idx] = tgt[i]
+        for t in range(num_tables):
+            idx = hs[1 + 2*t][i]
+            if t == prov:
+                if prov_ok:
+                    ctr[t][idx] = counter_update(ctr[t][idx], True, ctr_bits)
+                    if not alt_ok:
+                        u[t][idx] = 1
+                elif ctr[t][idx] == 0:
+                    tgts[t][idx] = tgt[i]
+                else:
+                    ctr[t][idx] = counter_update(ctr[t][idx], False, ctr_bits)
+            elif mispred and (alloc == t):
+                valid[t][idx] = 1
+                tag[t][idx] = hs[2 + 2*t][i]
+                tgts[t][idx] = tgt[i]
+                ctr[t][idx] = 0
+                u[t][idx] = 0
+            elif mispred and (alloc < 0) and (t > prov):
+                u[t][idx] = 0
+        pred_valid[i] = res_valid
+        pred_tgt[i] = res_tgt
+
+class IttageModel(object):
+    """ Model of :class:`ember.front.bp.ittage.IttagePredictor`. """
+    def __init__(self, param: EmberParams):
+        self.p = param
+        ip = self.ip = param.bp.ittage
+        self.base_valid = _table(0, ip.base_depth)
+        self.base_tgt = _table(0, ip.base_depth)
+        self.valid = _table(0, ip.num_tables, ip.table_depth)
+        self.tag = _table(0, ip.num_tables, ip.table_depth)
+        self.tgt = _table(0, ip.num_tables, ip.table_depth)
+        self.ctr = _table(0, ip.num_tables, ip.table_depth)
+        self.u = _table(0, ip.num_tables, ip.table_depth)
+
+    def hashes(self, pc, hist):
+        ip = self.ip
+        res = [ (pc >> 2) & _mask(ip.base_idx_bits) ]
+        for table in range(ip.num_tables):
+            hlen = ip.hist_len[table]
+            idx = ((pc >> 2) ^ fold_history(hist, hlen, ip.idx_bits))
+            pc_tag = (pc >> (2 + ip.idx_bits)) & _mask(ip.tag_bits)
+            h0 = fold_history(hist, hlen, ip.tag_bits)
+            h1 = fold_history(hist, hlen, ip.tag_bits - 1)
+            res.append(idx & _mask(ip.idx_bits))
+            res.append((pc_tag ^ h0 ^ (h1 << 1)) & _mask(ip.tag_bits))
+        return tuple(res)
+
+    def run(self, pc, hist, tgt):
+        """ Predict and train a sequence of indirect jumps and calls,
+        returning a list of predictions (or ``None``).
+        """
+        hs = _apply(self.hashes, pc, hist)
+        tgt, = _inputs((tgt,))
+        pred_valid = _table(0, len(tgt))
+        pred_tgt = _table(0, len(tgt))
+        _ittage_replay(hs, tgt, self.base_valid, self.base_tgt, self.valid,
+            self.tag, self.tgt, self.ctr, self.u, self.ip.ctr_bits,
+            pred_valid, pred_tgt
+        )
+        pred_valid, pred_tgt = _columns((pred_valid, pred_tgt))
+        return [
+            res if valid else None
+            for valid, res in zip(pred_valid, pred_tgt)
+        ]
+
+
+# ----------------------------------------------------------------------------
+# Trace replay
+
+class TraceResult(object):
+    """ Misprediction counts for a trace. """
+    def __init__(self, insts: int, branches: int, br_miss: int,
+                 indirects: int, ind_miss: int):
+        self.insts     = insts
+        self.branches  = branches
+        self.br_miss   = br_miss
+        self.indirects = indirects
+        self.ind_miss  = ind_miss
+
+    def mpki(self, misses: int) -> float:
+        return 1000.0 * misses / max(self.insts, 1)
+
+    @property
+    def br_mpki(self):
+        return self.mpki(self.br_miss)
+
+    @property
+    def ind_mpki(self):
+        return self.mpki(self.ind_miss)
+
+    def __str__(self):
+        return (
+            f"branches={self.branches} mispredicts={self.br_miss} "
+            f"mpki={self.br_mpki:.3f} "
+            f"indirects={self.indirects} mispredicts={self.ind_miss} "
+            f"mpki={self.ind_mpki:.3f}"
+        )
+
+def run_trace(param: EmberParams, trace: BranchTrace) -> TraceResult:
+    """ Replay a trace through the conditional branch predictors and the
+    indirect target predictor.
+    """
+    br = trace.select([ControlFlowOp.BRANCH])
+    br_pc = trace.column("pc", br)
+    br_taken = trace.column("taken", br)
+    preds = BranchPredictionModel(param).run(br_pc, br_taken)
+    if np is not None:
+        br_miss = int(np.count_nonzero(np.asarray(preds) != br_taken))
+    else:
+        br_miss = sum(p != t for p, t in zip(preds, br_taken))
+
+    ind = trace.select([ControlFlowOp.JUMP_IND, ControlFlowOp.CALL_IND])
+    phist = trace.path_history(param.bp.ittage.hist_bits)
+    ind_pc = trace.column("pc", ind)
+    ind_tgt = trace.column("tgt", ind)
+    ind_hist = [ phist[idx] for idx in ind ] if np is None else phist[ind]
+    preds = IttageModel(param).run(ind_pc, ind_hist, ind_tgt)
+    ind_tgt, = _columns((ind_tgt,))
+    ind_miss = sum(p != t for p, t in zip(preds, ind_tgt))
+
+    # Without an instruction count, count each record as an instruction
+    return TraceResult(trace.insts or len(trace), len(br_taken), br_miss,
+        len(ind_tgt), ind_miss
+    )
+
+
+# ----------------------------------------------------------------------------
+# Cross-checking against the RTL
+
+def _rtl_run(dut, proc):
+    from ember.sim.common import Testbench
+    res = []
+    def tb(dut):
+        yield from proc(dut, res)
+    Testbench(dut, tb).run()
+    return res
+
+def crosscheck_direction(param: EmberParams, pc, taken, loop=False):
+    """ Compare a conditional branch predictor model with the RTL.
+
+    When ``loop`` is set, the loop predictor is used instead of the
+    direction predictor selected by ``param.bp.direction``.
+    Returns a list of ``(index, pc, rtl, model)`` for each mismatch.
+    """
+    from ember.front.bpu import DIRECTION_PREDICTORS
+    from ember.front.bp.loop import LoopPredictor
+    pc, taken = _columns((pc, taken))
+    if loop:
+        dut = LoopPredictor(param)
+        model, _ = LoopModel(param).run(pc, taken)
+    else:
+        dut = DIRECTION_PREDICTORS[param.bp.direction](param)
+        model = DIRECTION_MODELS[param.bp.direction](param).run(pc, taken)
+
+    def proc(dut, res):
+        for br_pc, br_taken in zip(pc, taken):
+            yield dut.predict.req.valid.eq(1)
+            yield dut.predict.req.pc.eq(br_pc)
+            yield Tick()
+            yield dut.predict.req.valid.eq(0)
+            pred = yield dut.predict.resp.taken
+            meta = yield dut.predict.resp.meta.as_value()
+            res.append(pred)
+            yield dut.update.valid.eq(1)
+            yield dut.update.pc.eq(br_pc)
+            yield dut.update.taken.eq(br_taken)
+            yield dut.update.meta.as_value().eq(meta)
+            yield dut.recover.valid.eq(pred != br_taken)
+            yield dut.recover.taken.eq(br_taken)
+            yield dut.recover.meta.as_value().eq(meta)
+            yield Tick()
+            yield dut.update.valid.eq(0)
+            yield dut.recover.valid.eq(0)
+
+    rtl = _rtl_run(dut, proc)
+    return [
+        (idx, pc[idx], r, m)
+        for idx, (r, m) in enumerate(zip(rtl, model)) if r != m
+    ]
+
+def crosscheck_ittage(param: EmberParams, pc, hist, tgt):
+    """ Compare the indirect target predictor model with the RTL.
+
+    Returns a list of ``(index, pc, rtl, model)`` for each mismatch.
+    """
+    from ember.front.bp.ittage import IttagePredictor
+    pc, hist, tgt = _columns((pc, hist, tgt))
+    dut = IttagePredictor(param)
+    model = IttageModel(param).run(pc, hist, tgt)
+
+    def proc(dut, res):
+        for ind_pc, ind_hist, ind_tgt in zip(pc, hist, tgt):
+            yield dut.predict.req.valid.eq(1)
+            yield dut.predict.req.pc.eq(ind_pc)
+            yield dut.predict.req.hist.eq(ind_hist)
+            hit = yield dut.predict.resp.hit
+            res.append((yield dut.predict.resp.tgt.bits) if hit else None)
+            yield dut.predict.req.valid.eq(0)
+            yield dut.update.valid.eq(1)
+            yield dut.update.pc.eq(ind_pc)
+            yield dut.update.hist.eq(ind_hist)
+            yield dut.update.tgt.eq(ind_tgt)
+            yield Tick()
+            yield dut.update.valid.eq(0)
+
+    rtl = _rtl_run(dut, proc)
+    return [
+        (idx, pc[idx], r, m)
+        for idx, (r, m) in enumerate(zip(rtl, model)) if r != m
+    ]
+
+def crosscheck_cfc(param: EmberParams, trace: BranchTrace):
+    """ Compare the path history and indirect target predictions made by the
+    control-flow controller with the models.
+
+    Each taken control-flow instruction in the trace is sent to the
+    controller as a redirect from the most-recently allocated FTQ entry
+    (conditional branches as BPU requests, and everything else as resteer
+    requests), and the checkpoints for each FTQ entry are kept by the
+    testbench. Indirect jumps and calls are trained as soon as they are
+    predicted.
+
+    Returns a list of ``(index, pc, rtl, model)`` for each indirect jump or
+    call where the ``(history, target)`` used by the controller and the
+    model differ. A missing prediction is the next-sequential instruction.
+    """
+    from ember.front.cfc import ControlFlowController
+    pc, tgt, op, taken = _columns((trace.pc, trace.tgt, trace.op, trace.taken))
+    ind_ops = [ ControlFlowOp.JUMP_IND.value, ControlFlowOp.CALL_IND.value ]
+    ind = [ idx for idx, rec_op in enumerate(op) if rec_op in ind_ops ]
+
+    phist = trace.path_history(param.bp.ittage.hist_bits)
+    ind_hist = [ int(phist[idx]) for idx in ind ]
+    ind_pc = [ pc[idx] for idx in ind ]
+    preds = IttageModel(param).run(ind_pc, ind_hist, [ tgt[idx] for idx in ind ])
+    model = [
+        (hist, (ind_pc[idx] + 4) if pred is None else pred)
+        for idx, (hist, pred) in enumerate(zip(ind_hist, preds))
+    ]
+
+    dut = ControlFlowController(param)
+    depth = param.ftq.depth
+    word_mask = (1 << param.l1i.word_idx_shape.width) - 1
+
+    def alloc(dut, ckpt, idx):
+        assert (yield dut.alloc_req.valid) == 1
+        ckpt[idx] = yield dut.alloc_req.phist
+        return (yield dut.alloc_req.vaddr.bits)
+
+    def proc(dut, res):
+        ckpt = {}
+        yield dut.ftq_sts.ready.eq(1)
+        yield dut.dbg.valid.eq(1)
+        yield Tick()
+        yield dut.dbg.valid.eq(0)
+        yield from alloc(dut, ckpt, 0)
+        parent = 0
+        for rec_pc, rec_tgt, rec_op, rec_taken in zip(pc, tgt, op, taken):
+            rec_op = ControlFlowOp(rec_op)
+            if rec_op == ControlFlowOp.BRANCH and not rec_taken:
+                continue
+            yield Tick()
+            yield dut.ftq_sts.next_ftq_idx.eq((parent + 1) % depth)
+            yield dut.ftq_ckpt.phist.eq(ckpt[parent])
+            if rec_op == ControlFlowOp.BRANCH:
+                req = dut.bpu_req
+                yield req.pc.eq(rec_tgt)
+            else:
+                req = dut.resteer_req
+                yield req.op.eq(rec_op)
+                yield req.src_pc.eq(rec_pc)
+                yield req.tgt_pc.eq(rec_tgt)
+            yield req.valid.eq(1)
+            yield req.parent_ftq_idx.eq(parent)
+            yield req.parent_idx.eq((rec_pc >> 2) & word_mask)
+            yield Tick()
+            yield req.valid.eq(0)
+
+            hist = ckpt[parent]
+            parent = (parent + 1) % depth
+            pred = yield from alloc(dut, ckpt, parent)
+            if rec_op.value in ind_ops:
+                res.append((hist, pred))
+                yield dut.ind_update.valid.eq(1)
+                yield dut.ind_update.pc.eq(rec_pc)
+                yield dut.ind_update.hist.eq(hist)
+                yield dut.ind_update.tgt.eq(rec_tgt)
+                yield Tick()
+                yield dut.ind_update.valid.eq(0)
+
+    rtl = _rtl_run(dut, proc)
+    return [
+        (idx, ind_pc[idx], r, m)
+        for idx, (r, m) in enumerate(zip(rtl, model)) if r != m
+    ]
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Replay branch traces through the predictor models"
+    )
+    parser.add_argument("traces", nargs="+", help="Branch trace files")
+    parser.add_argument("--direction", action="append",
+        choices=[ kind.value for kind in DirectionPredictorKind ],
+        help="Direction predictor (default: all)",
+    )
+    args = parser.parse_args()
+    kinds = args.direction or [ kind.value for kind in DirectionPredictorKind ]
+
+    for path in args.traces:
+        trace = BranchTrace.load(path)
+        for kind in kinds:
+            param = EmberParams()
+            param.bp.direction = DirectionPredictorKind(kind)
+            res = run_trace(param, trace)
+            print(f"{path} direction={kind:10} {res}")
+
+if __name__ == "__main__":
+    main()
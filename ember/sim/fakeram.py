@@ -4,28 +4,68 @@ from amaranth import *
 from amaranth.lib.wiring import *
 from amaranth.lib.data import *
 from struct import pack, unpack
+import random
 #from hexdump import hexdump
 
 
 class FakeRamRequest(Signature):
-    def __init__(self):
+    """ A request to memory. 
+
+    A request is accepted when both 'valid' and 'ready' are high. 
+
+    Members
+    =======
+    valid:
+        This request is valid
+    ready:
+        The memory is ready to accept a request
+    addr:
+        Address of the requested cacheline. The address may select any 
+        beat in the cacheline, and the selected beat is returned first. 
+    id:
+        Tag associated with this request
+    """
+    def __init__(self, id_bits: int = 4):
         super().__init__({
             "valid": Out(1),
+            "ready": In(1),
             "addr": Out(32),
+            "id": Out(id_bits),
         })
 class FakeRamResponse(Signature):
-    def __init__(self, width_words: int):
+    """ A response from memory. 
+
+    Each response is split into one or more beats. Beats for a request are 
+    returned in-order (starting with the beat selected by the request 
+    address, and wrapping around to the start of the cacheline), but beats 
+    for different requests may be interleaved.
+
+    Members
+    =======
+    valid:
+        This beat is valid
+    id:
+        Tag associated with the request
+    last:
+        This is the last beat for the request
+    data:
+        Beat data
+    """
+    def __init__(self, width_words: int, id_bits: int = 4):
         super().__init__({
             "valid": Out(1),
+            "id": Out(id_bits),
+            "last": Out(1),
             "data": Out(unsigned(32)).array(width_words),
         })
 
 class FakeRamInterface(Signature):
-    def __init__(self, width_words: int):
+    def __init__(self, width_words: int, id_bits: int = 4):
         self.width_words = width_words
+        self.id_bits = id_bits
         super().__init__({
-            "req": Out(FakeRamRequest()),
-            "resp": In(FakeRamResponse(width_words)),
+            "req": Out(FakeRamRequest(id_bits)),
+            "resp": In(FakeRamResponse(width_words, id_bits)),
         })
 
 class PendingRead(object):
@@ -41,6 +81,7 @@ class FakeRam(object):
         def __init__(self):
             self.valid = False
             self.addr  = 0
+            self.id    = 0
 
     def __init__(self, size: int):
         self.width_words = 8
@@ -48,7 +89,7 @@ class FakeRam(object):
         self.size = size
         self.cycle = 0
 
-        self.pipes = [ self.FakeRamPipe() for _ in range(2) ]
+        self.pipes = {}
 
         self.valid = False
         self.addr = 0
@@ -56,27 +97,38 @@ class FakeRam(object):
     def run(self, req: FakeRamRequest, resp: FakeRamResponse, pipe=0):
         assert len(resp.data) == self.width_words, "width mismatch?"
 
+        # Requests are always accepted
+        yield req.ready.eq(1)
+
         # Sample the request wires
         req_valid = yield req.valid
         req_addr  = yield req.addr
+        req_id    = yield req.id
         assert req_addr < self.size, f"FakeRam oob request @ {req_addr:08x}"
 
-        if self.pipes[pipe].valid: 
-            data = self.read_words(self.pipes[pipe].addr, self.width_words)
+        state = self.pipes.setdefault(pipe, self.FakeRamPipe())
+        if state.valid: 
+            data = self.read_words(state.addr, self.width_words)
             for idx in range(self.width_words):
                 yield resp.data[idx].eq(data[idx])
             yield resp.valid.eq(True)
+            yield resp.id.eq(state.id)
+            yield resp.last.eq(True)
         else:
             for idx in range(self.width_words):
                 yield resp.data[idx].eq(0)
             yield resp.valid.eq(False)
+            yield resp.id.eq(0)
+            yield resp.last.eq(False)
 
         if req_valid != 0:
-            self.pipes[pipe].valid = True
-            self.pipes[pipe].addr  = req_addr
+            state.valid = True
+            state.addr  = req_addr
+            state.id    = req_id
         else:
-            self.pipes[pipe].valid = False
-            self.pipes[pipe].addr  = 0
+            state.valid = False
+            state.addr  = 0
+            state.id    = 0
         return
 
     def read_word(self, offset: int): 
@@ -99,4 +151,84 @@ class FakeRam(object):
         self.data[offset:offset+len(data)] = data
 
 
+class DelayedFakeRam(FakeRam):
+    """ An imaginary RAM device with variable latency. 
+
+    - Requests are accepted while fewer than 'max_pending' requests are 
+      outstanding on a pipe (otherwise, 'ready' is held low)
+    - Each request is completed after a random number of cycles 
+      (between 'min_lat' and 'max_lat'), so responses may be returned 
+      out-of-order
+    - Each response is split into beats of 'width_words' words, and 
+      beats for different requests may be interleaved
+    - Beats are returned "critical-beat first", starting with the beat 
+      that contains the requested address
+
+    """
+    class PendingRequest(object):
+        def __init__(self, addr: int, start: int, id: int, due: int):
+            self.addr  = addr
+            self.start = start
+            self.id    = id
+            self.due   = due
+            self.beat  = 0
+
+    def __init__(self, size: int, width_words: int = 8, line_words: int = 8,
+                 min_lat: int = 1, max_lat: int = 8, max_pending: int = 4,
+                 seed: int = 0):
+        super().__init__(size)
+        assert line_words % width_words == 0
+        self.width_words = width_words
+        self.num_beats   = line_words // width_words
+        self.line_bytes  = line_words * 4
+        self.min_lat     = min_lat
+        self.max_lat     = max_lat
+        self.max_pending = max_pending
+        self.rng = random.Random(seed)
+        self.pending = {}
+        self.cycles  = {}
+
+    def run(self, req: FakeRamRequest, resp: FakeRamResponse, pipe=0):
+        assert len(resp.data) == self.width_words, "width mismatch?"
+        cycle = self.cycles[pipe] = self.cycles.get(pipe, 0) + 1
+        pending = self.pending.setdefault(pipe, [])
+
+        ready = len(pending) < self.max_pending
+        yield req.ready.eq(ready)
+
+        # Send the next beat for one of the completed requests
+        done = [ x for x in pending if x.due <= cycle ]
+        if len(done) != 0:
+            x = self.rng.choice(done)
+            beat = (x.start + x.beat) % self.num_beats
+            addr = x.addr + (beat * self.width_words * 4)
+            data = self.read_words(addr, self.width_words)
+            for idx in range(self.width_words):
+                yield resp.data[idx].eq(data[idx])
+            x.beat += 1
+            yield resp.valid.eq(True)
+            yield resp.id.eq(x.id)
+            yield resp.last.eq(x.beat == self.num_beats)
+            if x.beat == self.num_beats:
+                pending.remove(x)
+        else:
+            for idx in range(self.width_words):
+                yield resp.data[idx].eq(0)
+            yield resp.valid.eq(False)
+            yield resp.id.eq(0)
+            yield resp.last.eq(False)
 
+        # Sample the request wires
+        req_valid = yield req.valid
+        if req_valid and ready:
+            req_addr = yield req.addr
+            req_id   = yield req.id
+            assert req_addr < self.size, \
+                    f"FakeRam oob request @ {req_addr:08x}"
+            lat = self.rng.randint(self.min_lat, self.max_lat)
+            line_addr = req_addr & ~(self.line_bytes - 1)
+            start = (req_addr - line_addr) // (self.width_words * 4)
+            pending.append(self.PendingRequest(
+                line_addr, start, req_id, cycle + lat
+            ))
+        return
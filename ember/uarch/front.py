@@ -38,7 +38,8 @@ class ControlFlowRequest(Signature):
     parent_ftq_idx:
         The index of the FTQ entry that generated this request. 
     parent_line:
-        Cacheline index in the parent fetch block which caused this request.
+        Cacheline index in the parent fetch block which caused this request
+        [starting at 1 for the first cacheline].
     parent_idx:
         Word index into the parent cacheline which caused this request. 
 
@@ -97,6 +98,32 @@ class FTQEntryState(Enum, shape=4):
     FILL     = 3
     XLAT     = 4
 
+class RapCheckpoint(StructLayout):
+    """ A snapshot of the return address predictor.
+
+    The top-of-stack entry is saved along with the pointers so that it can be
+    repaired after being overwritten by a wrong-path call.
+
+    Members
+    =======
+    ptr:
+        Index of the top-of-stack entry
+    cnt:
+        Number of valid entries
+    addr:
+        Address in the top-of-stack entry
+    ctr:
+        Repeat counter in the top-of-stack entry
+    """
+    def __init__(self, num_entries: int, ctr_bits: int):
+        super().__init__({
+            "ptr": unsigned(exact_log2(num_entries)),
+            "cnt": unsigned(ceil_log2(num_entries + 1)),
+            "addr": unsigned(32),
+            "ctr": unsigned(ctr_bits),
+        })
+
+
 class FTQEntry(StructLayout):
     """ Layout of an entry in the Fetch Target Queue. 
 
@@ -110,6 +137,8 @@ class FTQEntry(StructLayout):
         Indicates when an entry is valid
     blocks:
         Number of sequential cachelines in this fetch block
+    end_idx:
+        Byte offset of the last instruction in the last cacheline
     prefetched:
         Indicates when an entry has been prefetched into the L1I cache
     complete:
@@ -118,6 +147,18 @@ class FTQEntry(StructLayout):
         Indicates when the program counter value is a physical address
     id: 
         Identifier for this entry
+    fill_line:
+        Physical address of the first cacheline that missed [when ``FILL``], 
+        without the offset bits
+    fill_mask:
+        Cachelines [relative to ``fill_line``] with outstanding fills 
+        [when ``FILL``]
+    xlat_vpn:
+        Virtual page number being translated [when ``XLAT``]
+    rap: :class:`RapCheckpoint`
+        Return address predictor state before this entry was fetched
+    phist:
+        Path history before this entry was fetched
 
     """
     def __init__(self, param: EmberParams):
@@ -125,12 +166,18 @@ class FTQEntry(StructLayout):
             "vaddr": param.vaddr,
             "state": FTQEntryState,
             "blocks": param.fblk_size_shape,
+            "end_idx": unsigned(param.vaddr.num_off_bits),
             "valid": unsigned(1),
             "prefetched": unsigned(1),
             "complete": unsigned(1),
             "predicted": unsigned(1),
             "passthru": unsigned(1),
             "id": param.ftq.index_shape,
+            "fill_line": unsigned(param.paddr.size - param.vaddr.num_off_bits),
+            "fill_mask": unsigned(param.max_fblk_size),
+            "xlat_vpn": VirtualPageNumberSv32(),
+            "rap": RapCheckpoint(param.bp.rap.depth, param.bp.rap.ctr_bits),
+            "phist": unsigned(param.bp.ittage.hist_bits),
         })
 
 
@@ -229,11 +276,15 @@ class FetchData(Signature):
     valid:
         This data is valid
     vaddr:
-        Program counter value used to fetch this data
+        Program counter value of the first instruction
     ftq_idx:
         Index of the associated FTQ entry
     data:
-        L1I cacheline data
+        Fetch packet data [indexed by the offset of each word within a 
+        cacheline]. Words before the offset of ``vaddr`` belong to the 
+        next sequential cacheline. 
+    mask:
+        Mask of valid words in the fetch packet
 
     """
     def __init__(self, p: EmberParams):
@@ -303,8 +354,13 @@ class PrefetchResponse(Signature):
         This response is valid
     vaddr:
         Virtual address associated with this response
+    paddr:
+        Physical address associated with this response [when the TLB hits]
     sts: :class:`PrefetchResponseStatus`
         Status associated with this response
+    stall:
+        The fill unit [or PTW] was not ready, and the request will be 
+        replayed
     ftq_idx:
         FTQ index responsible for the associated request
 
@@ -313,6 +369,7 @@ class PrefetchResponse(Signature):
         super().__init__({
             "valid": Out(1),
             "vaddr": Out(p.vaddr),
+            "paddr": Out(p.paddr),
             "sts": Out(FetchResponseStatus),
             "stall": Out(1),
             "ftq_idx": Out(p.ftq.index_shape),
@@ -378,6 +435,8 @@ class PredecodeInfoView(View):
         return (
             (self.cf_op == ControlFlowOp.CALL_DIR) |
             (self.cf_op == ControlFlowOp.JUMP_DIR) |
+            (self.cf_op == ControlFlowOp.CALL_IND) |
+            (self.cf_op == ControlFlowOp.JUMP_IND) |
             (self.cf_op == ControlFlowOp.RET)
         )
 
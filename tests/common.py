@@ -2,6 +2,8 @@
 import unittest
 import sys
 
+from amaranth.sim import Tick
+
 #import logging
 #logging.basicConfig(level=logging.DEBUG)
 #elog = logging.getLogger()
@@ -14,3 +16,38 @@ class EmberTestCase(unittest.TestCase):
 
     def tearDown(self):
         return
+
+
+def dirpred_run(dut, pc: int, outcomes: list):
+    """ Predict and train a single branch with the given sequence of
+    outcomes, returning a list of correct predictions.
+    """
+    return (yield from dirpred_trace(dut, [ (pc, taken) for taken in outcomes ]))
+
+def dirpred_trace(dut, trace: list):
+    """ Predict and train a sequence of ``(pc, taken)`` branches, returning
+    a list of correct predictions.
+    """
+    correct = []
+    for pc, taken in trace:
+        yield dut.predict.req.valid.eq(1)
+        yield dut.predict.req.pc.eq(pc)
+        yield Tick()
+        yield dut.predict.req.valid.eq(0)
+
+        assert (yield dut.predict.resp.valid) == 1
+        pred = yield dut.predict.resp.taken
+        meta = yield dut.predict.resp.meta.as_value()
+        correct.append(pred == taken)
+
+        yield dut.update.valid.eq(1)
+        yield dut.update.pc.eq(pc)
+        yield dut.update.taken.eq(taken)
+        yield dut.update.meta.as_value().eq(meta)
+        yield dut.recover.valid.eq(pred != taken)
+        yield dut.recover.taken.eq(taken)
+        yield dut.recover.meta.as_value().eq(meta)
+        yield Tick()
+        yield dut.update.valid.eq(0)
+        yield dut.recover.valid.eq(0)
+    return correct
@@ -0,0 +1,95 @@
+import unittest
+import random
+import os
+import tempfile
+import time
+from ember.param import *
+from ember.param.front import DirectionPredictorKind
+from ember.sim import bpmodel
+from ember.sim.bpmodel import *
+from ember.uarch.mop import ControlFlowOp
+
+def make_trace(seed: int, iters: int) -> BranchTrace:
+    """ A loop with a fixed trip count, a few correlated and random 
+    branches, and an indirect jump with several targets. 
+    """
+    rng = random.Random(seed)
+    recs = []
+    for it in range(iters):
+        for j in range(5):
+            recs.append((0x1000, 0x0f00, ControlFlowOp.BRANCH, int(j < 4)))
+        recs.append((0x2004 + 4*(it % 3), 0x2100, ControlFlowOp.BRANCH, it % 2))
+        recs.append((0x3008, 0x4000 + 0x40*(it % 3), ControlFlowOp.JUMP_IND, 1))
+        recs.append((0x5000, 0x6000, ControlFlowOp.BRANCH, rng.randint(0, 1)))
+    return BranchTrace.from_records(recs, insts=len(recs) * 4)
+
+class BranchPredictorModelTests(unittest.TestCase):
+    def test_trace_roundtrip(self):
+        trace = make_trace(0, 8)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "test.trace.gz")
+            trace.save(path)
+            res = BranchTrace.load(path)
+        assert res.insts == trace.insts
+        for name in ["pc", "tgt", "op", "taken"]:
+            assert list(getattr(res, name)) == list(getattr(trace, name))
+
+    def test_crosscheck_direction(self):
+        trace = make_trace(1, 16)
+        br = trace.select([ControlFlowOp.BRANCH])
+        pc = trace.column("pc", br)
+        taken = trace.column("taken", br)
+        for kind in DirectionPredictorKind:
+            p = EmberParams()
+            p.bp.direction = kind
+            assert crosscheck_direction(p, pc, taken) == [], kind
+
+    def test_crosscheck_loop(self):
+        trace = make_trace(2, 16)
+        br = trace.select([ControlFlowOp.BRANCH])
+        pc = trace.column("pc", br)
+        taken = trace.column("taken", br)
+        assert crosscheck_direction(EmberParams(), pc, taken, loop=True) == []
+
+    def test_crosscheck_ittage(self):
+        p = EmberParams()
+        trace = make_trace(3, 32)
+        ind = trace.select([ControlFlowOp.JUMP_IND])
+        phist = trace.path_history(p.bp.ittage.hist_bits)
+        hist = [ phist[idx] for idx in ind ]
+        pc = trace.column("pc", ind)
+        tgt = trace.column("tgt", ind)
+        assert crosscheck_ittage(p, pc, hist, tgt) == []
+
+    def test_crosscheck_cfc(self):
+        trace = make_trace(3, 32)
+        assert crosscheck_cfc(EmberParams(), trace) == []
+
+    def test_run_trace(self):
+        res = run_trace(EmberParams(), make_trace(4, 64))
+        assert res.branches == 64 * 7
+        assert res.indirects == 64
+        assert 0 < res.br_mpki < 1000 * 64 * 7 / res.insts
+
+    @unittest.skipIf(bpmodel.njit is None, "Numba is not available")
+    def test_throughput(self):
+        """ The compiled models should replay millions of branches per
+        second.
+        """
+        import numpy as np
+        rng = np.random.default_rng(5)
+        num = 1 << 18
+        pc = (0x1000 + 4 * rng.integers(0, 4096, num)).astype(np.uint32)
+        taken = (((pc >> 3) & 1) ^ (rng.random(num) < 0.1)).astype(np.uint8)
+        for kind in DirectionPredictorKind:
+            p = EmberParams()
+            p.bp.direction = kind
+            # Compile the model before measuring
+            BranchPredictionModel(p).run(pc[:16], taken[:16])
+            elapsed = []
+            for _ in range(3):
+                start = time.process_time()
+                BranchPredictionModel(p).run(pc, taken)
+                elapsed.append(time.process_time() - start)
+            rate = num / min(elapsed)
+            assert rate > 1e6, f"{kind}: {rate/1e6:.3f}M branches/s"
@@ -0,0 +1,138 @@
+import unittest
+from ember.param import *
+from ember.sim.common import Testbench
+from ember.uarch.mop import ControlFlowOp
+from ember.front.bp.l0_btb import *
+from ember.front.bp.l1_btb import *
+from ember.front.nfp import *
+
+from amaranth import *
+from amaranth.sim import *
+from amaranth.back import verilog, rtlil
+
+def btb_write(wreq, pc: int, tgt: int, op=ControlFlowOp.JUMP_DIR):
+    yield wreq.valid.eq(1)
+    yield wreq.pc.eq(pc)
+    yield wreq.op.eq(op)
+    yield wreq.tgt.eq(tgt)
+    yield Tick()
+    yield wreq.valid.eq(0)
+
+def l1_btb_read(dut: L1BranchTargetBuffer, pc: int):
+    yield dut.rp.req.valid.eq(1)
+    yield dut.rp.req.pc.eq(pc)
+    yield Tick()
+    yield dut.rp.req.valid.eq(0)
+    yield Tick()
+    assert (yield dut.rp.resp.valid) == 1
+    hit = yield dut.rp.resp.hit
+    tgt = yield dut.rp.resp.slot.tgt.bits
+    return (hit, tgt)
+
+def tb_l0_btb(dut: L0BranchTargetBuffer):
+    yield from btb_write(dut.wp.req, 0x0000_1008, 0x0000_2000)
+    yield from btb_write(dut.wp.req, 0x0000_1014, 0x0000_3000)
+
+    # The first branch at or after the fetch offset is selected
+    for (pc, hit, tgt) in [
+        (0x0000_1000, 1, 0x0000_2000),
+        (0x0000_1008, 1, 0x0000_2000),
+        (0x0000_100c, 1, 0x0000_3000),
+        (0x0000_1018, 0, None),
+        (0x0000_2000, 0, None),
+    ]:
+        yield dut.rp[0].req.valid.eq(1)
+        yield dut.rp[0].req.pc.eq(pc)
+        assert (yield dut.rp[0].resp.hit) == hit
+        if hit:
+            assert (yield dut.rp[0].resp.slot.tgt.bits) == tgt
+        yield Tick()
+
+def tb_l1_btb(dut: L1BranchTargetBuffer):
+    bp = dut.bp
+    set_stride = 32 * bp.num_sets
+
+    # Multiple branches in the same cacheline
+    yield from btb_write(dut.wp.req, 0x0000_1008, 0x0000_2000)
+    yield from btb_write(dut.wp.req, 0x0000_1014, 0x0000_3000)
+    yield Tick()
+    assert (yield from l1_btb_read(dut, 0x0000_1000)) == (1, 0x0000_2000)
+    assert (yield from l1_btb_read(dut, 0x0000_100c)) == (1, 0x0000_3000)
+    assert (yield from l1_btb_read(dut, 0x0000_1018))[0] == 0
+
+    # Fill all ways in the same set, then replace the oldest entry
+    for way in range(1, bp.num_ways + 1):
+        pc = 0x0000_1000 + (way * set_stride)
+        yield from btb_write(dut.wp.req, pc, 0x0000_4000 + way)
+    yield Tick()
+    assert (yield from l1_btb_read(dut, 0x0000_1000))[0] == 0
+    for way in range(1, bp.num_ways + 1):
+        pc = 0x0000_1000 + (way * set_stride)
+        assert (yield from l1_btb_read(dut, pc)) == (1, 0x0000_4000 + way)
+
+def tb_nfp_override(dut: NextFetchPredictor):
+    p = EmberParams()
+    depth = p.bp.l0_btb.depth
+
+    # Write more branches than the L0 BTB can hold
+    for idx in range(depth + 1):
+        yield from btb_write(dut.wp, 0x0001_0000 + (idx * 0x20), idx * 4)
+    yield Tick()
+
+    # The first branch was evicted from the L0 BTB
+    yield dut.req.valid.eq(1)
+    yield dut.req.pc.eq(0x0001_0000)
+    assert (yield dut.resp.hit) == 0
+    yield Tick()
+    yield dut.req.valid.eq(0)
+    assert (yield dut.override.valid) == 0
+    yield Tick()
+    assert (yield dut.override.valid) == 1
+    assert (yield dut.override.pc.bits) == 0
+    yield Tick()
+
+    # The branch was copied into the L0 BTB
+    yield dut.req.valid.eq(1)
+    yield dut.req.pc.eq(0x0001_0000)
+    assert (yield dut.resp.hit) == 1
+    yield Tick()
+    yield dut.req.valid.eq(0)
+    yield Tick()
+    assert (yield dut.override.valid) == 0
+
+
+class BTBTests(unittest.TestCase):
+    def test_btb_elaborate(self):
+        for cls in [L0BranchTargetBuffer, L1BranchTargetBuffer]:
+            dut = cls(EmberParams())
+            with open(f"/tmp/{cls.__name__}.v", "w") as f:
+                f.write(verilog.convert(dut,
+                    emit_src=False,
+                    strip_internal_attrs=True,
+                    name=cls.__name__
+                ))
+
+    def test_l0_btb(self):
+        tb = Testbench(
+            L0BranchTargetBuffer(EmberParams()),
+            tb_l0_btb,
+            "tb_l0_btb"
+        )
+        tb.run()
+
+    def test_l1_btb(self):
+        tb = Testbench(
+            L1BranchTargetBuffer(EmberParams()),
+            tb_l1_btb,
+            "tb_l1_btb"
+        )
+        tb.run()
+
+    def test_nfp_override(self):
+        tb = Testbench(
+            NextFetchPredictor(EmberParams()),
+            tb_nfp_override,
+            "tb_nfp_override"
+        )
+        tb.run()
+
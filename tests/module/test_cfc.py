@@ -0,0 +1,106 @@
+import unittest
+from ember.param import *
+from ember.sim.common import Testbench
+from ember.front.cfc import *
+from ember.uarch.mop import ControlFlowOp
+
+from amaranth import *
+from amaranth.sim import *
+from amaranth.back import verilog, rtlil
+
+def cfc_redirect(dut: ControlFlowController, parent: int, pc: int):
+    yield dut.bpu_req.valid.eq(1)
+    yield dut.bpu_req.parent_ftq_idx.eq(parent)
+    yield dut.bpu_req.pc.eq(pc)
+    flush = yield dut.ftq_flush.valid
+    flush_id = yield dut.ftq_flush.id
+    yield Tick()
+    yield dut.bpu_req.valid.eq(0)
+    return (flush, flush_id)
+
+def tb_cfc_redirect_full(dut: ControlFlowController):
+    # The FTQ is full when the redirect arrives. The flush is sent, but
+    # the target cannot be allocated yet.
+    yield dut.ftq_sts.ready.eq(0)
+    assert (yield from cfc_redirect(dut, 3, 0x0000_2000)) == (1, 3)
+    assert (yield dut.alloc_req.valid) == 0
+    yield Tick()
+    assert (yield dut.alloc_req.valid) == 0
+    assert (yield dut.ftq_flush.valid) == 0
+
+    # The target is allocated when the FTQ is ready
+    yield dut.ftq_sts.ready.eq(1)
+    yield Tick()
+    assert (yield dut.alloc_req.valid) == 1
+    assert (yield dut.alloc_req.vaddr.bits) == 0x0000_2000
+    assert (yield dut.alloc_req.predicted) == 1
+    yield Tick()
+    assert (yield dut.alloc_req.valid) == 0
+
+def tb_cfc_redirect_replace(dut: ControlFlowController):
+    # A newer redirect replaces a target which is still waiting for the FTQ
+    yield dut.ftq_sts.ready.eq(0)
+    assert (yield from cfc_redirect(dut, 3, 0x0000_2000)) == (1, 3)
+    assert (yield from cfc_redirect(dut, 1, 0x0000_3000)) == (1, 1)
+    yield dut.ftq_sts.ready.eq(1)
+    yield Tick()
+    assert (yield dut.alloc_req.valid) == 1
+    assert (yield dut.alloc_req.vaddr.bits) == 0x0000_3000
+    yield Tick()
+    assert (yield dut.alloc_req.valid) == 0
+
+def cfc_resteer(dut: ControlFlowController, op: ControlFlowOp, 
+                parent: int, src: int, tgt: int, phist: int):
+    yield dut.resteer_req.valid.eq(1)
+    yield dut.resteer_req.op.eq(op)
+    yield dut.resteer_req.parent_ftq_idx.eq(parent)
+    yield dut.resteer_req.src_pc.eq(src)
+    yield dut.resteer_req.tgt_pc.eq(tgt)
+    yield dut.ftq_ckpt.phist.eq(phist)
+    yield Tick()
+    yield dut.resteer_req.valid.eq(0)
+    assert (yield dut.alloc_req.valid) == 1
+    assert (yield dut.alloc_req.vaddr.bits) == tgt
+    return (yield dut.alloc_req.phist)
+
+def tb_cfc_resteer_phist(dut: ControlFlowController):
+    yield dut.ftq_sts.ready.eq(1)
+
+    # A resteering jump is shifted into the path history from the parent
+    phist = yield from cfc_resteer(dut, ControlFlowOp.JUMP_DIR, 
+        2, 0x0000_100c, 0x0000_2000, 0b01
+    )
+    assert phist == 0b0111
+
+    # A correction after an incorrect early redirect only restores the 
+    # path history from the parent
+    yield Tick()
+    phist = yield from cfc_resteer(dut, ControlFlowOp.NONE, 
+        2, 0x0000_100c, 0x0000_1010, 0b01
+    )
+    assert phist == 0b01
+
+class CFCUnitTests(unittest.TestCase):
+    def test_cfc_redirect_full(self):
+        tb = Testbench(
+            ControlFlowController(EmberParams()),
+            tb_cfc_redirect_full,
+            "tb_cfc_redirect_full"
+        )
+        tb.run()
+
+    def test_cfc_redirect_replace(self):
+        tb = Testbench(
+            ControlFlowController(EmberParams()),
+            tb_cfc_redirect_replace,
+            "tb_cfc_redirect_replace"
+        )
+        tb.run()
+
+    def test_cfc_resteer_phist(self):
+        tb = Testbench(
+            ControlFlowController(EmberParams()),
+            tb_cfc_resteer_phist,
+            "tb_cfc_resteer_phist"
+        )
+        tb.run()
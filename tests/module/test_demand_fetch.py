@@ -1,9 +1,11 @@
 import unittest
 from ember.param import *
+from ember.param.front import L1IFillParams
 from ember.sim.common import Testbench
 from ember.sim.fakeram import *
 from ember.front.demand_fetch import *
 from ember.front.demand_fetch import DemandFetchRequest
+from ember.front.bp.l0_btb import L0BTBReadPort
 from ember.uarch.front import *
 
 from amaranth import *
@@ -16,7 +18,17 @@ class DemandFetchUnitHarness(Component):
         self.p = param
         signature = Signature({
             "req": In(DemandFetchRequest(param)),
-            "fakeram": Out(FakeRamInterface(param.l1i.line_depth)).array(2),
+            "fakeram": Out(FakeRamInterface(
+                param.l1i.fill.beat_words, param.l1i.fill.id_bits
+            )).array(param.l1i.fill.num_mem),
+            "result": Out(FetchData(param)),
+            "resp": Out(DemandFetchResponse(param)),
+            "btb_rp": Out(L0BTBReadPort(param)),
+            "resteer_req": Out(ResteerRequest(param)),
+            "xlat": Out(L1ICacheTLBXlatPort()),
+            "tlb_fill": In(L1ICacheTLBFillRequest()),
+            "pd_resp": Out(PredecodeResponse(param)),
+            "bpu_req": In(ControlFlowRequest(param)),
         })
         super().__init__(signature)
 
@@ -30,18 +42,27 @@ class DemandFetchUnitHarness(Component):
         #m.submodules.pdu = pdu = PredecodeUnit(self.p)
 
         connect(m, flipped(self.req), dfu.req)
-        connect(m, dfu.l1i_rp, l1i.rp[0])
+        connect(m, dfu.result, flipped(self.result))
+        connect(m, dfu.resp, flipped(self.resp))
+        connect(m, dfu.btb_rp, flipped(self.btb_rp))
+        connect(m, dfu.resteer_req, flipped(self.resteer_req))
+        connect(m, dfu.pd_resp, flipped(self.pd_resp))
+        connect(m, flipped(self.bpu_req), dfu.bpu_req)
+        for idx in range(self.p.l1i.num_rp):
+            connect(m, dfu.l1i_rp[idx], l1i.rp[idx])
         connect(m, dfu.tlb_rp, itlb.rp)
+        connect(m, dfu.xlat, flipped(self.xlat))
+        connect(m, flipped(self.tlb_fill), itlb.fill_req)
         #connect(m, dfu.pd_req, pdu.req)
 
         connect(m, dfu.ifill, ifill.port[0])
         #connect(m, dfu.ifill_req, ifill.port[0].req)
 
         connect(m, dfu.ifill_sts, ifill.sts)
-        connect(m, ifill.fakeram[0], flipped(self.fakeram[0]))
-        connect(m, ifill.fakeram[1], flipped(self.fakeram[1]))
-        connect(m, ifill.l1i_wp[0], l1i.wp[0])
-        connect(m, ifill.l1i_wp[1], l1i.wp[1])
+        for idx in range(self.p.l1i.fill.num_mem):
+            connect(m, ifill.fakeram[idx], flipped(self.fakeram[idx]))
+        for idx in range(self.p.l1i.num_wp):
+            connect(m, ifill.l1i_wp[idx], l1i.wp[idx])
 
         return m
 
@@ -70,6 +91,407 @@ def tb_demand_fetch(dut: DemandFetchUnit):
         yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
         yield Tick()
 
+def tb_demand_fetch_end(dut: DemandFetchUnit):
+    ram = FakeRam(0x0001_0000)
+    for addr in range(0x1000, 0x2000, 4):
+        ram.write_word(addr, addr)
+    yield Tick()
+
+    # The fetch block ends within the first cacheline
+    yield dut.req.valid.eq(1)
+    yield dut.req.vaddr.eq(0x0000_1008)
+    yield dut.req.passthru.eq(1)
+    yield dut.req.lines.eq(1)
+    yield dut.req.end_idx.eq(0x10)
+    yield Tick()
+    yield dut.req.valid.eq(0)
+
+    results = []
+    done = False
+    for i in range(32):
+        yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
+        yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
+        if (yield dut.result.valid):
+            results.append((yield dut.result.mask))
+        if (yield dut.resp.valid):
+            done = True
+        yield Tick()
+    assert results == [0b0001_1100]
+    assert done
+
+def tb_demand_fetch_early(dut: DemandFetchUnit):
+    ram = FakeRam(0x0001_0000)
+    for addr in range(0x1000, 0x2000, 4):
+        ram.write_word(addr, addr)
+    yield Tick()
+
+    # The L0 BTB predicts a jump at 0x100c
+    yield dut.btb_rp.resp.hit.eq(1)
+    yield dut.btb_rp.resp.slot.valid.eq(1)
+    yield dut.btb_rp.resp.slot.off.eq(3)
+    yield dut.btb_rp.resp.slot.op.eq(ControlFlowOp.JUMP_DIR)
+    yield dut.btb_rp.resp.slot.tgt.eq(0x0000_2000)
+
+    yield dut.req.valid.eq(1)
+    yield dut.req.vaddr.eq(0x0000_1008)
+    yield dut.req.passthru.eq(1)
+    yield dut.req.lines.eq(1)
+    yield dut.req.end_idx.eq(0x1c)
+    yield Tick()
+    yield dut.req.valid.eq(0)
+
+    results = []
+    resteers = []
+    for i in range(32):
+        yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
+        yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
+        if (yield dut.result.valid):
+            results.append((yield dut.result.mask))
+        if (yield dut.resteer_req.valid):
+            resteers.append((
+                (yield dut.resteer_req.op),
+                (yield dut.resteer_req.src_pc),
+                (yield dut.resteer_req.tgt_pc),
+            ))
+        yield Tick()
+
+    # The early redirect is sent from stage 2. There is no jump at 0x100c, 
+    # so predecode resteers to the next instruction. 
+    assert results == [0b0000_1100]
+    assert resteers == [
+        (ControlFlowOp.JUMP_DIR.value, 0x0000_100c, 0x0000_2000),
+        (ControlFlowOp.NONE.value, 0x0000_100c, 0x0000_1010),
+    ]
+
+def tb_demand_fetch_early_branch(dut: DemandFetchUnit):
+    ram = FakeRam(0x0001_0000)
+    for addr in range(0x1000, 0x2000, 4):
+        ram.write_word(addr, addr)
+    # beq x0, x0, +0x40
+    ram.write_word(0x100c, 0x0400_0063)
+    yield Tick()
+
+    # The L0 BTB has a conditional branch at 0x100c
+    yield dut.btb_rp.resp.hit.eq(1)
+    yield dut.btb_rp.resp.slot.valid.eq(1)
+    yield dut.btb_rp.resp.slot.off.eq(3)
+    yield dut.btb_rp.resp.slot.op.eq(ControlFlowOp.BRANCH)
+    yield dut.btb_rp.resp.slot.tgt.eq(0x0000_104c)
+
+    yield dut.req.valid.eq(1)
+    yield dut.req.vaddr.eq(0x0000_1008)
+    yield dut.req.passthru.eq(1)
+    yield dut.req.lines.eq(1)
+    yield dut.req.end_idx.eq(0x1c)
+    yield Tick()
+    yield dut.req.valid.eq(0)
+
+    results = []
+    preds = 0
+    for i in range(32):
+        yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
+        yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
+        if (yield dut.result.valid):
+            results.append((yield dut.result.mask))
+        preds += (yield dut.pd_resp.valid)
+        assert not (yield dut.resteer_req.valid)
+        yield Tick()
+
+    # There is no early redirect for a conditional branch: the branch is 
+    # sent to the BPU instead
+    assert results == [0b1111_1100], results
+    assert preds == 1
+
+
+def tb_demand_fetch_pair(dut: DemandFetchUnit):
+    ram = FakeRam(0x0001_0000)
+    for addr in range(0x1000, 0x2000, 4):
+        ram.write_word(addr, addr)
+    yield Tick()
+
+    # The fetch block starts in the middle of the first cacheline, and 
+    # ends in the third cacheline
+    yield dut.req.valid.eq(1)
+    yield dut.req.vaddr.eq(0x0000_1008)
+    yield dut.req.passthru.eq(1)
+    yield dut.req.lines.eq(3)
+    yield dut.req.end_idx.eq(0x04)
+    yield Tick()
+    yield dut.req.valid.eq(0)
+
+    results = []
+    for i in range(48):
+        yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
+        yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
+        if (yield dut.result.valid):
+            mask = yield dut.result.mask
+            data = []
+            for idx in range(8):
+                data.append((yield dut.result.data[idx]))
+            results.append(((yield dut.result.vaddr.bits), mask, data))
+        yield Tick()
+
+    # Each fetch packet has eight instructions, and the words before the 
+    # offset are taken from the next cacheline
+    assert [ (pc, mask) for pc, mask, _ in results ] == [
+        (0x0000_1008, 0b1111_1111),
+        (0x0000_1028, 0b1111_1111),
+    ], results
+    assert results[0][2] == [ 0x1020, 0x1024 ] + [ 
+        0x1000 + (idx * 4) for idx in range(2, 8) 
+    ]
+    assert results[1][2] == [ 0x1040, 0x1044 ] + [ 
+        0x1020 + (idx * 4) for idx in range(2, 8) 
+    ]
+
+def tb_demand_fetch_hum(dut: DemandFetchUnit):
+    ram = FakeRam(0x0001_0000)
+    for addr in range(0x1000, 0x2000, 4):
+        ram.write_word(addr, addr)
+    yield Tick()
+
+    # Bring the second and third cachelines into the L1I
+    yield dut.req.valid.eq(1)
+    yield dut.req.vaddr.eq(0x0000_1020)
+    yield dut.req.passthru.eq(1)
+    yield dut.req.lines.eq(2)
+    yield dut.req.end_idx.eq(0x1c)
+    yield Tick()
+    yield dut.req.valid.eq(0)
+    for i in range(48):
+        yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
+        yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
+        if (yield dut.resp.valid):
+            break
+        yield Tick()
+    yield Tick()
+
+    # Only the first cacheline misses
+    yield dut.req.valid.eq(1)
+    yield dut.req.vaddr.eq(0x0000_1000)
+    yield dut.req.lines.eq(3)
+    yield Tick()
+    yield dut.req.valid.eq(0)
+
+    results = []
+    for i in range(48):
+        yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
+        yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
+        if (yield dut.result.valid):
+            data = []
+            for idx in range(8):
+                data.append((yield dut.result.data[idx]))
+            results.append(((yield dut.result.vaddr.bits), data))
+        yield Tick()
+
+    # The hitting cachelines are released after the missing cacheline
+    assert [ pc for pc, _ in results ] == [ 
+        0x0000_1000, 0x0000_1020, 0x0000_1040,
+    ], results
+    for pc, data in results:
+        assert data == [ pc + (idx * 4) for idx in range(8) ]
+
+def tb_demand_fetch_fwd(dut: DemandFetchUnit):
+    ram = FakeRam(0x0001_0000)
+    for addr in range(0x1000, 0x2000, 4):
+        ram.write_word(addr, addr)
+    yield Tick()
+
+    yield dut.req.valid.eq(1)
+    yield dut.req.vaddr.eq(0x0000_1000)
+    yield dut.req.passthru.eq(1)
+    yield dut.req.lines.eq(1)
+    yield dut.req.end_idx.eq(0x1c)
+    yield Tick()
+    yield dut.req.valid.eq(0)
+
+    ram_cyc = None
+    results = []
+    for i in range(32):
+        if (yield dut.fakeram[0].req.valid) and ram_cyc is None:
+            ram_cyc = i
+        yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
+        yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
+        if (yield dut.result.valid):
+            results.append((i, (yield dut.result.vaddr.bits)))
+        yield Tick()
+
+    # The missing cacheline is forwarded from the fill unit to predecode 
+    # (without being read back from the L1I)
+    assert [ pc for _, pc in results ] == [ 0x0000_1000 ], results
+    assert results[0][0] - ram_cyc <= 5, (ram_cyc, results)
+
+def tb_demand_fetch_restart(dut: DemandFetchUnit):
+    ram = FakeRam(0x0001_0000)
+    for addr in range(0x1000, 0x2000, 4):
+        ram.write_word(addr, addr)
+    yield Tick()
+
+    yield dut.req.valid.eq(1)
+    yield dut.req.vaddr.eq(0x0000_1000)
+    yield dut.req.passthru.eq(1)
+    yield dut.req.lines.eq(4)
+    yield dut.req.end_idx.eq(0x1c)
+    yield Tick()
+    yield dut.req.valid.eq(0)
+
+    results = []
+    for i in range(32):
+        yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
+        yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
+        if (yield dut.result.valid):
+            results.append((i, (yield dut.result.vaddr.bits)))
+        yield Tick()
+
+    # Each cacheline is released as soon as it is forwarded from the 
+    # fill unit (without waiting for the rest of the fill)
+    assert [ pc for _, pc in results ] == [ 
+        0x0000_1000, 0x0000_1020, 0x0000_1040, 0x0000_1060,
+    ], results
+    cycles = [ cyc for cyc, _ in results ]
+    assert cycles == list(range(cycles[0], cycles[0] + 4)), results
+
+def tb_demand_fetch_beat(dut: DemandFetchUnit):
+    ram = DelayedFakeRam(0x0001_0000, 
+        width_words=dut.p.l1i.fill.beat_words, 
+        line_words=dut.p.l1i.line_depth,
+        min_lat=4, max_lat=4,
+    )
+    for addr in range(0x1000, 0x2000, 4):
+        ram.write_word(addr, addr)
+    yield Tick()
+
+    # The instructions are in the second beat of the cacheline
+    yield dut.req.valid.eq(1)
+    yield dut.req.vaddr.eq(0x0000_1010)
+    yield dut.req.passthru.eq(1)
+    yield dut.req.lines.eq(1)
+    yield dut.req.end_idx.eq(0x1c)
+    yield Tick()
+    yield dut.req.valid.eq(0)
+
+    beat_cyc = []
+    results = []
+    for i in range(32):
+        yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
+        yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
+        if (yield dut.fakeram[0].resp.valid):
+            beat_cyc.append(i)
+        if (yield dut.result.valid):
+            data = []
+            for idx in range(4, 8):
+                data.append((yield dut.result.data[idx]))
+            results.append((i, (yield dut.result.vaddr.bits), data))
+        yield Tick()
+
+    # The critical beat is returned first, and the request is released 
+    # as soon as it is forwarded (before the cacheline is complete)
+    assert [ (pc, data) for _, pc, data in results ] == [ 
+        (0x0000_1010, [ 0x1010, 0x1014, 0x1018, 0x101c ]),
+    ], results
+    assert len(beat_cyc) == 2, beat_cyc
+    assert results[0][0] - beat_cyc[0] <= 3, (beat_cyc, results)
+
+def tb_demand_fetch_bpu(dut: DemandFetchUnit):
+    ram = FakeRam(0x0001_0000)
+    for addr in range(0x1000, 0x2000, 4):
+        ram.write_word(addr, addr)
+    # beq x0, x0, +0x40
+    ram.write_word(0x1024, 0x0400_0063)
+    yield Tick()
+
+    yield dut.req.valid.eq(1)
+    yield dut.req.vaddr.eq(0x0000_1000)
+    yield dut.req.passthru.eq(1)
+    yield dut.req.lines.eq(4)
+    yield dut.req.end_idx.eq(0x1c)
+    yield dut.req.ftq_idx.eq(3)
+    yield Tick()
+    yield dut.req.valid.eq(0)
+
+    results = []
+    preds = []
+    resps = []
+    for i in range(32):
+        # The BPU predicts the branch taken on the next cycle
+        yield dut.bpu_req.valid.eq(len(preds) == 1)
+        yield dut.bpu_req.parent_ftq_idx.eq(3)
+        if len(preds) == 1:
+            preds.append(None)
+        yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
+        yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
+        if (yield dut.result.valid):
+            results.append((yield dut.result.vaddr.bits))
+        if (yield dut.pd_resp.valid):
+            valid = []
+            for idx in range(8):
+                valid.append((yield dut.pd_resp.info_valid[idx]))
+            preds.append((
+                (yield dut.pd_resp.vaddr.bits), 
+                (yield dut.pd_resp.ftq_idx), 
+                (yield dut.pd_resp.line), 
+                valid,
+            ))
+        if (yield dut.resp.valid):
+            resps.append(((yield dut.resp.ftq_idx), (yield dut.resp.sts)))
+        assert not (yield dut.resteer_req.valid)
+        yield Tick()
+
+    # Only the branch is sent to the BPU, and the predicted-taken branch 
+    # ends the transaction after the cacheline containing it
+    assert preds[0] == (0x0000_1020, 3, 2, [0, 1, 0, 0, 0, 0, 0, 0]), preds
+    assert results == [ 0x0000_1000, 0x0000_1020 ], results
+    assert resps == [ (3, DemandResponseStatus.RESTEER.value) ], resps
+
+def tb_demand_fetch_xlat(dut: DemandFetchUnit):
+    ram = FakeRam(0x0001_0000)
+    for addr in range(0x1000, 0x2000, 4):
+        ram.write_word(addr, addr)
+    yield Tick()
+
+    # Virtual page 0x00401 is mapped to physical page 0x00001
+    yield dut.req.valid.eq(1)
+    yield dut.req.vaddr.eq(0x0040_1008)
+    yield dut.req.passthru.eq(0)
+    yield dut.req.lines.eq(1)
+    yield dut.req.end_idx.eq(0x1c)
+    yield Tick()
+    yield dut.req.valid.eq(0)
+
+    xlat_cyc = None
+    results = []
+    done = False
+    for i in range(48):
+        yield dut.tlb_fill.valid.eq(0)
+        yield dut.xlat.resp.valid.eq(0)
+        if (yield dut.xlat.req.valid):
+            assert xlat_cyc is None
+            assert (yield dut.xlat.req.vpn.as_value()) == 0x00401
+            xlat_cyc = i
+        # Fill the TLB and respond a few cycles after the TLB miss
+        if xlat_cyc is not None and i == xlat_cyc + 4:
+            yield dut.tlb_fill.valid.eq(1)
+            yield dut.tlb_fill.vpn.eq(0x00401)
+            yield dut.tlb_fill.pte.v.eq(1)
+            yield dut.tlb_fill.pte.x.eq(1)
+            yield dut.tlb_fill.pte.ppn.eq(0x00001)
+            yield dut.xlat.resp.valid.eq(1)
+            yield dut.xlat.resp.vpn.eq(0x00401)
+        yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
+        yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
+        if (yield dut.result.valid):
+            results.append((
+                (yield dut.result.vaddr.bits), 
+                (yield dut.result.data[2]),
+            ))
+        if (yield dut.resp.valid):
+            done = True
+        yield Tick()
+
+    # The transaction is replayed after the TLB has been filled
+    assert xlat_cyc is not None
+    assert results == [ (0x0040_1008, 0x0000_1008) ], results
+    assert done
 
 class DemandFetchTests(unittest.TestCase):
     def test_demand(self):
@@ -81,3 +503,85 @@ class DemandFetchTests(unittest.TestCase):
         tb.run()
 
 
+
+    def test_demand_end(self):
+        tb = Testbench(
+            DemandFetchUnitHarness(EmberParams()),
+            tb_demand_fetch_end,
+            "tb_demand_fetch_end"
+        )
+        tb.run()
+
+    def test_demand_early(self):
+        tb = Testbench(
+            DemandFetchUnitHarness(EmberParams()),
+            tb_demand_fetch_early,
+            "tb_demand_fetch_early"
+        )
+        tb.run()
+
+    def test_demand_early_branch(self):
+        tb = Testbench(
+            DemandFetchUnitHarness(EmberParams()),
+            tb_demand_fetch_early_branch,
+            "tb_demand_fetch_early_branch"
+        )
+        tb.run()
+
+    def test_demand_pair(self):
+        tb = Testbench(
+            DemandFetchUnitHarness(EmberParams()),
+            tb_demand_fetch_pair,
+            "tb_demand_fetch_pair"
+        )
+        tb.run()
+
+    def test_demand_hum(self):
+        tb = Testbench(
+            DemandFetchUnitHarness(EmberParams()),
+            tb_demand_fetch_hum,
+            "tb_demand_fetch_hum"
+        )
+        tb.run()
+
+    def test_demand_fwd(self):
+        tb = Testbench(
+            DemandFetchUnitHarness(EmberParams()),
+            tb_demand_fetch_fwd,
+            "tb_demand_fetch_fwd"
+        )
+        tb.run()
+
+    def test_demand_restart(self):
+        tb = Testbench(
+            DemandFetchUnitHarness(EmberParams()),
+            tb_demand_fetch_restart,
+            "tb_demand_fetch_restart"
+        )
+        tb.run()
+
+    def test_demand_bpu(self):
+        tb = Testbench(
+            DemandFetchUnitHarness(EmberParams()),
+            tb_demand_fetch_bpu,
+            "tb_demand_fetch_bpu"
+        )
+        tb.run()
+
+    def test_demand_xlat(self):
+        tb = Testbench(
+            DemandFetchUnitHarness(EmberParams()),
+            tb_demand_fetch_xlat,
+            "tb_demand_fetch_xlat"
+        )
+        tb.run()
+
+    def test_demand_beat(self):
+        p = EmberParams()
+        p.l1i.fill = L1IFillParams(num_mshr=2, num_port=2, beat_words=4)
+        tb = Testbench(
+            DemandFetchUnitHarness(p),
+            tb_demand_fetch_beat,
+            "tb_demand_fetch_beat"
+        )
+        tb.run()
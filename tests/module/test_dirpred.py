@@ -0,0 +1,193 @@
+import unittest
+import random
+from ember.param import *
+from ember.sim.common import Testbench
+from tests.common import dirpred_run, dirpred_trace
+from ember.front.bp.bimodal import *
+from ember.front.bp.gshare import *
+from ember.front.bp.perceptron import *
+from ember.front.bp.tage import *
+
+from amaranth import *
+from amaranth.sim import *
+from amaranth.back import verilog, rtlil
+
+def tb_dirpred_always_taken(dut):
+    correct = yield from dirpred_run(dut, 0x0000_1004, [1] * 16)
+    assert all(correct[-8:])
+
+def tb_dirpred_alternating(dut):
+    correct = yield from dirpred_run(dut, 0x0000_2010, [1, 0] * 64)
+    assert all(correct[-32:])
+
+def tb_dirpred_period3(dut):
+    correct = yield from dirpred_run(dut, 0x0000_3008, [1, 1, 0] * 64)
+    assert all(correct[-48:])
+
+def tb_dirpred_correlated(dut):
+    # The second branch repeats the outcome of the first, which is only
+    # predictable from the global history. The other history bits are
+    # random, so allow for some mispredictions while new patterns are seen.
+    rng = random.Random(27)
+    trace = []
+    for _ in range(512):
+        taken = rng.randint(0, 1)
+        trace += [ (0x0000_4000, taken), (0x0000_4040, taken) ]
+    correct = yield from dirpred_trace(dut, trace)
+    assert sum(correct[1::2][-128:]) >= 96
+
+def tb_dirpred_recover(dut):
+    # Mispredict and recover a few branches, leaving 0b100 in the history
+    mask = (1 << dut.p.bp.ghist_bits) - 1
+    yield from dirpred_run(dut, 0x0000_5000, [1, 0, 0])
+
+    # Back-to-back predictions. The first is correct, and the second 
+    # is recovered. 
+    yield dut.predict.req.valid.eq(1)
+    yield dut.predict.req.pc.eq(0x0000_5040)
+    yield Tick()
+    yield dut.predict.req.pc.eq(0x0000_5080)
+    hist_a = yield dut.predict.resp.meta.hist.ghist
+    pred_a = yield dut.predict.resp.taken
+    yield Tick()
+    yield dut.predict.req.valid.eq(0)
+    meta_b = yield dut.predict.resp.meta.as_value()
+    pred_b = yield dut.predict.resp.taken
+    yield dut.recover.valid.eq(1)
+    yield dut.recover.taken.eq(1 - pred_b)
+    yield dut.recover.meta.as_value().eq(meta_b)
+    yield Tick()
+    yield dut.recover.valid.eq(0)
+    assert hist_a == 0b100
+
+    # The repaired history includes the outcome of the first prediction
+    yield dut.predict.req.valid.eq(1)
+    yield dut.predict.req.pc.eq(0x0000_50c0)
+    yield Tick()
+    yield dut.predict.req.valid.eq(0)
+    hist_c = yield dut.predict.resp.meta.hist.ghist
+    assert hist_c == (((hist_a << 2) | (pred_a << 1) | (1 - pred_b)) & mask)
+
+class DirectionPredictorTests(unittest.TestCase):
+    def test_dirpred_elaborate(self):
+        for cls in [BimodalPredictor, GsharePredictor, PerceptronPredictor,
+                    TagePredictor]:
+            dut = cls(EmberParams())
+            with open(f"/tmp/{cls.__name__}.v", "w") as f:
+                f.write(verilog.convert(dut,
+                    emit_src=False,
+                    strip_internal_attrs=True,
+                    name=cls.__name__
+                ))
+
+    def test_bimodal_always_taken(self):
+        tb = Testbench(
+            BimodalPredictor(EmberParams()),
+            tb_dirpred_always_taken,
+            "tb_bimodal_always_taken"
+        )
+        tb.run()
+
+    def test_gshare_alternating(self):
+        tb = Testbench(
+            GsharePredictor(EmberParams()),
+            tb_dirpred_alternating,
+            "tb_gshare_alternating"
+        )
+        tb.run()
+
+    def test_perceptron_alternating(self):
+        tb = Testbench(
+            PerceptronPredictor(EmberParams()),
+            tb_dirpred_alternating,
+            "tb_perceptron_alternating"
+        )
+        tb.run()
+
+    def test_gshare_period3(self):
+        tb = Testbench(
+            GsharePredictor(EmberParams()),
+            tb_dirpred_period3,
+            "tb_gshare_period3"
+        )
+        tb.run()
+
+    def test_gshare_correlated(self):
+        tb = Testbench(
+            GsharePredictor(EmberParams()),
+            tb_dirpred_correlated,
+            "tb_gshare_correlated"
+        )
+        tb.run()
+
+    def test_perceptron_period3(self):
+        tb = Testbench(
+            PerceptronPredictor(EmberParams()),
+            tb_dirpred_period3,
+            "tb_perceptron_period3"
+        )
+        tb.run()
+
+    def test_perceptron_correlated(self):
+        tb = Testbench(
+            PerceptronPredictor(EmberParams()),
+            tb_dirpred_correlated,
+            "tb_perceptron_correlated"
+        )
+        tb.run()
+
+    def test_tage_always_taken(self):
+        tb = Testbench(
+            TagePredictor(EmberParams()),
+            tb_dirpred_always_taken,
+            "tb_tage_always_taken"
+        )
+        tb.run()
+
+    def test_tage_alternating(self):
+        tb = Testbench(
+            TagePredictor(EmberParams()),
+            tb_dirpred_alternating,
+            "tb_tage_alternating"
+        )
+        tb.run()
+
+    def test_tage_period3(self):
+        tb = Testbench(
+            TagePredictor(EmberParams()),
+            tb_dirpred_period3,
+            "tb_tage_period3"
+        )
+        tb.run()
+
+    def test_tage_correlated(self):
+        tb = Testbench(
+            TagePredictor(EmberParams()),
+            tb_dirpred_correlated,
+            "tb_tage_correlated"
+        )
+        tb.run()
+
+    def test_gshare_recover(self):
+        tb = Testbench(
+            GsharePredictor(EmberParams()),
+            tb_dirpred_recover,
+            "tb_gshare_recover"
+        )
+        tb.run()
+
+    def test_perceptron_recover(self):
+        tb = Testbench(
+            PerceptronPredictor(EmberParams()),
+            tb_dirpred_recover,
+            "tb_perceptron_recover"
+        )
+        tb.run()
+
+    def test_tage_recover(self):
+        tb = Testbench(
+            TagePredictor(EmberParams()),
+            tb_dirpred_recover,
+            "tb_tage_recover"
+        )
+        tb.run()
@@ -1,11 +1,16 @@
 import unittest
 from ember.param import *
+from ember.param.front import DirectionPredictorKind
 from ember.sim.common import Testbench
 from ember.sim.fakeram import *
 from ember.front.ftq import *
+from ember.front.bpu import *
+from ember.front.predecode import PredecodeResponse
 from ember.uarch.front import *
+from ember.uarch.mop import ControlFlowOp
 
 from amaranth import *
+from amaranth.lib.wiring import *
 from amaranth.sim import *
 from amaranth.back import verilog, rtlil
 from amaranth.lib.enum import Enum
@@ -22,6 +27,350 @@ def tb_ftq_simple(dut: FetchTargetQueue):
 
     yield Tick()
 
+def ftq_alloc(dut: FetchTargetQueue, vaddr: int):
+    yield dut.alloc_req.valid.eq(1)
+    yield dut.alloc_req.passthru.eq(1)
+    yield dut.alloc_req.blocks.eq(1)
+    yield dut.alloc_req.vaddr.eq(vaddr)
+    yield Tick()
+    yield dut.alloc_req.valid.eq(0)
+
+def ftq_respond(dut: FetchTargetQueue, idx: int):
+    yield dut.fetch_resp.valid.eq(1)
+    yield dut.fetch_resp.sts.eq(DemandResponseStatus.OK)
+    yield dut.fetch_resp.ftq_idx.eq(idx)
+    yield Tick()
+    yield dut.fetch_resp.valid.eq(0)
+
+def tb_ftq_reclaim(dut: FetchTargetQueue):
+    # Complete each demand fetch two cycles after it is sent, and free 
+    # the entry on the same cycle. 
+    pending = []
+    allocs = 0
+    for cycle in range(96):
+        ready = yield dut.sts.ready
+        yield dut.alloc_req.valid.eq(ready)
+        yield dut.alloc_req.passthru.eq(1)
+        yield dut.alloc_req.blocks.eq(1)
+        yield dut.alloc_req.vaddr.eq(0x0000_1000 | ((cycle * 0x20) & 0xfff))
+        allocs += ready
+
+        resp = bool(pending) and (pending[0][0] <= cycle)
+        yield dut.fetch_resp.valid.eq(resp)
+        yield dut.fetch_resp.sts.eq(DemandResponseStatus.OK)
+        yield dut.free_req.valid.eq(resp)
+        if resp:
+            idx = pending.pop(0)[1]
+            yield dut.fetch_resp.ftq_idx.eq(idx)
+            yield dut.free_req.id.eq(idx)
+        if (yield dut.fetch_req.valid):
+            pending.append((cycle + 2, (yield dut.fetch_req.ftq_idx)))
+        yield Tick()
+    # The queue wraps around more than twice without filling up
+    assert allocs > 2 * 16
+
+def tb_ftq_flush(dut: FetchTargetQueue):
+    for i in range(6):
+        yield from ftq_alloc(dut, 0x0000_1000 | (i * 0x20))
+    assert (yield dut.sts.next_ftq_idx) == 6
+
+    # Entry 0 is being fetched. Flush the entries younger than entry 2.
+    yield dut.flush_req.valid.eq(1)
+    yield dut.flush_req.id.eq(2)
+    yield Tick()
+    yield dut.flush_req.valid.eq(0)
+    assert (yield dut.sts.next_ftq_idx) == 3
+    assert (yield dut.sts.ready) == 1
+
+    # Complete entry 0, and entry 1 is fetched next
+    yield from ftq_respond(dut, 0)
+    yield Tick()
+    assert (yield dut.fetch_req.valid) == 1
+    assert (yield dut.fetch_req.ftq_idx) == 1
+
+    # Flush the entries younger than entry 0 while entry 1 is being fetched
+    yield dut.flush_req.valid.eq(1)
+    yield dut.flush_req.id.eq(0)
+    yield Tick()
+    yield dut.flush_req.valid.eq(0)
+    assert (yield dut.sts.next_ftq_idx) == 1
+
+    # The new entry is not fetched until the flushed fetch completes
+    yield from ftq_alloc(dut, 0x0000_2000)
+    for _ in range(4):
+        assert (yield dut.fetch_req.valid) == 0
+        yield Tick()
+    yield from ftq_respond(dut, 1)
+    yield Tick()
+    assert (yield dut.fetch_req.valid) == 1
+    assert (yield dut.fetch_req.ftq_idx) == 1
+    assert (yield dut.fetch_req.vaddr.bits) == 0x0000_2000
+
+def tb_ftq_flush_freed(dut: FetchTargetQueue):
+    for i in range(4):
+        yield from ftq_alloc(dut, 0x0000_1000 | (i * 0x20))
+
+    # Entry 0 is fetched and freed before the redirect from entry 0
+    # arrives, and entry 1 is being fetched
+    yield dut.free_req.valid.eq(1)
+    yield dut.free_req.id.eq(0)
+    yield from ftq_respond(dut, 0)
+    yield dut.free_req.valid.eq(0)
+    yield Tick()
+    assert (yield dut.fetch_req.valid) == 1
+    assert (yield dut.fetch_req.ftq_idx) == 1
+    assert (yield dut.sts.next_ftq_idx) == 4
+
+    # Every entry is younger than entry 0, and all of them are flushed
+    yield dut.flush_req.valid.eq(1)
+    yield dut.flush_req.id.eq(0)
+    yield Tick()
+    yield dut.flush_req.valid.eq(0)
+    assert (yield dut.sts.next_ftq_idx) == 1
+
+    # The flushed demand fetch for entry 1 completes, and the new entry
+    # is fetched next
+    yield from ftq_alloc(dut, 0x0000_2000)
+    yield from ftq_respond(dut, 1)
+    yield Tick()
+    assert (yield dut.fetch_req.valid) == 1
+    assert (yield dut.fetch_req.ftq_idx) == 1
+    assert (yield dut.fetch_req.vaddr.bits) == 0x0000_2000
+
+    # A flush for an entry which has already been flushed is ignored
+    yield dut.flush_req.valid.eq(1)
+    yield dut.flush_req.id.eq(3)
+    yield Tick()
+    yield dut.flush_req.valid.eq(0)
+    assert (yield dut.sts.next_ftq_idx) == 2
+
+def ftq_collect_prefetch(dut: FetchTargetQueue, cycles: int):
+    sent = []
+    for _ in range(cycles):
+        yield Tick()
+        if (yield dut.prefetch_req.valid):
+            sent.append((yield dut.prefetch_req.ftq_idx))
+    return sent
+
+def tb_ftq_prefetch(dut: FetchTargetQueue):
+    pf = dut.p.ftq.prefetch
+    for i in range(8):
+        yield from ftq_alloc(dut, 0x0000_1000 | (i * 0x40))
+    yield dut.prefetch_sts.ready.eq(1)
+
+    # Entry 0 is being fetched. With the initial accuracy, only entries 
+    # within half of the maximum distance are prefetched. 
+    sent = yield from ftq_collect_prefetch(dut, 8)
+    assert sent == list(range(1, 1 + pf.max_dist // 2)), sent
+
+    # Completing entry 0 lets the prefetch pointer move ahead
+    yield from ftq_respond(dut, 0)
+    sent = yield from ftq_collect_prefetch(dut, 8)
+    assert sent == [ 1 + pf.max_dist // 2 ], sent
+
+    # Completing prefetched entries increases accuracy and distance
+    sent = []
+    for idx in range(1, 4):
+        yield dut.fetch_resp.valid.eq(1)
+        yield dut.fetch_resp.ftq_idx.eq(idx)
+        sent += yield from ftq_collect_prefetch(dut, 1)
+        yield dut.fetch_resp.valid.eq(0)
+        sent += yield from ftq_collect_prefetch(dut, 1)
+    sent += yield from ftq_collect_prefetch(dut, 8)
+    assert sent == [ 4, 5, 6, 7 ], sent
+
+    # Prefetch stops while the fill budget is used up
+    yield dut.prefetch_resp.valid.eq(1)
+    yield dut.prefetch_resp.sts.eq(FetchResponseStatus.L1_MISS)
+    for _ in range(pf.max_inflight):
+        yield Tick()
+    yield dut.prefetch_resp.valid.eq(0)
+    yield from ftq_alloc(dut, 0x0000_1200)
+    sent = yield from ftq_collect_prefetch(dut, 8)
+    assert sent == [], sent
+
+    # A completed prefetch fill releases the budget
+    yield dut.ifill_resp[1].valid.eq(1)
+    yield dut.ifill_resp[1].src.eq(L1IFillSource.PREFETCH)
+    yield Tick()
+    yield dut.ifill_resp[1].valid.eq(0)
+    sent = yield from ftq_collect_prefetch(dut, 8)
+    assert sent == [ 8 ], sent
+
+def ftq_prefetch_miss(dut: FetchTargetQueue, idx: int, paddr: int):
+    yield dut.prefetch_resp.valid.eq(1)
+    yield dut.prefetch_resp.sts.eq(FetchResponseStatus.L1_MISS)
+    yield dut.prefetch_resp.ftq_idx.eq(idx)
+    yield dut.prefetch_resp.paddr.eq(paddr)
+    yield Tick()
+    yield dut.prefetch_resp.valid.eq(0)
+
+def ftq_fill_done(dut: FetchTargetQueue, port: int, addr: int, blocks: int):
+    yield dut.ifill_resp[port].valid.eq(1)
+    yield dut.ifill_resp[port].addr.eq(addr)
+    yield dut.ifill_resp[port].blocks.eq(blocks)
+    yield dut.ifill_resp[port].src.eq(L1IFillSource.PREFETCH)
+    yield Tick()
+    yield dut.ifill_resp[port].valid.eq(0)
+
+def ftq_wait_fetch(dut: FetchTargetQueue, cycles: int):
+    for _ in range(cycles):
+        yield Tick()
+        if (yield dut.fetch_req.valid):
+            return (yield dut.fetch_req.ftq_idx)
+    return None
+
+def tb_ftq_wakeup(dut: FetchTargetQueue):
+    for i in range(4):
+        yield from ftq_alloc(dut, 0x0000_1000 | (i * 0x20))
+
+    # Entries 1 and 2 miss on the same cacheline, and entry 3 misses on 
+    # the cacheline after it
+    yield from ftq_prefetch_miss(dut, 1, 0x0000_1020)
+    yield from ftq_prefetch_miss(dut, 2, 0x0000_1030)
+    yield from ftq_prefetch_miss(dut, 3, 0x0000_1060)
+
+    # Entry 1 is not fetched until the fill has completed
+    yield from ftq_respond(dut, 0)
+    assert (yield from ftq_wait_fetch(dut, 4)) is None
+
+    # Both entries waiting on the cacheline are woken
+    yield from ftq_fill_done(dut, 1, 0x0000_1020, 1)
+    assert (yield from ftq_wait_fetch(dut, 4)) == 1
+    yield from ftq_respond(dut, 1)
+    assert (yield from ftq_wait_fetch(dut, 2)) == 2
+    yield from ftq_respond(dut, 2)
+    assert (yield from ftq_wait_fetch(dut, 4)) is None
+
+    # A fill covering several cachelines wakes entry 3
+    yield from ftq_fill_done(dut, 0, 0x0000_1000, 4)
+    assert (yield from ftq_wait_fetch(dut, 4)) == 3
+
+def tb_ftq_wakeup_ooo(dut: FetchTargetQueue):
+    for i in range(2):
+        yield from ftq_alloc(dut, 0x0000_1000 | (i * 0x80))
+
+    # Entry 1 misses on two cachelines
+    yield from ftq_prefetch_miss(dut, 1, 0x0000_1080)
+    yield from ftq_prefetch_miss(dut, 1, 0x0000_10c0)
+    yield from ftq_respond(dut, 0)
+
+    # The fill for the last cacheline completes first
+    yield from ftq_fill_done(dut, 1, 0x0000_10c0, 1)
+    assert (yield from ftq_wait_fetch(dut, 4)) is None
+
+    # Entry 1 is woken when the fill for the first cacheline completes
+    yield from ftq_fill_done(dut, 0, 0x0000_1080, 1)
+    assert (yield from ftq_wait_fetch(dut, 4)) == 1
+
+def ftq_prefetch_tlb_miss(dut: FetchTargetQueue, idx: int, vaddr: int):
+    yield dut.prefetch_resp.valid.eq(1)
+    yield dut.prefetch_resp.sts.eq(FetchResponseStatus.TLB_MISS)
+    yield dut.prefetch_resp.ftq_idx.eq(idx)
+    yield dut.prefetch_resp.vaddr.eq(vaddr)
+    yield Tick()
+    yield dut.prefetch_resp.valid.eq(0)
+
+def ftq_xlat_done(dut: FetchTargetQueue, vpn: int):
+    yield dut.xlat_resp.valid.eq(1)
+    yield dut.xlat_resp.vpn.eq(vpn)
+    yield Tick()
+    yield dut.xlat_resp.valid.eq(0)
+
+def tb_ftq_xlat(dut: FetchTargetQueue):
+    for i in range(3):
+        yield from ftq_alloc(dut, 0x0040_1000 | (i * 0x1000))
+
+    # Entries 1 and 2 miss in the TLB on different pages
+    yield from ftq_prefetch_tlb_miss(dut, 1, 0x0040_2000)
+    yield from ftq_prefetch_tlb_miss(dut, 2, 0x0040_3000)
+
+    # Entry 1 is not fetched until the translation has completed
+    yield from ftq_respond(dut, 0)
+    assert (yield from ftq_wait_fetch(dut, 4)) is None
+    yield from ftq_xlat_done(dut, 0x403)
+    assert (yield from ftq_wait_fetch(dut, 4)) is None
+    yield from ftq_xlat_done(dut, 0x402)
+    assert (yield from ftq_wait_fetch(dut, 4)) == 1
+
+    # Entry 2 was already woken
+    yield from ftq_respond(dut, 1)
+    assert (yield from ftq_wait_fetch(dut, 2)) == 2
+
+class FTQBranchHarness(Component):
+    """ An FTQ connected to the BPU. """
+    def __init__(self, p: EmberParams):
+        self.p = p
+        meta_layout = BranchPredictionUnit.meta_layout(p)
+        super().__init__(Signature({
+            "alloc_req": In(FTQAllocRequest(p)),
+            "flush_req": In(FTQFlushRequest(p)),
+            "pd_resp": In(PredecodeResponse(p)),
+            "pred": Out(BranchPrediction(p, meta_layout)),
+        }))
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.ftq = ftq = FetchTargetQueue(self.p)
+        m.submodules.bpu = bpu = BranchPredictionUnit(self.p)
+        connect(m, flipped(self.alloc_req), ftq.alloc_req)
+        connect(m, flipped(self.flush_req), ftq.flush_req)
+        connect(m, flipped(self.pd_resp), bpu.pd_resp)
+        connect(m, bpu.pred, ftq.bp_pred, flipped(self.pred))
+        connect(m, ftq.bp_recover, bpu.recover)
+        return m
+
+def ftq_predict(dut: FTQBranchHarness, idx: int, pc: int):
+    """ Predict a conditional branch at the start of a cacheline in FTQ 
+    entry ``idx``, and return the global history used for the prediction.
+    """
+    yield dut.pd_resp.valid.eq(1)
+    yield dut.pd_resp.vaddr.eq(pc)
+    yield dut.pd_resp.ftq_idx.eq(idx)
+    yield dut.pd_resp.line.eq(1)
+    yield dut.pd_resp.info[0].cf_op.eq(ControlFlowOp.BRANCH)
+    yield dut.pd_resp.info_valid[0].eq(1)
+    yield Tick()
+    yield dut.pd_resp.valid.eq(0)
+    assert (yield dut.pred.valid) == 1
+    assert (yield dut.pred.ftq_idx) == idx
+    ghist = yield dut.pred.meta.dir.hist.ghist
+    # The prediction is shifted into the history at the end of the cycle
+    yield Tick()
+    return ghist
+
+def tb_ftq_bp_recover(dut: FTQBranchHarness):
+    for i in range(4):
+        yield from ftq_alloc(dut, 0x0000_1000 | (i * 0x100))
+
+    # An untrained perceptron predicts every branch taken
+    hist = []
+    for i in range(4):
+        pc = 0x0000_1000 | (i * 0x100)
+        hist.append((yield from ftq_predict(dut, i, pc)))
+    assert hist == [0b0, 0b1, 0b11, 0b111]
+
+    # A resteer from entry 1 flushes the younger entries, and the history 
+    # is restored to the state after the branch in entry 1
+    yield dut.flush_req.valid.eq(1)
+    yield dut.flush_req.id.eq(1)
+    yield Tick()
+    yield dut.flush_req.valid.eq(0)
+    yield from ftq_alloc(dut, 0x0000_2000)
+    assert (yield from ftq_predict(dut, 2, 0x0000_2000)) == 0b11
+
+    # Entry 3 has no branches, and is restored to the state after the 
+    # branch in entry 2
+    yield from ftq_alloc(dut, 0x0000_3000)
+    yield from ftq_alloc(dut, 0x0000_4000)
+    assert (yield from ftq_predict(dut, 4, 0x0000_4000)) == 0b111
+    yield dut.flush_req.valid.eq(1)
+    yield dut.flush_req.id.eq(3)
+    yield Tick()
+    yield dut.flush_req.valid.eq(0)
+    yield from ftq_alloc(dut, 0x0000_5000)
+    assert (yield from ftq_predict(dut, 4, 0x0000_5000)) == 0b111
+
 class FTQTests(unittest.TestCase):
     def test_ftq_elaborate(self):
         dut = FetchTargetQueue(EmberParams())
@@ -41,4 +390,68 @@ class FTQTests(unittest.TestCase):
         )
         tb.run()
 
+    def test_ftq_reclaim(self):
+        tb = Testbench(
+            FetchTargetQueue(EmberParams()),
+            tb_ftq_reclaim,
+            "tb_ftq_reclaim"
+        )
+        tb.run()
+
+    def test_ftq_flush(self):
+        tb = Testbench(
+            FetchTargetQueue(EmberParams()),
+            tb_ftq_flush,
+            "tb_ftq_flush"
+        )
+        tb.run()
+
+    def test_ftq_flush_freed(self):
+        tb = Testbench(
+            FetchTargetQueue(EmberParams()),
+            tb_ftq_flush_freed,
+            "tb_ftq_flush_freed"
+        )
+        tb.run()
+
+    def test_ftq_prefetch(self):
+        tb = Testbench(
+            FetchTargetQueue(EmberParams()),
+            tb_ftq_prefetch,
+            "tb_ftq_prefetch"
+        )
+        tb.run()
+
+    def test_ftq_wakeup(self):
+        tb = Testbench(
+            FetchTargetQueue(EmberParams()),
+            tb_ftq_wakeup,
+            "tb_ftq_wakeup"
+        )
+        tb.run()
 
+    def test_ftq_wakeup_ooo(self):
+        tb = Testbench(
+            FetchTargetQueue(EmberParams()),
+            tb_ftq_wakeup_ooo,
+            "tb_ftq_wakeup_ooo"
+        )
+        tb.run()
+
+    def test_ftq_xlat(self):
+        tb = Testbench(
+            FetchTargetQueue(EmberParams()),
+            tb_ftq_xlat,
+            "tb_ftq_xlat"
+        )
+        tb.run()
+
+    def test_ftq_bp_recover(self):
+        p = EmberParams()
+        p.bp.direction = DirectionPredictorKind.PERCEPTRON
+        tb = Testbench(
+            FTQBranchHarness(p),
+            tb_ftq_bp_recover,
+            "tb_ftq_bp_recover"
+        )
+        tb.run()
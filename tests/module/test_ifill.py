@@ -3,6 +3,7 @@ import unittest
 import logging
 
 from ember.param import *
+from ember.param.front import L1IFillParams
 from ember.front.l1i import *
 from ember.front.itlb import *
 from ember.front.ifill import *
@@ -19,8 +20,11 @@ class L1IFillHarness(Component):
     def __init__(self, p: EmberParams):
         self.p = p
         super().__init__(Signature({
-            "fakeram": Out(FakeRamInterface(p.l1i.line_depth).flip()).array(2),
+            "fakeram": Out(FakeRamInterface(
+                p.l1i.fill.beat_words, p.l1i.fill.id_bits
+            ).flip()).array(p.l1i.fill.num_mem),
             "port": In(L1IFillPort(p).flip()),
+            "pf": In(L1IFillPort(p).flip()),
             "l1i_rp": In(L1ICacheReadPort(p).flip()),
         }))
 
@@ -30,10 +34,11 @@ class L1IFillHarness(Component):
         m.submodules.ifill = ifill = NewL1IFillUnit(self.p)
 
         connect(m, self.port, ifill.port[0])
-        connect(m, self.fakeram[0], ifill.fakeram[0])
-        connect(m, self.fakeram[1], ifill.fakeram[1])
-        connect(m, ifill.l1i_wp[0], l1i.wp[0])
-        connect(m, ifill.l1i_wp[1], l1i.wp[1])
+        connect(m, self.pf, ifill.port[1])
+        for idx in range(self.p.l1i.fill.num_mem):
+            connect(m, self.fakeram[idx], ifill.fakeram[idx])
+        for idx in range(self.p.l1i.num_wp):
+            connect(m, ifill.l1i_wp[idx], l1i.wp[idx])
         connect(m, self.l1i_rp, l1i.rp[0])
 
         return m
@@ -123,6 +128,205 @@ def tb_l1ifill(dut: NewL1IFillUnit):
 
 
 
+def tb_l1ifill_delayed(dut: L1IFillHarness):
+    ram = DelayedFakeRam(0x0000_2000, 
+        width_words=dut.p.l1i.fill.beat_words, 
+        line_words=dut.p.l1i.line_depth,
+        min_lat=1, max_lat=6, max_pending=2, seed=1,
+    )
+    for addr in range(0x1000, 0x2000, 4):
+        ram.write_word(addr, addr)
+
+    # The first instruction is in the second beat of the first cacheline
+    yield dut.port.req.addr.eq(0x0000_1018)
+    yield dut.port.req.way.eq(0)
+    yield dut.port.req.valid.eq(1)
+    yield dut.port.req.blocks.eq(4)
+    yield Tick()
+    yield dut.port.req.addr.eq(0)
+    yield dut.port.req.valid.eq(0)
+    yield dut.port.req.blocks.eq(0)
+
+    full_mask = (1 << dut.p.l1i.line_depth) - 1
+    mem_reqs = []
+    fwd = []
+    beat_fwd = []
+    resp = 0
+    for cyc in range(64):
+        req = dut.fakeram[0].req
+        yield from ram.run(req, dut.fakeram[0].resp)
+        if (yield req.valid) and (yield req.ready):
+            mem_reqs.append((yield req.addr))
+        if (yield dut.port.fwd.valid):
+            addr = yield dut.port.fwd.addr.bits
+            mask = yield dut.port.fwd.mask
+            # Only the valid words are checked
+            for idx in range(dut.p.l1i.line_depth):
+                if mask & (1 << idx):
+                    word = yield dut.port.fwd.data[idx]
+                    assert word == addr + (idx * 4), f"{addr:08x}"
+            if mask == full_mask:
+                fwd.append(addr)
+            else:
+                assert addr not in fwd
+                beat_fwd.append((addr, mask))
+        if (yield dut.port.resp.valid):
+            assert len(fwd) == 4
+            resp += 1
+        yield Tick()
+
+    # The first cacheline is requested "critical-beat first"
+    assert mem_reqs == [ 0x1010, 0x1020, 0x1040, 0x1060 ], mem_reqs
+    assert (0x1000, 0xf0) in beat_fwd, beat_fwd
+    assert all(addr != 0x1000 or mask == 0xf0 for addr, mask in beat_fwd)
+
+    # Cachelines may be written in any order, and the response is only 
+    # sent after the last cacheline has been written
+    assert resp == 1
+    assert sorted(fwd) == [ 0x1000, 0x1020, 0x1040, 0x1060 ], fwd
+
+    for set_idx in range(0, 4):
+        yield dut.l1i_rp.req.valid.eq(1)
+        yield dut.l1i_rp.req.set.eq(set_idx)
+        yield Tick()
+        expected = [ 
+            0x1000 + (set_idx * 0x20) + (idx * 4) 
+            for idx in range(dut.p.l1i.line_depth)
+        ]
+        found = False
+        for way_idx in range(dut.p.l1i.num_ways):
+            if not (yield dut.l1i_rp.resp.tag_data[way_idx].valid):
+                continue
+            line = []
+            for idx in range(dut.p.l1i.line_depth):
+                line.append((yield dut.l1i_rp.resp.line_data[way_idx][idx]))
+            found = found or (line == expected)
+        assert found, f"set {set_idx}"
+
+
+def tb_l1ifill_merge(dut: L1IFillHarness):
+    ram = DelayedFakeRam(0x0000_2000, 
+        width_words=dut.p.l1i.fill.beat_words, 
+        line_words=dut.p.l1i.line_depth,
+        min_lat=4, max_lat=6, seed=2,
+    )
+    for addr in range(0x1000, 0x2000, 4):
+        ram.write_word(addr, addr)
+
+    # A prefetch request for the first cacheline
+    yield dut.pf.req.addr.eq(0x0000_1000)
+    yield dut.pf.req.valid.eq(1)
+    yield dut.pf.req.blocks.eq(1)
+    yield dut.pf.req.ftq_idx.eq(1)
+    yield dut.pf.req.src.eq(L1IFillSource.PREFETCH)
+    yield Tick()
+    yield dut.pf.req.valid.eq(0)
+
+    # A demand request for the same fetch block, one cycle later
+    yield dut.port.req.addr.eq(0x0000_1000)
+    yield dut.port.req.valid.eq(1)
+    yield dut.port.req.blocks.eq(4)
+    yield dut.port.req.ftq_idx.eq(2)
+    yield dut.port.req.src.eq(L1IFillSource.DEMAND)
+
+    mem_reqs = []
+    fwd = []
+    pf_resp = []
+    dm_resp = []
+    for cyc in range(64):
+        for pipe in range(2):
+            req = dut.fakeram[pipe].req
+            yield from ram.run(req, dut.fakeram[pipe].resp, pipe=pipe)
+            if (yield req.valid) and (yield req.ready):
+                mem_reqs.append((yield req.addr))
+        if (yield dut.port.fwd.valid):
+            assert (yield dut.port.fwd.ftq_idx) == 2
+            fwd.append((yield dut.port.fwd.addr.bits))
+        if (yield dut.pf.resp.valid):
+            pf_resp.append((
+                (yield dut.pf.resp.ftq_idx),
+                (yield dut.pf.resp.addr.bits),
+                (yield dut.pf.resp.blocks),
+                (yield dut.pf.resp.src),
+            ))
+        if (yield dut.port.resp.valid):
+            dm_resp.append((
+                (yield dut.port.resp.ftq_idx),
+                (yield dut.port.resp.addr.bits),
+                (yield dut.port.resp.blocks),
+                (yield dut.port.resp.src),
+            ))
+        yield Tick()
+        yield dut.port.req.valid.eq(0)
+
+    # Both requests are serviced by a single fill
+    assert sorted(mem_reqs) == [ 0x1000, 0x1020, 0x1040, 0x1060 ], mem_reqs
+    assert sorted(fwd) == [ 0x1000, 0x1020, 0x1040, 0x1060 ], fwd
+
+    # Each requester receives a response for its own request
+    assert pf_resp == [ (1, 0x1000, 1, L1IFillSource.PREFETCH.value) ]
+    assert dm_resp == [ (2, 0x1000, 4, L1IFillSource.DEMAND.value) ]
+
+
+def tb_l1ifill_shared(dut: L1IFillHarness):
+    ram = DelayedFakeRam(0x0000_2000, 
+        width_words=dut.p.l1i.fill.beat_words, 
+        line_words=dut.p.l1i.line_depth,
+        min_lat=1, max_lat=8, max_pending=6, seed=3,
+    )
+    for addr in range(0x1000, 0x2000, 4):
+        ram.write_word(addr, addr)
+
+    # Four outstanding fills sharing a single memory channel
+    reqs = [ 
+        (dut.port, 0x1000, 3, 1), (dut.pf, 0x1100, 2, 2), 
+        (dut.port, 0x1200, 2, 3), (dut.pf, 0x1300, 1, 4),
+    ]
+    for idx in range(0, len(reqs), 2):
+        for port, addr, blocks, ftq_idx in reqs[idx:idx+2]:
+            yield port.req.addr.eq(addr)
+            yield port.req.valid.eq(1)
+            yield port.req.blocks.eq(blocks)
+            yield port.req.ftq_idx.eq(ftq_idx)
+        yield Tick()
+    yield dut.port.req.valid.eq(0)
+    yield dut.pf.req.valid.eq(0)
+
+    fwd = []
+    resp = []
+    for cyc in range(96):
+        yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
+        for port in [ dut.port, dut.pf ]:
+            if (yield port.fwd.valid):
+                fwd.append((yield port.fwd.addr.bits))
+            if (yield port.resp.valid):
+                resp.append((
+                    (yield port.resp.ftq_idx), 
+                    (yield port.resp.addr.bits),
+                ))
+        yield Tick()
+
+    expected = [ 
+        addr + (idx * 0x20) 
+        for _, addr, blocks, _ in reqs for idx in range(blocks)
+    ]
+    assert sorted(fwd) == sorted(expected), fwd
+    assert sorted(resp) == [ (x[3], x[1]) for x in reqs ], resp
+
+    # Every cacheline was written to the L1I
+    for addr in expected:
+        yield dut.l1i_rp.req.valid.eq(1)
+        yield dut.l1i_rp.req.set.eq((addr >> 5) & (dut.p.l1i.num_sets - 1))
+        yield Tick()
+        found = False
+        for way_idx in range(dut.p.l1i.num_ways):
+            if not (yield dut.l1i_rp.resp.tag_data[way_idx].valid):
+                continue
+            word = yield dut.l1i_rp.resp.line_data[way_idx][0]
+            found = found or (word == addr)
+        assert found, f"{addr:08x}"
+
+
 class L1IFillUnitTests(unittest.TestCase):
     def test_l1ifill(self):
         tb = Testbench(
@@ -140,3 +344,32 @@ class L1IFillUnitTests(unittest.TestCase):
         )
         tb.run()
 
+    def test_l1ifill_delayed(self):
+        p = EmberParams()
+        p.l1i.fill = L1IFillParams(num_mshr=2, num_port=2, 
+            beat_words=4, num_lbuf=4
+        )
+        tb = Testbench(
+            L1IFillHarness(p),
+            tb_l1ifill_delayed,
+            "tb_l1ifill_delayed"
+        )
+        tb.run()
+
+    def test_l1ifill_merge(self):
+        tb = Testbench(
+            L1IFillHarness(EmberParams()),
+            tb_l1ifill_merge,
+            "tb_l1ifill_merge"
+        )
+        tb.run()
+
+    def test_l1ifill_shared(self):
+        p = EmberParams()
+        p.l1i.fill = L1IFillParams(num_mshr=4, num_port=2, num_mem=1)
+        tb = Testbench(
+            L1IFillHarness(p),
+            tb_l1ifill_shared,
+            "tb_l1ifill_shared"
+        )
+        tb.run()
@@ -0,0 +1,73 @@
+import unittest
+from ember.param import *
+from ember.sim.common import Testbench
+from ember.front.bp.ittage import *
+
+from amaranth import *
+from amaranth.sim import *
+from amaranth.back import verilog, rtlil
+
+def ittage_predict(dut: IttagePredictor, pc: int, hist: int):
+    yield dut.predict.req.valid.eq(1)
+    yield dut.predict.req.pc.eq(pc)
+    yield dut.predict.req.hist.eq(hist)
+    hit = yield dut.predict.resp.hit
+    tgt = yield dut.predict.resp.tgt.bits
+    yield dut.predict.req.valid.eq(0)
+    return (hit, tgt)
+
+def ittage_update(dut: IttagePredictor, pc: int, hist: int, tgt: int):
+    yield dut.update.valid.eq(1)
+    yield dut.update.pc.eq(pc)
+    yield dut.update.hist.eq(hist)
+    yield dut.update.tgt.eq(tgt)
+    yield Tick()
+    yield dut.update.valid.eq(0)
+
+def tb_ittage_monomorphic(dut: IttagePredictor):
+    # A single target is learned by the base table
+    assert (yield from ittage_predict(dut, 0x0000_1000, 0))[0] == 0
+    yield from ittage_update(dut, 0x0000_1000, 0, 0x0000_4000)
+    assert (yield from ittage_predict(dut, 0x0000_1000, 0)) == (1, 0x0000_4000)
+    assert (yield from ittage_predict(dut, 0x0000_1000, 0x5)) == (1, 0x0000_4000)
+
+def tb_ittage_polymorphic(dut: IttagePredictor):
+    # The target depends on the path taken to reach the jump
+    pc = 0x0000_1000
+    paths = [
+        (0x0000_0001, 0x0000_4000),
+        (0x0000_0002, 0x0000_8000),
+        (0x0000_0003, 0x0000_c000),
+    ]
+    for _ in range(8):
+        for (hist, tgt) in paths:
+            yield from ittage_update(dut, pc, hist, tgt)
+    for (hist, tgt) in paths:
+        assert (yield from ittage_predict(dut, pc, hist)) == (1, tgt)
+
+
+class IttageTests(unittest.TestCase):
+    def test_ittage_elaborate(self):
+        dut = IttagePredictor(EmberParams())
+        with open("/tmp/IttagePredictor.v", "w") as f:
+            f.write(verilog.convert(dut,
+                emit_src=False,
+                strip_internal_attrs=True,
+                name="IttagePredictor"
+            ))
+
+    def test_ittage_monomorphic(self):
+        tb = Testbench(
+            IttagePredictor(EmberParams()),
+            tb_ittage_monomorphic,
+            "tb_ittage_monomorphic"
+        )
+        tb.run()
+
+    def test_ittage_polymorphic(self):
+        tb = Testbench(
+            IttagePredictor(EmberParams()),
+            tb_ittage_polymorphic,
+            "tb_ittage_polymorphic"
+        )
+        tb.run()
@@ -75,6 +75,92 @@ def tb_l1itlb(dut: L1ICacheTLB):
     assert pte == 0x1111_1111
 
 
+def tb_l1itlb_plru(dut: L1ICacheTLB):
+    depth = dut.depth
+
+    # Fill every entry
+    for idx in range(depth):
+        yield dut.fill_req.valid.eq(1)
+        yield dut.fill_req.pte.eq(0x1000_0000 | idx)
+        yield dut.fill_req.vpn.eq(0x100 + idx)
+        yield Tick()
+
+    # Refilling an existing page must not evict another entry
+    yield dut.fill_req.pte.eq(0x2000_0000)
+    yield dut.fill_req.vpn.eq(0x100)
+    yield Tick()
+    yield dut.fill_req.valid.eq(0)
+
+    # Touch another page
+    yield dut.rp.req.valid.eq(1)
+    yield dut.rp.req.vpn.eq(0x101)
+    yield Tick()
+    yield dut.rp.req.valid.eq(0)
+    assert (yield dut.rp.resp.hit) == 1
+
+    # Fill a new page: an untouched entry is replaced
+    yield dut.fill_req.valid.eq(1)
+    yield dut.fill_req.pte.eq(0x3000_0000)
+    yield dut.fill_req.vpn.eq(0x200)
+    yield Tick()
+    yield dut.fill_req.valid.eq(0)
+
+    # Recently-used pages are still present
+    for vpn, pte in [ (0x100, 0x2000_0000), (0x101, 0x1000_0001), 
+                      (0x200, 0x3000_0000) ]:
+        yield dut.rp.req.valid.eq(1)
+        yield dut.rp.req.vpn.eq(vpn)
+        yield Tick()
+        assert (yield dut.rp.resp.hit) == 1
+        assert (yield dut.rp.resp.pte) == pte
+    yield dut.rp.req.valid.eq(0)
+
+    # Exactly one of the original pages was evicted
+    misses = 0
+    for idx in range(depth):
+        yield dut.rp.req.valid.eq(1)
+        yield dut.rp.req.vpn.eq(0x100 + idx)
+        yield Tick()
+        misses += 1 - (yield dut.rp.resp.hit)
+    assert misses == 1
+
+
+def tb_l1itlb_superpage(dut: L1ICacheTLB):
+    # A 4MiB superpage [vpn1=0x003 -> ppn1=0x007], and a 4KiB page
+    yield dut.fill_req.valid.eq(1)
+    yield dut.fill_req.pte.eq((0x007 << 20) | 0xcb)
+    yield dut.fill_req.vpn.eq(0x003 << 10)
+    yield dut.fill_req.superpage.eq(1)
+    yield Tick()
+    yield dut.fill_req.pte.eq((0x008 << 20) | (0x001 << 10) | 0xcb)
+    yield dut.fill_req.vpn.eq((0x004 << 10) | 0x001)
+    yield dut.fill_req.superpage.eq(0)
+    yield Tick()
+    yield dut.fill_req.valid.eq(0)
+
+    # Every page in the superpage hits [on both ports], and the lower 
+    # bits of the physical page number come from the request
+    for vpn0 in [ 0x000, 0x025, 0x3ff ]:
+        yield dut.rp.req.valid.eq(1)
+        yield dut.rp.req.vpn.eq((0x003 << 10) | vpn0)
+        yield dut.pp.req.valid.eq(1)
+        yield dut.pp.req.vpn.eq((0x003 << 10) | vpn0)
+        yield Tick()
+        for port in [ dut.rp, dut.pp ]:
+            assert (yield port.resp.hit) == 1
+            assert (yield port.resp.pte) == (0x007 << 20) | (vpn0 << 10) | 0xcb
+
+    # Other pages only match the whole virtual page number
+    for vpn, hit in [ ((0x004 << 10) | 0x001, 1), ((0x004 << 10) | 0x002, 0), 
+                      ((0x002 << 10) | 0x025, 0) ]:
+        yield dut.rp.req.valid.eq(1)
+        yield dut.rp.req.vpn.eq(vpn)
+        yield Tick()
+        assert (yield dut.rp.resp.hit) == hit
+    yield dut.rp.req.valid.eq(0)
+    yield dut.pp.req.valid.eq(0)
+
+
 class L1ICacheHarness(object):
     def __init__(self, dut: L1ICache):
         self.dut = dut
@@ -167,6 +253,39 @@ def tb_l1icache_rw(dut: L1ICache):
     assert valid == 1
     assert tag_data[1] == 0x4
 
+def tb_l1icache_plru(dut: L1ICache):
+    cache = L1ICacheHarness(dut)
+    num_ways = dut.p.l1i.num_ways
+
+    # Two concurrent writes to the same set use different ways
+    yield from cache.drive_write_port(0, 3, 0, 0x10, [1] * 8)
+    yield from cache.drive_write_port(1, 3, 0, 0x20, [2] * 8)
+    way0 = yield dut.wp[0].victim.way
+    yield dut.wp[0].req.way.eq(way0)
+    way1 = yield dut.wp[1].victim.way
+    yield dut.wp[1].req.way.eq(way1)
+    assert way0 != way1
+    yield Tick()
+    yield from cache.clear_write_port(0)
+    yield from cache.clear_write_port(1)
+
+    yield from cache.drive_read_port(0, 3)
+    yield Tick()
+    yield from cache.clear_read_port(0)
+    valid, tag_data, tag_valid, line_data = yield from cache.sample_read_port(0)
+    assert tag_data[way0] == 0x10 and tag_valid[way0] == 1
+    assert tag_data[way1] == 0x20 and tag_valid[way1] == 1
+
+    # A hit protects a way from being replaced
+    for way in range(num_ways):
+        yield dut.rp[0].hit.valid.eq(1)
+        yield dut.rp[0].hit.set.eq(3)
+        yield dut.rp[0].hit.way.eq(way)
+        yield Tick()
+        yield dut.rp[0].hit.valid.eq(0)
+        yield dut.wp[0].req.set.eq(3)
+        assert (yield dut.wp[0].victim.way) != way
+
 class L1ICacheTests(unittest.TestCase):
 
     #def test_l1icache_elaborate(self):
@@ -190,6 +309,22 @@ class L1ICacheTests(unittest.TestCase):
         )
         tb.run()
 
+    def test_l1itlb_plru(self):
+        tb = Testbench(
+            L1ICacheTLB(EmberParams()),
+            tb_l1itlb_plru,
+            "tb_l1itlb_plru"
+        )
+        tb.run()
+
+    def test_l1itlb_superpage(self):
+        tb = Testbench(
+            L1ICacheTLB(EmberParams()),
+            tb_l1itlb_superpage,
+            "tb_l1itlb_superpage"
+        )
+        tb.run()
+
     def test_l1icache_rw(self):
         tb = Testbench(
             L1ICache(EmberParams()),
@@ -198,3 +333,10 @@ class L1ICacheTests(unittest.TestCase):
         )
         tb.run()
 
+    def test_l1icache_plru(self):
+        tb = Testbench(
+            L1ICache(EmberParams()),
+            tb_l1icache_plru,
+            "tb_l1icache_plru"
+        )
+        tb.run()
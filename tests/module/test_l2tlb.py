@@ -0,0 +1,72 @@
+import unittest
+
+from ember.param import *
+from ember.front.l2tlb import *
+from ember.sim.common import Testbench
+
+from amaranth import *
+from amaranth.sim import *
+
+def l2tlb_fill(dut: L2TLB, vpn: int, pte: int, superpage=0):
+    yield dut.fill.valid.eq(1)
+    yield dut.fill.vpn.eq(vpn)
+    yield dut.fill.pte.eq(pte)
+    yield dut.fill.superpage.eq(superpage)
+    yield Tick()
+    yield dut.fill.valid.eq(0)
+
+def l2tlb_lookup(dut: L2TLB, port: int, vpn: int):
+    rp = dut.rp[port]
+    yield rp.req.valid.eq(1)
+    yield rp.req.vpn.eq(vpn)
+    yield Tick()
+    yield rp.req.valid.eq(0)
+    assert (yield rp.resp.valid)
+    assert (yield rp.resp.vpn) == vpn
+    if (yield rp.resp.hit):
+        return (yield rp.resp.pte)
+    return None
+
+def tb_l2tlb(dut: L2TLB):
+    tp = dut.p.l2tlb
+
+    # Pages in the same set
+    vpns = [ (idx << tp.set_bits) | 3 for idx in range(1, tp.num_ways + 2) ]
+
+    # Fill every way in the set, and update the first entry
+    for idx, vpn in enumerate(vpns[:tp.num_ways]):
+        yield from l2tlb_fill(dut, vpn, 0x1000 + idx)
+    yield from l2tlb_fill(dut, vpns[0], 0x2000)
+    yield Tick()
+    for port in range(tp.num_port):
+        assert (yield from l2tlb_lookup(dut, port, vpns[0])) == 0x2000
+        assert (yield from l2tlb_lookup(dut, port, vpns[1])) == 0x1001
+        assert (yield from l2tlb_lookup(dut, port, vpns[-1])) == None
+        assert (yield from l2tlb_lookup(dut, port, vpns[1] ^ 1)) == None
+
+    # A new page replaces the first way in the set
+    yield from l2tlb_fill(dut, vpns[-1], 0x3000)
+    yield Tick()
+    assert (yield from l2tlb_lookup(dut, 0, vpns[0])) == None
+    assert (yield from l2tlb_lookup(dut, 0, vpns[-1])) == 0x3000
+    for idx, vpn in enumerate(vpns[1:tp.num_ways]):
+        assert (yield from l2tlb_lookup(dut, 1, vpn)) == 0x1001 + idx
+
+    # Entries keep the page-size bit
+    yield from l2tlb_fill(dut, vpns[1], 0x4000, superpage=1)
+    yield Tick()
+    assert (yield from l2tlb_lookup(dut, 0, vpns[1])) == 0x4000
+    assert (yield dut.rp[0].resp.superpage) == 1
+    assert (yield from l2tlb_lookup(dut, 0, vpns[2])) == 0x1002
+    assert (yield dut.rp[0].resp.superpage) == 0
+
+
+class L2TLBTests(unittest.TestCase):
+    def test_l2tlb(self):
+        tb = Testbench(
+            L2TLB(EmberParams()),
+            tb_l2tlb,
+            "tb_l2tlb"
+        )
+        tb.run()
+
@@ -0,0 +1,98 @@
+import unittest
+from ember.param import *
+from ember.sim.common import Testbench
+from tests.common import dirpred_run
+from ember.front.bp.loop import *
+from ember.front.bpu import *
+
+from amaranth import *
+from amaranth.sim import *
+from amaranth.back import verilog, rtlil
+
+def tb_loop_trip_count(dut: LoopPredictor):
+    # A loop which is taken 5 times before exiting
+    trip = [1] * 5 + [0]
+    correct = yield from dirpred_run(dut, 0x0000_1010, trip * 8)
+    assert all(correct[-len(trip) * 2:])
+
+    # The loop predictor is confident about the exit
+    for taken in trip:
+        yield dut.predict.req.valid.eq(1)
+        yield dut.predict.req.pc.eq(0x0000_1010)
+        yield Tick()
+        yield dut.predict.req.valid.eq(0)
+        assert (yield dut.predict.resp.meta.confident) == 1
+        assert (yield dut.predict.resp.taken) == taken
+
+def tb_loop_trip_change(dut: LoopPredictor):
+    # Confidence is lost when the trip count changes
+    yield from dirpred_run(dut, 0x0000_1010, ([1] * 3 + [0]) * 8)
+    yield from dirpred_run(dut, 0x0000_1010, [1] * 5 + [0])
+    yield dut.predict.req.valid.eq(1)
+    yield dut.predict.req.pc.eq(0x0000_1010)
+    yield Tick()
+    yield dut.predict.req.valid.eq(0)
+    assert (yield dut.predict.resp.meta.confident) == 0
+
+def loop_hit(dut: LoopPredictor, pc: int):
+    yield dut.predict.req.valid.eq(1)
+    yield dut.predict.req.pc.eq(pc)
+    yield Tick()
+    yield dut.predict.req.valid.eq(0)
+    return (yield dut.predict.resp.meta.hit)
+
+def tb_loop_replace(dut: LoopPredictor):
+    lp = dut.p.bp.loop
+
+    # Two branches with the same index and different tags
+    pc_a = 0x0000_1010
+    pc_b = pc_a + (lp.depth << 2)
+
+    # The loop for the first branch is still being learned
+    yield from dirpred_run(dut, pc_a, [0] + [1] * 3 + [0])
+    assert (yield from loop_hit(dut, pc_a)) == 1
+
+    # Conflicting allocations age the entry before it is replaced
+    for _ in range((1 << lp.age_bits) - 1):
+        yield from dirpred_run(dut, pc_b, [0])
+        assert (yield from loop_hit(dut, pc_a)) == 1
+        assert (yield from loop_hit(dut, pc_b)) == 0
+    yield from dirpred_run(dut, pc_b, [0])
+    assert (yield from loop_hit(dut, pc_a)) == 0
+    assert (yield from loop_hit(dut, pc_b)) == 1
+
+
+class LoopPredictorTests(unittest.TestCase):
+    def test_loop_elaborate(self):
+        for cls in [LoopPredictor, BranchPredictionUnit]:
+            dut = cls(EmberParams())
+            with open(f"/tmp/{cls.__name__}.v", "w") as f:
+                f.write(verilog.convert(dut,
+                    emit_src=False,
+                    strip_internal_attrs=True,
+                    name=cls.__name__
+                ))
+
+    def test_loop_trip_count(self):
+        tb = Testbench(
+            LoopPredictor(EmberParams()),
+            tb_loop_trip_count,
+            "tb_loop_trip_count"
+        )
+        tb.run()
+
+    def test_loop_replace(self):
+        tb = Testbench(
+            LoopPredictor(EmberParams()),
+            tb_loop_replace,
+            "tb_loop_replace"
+        )
+        tb.run()
+
+    def test_loop_trip_change(self):
+        tb = Testbench(
+            LoopPredictor(EmberParams()),
+            tb_loop_trip_change,
+            "tb_loop_trip_change"
+        )
+        tb.run()
@@ -1,4 +1,5 @@
 import unittest
+import random
 from ember.common.replacement import TreePLRU
 from ember.sim.common import Testbench
 
@@ -6,29 +7,80 @@ from amaranth import *
 from amaranth.sim import *
 from amaranth.back import verilog, rtlil
 
+class TreePLRUModel(object):
+    """ Reference model for a tree PLRU. """
+    def __init__(self, num_entries):
+        self.num_entries = num_entries
+        self.width = num_entries.bit_length() - 1
+        self.state = [ 0 for _ in range(num_entries - 1) ]
+
+    def touch(self, idx):
+        node = 0
+        for depth in range(self.width):
+            bit = (idx >> (self.width - 1 - depth)) & 1
+            self.state[node] = bit ^ 1
+            node = (2 * node) + 1 + bit
+
+    def victim(self):
+        node = 0
+        idx = 0
+        for depth in range(self.width):
+            bit = self.state[node]
+            idx = (idx << 1) | bit
+            node = (2 * node) + 1 + bit
+        return idx
+
 def plru_test_proc(dut: TreePLRU):
-    for i in range(8):
-        output = yield dut.lru
-        #if i % 4 == 0:
-        #    yield dut.en.eq(1)
-        #else:
-        #    yield dut.en.eq(0)
+    # Touching every entry (in bit-reversed order) leaves the first entry 
+    # as the least-recently used
+    width = dut.idx_width
+    order = [ 
+        int(f"{idx:0{width}b}"[::-1], 2) for idx in range(dut.num_entries) 
+    ]
+    for idx in order:
+        yield dut.access[0].valid.eq(1)
+        yield dut.access[0].idx.eq(idx)
+        yield Tick()
+    yield dut.access[0].valid.eq(0)
+    yield Tick()
+    assert (yield dut.lru) == 0
+
+    # Compare against the model with two accesses per cycle
+    model = TreePLRUModel(dut.num_entries)
+    for idx in order:
+        model.touch(idx)
+    rng = random.Random(0)
+    for _ in range(64):
+        assert (yield dut.lru) == model.victim()
+        for port in range(dut.num_access):
+            valid = rng.randrange(2)
+            idx = rng.randrange(dut.num_entries)
+            yield dut.access[port].valid.eq(valid)
+            yield dut.access[port].idx.eq(idx)
+            if valid:
+                model.touch(idx)
         yield Tick()
 
-#class TreePLRUTests(unittest.TestCase):
+class TreePLRUTests(unittest.TestCase):
 
     #def test_lfsr_values(self):
     #    dut = LFSR(degree=6)
     #    values = dut.generate()
     #    for value in values: print(value)
 
-    #def test_plru(self):
-    #    print()
-    #    tb = Testbench(
-    #        TreePLRU(8),
-    #        plru_test_proc,
-    #        "test_plru"
-    #    )
-    #    tb.run()
+    def test_plru(self):
+        tb = Testbench(
+            TreePLRU(4, num_access=2),
+            plru_test_proc,
+            "test_plru"
+        )
+        tb.run()
 
+    def test_plru_8(self):
+        tb = Testbench(
+            TreePLRU(8, num_access=2),
+            plru_test_proc,
+            "test_plru_8"
+        )
+        tb.run()
 
@@ -0,0 +1,175 @@
+import unittest
+
+from ember.param import *
+from ember.param.front import PageTableWalkerParams
+from ember.front.itlb import *
+from ember.front.ptw import *
+from ember.front.l2tlb import *
+from ember.sim.common import Testbench
+from ember.sim.fakeram import *
+
+from amaranth import *
+from amaranth.sim import *
+
+class PageTableWalkerHarness(Component):
+    def __init__(self, p: EmberParams):
+        self.p = p
+        super().__init__(Signature({
+            "satp": Out(SatpSv32()),
+            "fakeram": Out(FakeRamInterface(
+                p.ptw.beat_words, p.ptw.id_bits
+            ).flip()),
+            "port": In(L1ICacheTLBXlatPort().flip()).array(p.ptw.num_port),
+            "resp": Out(L1ICacheTLBXlatPort.Response()),
+            "tlb_rp": In(L1ICacheTLBReadPort().flip()),
+        }))
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.ptw  = ptw  = PageTableWalker(self.p)
+        m.submodules.itlb = itlb = L1ICacheTLB(self.p)
+        m.submodules.l2tlb = l2tlb = L2TLB(self.p)
+
+        m.d.comb += ptw.satp.eq(self.satp)
+        connect(m, self.fakeram, ptw.fakeram)
+        for idx in range(self.p.ptw.num_port):
+            connect(m, self.port[idx], ptw.port[idx])
+        connect(m, ptw.resp, flipped(self.resp))
+        connect(m, ptw.tlb_fill, itlb.fill_req)
+        connect(m, ptw.l2tlb_rp, l2tlb.rp[0])
+        connect(m, ptw.l2tlb_fill, l2tlb.fill)
+        connect(m, self.tlb_rp, itlb.rp)
+        return m
+
+# Page table entry flags
+PTE_V = 1 << 0
+PTE_R = 1 << 1
+PTE_X = 1 << 3
+PTE_A = 1 << 6
+
+def pte(ppn: int, flags: int):
+    return (ppn << 10) | flags
+
+def vpn(vpn1: int, vpn0: int):
+    return (vpn1 << 10) | vpn0
+
+def build_page_table(ram: FakeRam):
+    """ Root table at 0x4000, and one level 0 table at 0x5000. """
+    ram.write_word(0x4000 + (1 * 4), pte(0x5, PTE_V))
+    ram.write_word(0x4000 + (2 * 4), pte(3 << 10, PTE_V|PTE_R|PTE_X|PTE_A))
+    ram.write_word(0x5000 + (1 * 4), pte(0x8, PTE_V|PTE_R|PTE_X|PTE_A))
+    ram.write_word(0x5000 + (2 * 4), pte(0x9, PTE_V|PTE_R|PTE_X|PTE_A))
+    ram.write_word(0x5000 + (3 * 4), pte(0xa, PTE_V|PTE_R|PTE_A))
+
+def run_walks(dut: PageTableWalkerHarness, ram: FakeRam, reqs: list):
+    """ Send groups of requests [a list of (port, vpn) for each group], and
+    collect the completed translations and the memory requests.
+    """
+    resp = {}
+    mem_reqs = []
+    reqs = list(reqs)
+    for cyc in range(128):
+        for port in dut.port:
+            yield port.req.valid.eq(0)
+        # Wait until the ports are ready
+        ready = True
+        for idx, x in (reqs[0] if len(reqs) != 0 else []):
+            ready = ready and (yield dut.port[idx].ready)
+        if len(reqs) != 0 and ready:
+            for idx, x in reqs.pop(0):
+                yield dut.port[idx].req.valid.eq(1)
+                yield dut.port[idx].req.vpn.eq(x)
+        yield from ram.run(dut.fakeram.req, dut.fakeram.resp)
+        if (yield dut.fakeram.req.valid) and (yield dut.fakeram.req.ready):
+            mem_reqs.append((yield dut.fakeram.req.addr))
+        if (yield dut.resp.valid):
+            x = yield dut.resp.vpn
+            assert x not in resp
+            resp[x] = (yield dut.resp.fault)
+            # Every port observes the same response
+            for port in dut.port:
+                assert (yield port.resp.valid)
+                assert (yield port.resp.vpn) == x
+        yield Tick()
+    return resp, mem_reqs
+
+def tlb_lookup(dut: PageTableWalkerHarness, x: int):
+    yield dut.tlb_rp.req.valid.eq(1)
+    yield dut.tlb_rp.req.vpn.eq(x)
+    yield Tick()
+    yield dut.tlb_rp.req.valid.eq(0)
+    if (yield dut.tlb_rp.resp.hit):
+        return (yield dut.tlb_rp.resp.pte) >> 10
+    return None
+
+def tb_ptw_common(dut: PageTableWalkerHarness, ram: FakeRam):
+    build_page_table(ram)
+    yield dut.satp.ppn.eq(0x4)
+
+    # A two-level walk, and a superpage
+    resp, mem_reqs = yield from run_walks(dut, ram, [
+        [ (0, vpn(1, 1)), (1, vpn(2, 5)) ],
+    ])
+    assert resp == { vpn(1, 1): 0, vpn(2, 5): 0 }, resp
+    assert sorted(mem_reqs) == [ 0x4000, 0x4000, 0x5000 ], mem_reqs
+
+    # The PDE cache hits, and requests for the same page are merged
+    resp, mem_reqs = yield from run_walks(dut, ram, [
+        [ (0, vpn(1, 2)), (1, vpn(1, 2)) ],
+        [ (1, vpn(0, 3)) ],
+        [ (1, vpn(1, 3)) ],
+    ])
+    assert resp == { vpn(1, 2): 0, vpn(0, 3): 1, vpn(1, 3): 1 }, resp
+    assert sorted(mem_reqs) == [ 0x4000, 0x5000, 0x5000 ], mem_reqs
+
+    # Completed translations are found in the L2 TLB
+    resp, mem_reqs = yield from run_walks(dut, ram, [
+        [ (0, vpn(1, 1)), (1, vpn(2, 5)) ],
+        [ (1, vpn(1, 3)) ],
+    ])
+    assert resp == { vpn(1, 1): 0, vpn(2, 5): 0, vpn(1, 3): 1 }, resp
+    assert sorted(mem_reqs) == [ 0x5000 ], mem_reqs
+
+    # Translations are filled into the TLB
+    assert (yield from tlb_lookup(dut, vpn(1, 1))) == 0x8
+    assert (yield from tlb_lookup(dut, vpn(1, 2))) == 0x9
+    assert (yield from tlb_lookup(dut, vpn(2, 5))) == (3 << 10) | 5
+    # The superpage covers pages that were never walked
+    assert (yield from tlb_lookup(dut, vpn(2, 0x3ff))) == (3 << 10) | 0x3ff
+    assert (yield from tlb_lookup(dut, vpn(0, 3))) == None
+    assert (yield from tlb_lookup(dut, vpn(1, 3))) == None
+
+def tb_ptw(dut: PageTableWalkerHarness):
+    yield from tb_ptw_common(dut, FakeRam(0x10000))
+
+def tb_ptw_delayed(dut: PageTableWalkerHarness):
+    ram = DelayedFakeRam(0x10000, 
+        width_words=dut.p.ptw.beat_words, 
+        line_words=dut.p.ptw.line_words,
+        min_lat=1, max_lat=8, seed=4,
+    )
+    yield from tb_ptw_common(dut, ram)
+
+
+class PageTableWalkerTests(unittest.TestCase):
+    def test_ptw(self):
+        p = EmberParams()
+        tb = Testbench(
+            PageTableWalkerHarness(p),
+            tb_ptw,
+            "tb_ptw"
+        )
+        tb.run()
+
+    def test_ptw_delayed(self):
+        p = EmberParams()
+        p.ptw = PageTableWalkerParams(num_walk=4, num_port=2,
+            beat_words=4, line_words=8,
+        )
+        tb = Testbench(
+            PageTableWalkerHarness(p),
+            tb_ptw_delayed,
+            "tb_ptw_delayed"
+        )
+        tb.run()
+
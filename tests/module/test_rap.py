@@ -9,38 +9,68 @@ from amaranth import *
 from amaranth.sim import *
 from amaranth.back import verilog, rtlil
 
-def tb_rap_rw(dut: ReturnAddressPredictor):
-    #yield dut.req.valid.eq(1)
-    #yield dut.req.idx.eq(3)
-    #yield dut.write_req.valid.eq(1)
-    #yield dut.write_req.idx.eq(3)
-    #yield dut.write_req.addr.eq(0xdeadc0de)
-    #yield Tick()
-
-    #addr = yield dut.resp.addr
-    #valid = yield dut.resp.valid
-    #assert addr == 0xdeadc0de
-    #assert valid == 1
-    #yield dut.req.valid.eq(0)
-    #yield dut.req.idx.eq(0)
-    #yield dut.write_req.valid.eq(0)
-    #yield dut.write_req.idx.eq(0)
-    #yield dut.write_req.addr.eq(0)
-    #yield Tick()
-
-    #yield dut.req.valid.eq(1)
-    #yield dut.req.idx.eq(3)
-    #yield Tick()
-    #addr = yield dut.resp.addr
-    #valid = yield dut.resp.valid
-    #assert addr == 0xdeadc0de
-    #assert valid == 1
+def rap_push(dut: ReturnAddressPredictor, addr: int):
+    yield dut.push.req.valid.eq(1)
+    yield dut.push.req.addr.eq(addr)
+    overflow = yield dut.push.resp.overflow
+    yield Tick()
+    yield dut.push.req.valid.eq(0)
+    return overflow
 
+def rap_pop(dut: ReturnAddressPredictor):
+    yield dut.pop.req.valid.eq(1)
+    addr = yield dut.pop.resp.addr
+    underflow = yield dut.pop.resp.underflow
     yield Tick()
+    yield dut.pop.req.valid.eq(0)
+    return (addr, underflow)
+
+def tb_rap_rw(dut: ReturnAddressPredictor):
+    for addr in [0x1000, 0x2000, 0x3000]:
+        assert (yield from rap_push(dut, addr)) == 0
+    for addr in [0x3000, 0x2000, 0x1000]:
+        assert (yield from rap_pop(dut)) == (addr, 0)
+    assert (yield dut.head_valid) == 0
+    assert (yield from rap_pop(dut))[1] == 1
+
+def tb_rap_recursion(dut: ReturnAddressPredictor):
+    # Repeated pushes of the same address occupy a single entry
+    yield from rap_push(dut, 0x1000)
+    for _ in range(3 * dut.num_entries):
+        assert (yield from rap_push(dut, 0x2000)) == 0
+    for _ in range(3 * dut.num_entries):
+        assert (yield from rap_pop(dut)) == (0x2000, 0)
+    assert (yield from rap_pop(dut)) == (0x1000, 0)
+
+def tb_rap_overflow(dut: ReturnAddressPredictor):
+    n = dut.num_entries
+    overflow = []
+    for idx in range(n + 2):
+        overflow.append((yield from rap_push(dut, 0x1000 + (idx * 4))))
+    assert overflow == ([0] * n) + [1, 1]
 
+    # The most-recent entries are still correct
+    for idx in reversed(range(2, n + 2)):
+        assert (yield from rap_pop(dut)) == (0x1000 + (idx * 4), 0)
+    assert (yield dut.head_valid) == 0
 
+def tb_rap_restore(dut: ReturnAddressPredictor):
+    yield from rap_push(dut, 0x1000)
+    yield from rap_push(dut, 0x2000)
+    ckpt = yield dut.ckpt.as_value()
 
+    # Wrong-path pop, then a wrong-path push overwriting the old top entry
+    yield from rap_pop(dut)
+    yield from rap_push(dut, 0xdead)
+    assert (yield dut.head) == 0xdead
 
+    # Restore and pop on the same cycle
+    yield dut.restore.valid.eq(1)
+    yield dut.restore.ckpt.as_value().eq(ckpt)
+    assert (yield dut.head) == 0x2000
+    assert (yield from rap_pop(dut)) == (0x2000, 0)
+    yield dut.restore.valid.eq(0)
+    assert (yield from rap_pop(dut)) == (0x1000, 0)
 
 class RAPUnitTests(unittest.TestCase):
     def test_rap_elaborate(self):
@@ -57,4 +87,28 @@ class RAPUnitTests(unittest.TestCase):
         )
         tb.run()
 
+    def test_rap_recursion(self):
+        tb = Testbench(
+            ReturnAddressPredictor(8),
+            tb_rap_recursion,
+            "tb_rap_recursion"
+        )
+        tb.run()
+
+    def test_rap_overflow(self):
+        tb = Testbench(
+            ReturnAddressPredictor(8),
+            tb_rap_overflow,
+            "tb_rap_overflow"
+        )
+        tb.run()
+
+    def test_rap_restore(self):
+        tb = Testbench(
+            ReturnAddressPredictor(8),
+            tb_rap_restore,
+            "tb_rap_restore"
+        )
+        tb.run()
+
 
@@ -0,0 +1,73 @@
+import unittest
+from ember.param import *
+from ember.sim.common import Testbench
+from ember.uarch.mop import ControlFlowOp
+from ember.front.bp.update import *
+
+from amaranth import *
+from amaranth.sim import *
+from amaranth.back import verilog, rtlil
+
+def pd_resteer(dut: PredictorUpdateUnit, src: int, tgt: int, line: int):
+    yield dut.pd_resteer.valid.eq(1)
+    yield dut.pd_resteer.op.eq(ControlFlowOp.JUMP_DIR)
+    yield dut.pd_resteer.src_pc.eq(src)
+    yield dut.pd_resteer.tgt_pc.eq(tgt)
+    yield dut.pd_resteer.parent_line.eq(line)
+    yield dut.pd_resteer.parent_idx.eq((src >> 2) & 0x7)
+
+def tb_update(dut: PredictorUpdateUnit):
+    # A direct jump discovered by predecode
+    yield dut.ftq_ckpt.vaddr.eq(0x0000_1000)
+    yield from pd_resteer(dut, 0x0000_1024, 0x0000_2000, 2)
+    yield Tick()
+    yield dut.pd_resteer.valid.eq(0)
+    assert (yield dut.btb_wp.valid) == 1
+    assert (yield dut.btb_wp.pc.bits) == 0x0000_1024
+    assert (yield dut.btb_wp.tgt.bits) == 0x0000_2000
+    assert (yield dut.cfm_wp.req.valid) == 1
+    assert (yield dut.cfm_wp.req.entry.entry_pc.bits) == 0x0000_1000
+    assert (yield dut.cfm_wp.req.entry.blocks) == 2
+    assert (yield dut.cfm_wp.req.entry.end_idx) == 0x4
+    assert (yield dut.cfm_wp.req.entry.next_pc.bits) == 0x0000_2000
+    assert (yield dut.dir_update.valid) == 0
+    yield Tick()
+    assert (yield dut.btb_wp.valid) == 0
+
+    # A resolved branch and a direct jump on the same cycle
+    yield from pd_resteer(dut, 0x0000_3004, 0x0000_4000, 1)
+    yield dut.res.valid.eq(1)
+    yield dut.res.op.eq(ControlFlowOp.BRANCH)
+    yield dut.res.pc.eq(0x0000_5008)
+    yield dut.res.taken.eq(0)
+    yield Tick()
+    yield dut.pd_resteer.valid.eq(0)
+    yield dut.res.valid.eq(0)
+    assert (yield dut.dir_update.valid) == 1
+    assert (yield dut.dir_update.pc.bits) == 0x0000_5008
+    assert (yield dut.btb_wp.valid) == 0
+    yield Tick()
+    assert (yield dut.dir_update.valid) == 0
+    assert (yield dut.btb_wp.valid) == 1
+    assert (yield dut.btb_wp.pc.bits) == 0x0000_3004
+    yield Tick()
+    assert (yield dut.btb_wp.valid) == 0
+
+
+class PredictorUpdateTests(unittest.TestCase):
+    def test_update_elaborate(self):
+        dut = PredictorUpdateUnit(EmberParams())
+        with open("/tmp/PredictorUpdateUnit.v", "w") as f:
+            f.write(verilog.convert(dut,
+                emit_src=False,
+                strip_internal_attrs=True,
+                name="PredictorUpdateUnit"
+            ))
+
+    def test_update(self):
+        tb = Testbench(
+            PredictorUpdateUnit(EmberParams()),
+            tb_update,
+            "tb_update"
+        )
+        tb.run()
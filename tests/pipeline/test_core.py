@@ -1,10 +1,11 @@
 import unittest
+from struct import pack
 from ember.param import *
 
 from ember.sim.common import Testbench
 from ember.uarch.front import *
 from ember.sim.fakeram import *
-from ember.core import EmberCore
+from ember.core import EmberCore, EmberFrontend
 
 from amaranth import *
 from amaranth.sim import *
@@ -33,10 +34,93 @@ def tb_core_simple(dut: EmberCore):
         yield Tick()
         yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
         yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
+        yield from ram.run(dut.ptw_fakeram.req, dut.ptw_fakeram.resp, pipe=2)
         cyc += 1
 
+def rv32_jal(rd: int, off: int):
+    imm = off & 0x1f_ffff
+    return (
+        (((imm >> 20) & 1) << 31) | (((imm >> 1) & 0x3ff) << 21) | 
+        (((imm >> 11) & 1) << 20) | (((imm >> 12) & 0xff) << 12) | 
+        (rd << 7) | 0b1101111
+    )
+
+def tb_frontend_flush(dut: EmberFrontend):
+    ram = FakeRam(0x0000_1000)
+    ram.write_bytes(0x000, bytearray(pack("<L", rv32_jal(0, 0x100))))
+    ram.write_bytes(0x100, bytearray(pack("<L", rv32_jal(0, -0x100))))
+
+    # The block at 0x040 is younger than the block at 0x000, and is on the 
+    # wrong path after the jump at 0x000 
+    for pc in [ 0x000, 0x040 ]:
+        yield dut.dbg_cf_req.valid.eq(1)
+        yield dut.dbg_cf_req.pc.eq(pc)
+        yield Tick()
+    yield dut.dbg_cf_req.valid.eq(0)
+    yield dut.dbg_cf_req.pc.eq(0)
+
+    fetched = []
+    for cyc in range(160):
+        if (yield dut.dbg_fetch_resp.valid):
+            fetched.append((yield dut.dbg_fetch_resp.vaddr))
+        yield Tick()
+        yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
+        yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
+        yield from ram.run(dut.ptw_fakeram.req, dut.ptw_fakeram.resp, pipe=2)
+
+    # The wrong-path block is never fetched, and blocks predicted correctly 
+    # after the BTBs are trained are not duplicated
+    assert 0x040 not in fetched
+    assert len(fetched) >= 8, fetched
+    assert fetched == [ [0x000, 0x100][idx % 2] for idx in range(len(fetched)) ]
+
+def tb_frontend_override(dut: EmberFrontend):
+    # A loop of jumps with more blocks than entries in the L0 BTB. 
+    # After the first iteration, blocks are predicted by L1 BTB overrides.
+    num_blks = dut.p.bp.l0_btb.depth + 8
+    ram = FakeRam(0x0000_1000)
+    for idx in range(num_blks):
+        off = 0x20 if idx < num_blks - 1 else -0x20 * (num_blks - 1)
+        ram.write_bytes(0x20 * idx, bytearray(pack("<L", rv32_jal(0, off))))
+
+    yield dut.dbg_cf_req.valid.eq(1)
+    yield dut.dbg_cf_req.pc.eq(0x000)
+    yield Tick()
+    yield dut.dbg_cf_req.valid.eq(0)
+
+    fetched = []
+    for cyc in range(600):
+        if (yield dut.dbg_fetch_resp.valid):
+            fetched.append((yield dut.dbg_fetch_resp.vaddr))
+        yield Tick()
+        yield from ram.run(dut.fakeram[0].req, dut.fakeram[0].resp)
+        yield from ram.run(dut.fakeram[1].req, dut.fakeram[1].resp, pipe=1)
+        yield from ram.run(dut.ptw_fakeram.req, dut.ptw_fakeram.resp, pipe=2)
+
+    # Overrides never leave wrong-path blocks behind
+    assert len(fetched) >= 2 * num_blks, fetched
+    assert fetched == [ 
+        0x20 * (idx % num_blks) for idx in range(len(fetched)) 
+    ], fetched
+
 
 class EmberCoreTests(unittest.TestCase):
+    def test_frontend_override(self):
+        tb = Testbench(
+            EmberFrontend(EmberParams()), 
+            tb_frontend_override,
+            "tb_frontend_override"
+        )
+        tb.run()
+
+    def test_frontend_flush(self):
+        tb = Testbench(
+            EmberFrontend(EmberParams()), 
+            tb_frontend_flush,
+            "tb_frontend_flush"
+        )
+        tb.run()
+
     #def test_core_elab(self):
     #    m = EmberCore(EmberParams())
     #    with open("/tmp/EmberCore.v", "w") as f: